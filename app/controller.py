@@ -15,14 +15,53 @@
 
 """Provides a web interface for pfif_tools."""
 
-from google.appengine.ext import webapp
-from google.appengine.ext.webapp.util import run_wsgi_app
+try:
+  from google.appengine.ext import webapp
+  from google.appengine.ext.webapp.util import run_wsgi_app
+except ImportError:
+  # Outside of App Engine (for instance, behind wsgi_server.py), use the
+  # standard library version of the parts of webapp that we need.
+  import webapp_compat as webapp
+  from webapp_compat import run_wsgi_app
 
 from StringIO import StringIO
+import cgi
 import pfif_validator
+import pfif_batch_validator
 import pfif_diff
+import jobs
 import utils
 
+# The number of messages shown on each page of a job's results.
+JOB_RESULTS_PAGE_SIZE = 100
+
+# Where jobs are stored when no other sqlite database is set.  It only lasts as
+# long as the process, so only that process can answer about its jobs.
+IN_MEMORY_JOB_DB = ':memory:'
+
+_job_queue = None # pylint: disable=C0103
+_job_db_path = IN_MEMORY_JOB_DB # pylint: disable=C0103
+
+def set_job_db_path(db_path):
+  """Stores jobs in the sqlite database at db_path from now on.  Every process
+  that serves the same clients must use the same file, because a job can be
+  polled on a different process from the one that it was posted to."""
+  global _job_queue, _job_db_path # pylint: disable=W0603
+  _job_db_path = db_path
+  _job_queue = None
+
+def get_job_db_path():
+  """Returns the path of the sqlite database that jobs are stored in."""
+  return _job_db_path
+
+def get_job_queue():
+  """Returns the queue that background jobs are run on, creating it the first
+  time that it is needed."""
+  global _job_queue # pylint: disable=W0603
+  if _job_queue is None:
+    _job_queue = jobs.JobQueue(jobs.JobStore(_job_db_path))
+  return _job_queue
+
 class PfifController(webapp.RequestHandler):
   """Provides common functionality to the different PFIF Tools controllers."""
 
@@ -42,44 +81,106 @@ class PfifController(webapp.RequestHandler):
     """Closes the body and html tags."""
     self.response.out.write('</body></html>')
 
+  def flush(self):
+    """Sends what has been written so far to the client.  Does nothing when the
+    response is buffered, as it is on App Engine."""
+    flush = getattr(self.response, 'flush', None)
+    if flush is not None:
+      flush()
+
+  def write_chunks(self, chunks):
+    """Writes each string from the chunks iterable and flushes after each."""
+    for chunk in chunks:
+      self.response.out.write(chunk)
+      self.flush()
+
+  def write_summary_placeholder(self):
+    """Writes an empty div that write_summary will fill in.  The summary can
+    only be written once every message is known, but it belongs at the top of
+    the page."""
+    self.response.out.write('<div id="summary_placeholder"></div>\n')
+
+  def write_summary(self, title, category_counts):
+    """Writes a heading with the title and the number of messages, followed by
+    a summary of category_counts, and moves them into the summary placeholder
+    if the browser runs scripts."""
+    message_count = sum(category_counts.values())
+    self.response.out.write(
+        '<div id="summary"><h1>' + title + ': ' + str(message_count) +
+        ' Messages</h1>' + utils.MessagesOutput.generate_category_count_summary(
+            category_counts, is_html=True) + '</div>\n')
+    self.response.out.write(
+        '<script>document.getElementById("summary_placeholder").appendChild('
+        'document.getElementById("summary"));</script>\n')
+
   def write_missing_input_file(self):
     """Writes that there is a missing input file."""
     self.response.out.write('<h1>Missing Input File</h1>')
 
+  def write_parse_error(self, exception):
+    """Writes that an input file couldn't be parsed.  The page has already
+    been sent up to this point, so this is written in place of the
+    messages."""
+    self.response.out.write('<h1>Invalid PFIF XML</h1>\n'
+                            '<p class="parse_error">' +
+                            cgi.escape(str(exception)) + '</p>\n')
+
+  def get_rules(self):
+    """Returns the validation rules selected by the skip_rules checkboxes and
+    the max_cost menu, or None if either names something unknown."""
+    try:
+      return pfif_validator.select_rules(
+          exclude=self.request.get_all('skip_rules'),
+          max_cost=self.request.get('max_cost') or None)
+    except ValueError:
+      return None
+
+  def write_invalid_rules(self):
+    """Writes that the selected rules were invalid."""
+    self.response.out.write('<h1>Invalid Rules</h1>')
+
   def get_file(self, file_number=1, return_filename=False):
     """Gets a file that was pasted in, uploaded, or given by a URL.  If multiple
     files are provided, specify the number of the desired file as file_number.
     Returns None if there is no file.  If return_filename is True, returns a
-    tuple: (desired_file, filename)."""
+    tuple: (desired_file, filename).  The returned file is only guaranteed to
+    support readline, and no copy of the input is made: uploads are read
+    straight from the request's (spooled) file and URLs from the connection."""
     paste_name = 'pfif_xml_' + str(file_number)
     upload_name = 'pfif_xml_file_' + str(file_number)
     url_name = 'pfif_xml_url_' + str(file_number)
     desired_file = None
     filename = None
 
-    for file_location in [paste_name, upload_name]:
-      if self.request.get(file_location):
-        desired_file = StringIO(self.request.get(file_location))
-        if file_location is upload_name:
-          filename = self.request.POST[file_location].filename
-    if self.request.get(url_name):
-      url = self.request.get(url_name)
-      # make a file-like object out of the URL's xml so we can seek on it
-      desired_file = StringIO(utils.open_url(url).read())
+    pasted_text = self.request.get(paste_name)
+    if pasted_text:
+      desired_file = StringIO(pasted_text)
+    upload = self.request.POST.get(upload_name)
+    if getattr(upload, 'filename', None):
+      desired_file = PfifController.get_upload_file(upload)
+      filename = upload.filename
+    url = self.request.get(url_name)
+    if url:
+      desired_file = utils.open_url(url)
       filename = url
 
-    if desired_file is not None:
-      if return_filename and filename is not None:
-        return (desired_file, filename)
-      elif return_filename:
-        return (desired_file, None)
-      else:
-        return desired_file
+    if return_filename:
+      return (desired_file, filename)
     else:
-      if return_filename:
-        return (None, None)
-      else:
-        return None
+      return desired_file
+
+  @staticmethod
+  def get_upload_file(upload):
+    """Returns a file-like object for an uploaded file.  The FieldStorage for an
+    upload already holds its contents in a file (in memory for small uploads
+    and on disk for large ones), so we rewind and use that file directly rather
+    than copying its value.  Compressed uploads are decompressed as they are
+    read."""
+    upload_file = getattr(upload, 'file', None)
+    if upload_file is None:
+      return utils.open_compressed(StringIO(upload.value))
+    upload_file.seek(0)
+    return utils.open_compressed(upload_file)
 
   def write_filename(self, filename, shorthand_name):
     """Writes out a mapping from shorthand_name to filename."""
@@ -98,6 +199,13 @@ class PfifController(webapp.RequestHandler):
 class DiffController(PfifController):
   """Displays the diff results page."""
 
+  def get_diff_options(self):
+    """Returns the options from the request to pass to pfif_file_diff."""
+    options = self.request.get_all('options')
+    return {'text_is_case_sensitive' : 'text_is_case_sensitive' in options,
+            'ignore_fields' : self.request.get('ignore_fields').split(),
+            'omit_blank_fields' : 'omit_blank_fields' in options}
+
   def post(self):
     file_1, filename_1 = self.get_file(1, return_filename=True)
     file_2, filename_2 = self.get_file(2, return_filename=True)
@@ -105,48 +213,69 @@ class DiffController(PfifController):
     if file_1 is None or file_2 is None:
       self.write_missing_input_file()
     else:
-      options = self.request.get_all('options')
-      ignore_fields = self.request.get('ignore_fields').split()
-      messages = pfif_diff.pfif_file_diff(
-          file_1, file_2,
-          text_is_case_sensitive='text_is_case_sensitive' in options,
-          ignore_fields=ignore_fields,
-          omit_blank_fields='omit_blank_fields' in options)
-      self.response.out.write(
-          '<h1>Diff: ' + str(len(messages)) + ' Messages</h1>')
-      self.response.out.write(
-          utils.MessagesOutput.generate_message_summary(messages, is_html=True))
+      self.write_summary_placeholder()
       self.write_filenames(filename_1, filename_2)
-      if 'group_messages_by_record' in options:
-        self.response.out.write(
-            utils.MessagesOutput.messages_to_str_by_id(messages, is_html=True))
+      self.flush()
+      options = self.request.get_all('options')
+      category_counts = {}
+      # The page has started, so a file that can't be parsed is reported on
+      # it.
+      try:
+        messages = utils.MessagesOutput.count_messages_by_category(
+            pfif_diff.iter_pfif_file_diff(file_1, file_2,
+                                          **self.get_diff_options()),
+            category_counts)
+        if 'group_messages_by_record' in options:
+          # Grouping needs every message, so nothing can be streamed.
+          self.response.out.write(utils.MessagesOutput.messages_to_str_by_id(
+              list(messages), is_html=True))
+        else:
+          self.write_chunks(utils.MessagesOutput.messages_to_chunks(
+              utils.MessagesOutput.truncate_stream(
+                  messages, utils.MessagesOutput.TRUNCATE_THRESHOLD),
+              show_error_type=False, is_html=True))
+      except (SyntaxError, AssertionError), exception:
+        self.write_parse_error(exception)
       else:
-        self.response.out.write(
-            utils.MessagesOutput.messages_to_str(
-                messages, show_error_type=False, is_html=True))
+        self.write_summary('Diff', category_counts)
     self.write_footer()
 
 class ValidatorController(PfifController):
-  """Displays the validation results page."""
+  """Displays the validation results page.  The page is streamed: messages are
+  sent as soon as they are found, and the summary is filled in at the end."""
 
   def post(self):
     xml_file = self.get_file()
     self.write_header('PFIF Validator: Results')
-    if xml_file is None:
+    rules = self.get_rules()
+    if rules is None:
+      self.write_invalid_rules()
+    elif xml_file is None:
       self.write_missing_input_file()
     else:
-      validator = pfif_validator.PfifValidator(xml_file)
-      messages = validator.run_validations()
-      self.response.out.write('<h1>Validation: ' +
-                              str(len(messages)) + ' Messages</h1>')
-      self.response.out.write(
-          utils.MessagesOutput.generate_message_summary(messages, is_html=True))
+      self.write_summary_placeholder()
+      self.flush()
+      # The page has started, so a file that can't be parsed is reported on
+      # it.
+      try:
+        validator = pfif_validator.PfifValidator(xml_file, rules=rules)
+      except (SyntaxError, AssertionError), exception:
+        self.write_parse_error(exception)
+        self.write_footer()
+        return
+      category_counts = {}
+      messages = utils.MessagesOutput.truncate_stream(
+          utils.MessagesOutput.count_messages_by_category(
+              validator.iter_validations(), category_counts),
+          utils.MessagesOutput.TRUNCATE_THRESHOLD)
       # print_options is a list of all printing options passed in via
       # checkboxes.  It will contain 'show_errors' if the user checked that box,
       # for instance.  Thus, saying show_errors='show_errors' in print_options
       # will set show_errors to True if the box was checked and false otherwise.
       print_options = self.request.get_all('print_options')
-      marked_up_message = validator.validator_messages_to_str(
+      # don't escape the messages since is_html escapes all input and contains
+      # html that should be interpreted as html
+      self.write_chunks(validator.validator_messages_to_chunks(
           messages,
           show_errors='show_errors' in print_options,
           show_warnings='show_warnings' in print_options,
@@ -155,16 +284,137 @@ class ValidatorController(PfifController):
           show_xml_tag='show_xml_tag' in print_options,
           show_xml_text='show_xml_text' in print_options,
           show_full_line='show_full_line' in print_options,
-          is_html=True)
-      # don't escape the message since is_html escapes all input and contains
-      # html that should be interpreted as html
-      self.response.out.write(marked_up_message)
+          is_html=True))
+      self.write_summary('Validation', category_counts)
+    self.write_footer()
+
+class BatchValidatorController(PfifController):
+  """Validates every URL in a list of URLs and displays a summary per feed."""
+
+  # The most feeds that will be fetched and validated at once.
+  NUM_WORKERS = 8
+
+  def post(self):
+    urls = [url.strip() for url in self.request.get('pfif_xml_urls').split()]
+    urls = [url for url in urls if url]
+    self.write_header('PFIF Validator: Batch Results')
+    if not urls:
+      self.write_missing_input_file()
+    else:
+      # Fetching the feeds is mostly waiting on the network, so threads are
+      # enough to overlap the feeds.
+      results = pfif_batch_validator.validate_feeds(
+          urls, num_workers=BatchValidatorController.NUM_WORKERS,
+          use_processes=False, are_urls=True)
+      self.response.out.write('<h1>Batch Validation: ' + str(len(results)) +
+                              ' Feeds</h1>')
+      self.response.out.write(pfif_batch_validator.feed_results_to_str(
+          results, is_html=True,
+          show_categories='show_categories' in self.request.get_all(
+              'print_options')))
+    self.write_footer()
+
+class JobController(PfifController):
+  """Provides common functionality to controllers for background jobs."""
+
+  def write_job_queued(self, job_id):
+    """Writes the id of a newly queued job and a link to its status page."""
+    self.response.out.write(
+        '<h1>Job Queued</h1>\n<p>Job ID: <span class="job_id">' + job_id +
+        '</span></p>\n<p><a href="/jobs/status?job_id=' + job_id +
+        '">Check the status of this job</a></p>\n')
+
+class ValidatorJobController(JobController):
+  """Queues a validation as a background job."""
+
+  def post(self):
+    xml_file = self.get_file()
+    self.write_header('PFIF Validator: Job')
+    rules = self.get_rules()
+    if rules is None:
+      self.write_invalid_rules()
+    elif xml_file is None:
+      self.write_missing_input_file()
+    else:
+      job_id = get_job_queue().enqueue('validate', jobs.run_validation,
+                                       xml_file, rules=rules)
+      self.write_job_queued(job_id)
     self.write_footer()
 
-APPLICATION = webapp.WSGIApplication(
-    [('/validate/results', ValidatorController),
-     ('/diff/results', DiffController)],
-    debug=True)
+class DiffJobController(JobController, DiffController):
+  """Queues a diff as a background job."""
+
+  def post(self):
+    file_1 = self.get_file(1)
+    file_2 = self.get_file(2)
+    self.write_header('PFIF Diff: Job')
+    if file_1 is None or file_2 is None:
+      self.write_missing_input_file()
+    else:
+      job_id = get_job_queue().enqueue('diff', jobs.run_diff, file_1, file_2,
+                                       **self.get_diff_options())
+      self.write_job_queued(job_id)
+    self.write_footer()
+
+class JobStatusController(JobController):
+  """Displays the status of a background job and, once it is done, one page of
+  its results.  The results are read from the job store rather than being
+  generated again."""
+
+  def get(self):
+    store = get_job_queue().store
+    job_id = self.request.get('job_id')
+    job = store.get_job(job_id)
+    self.write_header('PFIF Tools: Job Status')
+    if job is None:
+      self.response.out.write('<h1>No Such Job</h1>')
+    else:
+      self.response.out.write(
+          '<h1>Job ' + job_id + '</h1>\n<p>Status: <span class="job_status">' +
+          job['status'] + '</span></p>\n')
+      if job['status'] == jobs.JobStatus.FAILED:
+        self.response.out.write('<p class="job_error">' +
+                                cgi.escape(job['error'] or '') + '</p>\n')
+      elif job['status'] == jobs.JobStatus.DONE:
+        self.write_results_page(job)
+    self.write_footer()
+
+  def write_results_page(self, job):
+    """Writes the summary of a finished job along with the page of its messages
+    specified by the page parameter (counting from 0)."""
+    store = get_job_queue().store
+    try:
+      page = max(int(self.request.get('page', '0')), 0)
+    except ValueError:
+      page = 0
+    self.response.out.write(
+        '<h2>' + str(job['message_count']) + ' Messages</h2>\n')
+    self.response.out.write(
+        utils.MessagesOutput.generate_category_count_summary(
+            store.get_category_counts(job['job_id']), is_html=True))
+    messages, xml_lines = store.get_messages(
+        job['job_id'], offset=page * JOB_RESULTS_PAGE_SIZE,
+        limit=JOB_RESULTS_PAGE_SIZE)
+    self.response.out.write(utils.MessagesOutput.messages_to_str(
+        messages, show_error_type=(job['kind'] == 'validate'),
+        show_full_line=bool(xml_lines), is_html=True, xml_lines=xml_lines,
+        truncate=False))
+    page_link = '<a href="/jobs/status?job_id=' + job['job_id'] + '&page='
+    if page > 0:
+      self.response.out.write(page_link + str(page - 1) +
+                              '" class="previous_page">Previous Page</a>\n')
+    if (page + 1) * JOB_RESULTS_PAGE_SIZE < job['message_count']:
+      self.response.out.write(page_link + str(page + 1) +
+                              '" class="next_page">Next Page</a>\n')
+
+ROUTES = [('/validate/results', ValidatorController),
+          ('/diff/results', DiffController),
+          ('/validate/batch', BatchValidatorController),
+          ('/validate/jobs', ValidatorJobController),
+          ('/diff/jobs', DiffJobController),
+          ('/jobs/status', JobStatusController)]
+
+APPLICATION = webapp.WSGIApplication(ROUTES, debug=True)
 
 def main():
   """Sets up the controller."""
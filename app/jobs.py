@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs validations and diffs as background jobs.
+
+A job is enqueued with a function that returns its messages.  The job's
+status and, once it is done, its messages are kept in a JobStore so that a
+client can poll for the status and page through the results without the work
+being redone.  JobStore is backed by sqlite (in memory by default), and
+JobQueue runs jobs on in-process worker threads; together they stand in for a
+real task queue and datastore and can be used offline.  Finished jobs are
+deleted once they are old enough, or once there are too many of them, so that
+a long-running server doesn't keep every result forever."""
+
+import sqlite3
+import threading
+import time
+import Queue
+import uuid
+import utils
+import pfif_validator
+import pfif_diff
+
+class JobStatus: # pylint: disable=W0232
+  """Constants representing the state of a job."""
+
+  QUEUED = 'queued'
+  RUNNING = 'running'
+  DONE = 'done'
+  FAILED = 'failed'
+
+class JobStore:
+  """Stores jobs and their messages in sqlite.  A finished job is deleted
+  max_age_seconds after it finished, and the oldest finished jobs are deleted
+  whenever there are more than max_finished_jobs of them."""
+
+  # The Message fields that are stored for each message, in column order.
+  MESSAGE_FIELDS = ['category', 'extra_data', 'is_error', 'xml_line_number',
+                    'xml_tag', 'xml_text', 'person_record_id',
+                    'note_record_id']
+
+  DEFAULT_MAX_AGE_SECONDS = 60 * 60
+  DEFAULT_MAX_FINISHED_JOBS = 100
+
+  def __init__(self, db_path=':memory:',
+               max_age_seconds=DEFAULT_MAX_AGE_SECONDS,
+               max_finished_jobs=DEFAULT_MAX_FINISHED_JOBS):
+    self.max_age_seconds = max_age_seconds
+    self.max_finished_jobs = max_finished_jobs
+    self.lock = threading.Lock()
+    self.connection = sqlite3.connect(db_path, check_same_thread=False)
+    self.connection.executescript("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY, kind TEXT, status TEXT, error TEXT,
+            finished_time REAL);
+        CREATE INDEX IF NOT EXISTS jobs_by_finished_time
+            ON jobs (finished_time);
+        CREATE TABLE IF NOT EXISTS messages (
+            job_id TEXT, position INTEGER, category TEXT, extra_data TEXT,
+            is_error INTEGER, xml_line_number INTEGER, xml_tag TEXT,
+            xml_text TEXT, person_record_id TEXT, note_record_id TEXT,
+            xml_full_line TEXT, PRIMARY KEY (job_id, position));""")
+
+  def execute(self, statement, parameters=()):
+    """Runs a statement while holding the lock and returns all rows."""
+    self.lock.acquire()
+    try:
+      rows = self.connection.execute(statement, parameters).fetchall()
+      self.connection.commit()
+      return rows
+    finally:
+      self.lock.release()
+
+  def create_job(self, kind):
+    """Adds a queued job of the given kind, after deleting old jobs.  Returns
+    its job_id."""
+    self.delete_old_jobs()
+    job_id = uuid.uuid4().hex
+    self.execute('INSERT INTO jobs VALUES (?, ?, ?, NULL, NULL)',
+                 (job_id, kind, JobStatus.QUEUED))
+    return job_id
+
+  def set_status(self, job_id, status, error=None):
+    """Updates the status of a job, and its error if it failed.  A job that is
+    done or failed is marked as finished now."""
+    finished_time = None
+    if status in [JobStatus.DONE, JobStatus.FAILED]:
+      finished_time = time.time()
+    self.execute('UPDATE jobs SET status = ?, error = ?, finished_time = ? '
+                 'WHERE job_id = ?', (status, error, finished_time, job_id))
+
+  def delete_old_jobs(self, now=None):
+    """Deletes the finished jobs, and their messages, that finished more than
+    max_age_seconds before now (defaulting to the current time) or that are
+    older than the newest max_finished_jobs finished jobs.  Queued and running
+    jobs are never deleted.  Returns the number of jobs deleted."""
+    if now is None:
+      now = time.time()
+    self.lock.acquire()
+    try:
+      rows = self.connection.execute(
+          'SELECT job_id FROM jobs WHERE finished_time < ? UNION '
+          'SELECT job_id FROM (SELECT job_id FROM jobs '
+          'WHERE finished_time IS NOT NULL ORDER BY finished_time DESC '
+          'LIMIT -1 OFFSET ?)',
+          (now - self.max_age_seconds, self.max_finished_jobs)).fetchall()
+      for table in ['messages', 'jobs']:
+        self.connection.executemany(
+            'DELETE FROM ' + table + ' WHERE job_id = ?', rows)
+      self.connection.commit()
+      return len(rows)
+    finally:
+      self.lock.release()
+
+  def add_messages(self, job_id, messages, xml_lines=None):
+    """Stores the messages of a job in order.  If xml_lines is specified, the
+    full line of each message is stored alongside it."""
+    rows = []
+    for position, message in enumerate(messages):
+      row = [job_id, position]
+      row.extend([getattr(message, field) for field in
+                  JobStore.MESSAGE_FIELDS])
+      full_line = None
+      if xml_lines is not None and message.xml_line_number is not None:
+        full_line = xml_lines[message.xml_line_number - 1]
+      row.append(full_line)
+      rows.append(row)
+    self.lock.acquire()
+    try:
+      self.connection.executemany(
+          'INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+      self.connection.commit()
+    finally:
+      self.lock.release()
+
+  def get_job(self, job_id):
+    """Returns a dict with the kind, status, error, and message_count of a job,
+    or None if there is no such job."""
+    rows = self.execute('SELECT kind, status, error FROM jobs WHERE job_id = ?',
+                        (job_id,))
+    if not rows:
+      return None
+    kind, status, error = rows[0]
+    message_count = self.execute(
+        'SELECT COUNT(*) FROM messages WHERE job_id = ?', (job_id,))[0][0]
+    return {'job_id' : job_id, 'kind' : kind, 'status' : status,
+            'error' : error, 'message_count' : message_count}
+
+  def get_category_counts(self, job_id):
+    """Returns a dict from category to the number of messages in that category
+    for a job."""
+    rows = self.execute('SELECT category, COUNT(*) FROM messages '
+                        'WHERE job_id = ? GROUP BY category', (job_id,))
+    return dict(rows)
+
+  def get_messages(self, job_id, offset=0, limit=None):
+    """Returns a tuple (messages, xml_lines) with up to limit messages of a job
+    starting at offset.  xml_lines maps from line number - 1 to the full line,
+    so it can be passed to MessagesOutput.messages_to_str."""
+    if limit is None:
+      limit = -1
+    rows = self.execute(
+        'SELECT ' + ', '.join(JobStore.MESSAGE_FIELDS) + ', xml_full_line '
+        'FROM messages WHERE job_id = ? ORDER BY position LIMIT ? OFFSET ?',
+        (job_id, limit, offset))
+    messages = []
+    xml_lines = {}
+    for row in rows:
+      fields = dict(zip(JobStore.MESSAGE_FIELDS, row))
+      fields['is_error'] = bool(fields['is_error'])
+      message = utils.Message(fields.pop('category'), **fields)
+      messages.append(message)
+      if row[-1] is not None:
+        xml_lines[message.xml_line_number - 1] = row[-1]
+    return (messages, xml_lines)
+
+def run_validation(xml_file, rules=None):
+  """A job function that validates xml_file with rules (defaulting to every
+  rule)."""
+  validator = pfif_validator.PfifValidator(xml_file, rules=rules)
+  return (validator.run_validations(), validator.tree.lines)
+
+def run_diff(file_a, file_b, **diff_options):
+  """A job function that diffs file_a and file_b.  diff_options are passed on
+  to pfif_diff.pfif_file_diff."""
+  return (pfif_diff.pfif_file_diff(file_a, file_b, **diff_options), None)
+
+class JobQueue:
+  """Runs jobs on worker threads and records their results in a JobStore."""
+
+  def __init__(self, store, num_workers=1):
+    self.store = store
+    self.queue = Queue.Queue()
+    for _ in range(num_workers):
+      worker = threading.Thread(target=self.work)
+      worker.setDaemon(True)
+      worker.start()
+
+  def enqueue(self, kind, function, *args, **kwargs):
+    """Adds a job that will call function with args and kwargs.  function must
+    return a tuple (messages, xml_lines), where xml_lines can be None.  Returns
+    the job_id of the new job."""
+    job_id = self.store.create_job(kind)
+    self.queue.put((job_id, function, args, kwargs))
+    return job_id
+
+  def run_job(self, job_id, function, args, kwargs):
+    """Runs a single job and stores its messages or its error."""
+    self.store.set_status(job_id, JobStatus.RUNNING)
+    try:
+      messages, xml_lines = function(*args, **kwargs)
+      self.store.add_messages(job_id, messages, xml_lines)
+    except Exception, exception: # pylint: disable=W0703
+      self.store.set_status(job_id, JobStatus.FAILED, error=str(exception))
+    else:
+      self.store.set_status(job_id, JobStatus.DONE)
+
+  def work(self):
+    """Runs jobs from the queue forever."""
+    while True:
+      job_id, function, args, kwargs = self.queue.get()
+      try:
+        self.run_job(job_id, function, args, kwargs)
+      finally:
+        self.queue.task_done()
+
+  def wait_for_jobs(self):
+    """Blocks until every enqueued job has finished."""
+    self.queue.join()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Validates many PFIF XML feeds at once.
+
+Feeds are validated concurrently by a pool of workers that each import the
+validator once, so validating a whole directory of feeds takes about as long
+as validating the largest feed rather than as long as validating every feed in
+turn.  The output is one summary line per feed."""
+
+import cgi
+import glob
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import optparse
+import os
+import pfif_validator
+import utils
+
+class FeedResult:
+  """The outcome of validating one feed."""
+
+  def __init__(self, source, category_counts=None, error_count=0,
+               warning_count=0, failure=None):
+    self.source = source
+    self.category_counts = category_counts or {}
+    self.error_count = error_count
+    self.warning_count = warning_count
+    # If the feed could not be validated at all, failure describes why.
+    self.failure = failure
+
+def validate_feed(source, opener=utils.open_file):
+  """Validates the feed that opener opens from source.  Returns a FeedResult.
+  Exceptions are recorded in the result rather than raised so that one bad
+  feed does not stop the rest of a batch."""
+  try:
+    validator = pfif_validator.PfifValidator(opener(source))
+    messages = validator.run_validations()
+  except Exception, exception: # pylint: disable=W0703
+    return FeedResult(source, failure=str(exception) or repr(exception))
+  result = FeedResult(source)
+  for message in messages:
+    result.category_counts[message.category] = (
+        result.category_counts.get(message.category, 0) + 1)
+    if message.is_error:
+      result.error_count += 1
+    else:
+      result.warning_count += 1
+  return result
+
+def validate_url(url):
+  """Validates the feed at url.  Returns a FeedResult."""
+  return validate_feed(url, opener=utils.open_url)
+
+def validate_feeds(sources, num_workers=None, use_processes=True,
+                   are_urls=False):
+  """Validates every feed in sources concurrently.  Returns a list of
+  FeedResults in the same order as sources.  If use_processes is True, feeds
+  are validated in a pool of worker processes, which is best for local files;
+  otherwise, they are validated by a pool of threads, which is enough for
+  feeds that are mostly spent waiting on the network.  num_workers defaults to
+  the number of CPUs."""
+  if not sources:
+    return []
+  num_workers = min(num_workers or multiprocessing.cpu_count(), len(sources))
+  if are_urls:
+    validate_function = validate_url
+  else:
+    validate_function = validate_feed
+  if use_processes:
+    pool = multiprocessing.Pool(num_workers)
+  else:
+    pool = ThreadPool(num_workers)
+  try:
+    return pool.map(validate_function, sources, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+
+def find_feeds(paths, manifest=None):
+  """Returns a sorted list of the feeds specified by paths, each of which can
+  be a file, a directory (every .xml file in it is included), or a glob.  If
+  manifest is specified, it is a file with one feed per line, and those feeds
+  are added after the others in the order listed."""
+  feeds = set()
+  for path in paths:
+    if os.path.isdir(path):
+      feeds.update(glob.glob(os.path.join(path, '*.xml')))
+    else:
+      feeds.update(glob.glob(path) or [path])
+  feeds = sorted(feeds)
+  if manifest is not None:
+    for line in utils.open_file(manifest):
+      line = line.strip()
+      if line and not line.startswith('#'):
+        feeds.append(line)
+  return feeds
+
+def feed_results_to_str(results, is_html=False, show_categories=False):
+  """Returns a string with a table that has one row per feed along with a row
+  of totals.  If show_categories is True, it is followed by a table with the
+  number of messages in each category for each feed."""
+  output = utils.MessagesOutput(is_html, html_class='batch_summary')
+  output.start_table(['Feed', 'Errors', 'Warnings', 'Status'])
+  total_errors = 0
+  total_warnings = 0
+  failed_feeds = 0
+  for result in results:
+    if result.failure is None:
+      status = 'OK'
+    else:
+      status = 'FAILED: ' + result.failure
+      failed_feeds += 1
+    source = result.source
+    if is_html:
+      source = cgi.escape(source)
+      status = cgi.escape(status)
+    output.make_table_row([source, str(result.error_count),
+                           str(result.warning_count), status])
+    total_errors += result.error_count
+    total_warnings += result.warning_count
+  output.make_table_row([str(len(results)) + ' feeds', str(total_errors),
+                         str(total_warnings),
+                         str(failed_feeds) + ' failed'])
+  output.end_table()
+  if show_categories:
+    output.start_table(['Feed', 'Category', 'Number of Messages'])
+    for result in results:
+      source = result.source
+      if is_html:
+        source = cgi.escape(source)
+      for category, count in result.category_counts.items():
+        output.make_table_row([source, category, str(count)])
+    output.end_table()
+  return output.get_output()
+
+def main():
+  """Validates every feed specified on the command line."""
+  parser = optparse.OptionParser(
+      usage='usage: %prog [options] file-dir-or-glob...')
+  parser.add_option('--manifest',
+                    help='A file listing one feed to validate per line.')
+  parser.add_option('--workers', type='int', default=None,
+                    help='The number of feeds to validate at once.  Defaults '
+                    'to the number of CPUs.')
+  parser.add_option('--urls', action='store_true', default=False,
+                    help='The feeds are URLs rather than files, so they will '
+                    'be fetched by a pool of threads.')
+  parser.add_option('--show-categories', action='store_true', default=False,
+                    help='Also print the number of messages in each category '
+                    'for each feed.')
+  (options, args) = parser.parse_args()
+
+  feeds = find_feeds(args, manifest=options.manifest)
+  assert feeds, 'Must provide at least one feed to validate.'
+  results = validate_feeds(feeds, num_workers=options.workers,
+                           use_processes=not options.urls,
+                           are_urls=options.urls)
+  print feed_results_to_str(results, show_categories=options.show_categories)
+
+if __name__ == '__main__':
+  main()
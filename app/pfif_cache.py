@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Caches parsed PFIF XML feeds on disk in a compact binary format.
+
+A pipeline often validates, diffs, and summarizes the same feed several times,
+and parsing the XML is the slowest part of each.  ParsedFeed.write saves a
+parsed feed once, and a ParsedFeed opens the saved file with mmap, so loading
+it again only copies a few flat arrays.  The elements of the tree are only
+built from those arrays when something first asks for the tree.
+
+A parsed feed file has a header and then these sections, in order:
+ * the string table: the end offset of each string, then every string in
+   UTF-8.  Tags, text, and tails are all stored once in the string table, so
+   each distinct field name or value is only stored once.
+ * one array each of the tag, text, tail, parent, and line number of every
+   element, in document order.  Strings are indexes into the string table
+   (NONE for None), and the parent is the index of the parent element (NONE for
+   the root).
+ * the index of the first element of each record (each child of the root).
+ * the lines of the original file, compressed with zlib in blocks of
+   LINE_BLOCK_SIZE lines: the end offset of each block, then the blocks.
+The arrays are in the byte order and sizes of the machine that wrote them, and
+a file written on a different kind of machine is treated as missing.
+Attributes are not stored, since PFIF doesn't use any.
+
+ParsedFeedCache keeps parsed feeds in a directory, named by the SHA-1 of the
+contents of the original file, so a changed file is always parsed again."""
+
+import array
+import hashlib
+import mmap
+import optparse
+import os
+import struct
+import sys
+import time
+import zlib
+import utils
+
+# Stands for None in the string and parent arrays
+NONE = -1
+
+# The number of lines compressed together
+LINE_BLOCK_SIZE = 256
+
+class ParsedFeedLines:
+  """The lines of the original file of a ParsedFeed.  A block of lines is only
+  read from the mapped file and decompressed when one of its lines is asked
+  for, so that the lines of a large feed are not loaded just in case a message
+  needs one.  The last block read is kept, since messages come in order."""
+
+  def __init__(self, data, start, block_offsets, num_lines, is_unicode):
+    self.data = data
+    self.start = start
+    self.block_offsets = block_offsets
+    self.num_lines = num_lines
+    self.is_unicode = is_unicode
+    self.block_index = None
+    self.block = None
+
+  def __len__(self):
+    return self.num_lines
+
+  def __getitem__(self, index):
+    if index < 0:
+      index += len(self)
+    if index < 0 or index >= len(self):
+      raise IndexError('line index out of range')
+    block_index = index / LINE_BLOCK_SIZE
+    if block_index != self.block_index:
+      text = zlib.decompress(
+          self.data[self.start + self.block_offsets[block_index]:
+                    self.start + self.block_offsets[block_index + 1]])
+      # Every line but the last line of the file ends in a newline.
+      parts = text.split('\n')
+      self.block = [part + '\n' for part in parts[:-1]]
+      if parts[-1]:
+        self.block.append(parts[-1])
+      self.block_index = block_index
+    line = self.block[index % LINE_BLOCK_SIZE]
+    if self.is_unicode:
+      return line.decode('utf-8')
+    return line
+
+  def __iter__(self):
+    for index in xrange(len(self)):
+      yield self[index]
+
+class ParsedFeedTree(utils.PfifXmlTree):
+  """A PfifXmlTree that is loaded from a ParsedFeed instead of being parsed.
+  The namespace and version are known right away, but the elements (and so
+  tree and line_numbers) are only built when they are first used."""
+
+  # Doesn't call PfifXmlTree.__init__, which would parse a file
+  def __init__(self, parsed_feed): # pylint: disable=W0231
+    self.parsed_feed = parsed_feed
+    self.namespace = None
+    self.version = None
+    self.parser = None
+    self.lines = parsed_feed.lines
+    self.parse_seconds = parsed_feed.load_seconds
+    self.bytes_read = parsed_feed.bytes_read
+    self.records_visited = 0
+    self.selected_records = None
+    self.initialize_pfif_version(parsed_feed.get_string(parsed_feed.tags[0]))
+
+  def __getattr__(self, name):
+    # Only called for attributes that haven't been set yet
+    if name in ['tree', 'line_numbers']:
+      start_time = time.time()
+      root, self.line_numbers = self.parsed_feed.build_elements(
+          0, len(self.parsed_feed.tags))
+      self.tree = utils.import_parser(ParsedFeed.get_builder()).ElementTree(
+          root)
+      self.parse_seconds += time.time() - start_time
+      return getattr(self, name)
+    raise AttributeError(name)
+
+class ParsedFeed:
+  """A parsed PFIF XML feed that was saved with ParsedFeed.write, opened with
+  mmap.  get_tree returns a PfifXmlTree of the feed, which can be passed to
+  anything that takes a parsed feed."""
+
+  MAGIC = 'PFIFFEED'
+  # Incremented whenever the layout of the file changes
+  FORMAT = 1
+  # The magic, the format, a description of how arrays are stored, the SHA-1
+  # of the original file, the counts of strings, elements, records, and lines,
+  # the number of bytes in the original file, and whether its lines were
+  # unicode.
+  HEADER = struct.Struct('<8sI8s20sIIIIQB')
+  # The types of the arrays of indexes and of offsets
+  INDEX_TYPE = 'i'
+  OFFSET_TYPE = 'L'
+
+  def __init__(self, path, tree=None):
+    """Opens the parsed feed at path.  Raises a ValueError if path wasn't
+    written by this version of ParsedFeed.write on this kind of machine.  If
+    tree, the PfifXmlTree that the file was written from, is given, get_tree
+    returns it rather than building a new one."""
+    start_time = time.time()
+    self.path = path
+    self.parsed_tree = tree
+    feed_file = open(path, 'rb')
+    try:
+      self.data = mmap.mmap(feed_file.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+      feed_file.close()
+    if len(self.data) < ParsedFeed.HEADER.size:
+      raise ValueError('Not a parsed feed: ' + path)
+    (magic, file_format, layout, self.content_hash, num_strings, num_elements,
+     num_records, num_lines, self.bytes_read,
+     lines_are_unicode) = ParsedFeed.HEADER.unpack_from(self.data)
+    if (magic != ParsedFeed.MAGIC or file_format != ParsedFeed.FORMAT or
+        layout.rstrip('\0') != ParsedFeed.get_layout()):
+      raise ValueError('Not a parsed feed in this format: ' + path)
+    self.position = ParsedFeed.HEADER.size
+    self.string_offsets = self.read_array(ParsedFeed.OFFSET_TYPE,
+                                          num_strings + 1)
+    self.strings_start = self.position
+    self.position += self.string_offsets[-1]
+    self.strings = [None] * num_strings
+    self.all_strings = None
+    self.tags = self.read_array(ParsedFeed.INDEX_TYPE, num_elements)
+    self.texts = self.read_array(ParsedFeed.INDEX_TYPE, num_elements)
+    self.tails = self.read_array(ParsedFeed.INDEX_TYPE, num_elements)
+    self.parents = self.read_array(ParsedFeed.INDEX_TYPE, num_elements)
+    self.line_numbers = self.read_array(ParsedFeed.INDEX_TYPE, num_elements)
+    self.record_starts = self.read_array(ParsedFeed.INDEX_TYPE, num_records)
+    num_blocks = (num_lines + LINE_BLOCK_SIZE - 1) / LINE_BLOCK_SIZE
+    block_offsets = self.read_array(ParsedFeed.OFFSET_TYPE, num_blocks + 1)
+    self.lines = ParsedFeedLines(self.data, self.position, block_offsets,
+                                 num_lines, bool(lines_are_unicode))
+    self.load_seconds = time.time() - start_time
+
+  @staticmethod
+  def get_layout():
+    """Returns a description of the byte order and array sizes of this
+    machine."""
+    return '%s%d%d' % (sys.byteorder[0],
+                       array.array(ParsedFeed.INDEX_TYPE).itemsize,
+                       array.array(ParsedFeed.OFFSET_TYPE).itemsize)
+
+  @staticmethod
+  def get_builder():
+    """Returns the parser whose elements are fastest to build by hand."""
+    for parser in ['cElementTree', 'ElementTree']:
+      if parser in utils.get_available_parsers():
+        return parser
+
+  def read_array(self, typecode, length):
+    """Returns an array of length items of typecode read from the current
+    position, and moves past them."""
+    values = array.array(typecode)
+    end = self.position + length * values.itemsize
+    values.fromstring(self.data[self.position:end])
+    self.position = end
+    return values
+
+  def get_string(self, index):
+    """Returns the string at index in the string table, or None for NONE.
+    ASCII strings are str and others are unicode, like ElementTree's."""
+    if index == NONE:
+      return None
+    string = self.strings[index]
+    if string is None:
+      string = self.data[self.strings_start + self.string_offsets[index]:
+                         self.strings_start + self.string_offsets[index + 1]]
+      try:
+        string.decode('ascii')
+      except UnicodeDecodeError:
+        string = string.decode('utf-8')
+      self.strings[index] = string
+    return string
+
+  def get_record_count(self):
+    """Returns the number of children of the root."""
+    return len(self.record_starts)
+
+  def build_elements(self, start, end):
+    """Builds the elements from start up to end, which must be an element and
+    everything inside of it.  Returns a tuple (element, line_numbers), where
+    line_numbers maps each element built to its line number."""
+    if self.all_strings is None:
+      self.all_strings = [self.get_string(index) for index in
+                          xrange(len(self.strings))] + [None]
+    return build_elements(self.all_strings, (self.tags, self.texts, self.tails,
+                                             self.parents, self.line_numbers),
+                          start, end)
+
+  def get_record(self, record_index):
+    """Returns a tuple (record, line_numbers) for the child of the root at
+    record_index, building only that record."""
+    start = self.record_starts[record_index]
+    if record_index + 1 < len(self.record_starts):
+      end = self.record_starts[record_index + 1]
+    else:
+      end = len(self.tags)
+    return self.build_elements(start, end)
+
+  def get_tree(self):
+    """Returns a PfifXmlTree of the feed."""
+    if self.parsed_tree is not None:
+      return self.parsed_tree
+    return ParsedFeedTree(self)
+
+  def close(self):
+    """Unmaps the file."""
+    self.data.close()
+
+  @staticmethod
+  def write(tree, path, content_hash):
+    """Saves tree, a PfifXmlTree, to path, along with content_hash, the SHA-1
+    digest of the file that tree was parsed from.  The file is replaced all at
+    once so that a failed write never leaves half of a parsed feed."""
+    string_table, columns, record_starts = flatten_elements(
+        tree.getroot(), tree.line_numbers)
+    string_table = [string.encode('utf-8') if isinstance(string, unicode)
+                    else string for string in string_table]
+    tags = columns[0]
+    lines = tree.lines
+    lines_are_unicode = bool(lines) and isinstance(lines[0], unicode)
+    if lines_are_unicode:
+      lines = [line.encode('utf-8') for line in lines]
+
+    temp_path = path + '.tmp'
+    feed_file = open(temp_path, 'wb')
+    try:
+      feed_file.write(ParsedFeed.HEADER.pack(
+          ParsedFeed.MAGIC, ParsedFeed.FORMAT, ParsedFeed.get_layout(),
+          content_hash, len(string_table), len(tags), len(record_starts),
+          len(lines), tree.bytes_read, lines_are_unicode))
+      ParsedFeed.write_strings(feed_file, string_table)
+      for column in columns + [record_starts]:
+        column.tofile(feed_file)
+      ParsedFeed.write_strings(feed_file, [
+          zlib.compress(''.join(lines[start:start + LINE_BLOCK_SIZE]))
+          for start in xrange(0, len(lines), LINE_BLOCK_SIZE)])
+    finally:
+      feed_file.close()
+    os.rename(temp_path, path)
+
+  @staticmethod
+  def write_strings(feed_file, strings):
+    """Writes the end offset of each of strings and then the strings."""
+    offsets = array.array(ParsedFeed.OFFSET_TYPE, [0])
+    for string in strings:
+      offsets.append(offsets[-1] + len(string))
+    offsets.tofile(feed_file)
+    for string in strings:
+      feed_file.write(string)
+
+def flatten_elements(root, line_numbers):
+  """Returns a tuple (string_table, columns, record_starts) describing root and
+  everything inside of it, in document order, as in a parsed feed file.
+  string_table is a list of every distinct tag, text, and tail, columns is a
+  list of the tag, text, tail, parent, and line number arrays, and
+  record_starts is an array of the index of each child of root.  line_numbers
+  maps each element to its line number."""
+  # string : index in the string table, with None standing for NONE.  The
+  # index of a new string is the number of strings already in the table.
+  strings = {None : NONE}
+  intern_string = strings.setdefault
+  columns = [array.array(ParsedFeed.INDEX_TYPE) for _ in range(5)]
+  tags, texts, tails, parents, element_lines = columns
+  record_starts = array.array(ParsedFeed.INDEX_TYPE)
+  # (element, index of parent), with the next element in document order last
+  stack = [(root, NONE)]
+  while stack:
+    element, parent = stack.pop()
+    index = len(tags)
+    if parent == 0:
+      record_starts.append(index)
+    tags.append(intern_string(element.tag, len(strings) - 1))
+    texts.append(intern_string(element.text, len(strings) - 1))
+    tails.append(intern_string(element.tail, len(strings) - 1))
+    parents.append(parent)
+    element_lines.append(line_numbers[element])
+    stack.extend([(child, index) for child in reversed(element)])
+
+  del strings[None]
+  string_table = [None] * len(strings)
+  for string, index in strings.iteritems():
+    string_table[index] = string
+  return (string_table, columns, record_starts)
+
+def build_elements(strings, columns, start, end):
+  """Builds the elements from start up to end of columns, as returned by
+  flatten_elements, which must be an element and everything inside of it.
+  strings is the string table with None added to the end, so that NONE, the
+  last index, finds None without a call for each string.  Returns a tuple
+  (element, line_numbers), where line_numbers maps each element built to its
+  line number."""
+  etree = utils.import_parser(ParsedFeed.get_builder())
+  make_sub_element = etree.SubElement
+  tags, texts, tails, parents, element_lines = columns
+  root = etree.Element(strings[tags[start]])
+  # elements[index - start] is the element at index
+  elements = [root]
+  line_numbers = {root : element_lines[start]}
+  root.text = strings[texts[start]]
+  root.tail = strings[tails[start]]
+  for index in xrange(start + 1, end):
+    element = make_sub_element(elements[parents[index] - start],
+                               strings[tags[index]])
+    element.text = strings[texts[index]]
+    element.tail = strings[tails[index]]
+    elements.append(element)
+    line_numbers[element] = element_lines[index]
+  return (root, line_numbers)
+
+class ParsedFeedCache:
+  """A directory of parsed feeds, named by the SHA-1 of their original
+  files."""
+
+  SUFFIX = '.pfif-parsed'
+  # How much of a file is hashed at a time
+  CHUNK_SIZE = 1024 * 1024
+
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+
+  @staticmethod
+  def hash_file(path):
+    """Returns the SHA-1 digest of the contents of the file at path."""
+    digest = hashlib.sha1()
+    hashed_file = open(path, 'rb')
+    try:
+      chunk = hashed_file.read(ParsedFeedCache.CHUNK_SIZE)
+      while chunk:
+        digest.update(chunk)
+        chunk = hashed_file.read(ParsedFeedCache.CHUNK_SIZE)
+    finally:
+      hashed_file.close()
+    return digest.digest()
+
+  def get_path(self, content_hash):
+    """Returns the path of the parsed feed for content_hash."""
+    return os.path.join(self.cache_dir,
+                        content_hash.encode('hex') + ParsedFeedCache.SUFFIX)
+
+  def load(self, path, parser=None):
+    """Returns a ParsedFeed of the PFIF XML file at path.  If the file hasn't
+    been parsed before, it is parsed with parser and saved first."""
+    content_hash = ParsedFeedCache.hash_file(path)
+    cache_path = self.get_path(content_hash)
+    if os.path.exists(cache_path):
+      try:
+        return ParsedFeed(cache_path)
+      except ValueError:
+        # Written in an older format or on another kind of machine
+        pass
+    tree = utils.PfifXmlTree(utils.open_file(path, 'r'), parser=parser)
+    ParsedFeed.write(tree, cache_path, content_hash)
+    return ParsedFeed(cache_path, tree=tree)
+
+def main():
+  """Parses each PFIF XML file into the cache, unless it is already there, and
+  prints how long loading it took."""
+  parser = optparse.OptionParser(
+      usage='usage: %prog --cache DIR pfif-xml-file ...')
+  parser.add_option('--cache',
+                    help='The directory of parsed feeds.  It is created if it '
+                    'does not exist.')
+  (options, args) = parser.parse_args()
+  assert options.cache, 'Must provide a cache directory.'
+
+  cache = ParsedFeedCache(options.cache)
+  for path in args:
+    parsed_feed = cache.load(path)
+    print '%s: %s (%d records, loaded in %.3f seconds)' % (
+        path, parsed_feed.path, parsed_feed.get_record_count(),
+        parsed_feed.load_seconds)
+    parsed_feed.close()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Stores the records of a PFIF XML feed column by column.
+
+pfif_diff.objectify_pfif_tree makes a dict for every record, with a key and a
+value string for every field.  ColumnarRecords holds the same data as one
+RecordTable for persons and one for notes.  Each table has one array per
+field name, with a row for each record, and every value is a code in a
+StringPool shared by both tables (and by any other feed that is compared with
+them), so each distinct string is only stored once and each field of a record
+takes four bytes.  Each table's index maps record ids to rows.
+
+Whole-feed passes work on columns rather than records: a format check tests
+each distinct value of a column once, counts are taken by scanning arrays,
+and pfif_diff.iter_columnar_diff compares two feeds that share a pool by their
+codes, without comparing any strings."""
+
+import array
+import optparse
+import utils
+import pfif_validator
+
+# The code of a field that a record doesn't have
+NONE = -1
+
+# The type of the arrays of codes
+CODE_TYPE = 'i'
+
+class StringPool:
+  """Gives every distinct string a code, and stores it once."""
+
+  def __init__(self):
+    self.strings = []
+    self.codes = {}
+    # code : the code of the string in lower case
+    self.lower_codes = array.array(CODE_TYPE)
+
+  def __len__(self):
+    return len(self.strings)
+
+  def encode(self, string):
+    """Returns the code of string, adding it if it is new, or NONE for
+    None."""
+    if string is None:
+      return NONE
+    code = self.codes.get(string)
+    if code is None:
+      code = self.codes[string] = len(self.strings)
+      self.strings.append(string)
+    return code
+
+  def decode(self, code):
+    """Returns the string with code, or None for NONE."""
+    if code == NONE:
+      return None
+    return self.strings[code]
+
+  def get_lower_codes(self):
+    """Returns a list of the code of each string in lower case, with NONE at
+    the end, so that it can be indexed by any code, including NONE.  Lower
+    case strings that are new are added, so the list covers them too."""
+    while len(self.lower_codes) < len(self.strings):
+      self.lower_codes.append(
+          self.encode(self.strings[len(self.lower_codes)].lower()))
+    return self.lower_codes.tolist() + [NONE]
+
+class RecordTable:
+  """The records of one type, with a column of codes for each field.  ids is
+  the column of record ids, and rows maps the code of each record id to its
+  row."""
+
+  def __init__(self, record_type, pool):
+    self.record_type = record_type
+    self.pool = pool
+    self.ids = array.array(CODE_TYPE)
+    self.rows = {}
+    self.columns = {}
+
+  def __len__(self):
+    return len(self.ids)
+
+  def get_row(self, record_id):
+    """Returns the row of record_id, adding an empty row if it is new."""
+    id_code = self.pool.encode(record_id)
+    row = self.rows.get(id_code)
+    if row is None:
+      row = self.rows[id_code] = len(self.ids)
+      self.ids.append(id_code)
+      for column in self.columns.itervalues():
+        column.append(NONE)
+    return row
+
+  def set_field(self, row, field, value):
+    """Sets field of the record at row to value."""
+    column = self.columns.get(field)
+    if column is None:
+      column = self.columns[field] = array.array(CODE_TYPE,
+                                                 [NONE]) * len(self.ids)
+    column[row] = self.pool.encode(value)
+
+  def set_fields(self, row, fields):
+    """Sets each (field, value) pair of fields in the record at row, like
+    set_field, with the pool's maps used directly to save a call per
+    field.  The values can't be None."""
+    columns = self.columns
+    codes = self.pool.codes
+    strings = self.pool.strings
+    for field, value in fields:
+      column = columns.get(field)
+      if column is None:
+        column = columns[field] = array.array(CODE_TYPE,
+                                              [NONE]) * len(self.ids)
+      code = codes.get(value)
+      if code is None:
+        code = codes[value] = len(strings)
+        strings.append(value)
+      column[row] = code
+
+  def get_record_id(self, row):
+    """Returns the record id of row."""
+    return self.pool.decode(self.ids[row])
+
+  def get_record(self, row):
+    """Returns a map from field name to value of the fields of the record at
+    row, like the map of the record from pfif_diff.objectify_pfif_tree."""
+    decode = self.pool.decode
+    return dict((field, decode(column[row]))
+                for field, column in self.columns.iteritems()
+                if column[row] != NONE)
+
+  def count_filled(self, field):
+    """Returns how many records have field, blank or not."""
+    column = self.columns.get(field)
+    if column is None:
+      return 0
+    return len(column) - column.count(NONE)
+
+  def count_values(self, field):
+    """Returns a map from each value of field to the number of records with
+    it."""
+    column = self.columns.get(field, ())
+    counts = {}
+    for code in column:
+      counts[code] = counts.get(code, 0) + 1
+    counts.pop(NONE, None)
+    return dict((self.pool.decode(code), count)
+                for code, count in counts.iteritems())
+
+  def get_distinct_codes(self, field):
+    """Returns a set of the codes in field."""
+    codes = set(self.columns.get(field, ()))
+    codes.discard(NONE)
+    return codes
+
+  def find_rows(self, field, codes):
+    """Returns a list of the rows whose field is one of codes, in order."""
+    if not codes:
+      return []
+    column = self.columns[field]
+    return [row for row, code in enumerate(column) if code in codes]
+
+  def check_format(self, field, checker):
+    """Returns a tuple (empty_rows, bad_rows) of the rows whose field is blank
+    and the rows whose field isn't blank but doesn't pass checker, a function
+    from text to whether it is valid.  Each distinct value is only checked
+    once."""
+    strings = self.pool.strings
+    empty_codes = set()
+    bad_codes = set()
+    for code in self.get_distinct_codes(field):
+      text = strings[code]
+      if not text:
+        empty_codes.add(code)
+      elif not checker(text):
+        bad_codes.add(code)
+    return (self.find_rows(field, empty_codes),
+            self.find_rows(field, bad_codes))
+
+class ColumnarRecords:
+  """The persons and notes of a PfifXmlTree, as read by
+  pfif_diff.objectify_pfif_tree: notes in persons are stored with the
+  top level notes, with the person_record_id of their person, fields in
+  ignore_fields are left out, as are blank fields if omit_blank_fields, a
+  record with the id of an earlier one adds its fields to it, and records
+  without ids are skipped.  pool is the StringPool to store the values in,
+  which must be shared to compare two feeds; by default, a new one is used."""
+
+  def __init__(self, tree, pool=None, ignore_fields=None,
+               omit_blank_fields=False):
+    if pool is None:
+      pool = StringPool()
+    self.pool = pool
+    self.version = tree.version
+    self.persons = RecordTable('person', self.pool)
+    self.notes = RecordTable('note', self.pool)
+    self.ignore_fields = set(ignore_fields or [])
+    self.omit_blank_fields = omit_blank_fields
+    # etree tag : field name
+    self.fields = {}
+    note_tag = tree.add_namespace_to_tag('note')
+    for person in tree.get_all_persons():
+      person_record_id = self.add_record(self.persons, person, note_tag)
+      if person_record_id is not None:
+        for note in person.findall(note_tag):
+          self.add_record(self.notes, note, note_tag,
+                          person_record_id=person_record_id)
+    for note in tree.get_top_level_notes():
+      self.add_record(self.notes, note, note_tag)
+
+  def get_tables(self):
+    """Returns a list of the persons table and the notes table."""
+    return [self.persons, self.notes]
+
+  def add_record(self, table, record, note_tag, person_record_id=None):
+    """Adds the fields of record, an element, to table, except for the notes
+    of a person.  person_record_id is the id of the person that a note is
+    in.  Returns the record id, or None if the record doesn't have one."""
+    id_field = table.record_type + '_record_id'
+    is_person = table is self.persons
+    ignore_fields = self.ignore_fields
+    omit_blank_fields = self.omit_blank_fields
+    values = []
+    if person_record_id is not None and 'person_record_id' not in ignore_fields:
+      values.append(('person_record_id', person_record_id))
+    record_id = None
+    for child in record:
+      tag = child.tag
+      if is_person and tag == note_tag:
+        continue
+      field = self.fields.get(tag)
+      if field is None:
+        field = self.fields[tag] = utils.extract_tag(tag)
+      # if there is no text in the node, use the empty string, not None
+      value = child.text or ''
+      if field == id_field and record_id is None:
+        record_id = value
+      if field not in ignore_fields and (value or not omit_blank_fields):
+        values.append((field, value))
+    if not record_id:
+      print 'Invalid PFIF XML: a record is missing its ' + id_field
+      return None
+    table.set_fields(table.get_row(record_id), values)
+    return record_id
+
+  def check_formats(self):
+    """Checks every field that has a format in PfifValidator.FORMATS for the
+    version of the feed, one column at a time.  Returns a list of messages
+    like those of PfifValidator.validate_fields_have_correct_format, but
+    without line numbers, grouped by field.  The messages for notes have the
+    person_record_id of the note, or of its person."""
+    messages = []
+    for table in self.get_tables():
+      messages.extend(self.check_table_formats(table))
+    return messages
+
+  def check_table_formats(self, table):
+    """Returns the messages of check_formats for the records in table."""
+    messages = []
+    formats = pfif_validator.PfifValidator.FORMATS[self.version]
+    id_field = table.record_type + '_record_id'
+    for field, field_format in sorted(formats[table.record_type].items()):
+      if field not in table.columns:
+        continue
+      empty_rows, bad_rows = table.check_format(
+          field, pfif_validator.RecordPlan.make_checker(field_format))
+      for rows, category, is_error in [
+          (empty_rows, 'You had an empty field.', False),
+          (bad_rows, 'The text in one of your fields does not match the '
+           'requirement in the specification.', True)]:
+        for row in rows:
+          message_ids = {id_field : table.get_record_id(row)}
+          if table is self.notes and 'person_record_id' in table.columns:
+            message_ids['person_record_id'] = table.pool.decode(
+                table.columns['person_record_id'][row])
+          messages.append(utils.Message(
+              category, is_error=is_error, xml_tag=field,
+              # like the text of an element, blank text is None
+              xml_text=table.pool.decode(table.columns[field][row]) or None,
+              **message_ids))
+    return messages
+
+  def get_field_stats(self):
+    """Returns a list of (record_type, field, filled, distinct) for every
+    field of every table, where filled is the number of records that have the
+    field and distinct is the number of distinct values that it has."""
+    stats = []
+    for table in self.get_tables():
+      for field in sorted(table.columns):
+        stats.append((table.record_type, field, table.count_filled(field),
+                      len(table.get_distinct_codes(field))))
+    return stats
+
+def main():
+  """Prints how many records have each field of a PFIF XML file, how many
+  distinct values each field has, and how many of its values are blank or
+  badly formatted."""
+  parser = optparse.OptionParser(usage='usage: %prog pfif-xml-file')
+  (_, args) = parser.parse_args()
+  assert len(args) == 1, 'Must provide one PFIF XML file.'
+  records = ColumnarRecords(utils.PfifXmlTree(utils.open_file(args[0], 'r')))
+  format_counts = {}
+  for table in records.get_tables():
+    # Notes have a person_record_id too, so the table tells them apart.
+    for message in records.check_table_formats(table):
+      key = (table.record_type, message.xml_tag, message.is_error)
+      format_counts[key] = format_counts.get(key, 0) + 1
+  print '\t'.join(['Record', 'Field', 'Filled', 'Distinct', 'Blank', 'Bad'])
+  for record_type, field, filled, distinct in records.get_field_stats():
+    print '\t'.join([record_type, field, str(filled), str(distinct),
+                     str(format_counts.get((record_type, field, False), 0)),
+                     str(format_counts.get((record_type, field, True), 0))])
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Converts PFIF XML feeds between versions 1.1, 1.2, and 1.3.
+
+Each record is read with utils.iter_records and converted with PfifValidator's
+tables for the target version: fields in FIELD_RENAMES are renamed (home_zip
+is home_postal_code after 1.1), names are filled in from each other where the
+target requires them (full_name from first_name and last_name, or the other
+way around), fields that aren't allowed in the target are dropped and counted,
+fields whose format is CAPS are upper cased, and the rest are sorted by the
+target's FIELD_ORDER.  The records are written
+with utils.PfifXmlWriter in the namespace of the target.
+
+Notes are kept where they are, or all nested in their persons, or all hoisted
+to the top level with the person_record_id of their person.  PFIF 1.1 has no
+top level notes, so they are always nested when converting to it.  Nesting
+needs every note of a person when the person is written, so the top level
+notes are read first, in a separate pass, into a NoteStore in sqlite on disk.
+
+Records are written in batches of BATCH_RECORDS, and each batch is checked by
+the record rules of the target version as it is written, with line numbers in
+the output.  The rules that compare records with each other need the whole
+feed, so the output should still be validated once it is done.  Memory only
+grows with the size of a batch and with the validation messages."""
+
+import cPickle
+import optparse
+import os
+import sqlite3
+import tempfile
+from StringIO import StringIO
+import pfif_incremental
+import pfif_validator
+import utils
+from pfif_validator import PfifValidator, Rule
+
+# Where notes go: KEEP_NOTES leaves them where they are, NEST_NOTES puts them
+# in their persons, and HOIST_NOTES puts them at the top level.
+KEEP_NOTES = 'keep'
+NEST_NOTES = 'nest'
+HOIST_NOTES = 'hoist'
+NOTE_PLACEMENTS = [KEEP_NOTES, NEST_NOTES, HOIST_NOTES]
+
+# How many records are written and validated at a time
+BATCH_RECORDS = 500
+
+# version : field : the name of the field in that version
+FIELD_RENAMES = {1.1 : {'home_postal_code' : 'home_zip'},
+                 1.2 : {'home_zip' : 'home_postal_code'},
+                 1.3 : {'home_zip' : 'home_postal_code'}}
+
+class NoteStore:
+  """Holds the top level notes of a feed in sqlite, by the person_record_id
+  that they belong to, until their persons are written.  The notes of each
+  person are taken out in the order that they were added, and the notes that
+  are left at the end have no person in the feed.  The database is a
+  temporary file unless db_path is given, so notes don't have to fit in
+  memory."""
+
+  def __init__(self, db_path=None):
+    self.temp_path = None
+    if db_path is None:
+      handle, db_path = tempfile.mkstemp(suffix='.sqlite')
+      os.close(handle)
+      self.temp_path = db_path
+    self.connection = sqlite3.connect(db_path)
+    self.connection.executescript("""
+        CREATE TABLE IF NOT EXISTS notes (
+            person_record_id TEXT, fields BLOB);
+        CREATE INDEX IF NOT EXISTS notes_by_person
+            ON notes (person_record_id);""")
+
+  def add_note(self, person_record_id, fields):
+    """Stores the (field, text) pairs of a note about person_record_id."""
+    self.connection.execute(
+        'INSERT INTO notes VALUES (?, ?)',
+        (person_record_id, buffer(cPickle.dumps(fields, 2))))
+
+  def pop_notes(self, person_record_id):
+    """Returns the fields of the notes about person_record_id, in order, and
+    removes them from the store."""
+    rows = self.connection.execute(
+        'SELECT rowid, fields FROM notes WHERE person_record_id = ? '
+        'ORDER BY rowid', (person_record_id,)).fetchall()
+    if rows:
+      self.connection.execute('DELETE FROM notes WHERE person_record_id = ?',
+                              (person_record_id,))
+    return [cPickle.loads(str(fields)) for _, fields in rows]
+
+  def iter_notes(self):
+    """Yields the fields of every note left, in order."""
+    for (fields,) in self.connection.execute(
+        'SELECT fields FROM notes ORDER BY rowid'):
+      yield cPickle.loads(str(fields))
+
+  def close(self):
+    """Closes the database, deleting it if it is a temporary file."""
+    self.connection.close()
+    if self.temp_path is not None:
+      os.remove(self.temp_path)
+      self.temp_path = None
+
+class VersionConverter:
+  """Converts feeds to target_version.  notes is one of NOTE_PLACEMENTS.  If
+  validate is True, every batch of records is checked by the record rules of
+  target_version, and their messages are kept in messages.  The converter
+  counts the records written, the fields dropped by name, and the notes moved,
+  and notes without a person that couldn't be nested are dropped and counted
+  in orphaned_notes."""
+
+  def __init__(self, target_version, notes=KEEP_NOTES, parser=None,
+               validate=True, batch_records=BATCH_RECORDS):
+    assert target_version in PfifValidator.FORMATS, (
+        'This converter only supports versions 1.1-1.3.')
+    assert notes in NOTE_PLACEMENTS, 'Unknown note placement: ' + notes
+    self.target_version = target_version
+    self.notes = notes
+    if target_version < 1.2:
+      self.notes = NEST_NOTES
+    self.parser = parser
+    self.validate = validate
+    self.batch_records = batch_records
+    self.allowed_fields = {
+        'person' : PfifValidator.ALLOWED_CHILDREN[target_version]['person'] -
+                   set(['note']),
+        # Like the validator, notes are checked against their formats.
+        'note' : set(PfifValidator.FORMATS[target_version]['note'])}
+    # PFIF 1.1 names and addresses are in capitals.
+    self.caps_fields = dict(
+        (record_type, set(field for field, field_format in formats.items()
+                          if field_format == PfifValidator.CAPS))
+        for record_type, formats in
+        PfifValidator.FORMATS[target_version].items())
+    self.field_order = PfifValidator.FIELD_ORDER.get(target_version, {})
+    self.renames = FIELD_RENAMES[target_version]
+    self.rules = pfif_validator.select_rules(scopes=[Rule.RECORD])
+    self.note_store = None
+    self.messages = []
+    self.records_written = 0
+    self.dropped_fields = {}
+    self.notes_nested = 0
+    self.notes_hoisted = 0
+    self.orphaned_notes = 0
+
+  def fill_in_names(self, fields):
+    """Adds the name fields that the target version requires of a person if it
+    only has the others: full_name is first_name and last_name joined by a
+    space, and without first_name and last_name, the last word of full_name is
+    the last_name and the rest is the first_name (so a blank full_name gives a
+    blank first_name and last_name)."""
+    get_field = utils.get_field
+    mandatory = PfifValidator.MANDATORY_CHILDREN[self.target_version]['person']
+    first_name = get_field(fields, 'first_name')
+    last_name = get_field(fields, 'last_name')
+    full_name = get_field(fields, 'full_name')
+    if 'full_name' in mandatory and full_name is None:
+      names = [name for name in [first_name, last_name] if name]
+      if names:
+        fields.append(('full_name', ' '.join(names)))
+    if ('first_name' in mandatory and first_name is None and
+        last_name is None and full_name is not None):
+      names = full_name.rsplit(None, 1) or ['']
+      fields.append(('first_name', len(names) > 1 and names[0] or ''))
+      fields.append(('last_name', names[-1]))
+
+  def convert_fields(self, record_type, fields):
+    """Returns the fields of a person or note converted to the target
+    version.  Fields that must be in capitals are upper cased."""
+    renames = self.renames
+    fields = [(renames.get(field, field), text) for field, text in fields]
+    if record_type == 'person':
+      self.fill_in_names(fields)
+    allowed = self.allowed_fields[record_type]
+    caps_fields = self.caps_fields[record_type]
+    converted = []
+    for field, text in fields:
+      if field in caps_fields:
+        converted.append((field, text.upper()))
+      elif field in allowed:
+        converted.append((field, text))
+      else:
+        self.dropped_fields[field] = self.dropped_fields.get(field, 0) + 1
+    ranks = self.field_order.get(record_type)
+    if ranks:
+      # The sort is stable, so fields of the same rank stay in order, and
+      # fields without a rank go at the end.
+      last_rank = max(ranks.values()) + 1
+      converted.sort(key=lambda item: ranks.get(item[0], last_rank))
+    return converted
+
+  def convert_note(self, fields, person_record_id):
+    """Returns the fields of a note converted to the target version, with
+    person_record_id added after the note_record_id if the note doesn't have
+    one and person_record_id isn't None."""
+    if (person_record_id is not None and
+        utils.get_field(fields, 'person_record_id') is None):
+      fields = list(fields)
+      fields.insert(fields and fields[0][0] == 'note_record_id' and 1 or 0,
+                    ('person_record_id', person_record_id))
+    return self.convert_fields('note', fields)
+
+  def store_top_level_notes(self, xml_file):
+    """Reads the top level notes of xml_file into the note store, so that
+    they can be nested in their persons.  Does nothing unless notes are being
+    nested."""
+    if self.notes != NEST_NOTES:
+      return
+    if self.note_store is None:
+      self.note_store = NoteStore()
+    records = utils.iter_records(xml_file, parser=self.parser)
+    utils.read_version(records)
+    for record in records:
+      if utils.get_field_name(record.tag) == 'note':
+        fields = utils.get_fields(record)
+        self.note_store.add_note(
+            utils.get_field(fields, 'person_record_id'), fields)
+    self.note_store.connection.commit()
+
+  def convert(self, xml_file, output):
+    """Writes the records of xml_file to output, converted to the target
+    version.  If notes are being nested, store_top_level_notes must have read
+    the same file first."""
+    assert self.notes != NEST_NOTES or self.note_store is not None, (
+        'store_top_level_notes must read the file before notes are nested.')
+    records = utils.iter_records(xml_file, parser=self.parser)
+    utils.read_version(records)
+    writer = utils.PfifXmlWriter(output, self.target_version)
+    batch = Batch(self, output)
+    for record in records:
+      record_type = utils.get_field_name(record.tag)
+      fields = utils.get_fields(record)
+      if record_type == 'person':
+        self.convert_person(fields, utils.get_notes(record), batch)
+      elif self.notes != NEST_NOTES:
+        batch.add_record('note', self.convert_note(fields, None))
+    self.convert_stored_notes(batch)
+    batch.flush()
+    writer.close()
+
+  def convert_stored_notes(self, batch):
+    """Adds the notes left in the note store, whose persons weren't in the
+    feed, to batch at the top level, or drops them in 1.1, and closes the
+    store."""
+    if self.note_store is None:
+      return
+    for fields in self.note_store.iter_notes():
+      if self.target_version < 1.2:
+        self.orphaned_notes += 1
+      else:
+        batch.add_record('note', self.convert_note(fields, None))
+    self.note_store.close()
+    self.note_store = None
+
+  def convert_person(self, fields, notes, batch):
+    """Adds a person and its notes to batch, placing the notes."""
+    person_record_id = utils.get_field(fields, 'person_record_id')
+    if self.note_store is not None and person_record_id is not None:
+      stored_notes = self.note_store.pop_notes(person_record_id)
+      self.notes_nested += len(stored_notes)
+      notes = notes + stored_notes
+    if self.notes == HOIST_NOTES:
+      batch.add_record('person', self.convert_fields('person', fields))
+      for note in notes:
+        batch.add_record('note', self.convert_note(note, person_record_id))
+      self.notes_hoisted += len(notes)
+    else:
+      batch.add_record('person', self.convert_fields('person', fields),
+                       [self.convert_note(note, None) for note in notes])
+
+  def summary_to_str(self):
+    """Returns how many records were written and how many fields and notes
+    were dropped or moved."""
+    lines = ['%d records written in PFIF %s' % (self.records_written,
+                                                self.target_version)]
+    for field in sorted(self.dropped_fields):
+      lines.append('%d %s fields dropped' % (self.dropped_fields[field],
+                                              field))
+    for count, action in [(self.notes_nested, 'nested'),
+                          (self.notes_hoisted, 'hoisted'),
+                          (self.orphaned_notes, 'dropped without a person')]:
+      if count:
+        lines.append('%d notes %s' % (count, action))
+    return '\n'.join(lines) + '\n'
+
+class Batch:
+  """Records that have been converted but not written yet.  When there are
+  batch_records of them, they are written to output and validated, if the
+  converter validates, as a feed of their own.  Their line numbers are moved
+  to where they are in the output."""
+
+  def __init__(self, converter, output):
+    self.converter = converter
+    self.output = output
+    self.lines = []
+    self.record_count = 0
+    # The number of lines of records written to output so far
+    self.lines_written = 0
+
+  def add_record(self, record_type, fields, notes=()):
+    """Adds a record, with its nested notes, flushing the batch if it is
+    full."""
+    utils.PfifXmlWriter.record_to_lines(record_type, fields, notes, '  ',
+                                        self.lines)
+    self.record_count += 1
+    if self.record_count >= self.converter.batch_records:
+      self.flush()
+
+  def flush(self):
+    """Writes and validates the records in the batch."""
+    if not self.record_count:
+      return
+    text = ''.join(self.lines)
+    self.output.write(text)
+    converter = self.converter
+    if converter.validate:
+      feed = StringIO()
+      writer = utils.PfifXmlWriter(feed, converter.target_version)
+      feed.write(text)
+      writer.close()
+      feed.seek(0)
+      validator = PfifValidator(feed, rules=converter.rules,
+                                parser=converter.parser)
+      # The header before the records is the same in both.
+      converter.messages.extend(
+          pfif_incremental.move_message(message, self.lines_written)
+          for message in validator.run_validations())
+    converter.records_written += self.record_count
+    self.lines_written += len(self.lines)
+    self.lines = []
+    self.record_count = 0
+
+def main():
+  """Converts a PFIF XML file to another version."""
+  parser = optparse.OptionParser(
+      usage='usage: %prog [options] pfif-xml-file output-file')
+  parser.add_option('--to-version', type='choice', default='1.3',
+                    choices=['1.1', '1.2', '1.3'],
+                    help='The version to convert to.  Defaults to 1.3.')
+  parser.add_option('--notes', type='choice', default=KEEP_NOTES,
+                    choices=NOTE_PLACEMENTS,
+                    help='Where to put notes: ' + ', '.join(NOTE_PLACEMENTS) +
+                    '.  Notes are always nested in PFIF 1.1.')
+  parser.add_option('--no-validate', action='store_false', dest='validate',
+                    default=True,
+                    help='Does not check the records as they are written.')
+  parser.add_option('--parser', choices=utils.PARSERS,
+                    help='The XML parser to use: ' + ', '.join(utils.PARSERS) +
+                    '.  Defaults to the fastest one installed.')
+  (options, args) = parser.parse_args()
+  assert len(args) == 2, 'Must provide a PFIF XML file and an output file.'
+  converter = VersionConverter(float(options.to_version), notes=options.notes,
+                               parser=options.parser,
+                               validate=options.validate)
+  converter.store_top_level_notes(utils.open_file(args[0], 'r'))
+  output = open(args[1], 'wb')
+  try:
+    converter.convert(utils.open_file(args[0], 'r'), output)
+  finally:
+    output.close()
+  print converter.summary_to_str()
+  if converter.messages:
+    print utils.MessagesOutput.generate_message_summary(converter.messages,
+                                                        is_html=False)
+    print utils.MessagesOutput.messages_to_str(
+        converter.messages,
+        xml_lines=utils.MessagesOutput.read_message_lines(
+            open(args[1]), converter.messages))
+
+if __name__ == '__main__':
+  main()
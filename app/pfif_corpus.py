@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks PFIF XML feeds for duplicate ids and dangling links across a corpus
+of feeds.
+
+The validator only looks inside of one file, but feeds are merged, so the same
+person_record_id can show up in two feeds and a linked_person_record_id can
+point to a person in another feed.  CorpusIndex keeps the record ids and links
+of every feed that has been added in sqlite, so a new feed can be checked
+against the whole corpus with indexed lookups instead of parsing every other
+feed again."""
+
+import optparse
+import sqlite3
+import utils
+
+class CorpusIndex:
+  """Stores the record ids and links of many feeds in sqlite.  Each feed is
+  known by a name, usually its path or URL, and adding a feed again replaces
+  what was indexed for it before."""
+
+  def __init__(self, db_path=':memory:'):
+    self.connection = sqlite3.connect(db_path)
+    self.connection.executescript("""
+        CREATE TABLE IF NOT EXISTS feeds (
+            feed TEXT PRIMARY KEY, record_count INTEGER, link_count INTEGER);
+        CREATE TABLE IF NOT EXISTS records (
+            record_type TEXT, record_id TEXT, feed TEXT);
+        CREATE INDEX IF NOT EXISTS records_by_id
+            ON records (record_type, record_id);
+        CREATE INDEX IF NOT EXISTS records_by_feed ON records (feed);
+        CREATE TABLE IF NOT EXISTS links (
+            person_record_id TEXT, linked_person_record_id TEXT, feed TEXT);
+        CREATE INDEX IF NOT EXISTS links_by_id
+            ON links (person_record_id, linked_person_record_id);
+        CREATE INDEX IF NOT EXISTS links_by_feed ON links (feed);""")
+
+  @staticmethod
+  def get_records(tree):
+    """Returns a list of (record_type, record_id, id_field, record) for every
+    person and note in tree that has an id."""
+    records = []
+    for record_type, record_list in [('person', tree.get_all_persons()),
+                                     ('note', tree.get_all_notes())]:
+      id_tag = tree.add_namespace_to_tag(record_type + '_record_id')
+      for record in record_list:
+        id_field = record.find(id_tag)
+        if id_field is not None and id_field.text:
+          records.append((record_type, id_field.text, id_field, record))
+    return records
+
+  @staticmethod
+  def get_links(tree):
+    """Returns a list of (person_record_id, linked_person_record_id,
+    link_field, note) for every note in tree with a linked_person_record_id.
+    Notes inside of persons belong to the person that contains them."""
+    links = []
+    link_tag = tree.add_namespace_to_tag('linked_person_record_id')
+    notes = [(tree.get_field_text(note, 'person_record_id'), note)
+             for note in tree.get_top_level_notes()]
+    for person in tree.get_all_persons():
+      person_record_id = tree.get_field_text(person, 'person_record_id')
+      notes.extend([(person_record_id, note) for note in
+                    person.findall(tree.add_namespace_to_tag('note'))])
+    for person_record_id, note in notes:
+      link_field = note.find(link_tag)
+      if person_record_id and link_field is not None and link_field.text:
+        links.append((person_record_id, link_field.text, link_field, note))
+    return links
+
+  def add_feed(self, feed, tree):
+    """Indexes the records and links of tree, a utils.PfifXmlTree, as feed,
+    replacing anything indexed for feed before."""
+    records = CorpusIndex.get_records(tree)
+    links = CorpusIndex.get_links(tree)
+    self.remove_feed(feed, commit=False)
+    self.connection.executemany(
+        'INSERT INTO records VALUES (?, ?, ?)',
+        [(record_type, record_id, feed)
+         for record_type, record_id, _, _ in records])
+    self.connection.executemany(
+        'INSERT INTO links VALUES (?, ?, ?)',
+        [(person_record_id, linked_id, feed)
+         for person_record_id, linked_id, _, _ in links])
+    self.connection.execute('INSERT INTO feeds VALUES (?, ?, ?)',
+                            (feed, len(records), len(links)))
+    self.connection.commit()
+
+  def remove_feed(self, feed, commit=True):
+    """Removes everything indexed for feed."""
+    for table in ['feeds', 'records', 'links']:
+      self.connection.execute('DELETE FROM ' + table + ' WHERE feed = ?',
+                              (feed,))
+    if commit:
+      self.connection.commit()
+
+  def get_feeds(self):
+    """Returns a list of (feed, record_count, link_count) for every feed."""
+    return self.connection.execute(
+        'SELECT feed, record_count, link_count FROM feeds '
+        'ORDER BY feed').fetchall()
+
+  def get_other_feeds(self, record_type, record_id, feed):
+    """Returns a list of the feeds other than feed with the record."""
+    rows = self.connection.execute(
+        'SELECT DISTINCT feed FROM records WHERE record_type = ? AND '
+        'record_id = ? AND feed != ? ORDER BY feed',
+        (record_type, record_id, feed)).fetchall()
+    return [row[0] for row in rows]
+
+  def has_link(self, person_record_id, linked_id, feed):
+    """Returns True if a feed other than feed has a note for person_record_id
+    that links to linked_id."""
+    return self.connection.execute(
+        'SELECT 1 FROM links WHERE person_record_id = ? AND '
+        'linked_person_record_id = ? AND feed != ? LIMIT 1',
+        (person_record_id, linked_id, feed)).fetchone() is not None
+
+  @staticmethod
+  def make_message(category, tree, record, element, extra_data=None,
+                   is_error=True):
+    """Returns a Message about element, a field of record in tree."""
+    return utils.Message(
+        category, extra_data=extra_data, is_error=is_error,
+        xml_line_number=tree.line_numbers.get(element),
+        xml_tag=utils.extract_tag(element.tag), xml_text=element.text,
+        person_record_id=tree.get_field_text(record, 'person_record_id'),
+        note_record_id=tree.get_field_text(record, 'note_record_id'))
+
+  def check_feed(self, feed, tree):
+    """Returns a list of messages about the records in tree, a
+    utils.PfifXmlTree, that have the same id as a record in another feed, and
+    about the links in tree to persons that are only in other feeds but that
+    don't link back or to persons that aren't in any feed.  Anything indexed
+    for feed itself is ignored, so a feed can be checked again after it has
+    been added.  Links between persons in tree are left to the validator."""
+    messages = []
+    for record_type, record_id, id_field, record in CorpusIndex.get_records(
+        tree):
+      other_feeds = self.get_other_feeds(record_type, record_id, feed)
+      if other_feeds:
+        messages.append(CorpusIndex.make_message(
+            'A record in this feed has the same id as a record in another '
+            'feed.', tree, record, id_field,
+            extra_data='Also in: ' + ', '.join(other_feeds)))
+    person_ids = set(tree.get_field_text(person, 'person_record_id')
+                     for person in tree.get_all_persons())
+    for person_record_id, linked_id, link_field, note in CorpusIndex.get_links(
+        tree):
+      if linked_id in person_ids:
+        continue
+      if not self.get_other_feeds('person', linked_id, feed):
+        messages.append(CorpusIndex.make_message(
+            'A note links to a person that is not in this feed or in any '
+            'other feed.', tree, note, link_field, is_error=False))
+      elif not self.has_link(linked_id, person_record_id, feed):
+        messages.append(CorpusIndex.make_message(
+            'A note links to a person in another feed, but that person does '
+            'not link back.', tree, note, link_field, is_error=False))
+    return messages
+
+def main():
+  """Checks each PFIF XML file against the corpus index, and optionally adds
+  it to the index afterwards."""
+  parser = optparse.OptionParser(
+      usage='usage: %prog [options] --index FILE [pfif-xml-file ...]')
+  parser.add_option('--index',
+                    help='The sqlite file with the corpus index.  It is '
+                    'created if it does not exist.')
+  parser.add_option('--add', action='store_true', default=False,
+                    help='Adds each file to the index after checking it.')
+  parser.add_option('--remove', action='store_true', default=False,
+                    help='Removes each file from the index without checking '
+                    'it.')
+  parser.add_option('--list', action='store_true', default=False,
+                    help='Prints every feed in the index.')
+  (options, args) = parser.parse_args()
+  assert options.index, 'Must provide an index file.'
+
+  index = CorpusIndex(options.index)
+  for feed in args:
+    if options.remove:
+      index.remove_feed(feed)
+      continue
+    tree = utils.PfifXmlTree(utils.open_file(feed, 'r'))
+    messages = index.check_feed(feed, tree)
+    print '--- ' + feed
+    print utils.MessagesOutput.generate_message_summary(messages,
+                                                        is_html=False)
+    print utils.MessagesOutput.messages_to_str(messages, xml_lines=tree.lines)
+    if options.add:
+      index.add_feed(feed, tree)
+  if options.list:
+    output = utils.MessagesOutput(is_html=False)
+    output.start_table(['Feed', 'Records', 'Links'])
+    for row in index.get_feeds():
+      output.make_table_row([str(column) for column in row])
+    output.end_table()
+    print output.get_output()
+
+if __name__ == '__main__':
+  main()
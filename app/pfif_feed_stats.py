@@ -0,0 +1,473 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Profiles the contents of a PFIF XML feed in one pass.
+
+FeedProfile is given one record at a time, so a feed can be profiled straight
+from utils.iter_records without being held in memory, or from a PfifXmlTree
+that has already been parsed for validation.  It keeps how often each field is
+filled in, how long its values are, the range of each date field, how many
+notes each person has, and the most common sexes, statuses, and sources.
+
+Its memory doesn't grow with the feed: distinct values are counted exactly up
+to EXACT_DISTINCT_LIMIT and estimated with a HyperLogLog after that, lengths
+and note counts go into quantile sketches with a fixed relative error, and the
+most common values are kept with the space saving algorithm, which is exact
+until there are more distinct values than it has room for."""
+
+import array
+import cgi
+import hashlib
+import math
+import optparse
+import struct
+import utils
+
+# Distinct values are counted exactly until there are this many of them.
+EXACT_DISTINCT_LIMIT = 1024
+
+# Each HyperLogLog has 2 ** HYPERLOGLOG_PRECISION registers, which gives a
+# standard error of about 1.04 / sqrt(2 ** HYPERLOGLOG_PRECISION), or 1.6%.
+HYPERLOGLOG_PRECISION = 12
+
+# Quantiles of lengths and note counts are within this much of the real value,
+# relative to it.
+QUANTILE_ACCURACY = 0.01
+
+# The quantiles that are reported
+QUANTILES = [0.5, 0.9, 0.99]
+
+# How many of the most common values are reported for each field in
+# VALUE_FIELDS
+TOP_VALUES = 10
+
+# How many values are counted for each field in VALUE_FIELDS.  Space saving
+# only tells the most common values apart from the rest if it has room for
+# many more of them than are reported.
+TOP_VALUES_CAPACITY = 10 * TOP_VALUES
+
+# The fields whose most common values are reported, by record type
+VALUE_FIELDS = {'person' : ['sex', 'source_name'], 'note' : ['status']}
+
+# The fields whose values are dates, in every version (date_of_birth can be a
+# partial date, so it isn't one of them)
+DATE_FIELDS = set(['entry_date', 'expiry_date', 'source_date'])
+
+class DistinctCounter:
+  """Counts the distinct strings it is given: exactly, with a set, until there
+  are more than exact_limit, and then with a HyperLogLog of 2 ** precision
+  registers."""
+
+  def __init__(self, precision=HYPERLOGLOG_PRECISION,
+               exact_limit=EXACT_DISTINCT_LIMIT):
+    self.precision = precision
+    self.exact_limit = exact_limit
+    self.values = set()
+    self.registers = None
+
+  @staticmethod
+  def hash_value(value):
+    """Returns a 64 bit hash of value that is the same in every process."""
+    if isinstance(value, unicode):
+      value = value.encode('utf-8')
+    return struct.unpack('<Q', hashlib.md5(value).digest()[:8])[0]
+
+  def add_to_registers(self, value):
+    """Adds value to the HyperLogLog.  The first precision bits of its hash
+    pick a register, which keeps the most leading zeros (plus one) seen in the
+    rest of the bits."""
+    value_hash = DistinctCounter.hash_value(value)
+    rest_bits = 64 - self.precision
+    index = value_hash >> rest_bits
+    rest = value_hash & ((1 << rest_bits) - 1)
+    rank = rest_bits - rest.bit_length() + 1
+    if rank > self.registers[index]:
+      self.registers[index] = rank
+
+  def add(self, value):
+    """Counts value, a string."""
+    if self.registers is not None:
+      self.add_to_registers(value)
+      return
+    self.values.add(value)
+    if len(self.values) > self.exact_limit:
+      self.registers = array.array('B', [0]) * (1 << self.precision)
+      for old_value in self.values:
+        self.add_to_registers(old_value)
+      self.values = None
+
+  def is_exact(self):
+    """Returns True if the count is exact."""
+    return self.registers is None
+
+  def count(self):
+    """Returns the number of distinct values, or an estimate of it."""
+    if self.registers is None:
+      return len(self.values)
+    registers = len(self.registers)
+    alpha = 0.7213 / (1 + 1.079 / registers)
+    estimate = alpha * registers * registers / sum(
+        [2.0 ** -rank for rank in self.registers])
+    empty_registers = self.registers.count(0)
+    if estimate <= 2.5 * registers and empty_registers:
+      # Linear counting is more accurate for small counts.
+      estimate = registers * math.log(float(registers) / empty_registers)
+    return int(round(estimate))
+
+class QuantileSketch:
+  """Estimates the quantiles of non-negative numbers, like DDSketch: each
+  number is counted in a bucket whose bounds are within accuracy of it,
+  relative to it, and the number of buckets only grows with the logarithm of
+  the range of the numbers."""
+
+  def __init__(self, accuracy=QUANTILE_ACCURACY):
+    self.gamma = (1 + accuracy) / (1 - accuracy)
+    self.log_gamma = math.log(self.gamma)
+    # bucket index : count, where bucket i holds (gamma ** (i-1), gamma ** i]
+    self.buckets = {}
+    self.zeros = 0
+    self.count = 0
+    self.total = 0
+    self.minimum = None
+    self.maximum = None
+
+  def add(self, value):
+    """Counts value."""
+    self.count += 1
+    self.total += value
+    if self.minimum is None or value < self.minimum:
+      self.minimum = value
+    if self.maximum is None or value > self.maximum:
+      self.maximum = value
+    if value <= 0:
+      self.zeros += 1
+      return
+    index = int(math.ceil(math.log(value) / self.log_gamma))
+    self.buckets[index] = self.buckets.get(index, 0) + 1
+
+  def get_mean(self):
+    """Returns the mean of the values, or None if there are none."""
+    if not self.count:
+      return None
+    return float(self.total) / self.count
+
+  def get_quantile(self, quantile):
+    """Returns an estimate of the value at quantile, a fraction from 0 to 1,
+    or None if there are no values."""
+    if not self.count:
+      return None
+    rank = int(quantile * (self.count - 1))
+    if rank < self.zeros:
+      return 0
+    seen = self.zeros
+    for index in sorted(self.buckets):
+      seen += self.buckets[index]
+      if seen > rank:
+        value = 2 * self.gamma ** index / (self.gamma + 1)
+        return min(max(value, self.minimum), self.maximum)
+    return self.maximum
+
+class TopValues:
+  """Keeps the most common of the values it is given, with the space saving
+  algorithm: up to capacity values are counted, and a new value that doesn't
+  fit replaces the least common one, taking over its count.  The counts are
+  exact until that happens; after that, a count can be too high by at most the
+  count that it took over, its error.  Up to reported values are reported."""
+
+  def __init__(self, capacity=TOP_VALUES_CAPACITY, reported=TOP_VALUES):
+    self.capacity = capacity
+    self.reported = reported
+    self.counts = {}
+    # value : the count that it took over
+    self.errors = {}
+    self.evicted = False
+
+  def add(self, value):
+    """Counts value."""
+    if value in self.counts:
+      self.counts[value] += 1
+    elif len(self.counts) < self.capacity:
+      self.counts[value] = 1
+    else:
+      least_common = min(self.counts, key=self.counts.get)
+      count = self.counts.pop(least_common)
+      self.errors.pop(least_common, None)
+      self.counts[value] = count + 1
+      self.errors[value] = count
+      self.evicted = True
+
+  def is_exact(self):
+    """Returns True if every count is exact."""
+    return not self.evicted
+
+  def get_error(self, value):
+    """Returns how much too high the count of value may be."""
+    return self.errors.get(value, 0)
+
+  def get_cutoff(self):
+    """Returns the highest count that a value that isn't kept can have: the
+    lowest count kept, once a value has been evicted, or 0 before."""
+    if not self.evicted:
+      return 0
+    return min(self.counts.itervalues())
+
+  def get_top(self):
+    """Returns a list of (value, count) of up to reported values, most common
+    first.  Values that might not be more common than a value that wasn't
+    kept, because their count minus their error isn't above the cutoff, are
+    left out."""
+    cutoff = self.get_cutoff()
+    top = [(value, count) for value, count in self.counts.iteritems()
+           if count - self.get_error(value) > cutoff]
+    top.sort(key=lambda item: (-item[1], item[0]))
+    return top[:self.reported]
+
+class FieldProfile:
+  """What is known about the values of one field of one record type."""
+
+  def __init__(self, is_date):
+    self.is_date = is_date
+    self.filled = 0
+    self.blank = 0
+    self.distinct = DistinctCounter()
+    self.lengths = QuantileSketch()
+    # bit length of the length : count, so bucket b holds lengths from
+    # 2 ** (b-1) to 2 ** b - 1
+    self.length_histogram = {}
+    self.earliest = None
+    self.latest = None
+    self.not_dates = 0
+
+  def add(self, text):
+    """Adds the text of one field."""
+    if not text:
+      self.blank += 1
+      return
+    self.filled += 1
+    self.distinct.add(text)
+    length = len(text)
+    self.lengths.add(length)
+    bucket = length.bit_length()
+    self.length_histogram[bucket] = self.length_histogram.get(bucket, 0) + 1
+    if self.is_date:
+      date = utils.PFIF_DATES.parse(text)
+      if date is None:
+        self.not_dates += 1
+      else:
+        if self.earliest is None or date < self.earliest:
+          self.earliest = date
+        if self.latest is None or date > self.latest:
+          self.latest = date
+
+  def histogram_to_str(self):
+    """Returns the length histogram as a string like '1-1:3 2-3:10'."""
+    parts = []
+    for bucket in sorted(self.length_histogram):
+      low, high = 1 << (bucket - 1), (1 << bucket) - 1
+      parts.append('%d-%d:%d' % (low, high, self.length_histogram[bucket]))
+    return ' '.join(parts)
+
+class RecordTypeProfile:
+  """The number of records of one type, and a FieldProfile for each of their
+  fields."""
+
+  def __init__(self, record_type):
+    self.record_type = record_type
+    self.count = 0
+    self.fields = {}
+    self.top_values = dict((field, TopValues())
+                           for field in VALUE_FIELDS[record_type])
+
+  def add_record(self, record):
+    """Adds the fields of record, an element, except for any nested notes.  A
+    field that a record has more than once is only counted once."""
+    self.count += 1
+    seen_fields = set()
+    for child in record:
+      field = utils.extract_tag(child.tag)
+      if field == 'note' or field in seen_fields:
+        continue
+      seen_fields.add(field)
+      profile = self.fields.get(field)
+      if profile is None:
+        profile = self.fields[field] = FieldProfile(field in DATE_FIELDS)
+      text = child.text or ''
+      profile.add(text)
+      if field in self.top_values:
+        self.top_values[field].add(text)
+
+  def get_fill_rate(self, field):
+    """Returns the fraction of records with field filled in."""
+    if not self.count:
+      return 0.0
+    return float(self.fields[field].filled) / self.count
+
+class FeedProfile:
+  """The statistics of a feed, built up one record at a time with
+  add_record.  Nested notes are counted with the top level notes in notes,
+  and notes_per_person sketches how many notes are nested in each person.
+  Top level notes are only counted, along with how many distinct persons they
+  are about, since matching them to their persons would take memory that
+  grows with the feed."""
+
+  def __init__(self):
+    self.version = None
+    self.persons = RecordTypeProfile('person')
+    self.notes = RecordTypeProfile('note')
+    self.nested_notes = 0
+    self.top_level_notes = 0
+    self.other_records = 0
+    self.notes_per_person = QuantileSketch()
+    self.noted_persons = DistinctCounter()
+
+  def set_root(self, root):
+    """Takes the version from root, the pfif element."""
+    self.version = utils.get_pfif_version(root.tag)
+
+  def add_record(self, record):
+    """Adds record, a child of the root: a person with its notes, or a top
+    level note.  Other children are only counted."""
+    record_type = utils.extract_tag(record.tag)
+    if record_type == 'person':
+      self.persons.add_record(record)
+      note_count = 0
+      for child in record:
+        if utils.extract_tag(child.tag) == 'note':
+          self.notes.add_record(child)
+          note_count += 1
+      self.nested_notes += note_count
+      self.notes_per_person.add(note_count)
+    elif record_type == 'note':
+      self.notes.add_record(record)
+      self.top_level_notes += 1
+      for child in record:
+        if utils.extract_tag(child.tag) == 'person_record_id' and child.text:
+          self.noted_persons.add(child.text)
+          break
+    else:
+      self.other_records += 1
+
+  def add_tree(self, tree):
+    """Adds every record of tree, a PfifXmlTree that is already parsed."""
+    root = tree.getroot()
+    self.set_root(root)
+    for record in root:
+      self.add_record(record)
+
+  def to_str(self, is_html=False):
+    """Returns tables of the counts, the fields, the date ranges, and the most
+    common values."""
+    def escape(text):
+      """Escapes text from the feed for HTML."""
+      if is_html:
+        return cgi.escape(text)
+      return text
+    def format_number(number):
+      """Formats a length or count, which may be None or an estimate, as a
+      whole number."""
+      if number is None:
+        return ''
+      return '%d' % round(number)
+
+    output = utils.MessagesOutput(is_html, html_class='feed_stats')
+    output.start_table(['Records', 'Count'])
+    output.make_table_row(['version', str(self.version)])
+    output.make_table_row(['persons', str(self.persons.count)])
+    output.make_table_row(['nested notes', str(self.nested_notes)])
+    output.make_table_row(['top level notes', str(self.top_level_notes)])
+    output.make_table_row(['persons with top level notes',
+                           str(self.noted_persons.count())])
+    if self.other_records:
+      output.make_table_row(['other', str(self.other_records)])
+    sketch = self.notes_per_person
+    for quantile in QUANTILES:
+      output.make_table_row(['nested notes per person p%d' % (quantile * 100),
+                             format_number(sketch.get_quantile(quantile))])
+    output.make_table_row(['nested notes per person max',
+                           format_number(sketch.maximum)])
+    mean = sketch.get_mean()
+    output.make_table_row(['nested notes per person mean',
+                           mean is not None and '%.2f' % mean or ''])
+    output.end_table()
+
+    output.start_table(['Record', 'Field', 'Filled', 'Fill Rate', 'Blank',
+                        'Distinct'] +
+                       ['Length p%d' % (quantile * 100)
+                        for quantile in QUANTILES] +
+                       ['Length Max', 'Lengths'])
+    for profile in [self.persons, self.notes]:
+      for field in sorted(profile.fields):
+        field_profile = profile.fields[field]
+        distinct = str(field_profile.distinct.count())
+        if not field_profile.distinct.is_exact():
+          distinct = '~' + distinct
+        output.make_table_row(
+            [profile.record_type, field, str(field_profile.filled),
+             '%.1f%%' % (100 * profile.get_fill_rate(field)),
+             str(field_profile.blank), distinct] +
+            [format_number(field_profile.lengths.get_quantile(quantile))
+             for quantile in QUANTILES] +
+            [format_number(field_profile.lengths.maximum),
+             field_profile.histogram_to_str()])
+    output.end_table()
+
+    output.start_table(['Record', 'Field', 'Earliest', 'Latest', 'Not Dates'])
+    for profile in [self.persons, self.notes]:
+      for field in sorted(profile.fields):
+        field_profile = profile.fields[field]
+        if field_profile.is_date:
+          output.make_table_row(
+              [profile.record_type, field,
+               str(field_profile.earliest or ''),
+               str(field_profile.latest or ''), str(field_profile.not_dates)])
+    output.end_table()
+
+    output.start_table(['Record', 'Field', 'Value', 'Count'])
+    for profile in [self.persons, self.notes]:
+      for field in sorted(profile.top_values):
+        top_values = profile.top_values[field]
+        for value, count in top_values.get_top():
+          if top_values.get_error(value):
+            count = '~' + str(count)
+          output.make_table_row([profile.record_type, field, escape(value),
+                                 str(count)])
+    output.end_table()
+    return output.get_output()
+
+def profile_file(xml_file, parser=None):
+  """Returns the FeedProfile of xml_file, reading it one record at a time with
+  utils.iter_records."""
+  profile = FeedProfile()
+  records = utils.iter_records(xml_file, parser=parser)
+  for root in records:
+    profile.set_root(root)
+    break
+  for record in records:
+    profile.add_record(record)
+  return profile
+
+def main():
+  """Prints the statistics of a PFIF XML file."""
+  parser = optparse.OptionParser(usage='usage: %prog [options] pfif-xml-file')
+  parser.add_option('--parser', choices=utils.PARSERS,
+                    help='The XML parser to use: ' + ', '.join(utils.PARSERS) +
+                    '.  Defaults to the fastest one installed.')
+  (options, args) = parser.parse_args()
+  assert len(args) == 1, 'Must provide one PFIF XML file to profile.'
+  profile = profile_file(utils.open_file(args[0], 'r'), parser=options.parser)
+  print profile.to_str()
+
+if __name__ == '__main__':
+  main()
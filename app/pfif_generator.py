@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Generates synthetic PFIF XML feeds for benchmarks and tests.
+
+* The same seed and options always produce the same feed.
+* Feeds are written one record at a time, so they can be larger than memory.
+* Unless errors are injected, the feed is valid: the only messages that the
+  validator reports are warnings about the empty full_name of expired persons.
+* Each injected error causes exactly one error message.  The number of errors
+  of each kind is recorded in FeedGenerator.injected_errors.
+* Linked records come in pairs of consecutive persons whose notes link to each
+  other.  Expired persons are valid placeholders (PFIF 1.3 only)."""
+
+import datetime
+import optparse
+import random
+import sys
+import utils
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Every record is dated relative to BASE_DATE, and expired persons expired on
+# it, so the feed doesn't depend on when it was generated.
+BASE_DATE = datetime.datetime(2010, 1, 1)
+
+# The order that fields are written in for each version.  1.1 uses the order
+# in the specification; 1.2 and 1.3 only require the record ids to come first.
+PERSON_FIELDS = {1.1 : ['person_record_id', 'entry_date', 'author_name',
+                        'author_email', 'author_phone', 'source_name',
+                        'source_date', 'source_url', 'first_name',
+                        'last_name', 'home_city', 'home_state',
+                        'home_neighborhood', 'home_street', 'home_zip',
+                        'photo_url', 'other'],
+                 1.2 : ['person_record_id', 'entry_date', 'author_name',
+                        'author_email', 'author_phone', 'source_name',
+                        'source_date', 'source_url', 'first_name',
+                        'last_name', 'sex', 'date_of_birth', 'age',
+                        'home_street', 'home_neighborhood', 'home_city',
+                        'home_state', 'home_postal_code', 'home_country',
+                        'photo_url', 'other'],
+                 1.3 : ['person_record_id', 'entry_date', 'expiry_date',
+                        'author_name', 'author_email', 'author_phone',
+                        'source_name', 'source_date', 'source_url',
+                        'full_name', 'first_name', 'last_name', 'sex',
+                        'date_of_birth', 'age', 'home_street',
+                        'home_neighborhood', 'home_city', 'home_state',
+                        'home_postal_code', 'home_country', 'photo_url',
+                        'other']}
+
+NOTE_FIELDS = {1.1 : ['note_record_id', 'entry_date', 'author_name',
+                      'author_email', 'author_phone', 'source_date', 'found',
+                      'email_of_found_person', 'phone_of_found_person',
+                      'last_known_location', 'text'],
+               1.2 : ['note_record_id', 'person_record_id',
+                      'linked_person_record_id', 'entry_date', 'author_name',
+                      'author_email', 'author_phone', 'source_date', 'found',
+                      'status', 'email_of_found_person',
+                      'phone_of_found_person', 'last_known_location', 'text']}
+NOTE_FIELDS[1.3] = NOTE_FIELDS[1.2]
+
+FIRST_NAMES = ['Ana', 'John', 'Mei', 'Omar', 'Priya', 'Sofia', 'Taro', 'Yusuf']
+LAST_NAMES = ['Garcia', 'Kim', 'Nguyen', 'Okafor', 'Rossi', 'Silva', 'Smith']
+CITIES = ['Port au Prince', 'Christchurch', 'Sendai', 'Padang', 'Santiago']
+STREETS = ['Main Street', 'Second Avenue', 'Harbor Road', 'Hill Lane']
+NEIGHBORHOODS = ['Old Town', 'Riverside', 'North End', 'Eastgate']
+SEXES = ['male', 'female', 'other']
+STATUSES = ['information_sought', 'is_note_author', 'believed_alive',
+            'believed_missing', 'believed_dead']
+NOTE_TEXTS = ['Seen at the shelter on the hill.',
+              'Looking for news of my family & friends.',
+              'Called from the hospital, "doing fine".',
+              'Last heard from before the storm.']
+
+class ErrorKinds: # pylint: disable=W0232
+  """Constants representing the kinds of errors that can be injected."""
+
+  # A date without a time
+  BAD_DATE = 'bad_date'
+  # An email address without an @
+  BAD_FORMAT = 'bad_format'
+  # A mandatory field is left out
+  MISSING_FIELD = 'missing_field'
+  # A field that is not in the specification
+  EXTRANEOUS_FIELD = 'extraneous_field'
+
+  ALL = [BAD_DATE, BAD_FORMAT, MISSING_FIELD, EXTRANEOUS_FIELD]
+
+class FeedGenerator: # pylint: disable=R0902
+  """Generates a feed of num_persons persons.
+
+  notes_per_person is the average number of notes per person.
+  top_level_note_ratio is the fraction of notes written as children of the
+  root rather than of their person (1.2+).  error_rate is the fraction of
+  records with an injected error.  link_rate is the fraction of persons that
+  are linked to another person (1.2+).  expired_rate is the fraction of persons
+  that are expired placeholders without notes (1.3)."""
+
+  def __init__(self, num_persons, version=1.3, seed=0, notes_per_person=1.0,
+               top_level_note_ratio=0.0, error_rate=0.0, link_rate=0.0,
+               expired_rate=0.0, domain='example.org'):
+    assert version in PERSON_FIELDS, 'Only versions 1.1-1.3 are supported.'
+    assert version >= 1.2 or not top_level_note_ratio, (
+        'PFIF 1.1 does not allow top level notes.')
+    assert version >= 1.2 or not link_rate, (
+        'PFIF 1.1 does not allow linked records.')
+    assert version >= 1.3 or not expired_rate, (
+        'Only PFIF 1.3 has expiry dates.')
+    self.num_persons = num_persons
+    self.version = version
+    self.random = random.Random(seed)
+    self.notes_per_person = notes_per_person
+    self.top_level_note_ratio = top_level_note_ratio
+    self.error_rate = error_rate
+    self.link_rate = link_rate
+    self.expired_rate = expired_rate
+    self.domain = domain
+    self.note_count = 0
+    self.record_count = 0
+    self.injected_errors = dict((kind, 0) for kind in ErrorKinds.ALL)
+
+  def make_date(self, seconds):
+    """Returns the PFIF date seconds after BASE_DATE."""
+    return (BASE_DATE + datetime.timedelta(seconds=seconds)).strftime(
+        DATE_FORMAT)
+
+  def make_person_record_id(self, index):
+    """Returns the person_record_id of the index-th person."""
+    return self.domain + '/person.' + str(index)
+
+  @staticmethod
+  def order_fields(values, field_order, extra_fields):
+    """Returns a list of (field, text) pairs with the fields in values in the
+    order of field_order, followed by extra_fields."""
+    fields = [(field, values[field]) for field in field_order
+              if field in values]
+    fields.extend(extra_fields)
+    return fields
+
+  def inject_error(self, values, mandatory_field, extra_fields):
+    """With probability error_rate, changes values or extra_fields so that the
+    record has exactly one error."""
+    if self.error_rate and self.random.random() < self.error_rate:
+      kind = self.random.choice(ErrorKinds.ALL)
+      if kind == ErrorKinds.BAD_DATE:
+        values['source_date'] = values['source_date'][:10]
+      elif kind == ErrorKinds.BAD_FORMAT:
+        values['author_email'] = values['author_email'].replace('@', ' at ')
+      elif kind == ErrorKinds.MISSING_FIELD:
+        del values[mandatory_field]
+      else:
+        extra_fields.append(('extraneous_field', 'extraneous'))
+      self.injected_errors[kind] += 1
+
+  def make_person(self, index):
+    """Returns a list of (field, text) pairs for a person that isn't
+    expired."""
+    first_name = self.random.choice(FIRST_NAMES)
+    last_name = self.random.choice(LAST_NAMES)
+    date = self.make_date(index)
+    values = {'person_record_id' : self.make_person_record_id(index),
+              'entry_date' : date,
+              'author_name' : first_name + ' ' + last_name,
+              'author_email' : first_name.lower() + '@' + self.domain,
+              'author_phone' : '+1 650 555 %04d' % (index % 10000),
+              'source_name' : self.domain,
+              'source_date' : date,
+              'source_url' : 'http://' + self.domain + '/person/' + str(index),
+              'home_street' : self.random.choice(STREETS),
+              'home_neighborhood' : self.random.choice(NEIGHBORHOODS),
+              'home_city' : self.random.choice(CITIES),
+              'photo_url' : 'http://' + self.domain + '/photo/' + str(index),
+              'other' : 'description: generated person ' + str(index)}
+    if self.version == 1.1:
+      values['first_name'] = first_name.upper()
+      values['last_name'] = last_name.upper()
+      values['home_city'] = values['home_city'].upper()
+      values['home_street'] = values['home_street'].upper()
+      values['home_neighborhood'] = values['home_neighborhood'].upper()
+      values['home_state'] = 'CA'
+      values['home_zip'] = '%05d' % (index % 100000)
+    else:
+      values['first_name'] = first_name
+      values['last_name'] = last_name
+      values['sex'] = self.random.choice(SEXES)
+      age = self.random.randint(1, 99)
+      values['age'] = str(age)
+      values['date_of_birth'] = str(BASE_DATE.year - age)
+      values['home_state'] = 'US-CA'
+      values['home_postal_code'] = '%05d' % (index % 100000)
+      values['home_country'] = 'US'
+    if self.version >= 1.3:
+      values['full_name'] = first_name + ' ' + last_name
+    extra_fields = []
+    if self.version >= 1.3:
+      self.inject_error(values, 'full_name', extra_fields)
+    else:
+      self.inject_error(values, 'last_name', extra_fields)
+    return FeedGenerator.order_fields(values, PERSON_FIELDS[self.version],
+                                      extra_fields)
+
+  def make_expired_person(self, index):
+    """Returns a list of (field, text) pairs for a placeholder of an expired
+    person."""
+    expiry_date = self.make_date(index - self.num_persons)
+    values = {'person_record_id' : self.make_person_record_id(index),
+              'entry_date' : expiry_date,
+              'expiry_date' : expiry_date,
+              'source_date' : expiry_date,
+              'full_name' : ''}
+    return FeedGenerator.order_fields(values, PERSON_FIELDS[self.version], [])
+
+  def make_note(self, person_record_id, index, linked_person_record_id=None):
+    """Returns a list of (field, text) pairs for a note about the person with
+    person_record_id."""
+    self.note_count += 1
+    date = self.make_date(index)
+    author = self.random.choice(FIRST_NAMES)
+    values = {'note_record_id' : self.domain + '/note.' + str(self.note_count),
+              'entry_date' : date,
+              'author_name' : author,
+              'author_email' : author.lower() + '@' + self.domain,
+              'source_date' : date,
+              'found' : self.random.choice(['true', 'false']),
+              'last_known_location' : self.random.choice(CITIES),
+              'text' : self.random.choice(NOTE_TEXTS)}
+    if self.version >= 1.2:
+      values['person_record_id'] = person_record_id
+      values['status'] = self.random.choice(STATUSES)
+      if linked_person_record_id is not None:
+        values['linked_person_record_id'] = linked_person_record_id
+    extra_fields = []
+    self.inject_error(values, 'author_name', extra_fields)
+    return FeedGenerator.order_fields(values, NOTE_FIELDS[self.version],
+                                      extra_fields)
+
+  def get_note_count(self):
+    """Returns the number of notes for the next person, which averages out to
+    notes_per_person."""
+    whole_notes = int(self.notes_per_person)
+    if self.random.random() < self.notes_per_person - whole_notes:
+      return whole_notes + 1
+    return whole_notes
+
+  def iter_records(self):
+    """Yields a tuple (record_type, fields, notes) for each child of the root,
+    where fields is a list of (field, text) pairs and notes is a list of
+    nested notes, each of which is a list of (field, text) pairs."""
+    # The person that the previous person linked to, which must link back
+    linked_from = None
+    for index in xrange(self.num_persons):
+      person_record_id = self.make_person_record_id(index)
+      if (linked_from is None and self.expired_rate and
+          self.random.random() < self.expired_rate):
+        self.record_count += 1
+        yield ('person', self.make_expired_person(index), [])
+        continue
+
+      link_ids = []
+      if linked_from is not None:
+        link_ids.append(linked_from)
+        linked_from = None
+      elif (self.link_rate and index + 1 < self.num_persons and
+            self.random.random() < self.link_rate):
+        link_ids.append(self.make_person_record_id(index + 1))
+        linked_from = person_record_id
+      note_count = max(self.get_note_count(), len(link_ids))
+      link_ids.extend([None] * (note_count - len(link_ids)))
+
+      nested_notes = []
+      top_level_notes = []
+      for link_id in link_ids:
+        note = self.make_note(person_record_id, index, link_id)
+        if (self.top_level_note_ratio and
+            self.random.random() < self.top_level_note_ratio):
+          top_level_notes.append(note)
+        else:
+          nested_notes.append(note)
+      self.record_count += 1 + len(link_ids)
+      yield ('person', self.make_person(index), nested_notes)
+      for note in top_level_notes:
+        yield ('note', note, [])
+
+  def write_feed(self, output):
+    """Writes the whole feed to output, one record at a time."""
+    writer = utils.PfifXmlWriter(output, self.version)
+    for record_type, fields, notes in self.iter_records():
+      writer.write_record(record_type, fields, notes)
+    writer.close()
+
+def main():
+  """Writes a generated feed to a file or to stdout."""
+  parser = optparse.OptionParser(usage='usage: %prog [options] [output-file]')
+  parser.add_option('--persons', type='int', default=1000,
+                    help='The number of persons in the feed.')
+  parser.add_option('--version', type='choice', default='1.3',
+                    choices=['1.1', '1.2', '1.3'], dest='pfif_version',
+                    help='The PFIF version of the feed.')
+  parser.add_option('--seed', type='int', default=0,
+                    help='The same seed always generates the same feed.')
+  parser.add_option('--notes-per-person', type='float', default=1.0)
+  parser.add_option('--top-level-note-ratio', type='float', default=0.0,
+                    help='The fraction of notes that are children of the root '
+                    'rather than of their person.')
+  parser.add_option('--error-rate', type='float', default=0.0,
+                    help='The fraction of records with an injected error.')
+  parser.add_option('--link-rate', type='float', default=0.0,
+                    help='The fraction of persons linked to another person.')
+  parser.add_option('--expired-rate', type='float', default=0.0,
+                    help='The fraction of persons that are expired.')
+  (options, args) = parser.parse_args()
+
+  generator = FeedGenerator(
+      options.persons, version=float(options.pfif_version), seed=options.seed,
+      notes_per_person=options.notes_per_person,
+      top_level_note_ratio=options.top_level_note_ratio,
+      error_rate=options.error_rate, link_rate=options.link_rate,
+      expired_rate=options.expired_rate)
+  if args:
+    output = open(args[0], 'w')
+  else:
+    output = sys.stdout
+  try:
+    generator.write_feed(output)
+  finally:
+    if args:
+      output.close()
+  sys.stderr.write('Wrote %d records with %d injected errors.\n' % (
+      generator.record_count, sum(generator.injected_errors.values())))
+
+if __name__ == '__main__':
+  main()
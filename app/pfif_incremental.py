@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Validates a PFIF XML file against a snapshot of the last time that it was
+validated, so that only new or changed records are checked again.
+
+Each child of the root (a person with its notes, a top level note, or an
+extraneous tag) is a record.  The snapshot maps the fingerprint of every record
+to the messages that each record rule produced for it, along with the ids and
+links of the record.  Duplicate ids and asymmetric links are found from those
+ids and links, so unchanged records are never visited by any rule.  Line
+numbers are kept relative to the record, so records can move around the file
+without being checked again."""
+
+import copy
+import cPickle
+import hashlib
+import optparse
+import os
+import time
+import utils
+import pfif_validator
+from pfif_validator import PfifValidator, Rule, RuleStats
+
+# The rules that are found from the ids and links in the snapshot rather than
+# run on the tree
+INDEXED_RULES = ['person_ids_are_unique', 'note_ids_are_unique',
+                 'linked_records_matched']
+
+def fingerprint_record(record):
+  """Returns a hash of the tags, text, and attributes of record and everything
+  inside of it.  Whitespace counts, so two records with the same fingerprint
+  also have the same line numbers relative to their start."""
+  digest = hashlib.sha1()
+  for element in record.iter():
+    tail = None
+    if element is not record:
+      tail = element.tail
+    digest.update(repr((element.tag, element.text, tail,
+                        sorted(element.items()))))
+  return digest.hexdigest()
+
+def move_message(message, line_offset):
+  """Returns a copy of message with its line number moved by line_offset."""
+  moved = copy.copy(message)
+  if moved.xml_line_number is not None:
+    moved.xml_line_number += line_offset
+  return moved
+
+class Snapshot:
+  """The results of each record the last time a file was validated.  results
+  maps a fingerprint to a dict with the record's line number, the messages from
+  each record rule (keyed by rule id), and the person ids, note ids, and links
+  of the record.  The snapshot is only plain data and utils.Messages, so it can
+  be pickled no matter which module creates it."""
+
+  # Incremented whenever the contents of results change
+  FORMAT = 1
+
+  def __init__(self, namespace, rule_ids, results=None):
+    self.namespace = namespace
+    self.rule_ids = rule_ids
+    self.results = results or {}
+
+  def is_compatible(self, namespace, rule_ids):
+    """Returns True if the results were made with the same namespace and record
+    rules."""
+    return self.namespace == namespace and self.rule_ids == rule_ids
+
+  @staticmethod
+  def load(path):
+    """Returns the Snapshot saved at path, or None if there isn't one or it was
+    saved in a different format."""
+    if not os.path.exists(path):
+      return None
+    snapshot_file = open(path, 'rb')
+    try:
+      data = cPickle.load(snapshot_file)
+    finally:
+      snapshot_file.close()
+    if data.get('format') != Snapshot.FORMAT:
+      return None
+    return Snapshot(data['namespace'], data['rule_ids'], data['results'])
+
+  def save(self, path):
+    """Saves the snapshot to path.  The file is replaced all at once so that a
+    failed save never leaves half of a snapshot."""
+    temp_path = path + '.tmp'
+    snapshot_file = open(temp_path, 'wb')
+    try:
+      cPickle.dump({'format' : Snapshot.FORMAT, 'namespace' : self.namespace,
+                    'rule_ids' : self.rule_ids, 'results' : self.results},
+                   snapshot_file, cPickle.HIGHEST_PROTOCOL)
+    finally:
+      snapshot_file.close()
+    os.rename(temp_path, path)
+
+class IncrementalValidator(PfifValidator):
+  """A PfifValidator that reuses the results of unchanged records from
+  snapshot.  After running, self.snapshot holds the results of the current
+  records, self.records_checked is the number of records that were checked, and
+  self.records_reused is the number that came from the old snapshot."""
+
+  def __init__(self, xml_file, snapshot=None, rules=None):
+    PfifValidator.__init__(self, xml_file, rules=rules)
+    self.record_rules = [rule for rule in self.rules
+                         if rule.scope == Rule.RECORD and
+                         rule.applies_to(self.version)]
+    rule_ids = [rule.rule_id for rule in self.record_rules]
+    if snapshot is None or not snapshot.is_compatible(self.tree.namespace,
+                                                      rule_ids):
+      snapshot = Snapshot(self.tree.namespace, rule_ids)
+    self.old_snapshot = snapshot
+    self.snapshot = Snapshot(self.tree.namespace, rule_ids)
+    self.records_checked = 0
+    self.records_reused = 0
+
+  def check_record(self, record, rule_seconds):
+    """Runs every record rule on record alone and returns its results.  The
+    time of each rule is added to rule_seconds."""
+    result = {'line' : self.tree.line_numbers[record], 'messages' : {},
+              'person_ids' : [], 'note_ids' : [], 'links' : []}
+    self.tree.select_records([record])
+    try:
+      for rule in self.record_rules:
+        start_time = time.time()
+        result['messages'][rule.rule_id] = getattr(self, rule.method_name)()
+        rule_seconds[rule.rule_id] = (rule_seconds.get(rule.rule_id, 0.0) +
+                                      time.time() - start_time)
+    finally:
+      self.tree.select_records(None)
+    tag = utils.extract_tag(record.tag)
+    if tag == 'person':
+      person_record_id = self.tree.get_field_text(record, 'person_record_id')
+      # Records without an id field are flagged by the mandatory children
+      # rules instead.
+      id_tag = self.tree.add_namespace_to_tag('person_record_id')
+      if record.find(id_tag) != None:
+        result['person_ids'].append((person_record_id,
+                                     self.make_duplicate_id_message(record)))
+      for note in record.findall(self.tree.add_namespace_to_tag('note')):
+        self.index_note(note, person_record_id, False, result)
+    elif tag == 'note':
+      self.index_note(record,
+                      self.tree.get_field_text(record, 'person_record_id'),
+                      True, result)
+    return result
+
+  def index_note(self, note, person_record_id, is_top_level, result):
+    """Adds the id and link of note to result.  person_record_id is the id of
+    the person that the note belongs to."""
+    if note.find(self.tree.add_namespace_to_tag('note_record_id')) != None:
+      result['note_ids'].append((
+          self.tree.get_field_text(note, 'note_record_id'), is_top_level,
+          self.make_duplicate_id_message(note)))
+    linked_id = self.tree.get_field_text(note, 'linked_person_record_id')
+    if linked_id != None and person_record_id != None:
+      result['links'].append((person_record_id, linked_id, is_top_level,
+                              self.make_asymmetric_link_message(note)))
+
+  def get_record_results(self, rule_seconds):
+    """Returns a list of (result, line_offset) for every child of the root, in
+    order, checking only the records that aren't in the old snapshot."""
+    record_results = []
+    for record in self.tree.getroot().getchildren():
+      fingerprint = fingerprint_record(record)
+      result = self.snapshot.results.get(fingerprint)
+      if result is None:
+        result = self.old_snapshot.results.get(fingerprint)
+        if result is None:
+          result = self.check_record(record, rule_seconds)
+          self.records_checked += 1
+        else:
+          self.records_reused += 1
+        self.snapshot.results[fingerprint] = result
+      else:
+        self.records_reused += 1
+      record_results.append(
+          (result, self.tree.line_numbers[record] - result['line']))
+    return record_results
+
+  @staticmethod
+  def find_duplicate_ids(ids):
+    """Returns the messages of every (id, message, line_offset) in ids whose id
+    was used by an earlier one."""
+    messages = []
+    used_ids = set()
+    for record_id, message, line_offset in ids:
+      if record_id in used_ids:
+        messages.append(move_message(message, line_offset))
+      else:
+        used_ids.add(record_id)
+    return messages
+
+  @staticmethod
+  def find_indexed_messages(rule_id, record_results):
+    """Returns the messages of rule_id, one of INDEXED_RULES, in the same order
+    that PfifValidator would."""
+    if rule_id == 'person_ids_are_unique':
+      return IncrementalValidator.find_duplicate_ids(
+          [(person_id, message, line_offset)
+           for result, line_offset in record_results
+           for person_id, message in result['person_ids']])
+    if rule_id == 'note_ids_are_unique':
+      # Top level notes come before the notes inside of persons.
+      note_ids = []
+      for top_level in [True, False]:
+        note_ids.extend([(note_id, message, line_offset)
+                         for result, line_offset in record_results
+                         for note_id, is_top_level, message
+                         in result['note_ids'] if is_top_level == top_level])
+      return IncrementalValidator.find_duplicate_ids(note_ids)
+    # linked_records_matched: notes inside of persons come before top level
+    # notes, and a later note replaces an earlier one with the same link.
+    linked_records = {}
+    for top_level in [False, True]:
+      for result, line_offset in record_results:
+        for person_id, linked_id, is_top_level, message in result['links']:
+          if is_top_level == top_level:
+            linked_records.setdefault(person_id, {})[linked_id] = (
+                message, line_offset)
+    messages = []
+    for person_id, linked_dict in linked_records.items():
+      for linked_id, (message, line_offset) in linked_dict.items():
+        if (linked_id not in linked_records or
+            person_id not in linked_records[linked_id]):
+          messages.append(move_message(message, line_offset))
+    return messages
+
+  def iter_validations(self):
+    """Runs all validations, yielding the messages from each validation as soon
+    as it finishes.  Record rules are only run on records that changed since
+    the old snapshot, and INDEXED_RULES are found from the snapshot.  The time
+    of each record rule includes checking the changed records, and the time
+    spent fingerprinting and indexing records is recorded as
+    fingerprint_records."""
+    self.records_checked = 0
+    self.records_reused = 0
+    rule_seconds = {}
+    start_time = time.time()
+    record_results = self.get_record_results(rule_seconds)
+    self.stats.rules = [RuleStats(
+        'fingerprint_records',
+        seconds=time.time() - start_time - sum(rule_seconds.values()),
+        records_visited=len(record_results))]
+    for rule in self.rules:
+      if not rule.applies_to(self.version):
+        continue
+      records_visited = self.tree.records_visited
+      start_time = time.time()
+      if rule.scope == Rule.RECORD:
+        messages = [move_message(message, line_offset)
+                    for result, line_offset in record_results
+                    for message in result['messages'][rule.rule_id]]
+      elif rule.rule_id in INDEXED_RULES:
+        messages = IncrementalValidator.find_indexed_messages(rule.rule_id,
+                                                              record_results)
+      else:
+        messages = getattr(self, rule.method_name)()
+      self.stats.rules.append(RuleStats(
+          rule.rule_id,
+          seconds=time.time() - start_time + rule_seconds.get(rule.rule_id, 0),
+          records_visited=self.tree.records_visited - records_visited,
+          messages=len(messages)))
+      for message in messages:
+        yield message
+
+def main():
+  """Validates the provided PFIF XML file, only checking the records that
+  changed since the last time that it was validated with the same snapshot."""
+  parser = optparse.OptionParser(
+      usage='usage: %prog [options] --snapshot FILE pfif-xml-file')
+  parser.add_option('--snapshot',
+                    help='The results of the last validation are read from '
+                    'this file if it exists, and the new results are written '
+                    'to it.')
+  parser.add_option('--rules',
+                    help='A comma-separated list of the only rules to run.')
+  parser.add_option('--skip-rules',
+                    help='A comma-separated list of rules not to run.')
+  parser.add_option('--max-cost', choices=Rule.COSTS,
+                    help='Only runs rules that cost at most this much: ' +
+                    ', '.join(Rule.COSTS) + '.')
+  parser.add_option('--stats', action='store_true', default=False,
+                    help='Prints how many records were checked and how long '
+                    'each validation took.')
+  (options, args) = parser.parse_args()
+  assert options.snapshot, 'Must provide a snapshot file.'
+  assert len(args) == 1, 'Must provide one PFIF XML file to validate.'
+  try:
+    rules = pfif_validator.select_rules(
+        rule_ids=pfif_validator.split_rule_ids(options.rules),
+        exclude=pfif_validator.split_rule_ids(options.skip_rules),
+        max_cost=options.max_cost)
+  except ValueError, error:
+    parser.error(str(error))
+
+  validator = IncrementalValidator(utils.open_file(args[0], 'r'),
+                                   snapshot=Snapshot.load(options.snapshot),
+                                   rules=rules)
+  messages = validator.run_validations()
+  validator.snapshot.save(options.snapshot)
+  print utils.MessagesOutput.generate_message_summary(messages, is_html=False)
+  print validator.validator_messages_to_str(messages)
+  if options.stats:
+    print 'Checked %d records and reused %d.' % (validator.records_checked,
+                                                 validator.records_reused)
+    print validator.stats.to_str()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Merges PFIF XML feeds into one feed without duplicate records.
+
+When several feeds have a person or a note with the same record id, only one
+copy is written: the one with the latest entry_date, then the latest
+source_date, then the one read last.  PFIF dates are in UTC and in a fixed
+format, so they are compared as text, and a missing date is earlier than any
+other.  Records without a record id can't be duplicates, so they are all
+written.  Every note that is written is nested in its person, wherever it was
+in the input, and notes whose person isn't in any feed are left at the top
+level, or dropped in PFIF 1.1.
+
+The feeds are read twice with utils.iter_records.  The first pass keeps the
+record id and dates of every record in a RecordIndex, in sqlite on disk,
+along with the fields of the notes; sqlite then sorts the records to choose
+the copies to write and puts their notes in a pfif_converter.NoteStore.  The
+second pass writes the chosen persons in order with a
+pfif_converter.VersionConverter, so the output is in one version (the newest
+of the feeds unless another is given) and is checked in batches by the record
+rules as it is written.  Memory doesn't grow with the size of the feeds."""
+
+import cPickle
+import optparse
+import os
+import sqlite3
+import tempfile
+import pfif_converter
+import utils
+from pfif_converter import VersionConverter
+
+class RecordIndex:
+  """The record ids and dates of every person and note in the feeds, in
+  sqlite, with the fields of the notes.  Records are numbered in the order
+  that they are read, persons and notes separately.  The database is a
+  temporary file unless db_path is given."""
+
+  def __init__(self, db_path=None):
+    self.temp_path = None
+    if db_path is None:
+      handle, db_path = tempfile.mkstemp(suffix='.sqlite')
+      os.close(handle)
+      self.temp_path = db_path
+    self.connection = sqlite3.connect(db_path)
+    self.connection.executescript("""
+        CREATE TABLE IF NOT EXISTS records (
+            record_type TEXT, sequence INTEGER, record_id TEXT,
+            entry_date TEXT, source_date TEXT, person_record_id TEXT,
+            fields BLOB, PRIMARY KEY (record_type, sequence));
+        CREATE TABLE IF NOT EXISTS chosen (
+            record_type TEXT, sequence INTEGER,
+            PRIMARY KEY (record_type, sequence));""")
+
+  def add_record(self, record_type, sequence, fields, person_record_id=None):
+    """Adds a person or note with (field, text) pairs fields.  The fields of
+    notes are kept, with the person_record_id that they belong to."""
+    get_field = utils.get_field
+    self.connection.execute(
+        'INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (record_type, sequence, get_field(fields, record_type + '_record_id'),
+         get_field(fields, 'entry_date') or '',
+         get_field(fields, 'source_date') or '', person_record_id,
+         record_type == 'note' and buffer(cPickle.dumps(fields, 2)) or None))
+
+  def choose_records(self):
+    """Chooses the copy of each record to write and returns how many
+    duplicates there were of each record type."""
+    duplicates = {'person' : 0, 'note' : 0}
+    rows = self.connection.execute(
+        'SELECT record_type, record_id, sequence FROM records '
+        'ORDER BY record_type, record_id, entry_date DESC, source_date DESC, '
+        'sequence DESC')
+    chosen = []
+    last_key = None
+    for record_type, record_id, sequence in rows:
+      key = (record_type, record_id)
+      if record_id is not None and key == last_key:
+        duplicates[record_type] += 1
+      else:
+        chosen.append((record_type, sequence))
+        last_key = key
+      if len(chosen) >= pfif_converter.BATCH_RECORDS:
+        self.add_chosen(chosen)
+    self.add_chosen(chosen)
+    self.connection.commit()
+    return duplicates
+
+  def add_chosen(self, chosen):
+    """Marks the records in chosen, a list of (record type, sequence), to be
+    written, and empties it."""
+    self.connection.executemany('INSERT INTO chosen VALUES (?, ?)', chosen)
+    del chosen[:]
+
+  def iter_chosen_persons(self):
+    """Yields the sequence of each person to write, in order."""
+    for (sequence,) in self.connection.execute(
+        "SELECT sequence FROM chosen WHERE record_type = 'person' "
+        'ORDER BY sequence'):
+      yield sequence
+
+  def iter_chosen_notes(self):
+    """Yields the person_record_id and fields of each note to write, in
+    order."""
+    for person_record_id, fields in self.connection.execute(
+        'SELECT records.person_record_id, records.fields FROM chosen '
+        'JOIN records USING (record_type, sequence) '
+        "WHERE record_type = 'note' ORDER BY sequence"):
+      yield person_record_id, cPickle.loads(str(fields))
+
+  def close(self):
+    """Closes the database, deleting it if it is a temporary file."""
+    self.connection.close()
+    if self.temp_path is not None:
+      os.remove(self.temp_path)
+      self.temp_path = None
+
+class FeedMerger:
+  """Merges feeds into target_version, or the newest version of the feeds.
+  Each feed must be read by index_feed, in order, before they are all
+  merged.  Counts the feeds, records, and duplicates dropped."""
+
+  def __init__(self, target_version=None, parser=None, validate=True):
+    self.target_version = target_version
+    self.parser = parser
+    self.validate = validate
+    self.index = RecordIndex()
+    self.versions = []
+    self.person_count = 0
+    self.note_count = 0
+    self.duplicates = {'person' : 0, 'note' : 0}
+    self.converter = None
+
+  def add_note(self, fields, person_record_id):
+    """Adds a note to the index, about person_record_id unless it has its own
+    person_record_id."""
+    self.index.add_record(
+        'note', self.note_count, fields,
+        utils.get_field(fields, 'person_record_id') or
+        person_record_id)
+    self.note_count += 1
+
+  def index_feed(self, xml_file):
+    """Adds the persons and notes of xml_file to the index."""
+    records = utils.iter_records(xml_file, parser=self.parser)
+    self.versions.append(utils.read_version(records))
+    for record in records:
+      fields = utils.get_fields(record)
+      if utils.get_field_name(record.tag) == 'person':
+        self.index.add_record('person', self.person_count, fields)
+        self.person_count += 1
+        person_record_id = utils.get_field(fields, 'person_record_id')
+        for note in record:
+          if utils.get_field_name(note.tag) == 'note':
+            self.add_note(utils.get_fields(note), person_record_id)
+      else:
+        self.add_note(fields, None)
+    self.index.connection.commit()
+
+  def merge(self, xml_files, output):
+    """Writes the chosen records of xml_files, the feeds that were indexed,
+    in the same order, to output as one feed."""
+    assert self.versions, 'index_feed must read the feeds before they merge.'
+    target_version = self.target_version or max(self.versions)
+    self.duplicates = self.index.choose_records()
+    converter = self.converter = VersionConverter(
+        target_version, notes=pfif_converter.NEST_NOTES, parser=self.parser,
+        validate=self.validate)
+    converter.note_store = pfif_converter.NoteStore()
+    for person_record_id, fields in self.index.iter_chosen_notes():
+      converter.note_store.add_note(person_record_id, fields)
+    converter.note_store.connection.commit()
+    writer = utils.PfifXmlWriter(output, target_version)
+    batch = pfif_converter.Batch(converter, output)
+    chosen_persons = self.index.iter_chosen_persons()
+    next_person = next(chosen_persons, None)
+    sequence = 0
+    for xml_file in xml_files:
+      records = utils.iter_records(xml_file, parser=self.parser)
+      utils.read_version(records)
+      for record in records:
+        if utils.get_field_name(record.tag) == 'person':
+          if sequence == next_person:
+            # The notes, nested or not, come from the note store.
+            converter.convert_person(utils.get_fields(record), [], batch)
+            next_person = next(chosen_persons, None)
+          sequence += 1
+    assert sequence == self.person_count, (
+        'The feeds changed after they were indexed.')
+    converter.convert_stored_notes(batch)
+    batch.flush()
+    writer.close()
+    self.index.close()
+
+  def summary_to_str(self):
+    """Returns how many feeds and records were merged and how many
+    duplicates were dropped, followed by what the converter did."""
+    lines = ['%d feeds merged with %d persons and %d notes' % (
+        len(self.versions), self.person_count, self.note_count)]
+    for record_type in ['person', 'note']:
+      lines.append('%d duplicate %ss dropped' % (self.duplicates[record_type],
+                                                 record_type))
+    summary = '\n'.join(lines) + '\n'
+    if self.converter:
+      summary += self.converter.summary_to_str()
+    return summary
+
+def main():
+  """Merges PFIF XML files into one file."""
+  parser = optparse.OptionParser(
+      usage='usage: %prog [options] pfif-xml-file... output-file')
+  parser.add_option('--to-version', type='choice',
+                    choices=['1.1', '1.2', '1.3'],
+                    help='The version to write.  Defaults to the newest '
+                    'version of the files.')
+  parser.add_option('--no-validate', action='store_false', dest='validate',
+                    default=True,
+                    help='Does not check the records as they are written.')
+  parser.add_option('--parser', choices=utils.PARSERS,
+                    help='The XML parser to use: ' + ', '.join(utils.PARSERS) +
+                    '.  Defaults to the fastest one installed.')
+  (options, args) = parser.parse_args()
+  assert len(args) >= 2, 'Must provide PFIF XML files and an output file.'
+  input_paths, output_path = args[:-1], args[-1]
+  merger = FeedMerger(
+      target_version=options.to_version and float(options.to_version),
+      parser=options.parser, validate=options.validate)
+  for path in input_paths:
+    merger.index_feed(utils.open_file(path, 'r'))
+  output = open(output_path, 'wb')
+  try:
+    merger.merge((utils.open_file(path, 'r') for path in input_paths), output)
+  finally:
+    output.close()
+  print merger.summary_to_str()
+  converter = merger.converter
+  if converter.messages:
+    print utils.MessagesOutput.generate_message_summary(converter.messages,
+                                                        is_html=False)
+    print utils.MessagesOutput.messages_to_str(
+        converter.messages,
+        xml_lines=utils.MessagesOutput.read_message_lines(
+            open(output_path), converter.messages))
+
+if __name__ == '__main__':
+  main()
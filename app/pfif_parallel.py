@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parses large PFIF XML files on several cores.
+
+find_chunks scans a mapped file for the start tags of the top level persons
+and notes, without parsing it, and splits the file into chunks of whole
+records.  Each chunk is parsed in a worker process as a document of its own:
+the first chunk is the start of the file, and every other chunk is the start
+of the file up to the end of the root's start tag (so it has the same XML
+declaration, entities, and namespaces) followed by the chunk's records.  The
+workers send back each chunk's records as the flat arrays of
+pfif_cache.flatten_elements, with their line numbers in the original file, and
+ParallelPfifXmlTree joins them into one tree.
+
+The scan only skips comments and CDATA sections, so a file that it splits in
+the wrong place, like one with a record nested in an unknown element, fails to
+parse in some chunk.  ParallelPfifXmlTree then parses the whole file again in
+one process, so it always gives the same tree and errors as PfifXmlTree."""
+
+import mmap
+import multiprocessing
+import optparse
+import re
+import time
+from StringIO import StringIO
+import pfif_cache
+import utils
+
+# Each process is given about this many chunks, so that one slow chunk doesn't
+# hold up the others.
+CHUNKS_PER_PROCESS = 4
+
+# Smaller chunks aren't worth sending to another process.
+MIN_CHUNK_BYTES = 1024 * 1024
+
+# The start of a comment, a CDATA section, or an element's start tag, whose
+# name is the group.  Processing instructions, declarations, and end tags are
+# ignored.
+ROOT_SCAN_RE = re.compile(r'<!--|<!\[CDATA\[|<(?![!?/])([^\s/>]+)')
+
+# The rest of a start tag, after its name, ending in / if the element is empty
+START_TAG_END_RE = re.compile(
+    r'(?:\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*\s*(/?)>')
+
+# The ends of the sections that ROOT_SCAN_RE and the record scan skip
+SKIPPED_SECTION_ENDS = {'<!--' : '-->', '<![CDATA[' : ']]>'}
+
+def make_record_scan_re(prefix):
+  """Returns a regular expression that finds comments, CDATA sections, and the
+  start and end tags of persons and notes with the namespace prefix of the
+  root.  The first group is / for an end tag and the second is the tag."""
+  return re.compile(r'<!--|<!\[CDATA\[|<(/?)%s(person|note)(?=[\s/>])' %
+                    re.escape(prefix))
+
+class Chunks:
+  """Where the chunks of a file are.  header_end is the offset just past the
+  root's start tag, and header_line is the line it ends on.  starts holds the
+  offset and line of the start of each chunk; each one ends where the next
+  one starts, and the last one ends with the file.  close_tag ends the
+  root."""
+
+  def __init__(self, header_end, header_line, starts, close_tag):
+    self.header_end = header_end
+    self.header_line = header_line
+    self.starts = starts
+    self.close_tag = close_tag
+
+def skip_section(data, match):
+  """Returns where the comment or CDATA section that match starts ends, or
+  None if it doesn't end."""
+  end = data.find(SKIPPED_SECTION_ENDS[match.group(0)], match.end())
+  if end < 0:
+    return None
+  return end + len(SKIPPED_SECTION_ENDS[match.group(0)])
+
+def find_root(data):
+  """Returns a tuple (name, end, is_empty) of the root element in data: its
+  name as written, the offset just past its start tag, and whether it is
+  empty.  Returns None if there is no root."""
+  position = 0
+  while True:
+    match = ROOT_SCAN_RE.search(data, position)
+    if match is None:
+      return None
+    if match.group(1) is None:
+      position = skip_section(data, match)
+      if position is None:
+        return None
+      continue
+    tag_end = START_TAG_END_RE.match(data, match.end())
+    if tag_end is None:
+      return None
+    return (match.group(1), tag_end.end(), bool(tag_end.group(1)))
+
+def find_chunks(data, chunk_bytes):
+  """Returns the Chunks that data, the contents of a PFIF XML file, splits
+  into.  A chunk is started at the first top level person or note that is at
+  least chunk_bytes past the start of the last chunk.  Returns None if data
+  isn't a document that can be split, like a compressed file, one with no
+  root, or one whose root isn't pfif."""
+  # Longer than any of utils.COMPRESSION_MAGIC
+  if utils.detect_compression(data[:16]):
+    return None
+  root = find_root(data)
+  if root is None or root[2]:
+    return None
+  root_name, header_end = root[0], root[1]
+  prefix, _, local_name = root_name.rpartition(':')
+  # Atom feeds are unwrapped after parsing, so they are parsed in one piece.
+  if local_name != 'pfif':
+    return None
+  if prefix:
+    prefix += ':'
+  record_scan_re = make_record_scan_re(prefix)
+
+  starts = [(0, 1)]
+  line = 1
+  counted_to = 0
+  in_person = False
+  position = header_end
+  while True:
+    match = record_scan_re.search(data, position)
+    if match is None:
+      break
+    if match.group(2) is None:
+      position = skip_section(data, match)
+      if position is None:
+        break
+      continue
+    position = match.end()
+    if match.group(1):
+      if match.group(2) == 'person':
+        in_person = False
+      continue
+    tag_end = START_TAG_END_RE.match(data, position)
+    is_top_level = match.group(2) == 'person' or not in_person
+    if match.group(2) == 'person':
+      in_person = tag_end is None or not tag_end.group(1)
+    if is_top_level and match.start() - starts[-1][0] >= chunk_bytes:
+      line += data[counted_to:match.start()].count('\n')
+      counted_to = match.start()
+      starts.append((match.start(), line))
+  header_line = data[:header_end].count('\n') + 1
+  return Chunks(header_end, header_line, starts, '</' + root_name + '>')
+
+def parse_chunk(task):
+  """Parses one chunk of a file in a worker process.  task is a tuple (path,
+  parser, header_end, start, end, line_offset, close_tag), where the chunk is
+  the bytes of the file at path from start to end (None for the end of the
+  file), line_offset is added to each line number of the chunk document to
+  make it a line number of the file, and close_tag is added to the end unless
+  it is None.  Returns a tuple (string_table, columns, record_starts) as from
+  pfif_cache.flatten_elements, or None if the chunk couldn't be parsed."""
+  path, parser, header_end, start, end, line_offset, close_tag = task
+  feed_file = open(path, 'rb')
+  try:
+    data = mmap.mmap(feed_file.fileno(), 0, access=mmap.ACCESS_READ)
+  finally:
+    feed_file.close()
+  try:
+    if end is None:
+      end = len(data)
+    if start == 0:
+      text = data[:end]
+    else:
+      # The chunk starts on the line after the root's start tag.
+      text = data[:header_end] + '\n' + data[start:end]
+    if close_tag is not None:
+      text += close_tag
+  finally:
+    data.close()
+  # Any error is reported by parsing the whole file again.
+  try:
+    tree = utils.PfifXmlTree(StringIO(text), parser=parser)
+  except Exception: # pylint: disable=W0703
+    return None
+  string_table, columns, record_starts = pfif_cache.flatten_elements(
+      tree.getroot(), tree.line_numbers)
+  if line_offset:
+    element_lines = columns[4]
+    for index in xrange(len(element_lines)):
+      element_lines[index] += line_offset
+  return (string_table, columns, record_starts)
+
+class ParallelPfifXmlTree(utils.PfifXmlTree):
+  """A PfifXmlTree of a file that is parsed in chunks by several processes.
+  Files that can't be split in two, and compressed files, are parsed in one
+  process, as is a file that fails to parse, so that its error is the same as
+  PfifXmlTree's.  chunk_count is the number of chunks that were parsed in
+  parallel, or 0."""
+
+  def __init__(self, path, parser=None, processes=None, chunk_bytes=None):
+    """path is the name of a PFIF XML file.  processes defaults to the number
+    of CPUs; with only one process, the file is parsed in one chunk.  Chunks
+    are at least chunk_bytes long, which defaults to an even share of the file
+    for CHUNKS_PER_PROCESS chunks on each process, but at least
+    MIN_CHUNK_BYTES."""
+    self.processes = processes or multiprocessing.cpu_count()
+    self.chunk_bytes = chunk_bytes
+    self.chunk_count = 0
+    utils.PfifXmlTree.__init__(self, path, parser=parser)
+
+  def initialize_tree(self, xml_file):
+    """Parses the file named xml_file, in parallel if it can be split."""
+    start_time = time.time()
+    if self.processes > 1 and utils.get_file_for_test() is None:
+      self.initialize_tree_in_chunks(xml_file)
+    if self.chunk_count:
+      self.parse_seconds = time.time() - start_time
+    else:
+      utils.PfifXmlTree.initialize_tree(self, utils.open_file(xml_file, 'r'))
+
+  def initialize_tree_in_chunks(self, path):
+    """Parses the file at path in chunks, unless it can't be split or a chunk
+    fails to parse, in which case chunk_count is left at 0."""
+    feed_file = open(path, 'rb')
+    try:
+      data = mmap.mmap(feed_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (mmap.error, ValueError):
+      # An empty file, or one that isn't a regular file
+      return
+    finally:
+      feed_file.close()
+    try:
+      chunk_bytes = self.chunk_bytes or max(
+          MIN_CHUNK_BYTES, len(data) / (self.processes * CHUNKS_PER_PROCESS))
+      chunks = find_chunks(data, chunk_bytes)
+      if chunks is None or len(chunks.starts) < 2:
+        return
+      text = data[:]
+    finally:
+      data.close()
+
+    tasks = []
+    for index, (start, line) in enumerate(chunks.starts):
+      end, close_tag = None, None
+      if index + 1 < len(chunks.starts):
+        end, close_tag = chunks.starts[index + 1][0], chunks.close_tag
+      line_offset = 0
+      if start:
+        line_offset = line - chunks.header_line - 1
+      tasks.append((path, self.parser, chunks.header_end, start, end,
+                    line_offset, close_tag))
+    pool = multiprocessing.Pool(min(self.processes, len(tasks)))
+    try:
+      results = pool.map(parse_chunk, tasks, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+    if None in results:
+      return
+
+    # Every line but the last one ends in a newline, as from readline.
+    lines = text.split('\n')
+    self.lines = [line + '\n' for line in lines[:-1]]
+    if lines[-1]:
+      self.lines.append(lines[-1])
+    self.bytes_read = len(text)
+    root = None
+    for string_table, columns, record_starts in results:
+      strings = string_table + [None]
+      if root is None:
+        root, self.line_numbers = pfif_cache.build_elements(
+            strings, columns, 0, len(columns[0]))
+        continue
+      # Only the records are kept from the other chunks' roots.
+      ends = list(record_starts[1:]) + [len(columns[0])]
+      for start, end in zip(record_starts, ends):
+        record, line_numbers = pfif_cache.build_elements(strings, columns,
+                                                         start, end)
+        root.append(record)
+        self.line_numbers.update(line_numbers)
+    self.tree = utils.import_parser(
+        pfif_cache.ParsedFeed.get_builder()).ElementTree(root)
+    self.chunk_count = len(tasks)
+
+def main():
+  """Parses a PFIF XML file in parallel and prints how long it took."""
+  parser = optparse.OptionParser(usage='usage: %prog [options] pfif-xml-file')
+  parser.add_option('--processes', type='int',
+                    help='The number of processes to parse with.  Defaults '
+                    'to the number of CPUs.')
+  parser.add_option('--parser', choices=utils.PARSERS,
+                    help='The XML parser to use: ' + ', '.join(utils.PARSERS) +
+                    '.  Defaults to the fastest one installed.')
+  (options, args) = parser.parse_args()
+  assert len(args) == 1, 'Must provide one PFIF XML file to parse.'
+  tree = ParallelPfifXmlTree(args[0], parser=options.parser,
+                             processes=options.processes)
+  print '%s: %d records in %d chunks, parsed in %.3f seconds' % (
+      args[0], len(tree.get_root_children()), tree.chunk_count,
+      tree.parse_seconds)
+
+if __name__ == '__main__':
+  main()
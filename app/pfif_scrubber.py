@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rewrites a PFIF XML feed with the personal data of expired persons removed.
+
+A person whose expiry_date is more than a day in the past (as decided by
+PfifValidator.expiry_date_to_datetime, like validate_expired_records_removed)
+is replaced by a placeholder with only PfifValidator.PLACEHOLDER_FIELDS, and
+the other fields that the version requires left blank.  Its source_date and
+entry_date are both set to its expiry_date, unless they already match and are
+no later than a day after it.  The notes of an expired person are removed,
+whether they are nested in it or at the top level: a note can't be kept
+without its note_record_id, which the expiry rule counts as personal data.
+Persons and notes that already have no personal data are left as they are, so
+scrubbing a feed twice doesn't change it.
+
+The feed is read twice with utils.iter_records, one record at a time, and
+written with utils.PfifXmlWriter, so only the ids of expired persons are kept
+in memory.  The first pass finds the expired persons, since their top level
+notes can come before them; the second writes the feed.  Only PFIF 1.3 has
+expiry dates, so feeds of other versions are written without changes."""
+
+import optparse
+import pfif_validator
+import utils
+
+# The placeholder dates that are set from the expiry_date
+PLACEHOLDER_DATE_FIELDS = ['source_date', 'entry_date']
+
+class ExpiredRecordScrubber:
+  """Finds and scrubs the expired persons of a feed.  now is the time that
+  records are expired at, which defaults to the current time.  Counts how many
+  persons were scrubbed and how many notes were removed."""
+
+  def __init__(self, now=None, parser=None):
+    self.now = now or utils.get_utcnow()
+    self.parser = parser
+    self.expired_person_ids = set()
+    self.persons_scrubbed = 0
+    self.notes_removed = 0
+
+  def is_expired(self, person_fields):
+    """Returns True if the person with person_fields has expired."""
+    expiry_date = pfif_validator.PfifValidator.expiry_date_to_datetime(
+        utils.get_field(person_fields, 'expiry_date'))
+    return expiry_date is not None and expiry_date < self.now
+
+  @staticmethod
+  def has_personal_data(fields):
+    """Returns True if any field that isn't a placeholder field has text."""
+    for field, text in fields:
+      if text and field not in pfif_validator.PfifValidator.PLACEHOLDER_FIELDS:
+        return True
+    return False
+
+  @staticmethod
+  def is_placeholder(person_fields, notes, placeholder, version):
+    """Returns True if an expired person with person_fields and notes is
+    already a placeholder: nothing has personal data, it has every mandatory
+    field, and its placeholder fields are the same as in placeholder."""
+    has_personal_data = ExpiredRecordScrubber.has_personal_data
+    if has_personal_data(person_fields) or [note for note in notes
+                                            if has_personal_data(note)]:
+      return False
+    fields = set(field for field, _ in person_fields)
+    mandatory = pfif_validator.PfifValidator.MANDATORY_CHILDREN[version][
+        'person']
+    if fields.issuperset(mandatory):
+      get_field = utils.get_field
+      return not [(field, text) for field, text in placeholder
+                  if field in pfif_validator.PfifValidator.PLACEHOLDER_FIELDS
+                  and get_field(person_fields, field) != text]
+    return False
+
+  def make_placeholder(self, person_fields, version):
+    """Returns the fields of the placeholder of an expired person, with the
+    mandatory fields of version that aren't placeholder fields blank."""
+    get_field = utils.get_field
+    values = dict((field, get_field(person_fields, field))
+                  for field in pfif_validator.PfifValidator.PLACEHOLDER_FIELDS)
+    # Like validate_placeholder_dates, the dates must match and be no later
+    # than a day after the expiry_date.
+    removal_date = pfif_validator.PfifValidator.expiry_date_to_datetime(
+        values['expiry_date'])
+    placeholder_date = pfif_validator.PfifValidator.pfif_date_to_py_date(
+        values['source_date'])
+    if (values['source_date'] != values['entry_date'] or
+        not placeholder_date or placeholder_date > removal_date):
+      for field in PLACEHOLDER_DATE_FIELDS:
+        values[field] = values['expiry_date']
+    placeholder = [(field, values[field])
+                   for field in pfif_validator.PfifValidator.PLACEHOLDER_FIELDS]
+    for field in pfif_validator.PfifValidator.MANDATORY_CHILDREN[version][
+        'person']:
+      if field not in values:
+        placeholder.append((field, ''))
+    return placeholder
+
+  def find_expired_persons(self, xml_file):
+    """Reads xml_file and adds the person_record_id of each expired person to
+    expired_person_ids."""
+    records = utils.iter_records(xml_file, parser=self.parser)
+    if utils.read_version(records) < 1.3:
+      return
+    for record in records:
+      if utils.get_field_name(record.tag) == 'person':
+        fields = utils.get_fields(record)
+        person_record_id = utils.get_field(fields, 'person_record_id')
+        if person_record_id and self.is_expired(fields):
+          self.expired_person_ids.add(person_record_id)
+
+  def scrub(self, xml_file, output):
+    """Writes the records of xml_file to output, scrubbing expired persons and
+    removing their notes.  find_expired_persons must have read the same file
+    first."""
+    records = utils.iter_records(xml_file, parser=self.parser)
+    version = utils.read_version(records)
+    writer = utils.PfifXmlWriter(output, version)
+    for record in records:
+      record_type = utils.get_field_name(record.tag)
+      fields = utils.get_fields(record)
+      if record_type == 'person':
+        notes = [utils.get_fields(note) for note in record
+                 if utils.get_field_name(note.tag) == 'note']
+        placeholder = None
+        if version >= 1.3 and self.is_expired(fields):
+          placeholder = self.make_placeholder(fields, version)
+          if ExpiredRecordScrubber.is_placeholder(fields, notes, placeholder,
+                                                  version):
+            placeholder = None
+        if placeholder is not None:
+          writer.write_record('person', placeholder)
+          self.persons_scrubbed += 1
+          self.notes_removed += len(notes)
+        else:
+          writer.write_record('person', fields, notes)
+      elif (ExpiredRecordScrubber.has_personal_data(fields) and
+            utils.get_field(fields, 'person_record_id') in
+            self.expired_person_ids):
+        self.notes_removed += 1
+      else:
+        writer.write_record('note', fields)
+    writer.close()
+
+def main():
+  """Writes a copy of a PFIF XML file with its expired records scrubbed."""
+  parser = optparse.OptionParser(
+      usage='usage: %prog [options] pfif-xml-file output-file')
+  parser.add_option('--parser', choices=utils.PARSERS,
+                    help='The XML parser to use: ' + ', '.join(utils.PARSERS) +
+                    '.  Defaults to the fastest one installed.')
+  (options, args) = parser.parse_args()
+  assert len(args) == 2, 'Must provide a PFIF XML file and an output file.'
+  scrubber = ExpiredRecordScrubber(parser=options.parser)
+  scrubber.find_expired_persons(utils.open_file(args[0], 'r'))
+  output = open(args[1], 'wb')
+  try:
+    scrubber.scrub(utils.open_file(args[0], 'r'), output)
+  finally:
+    output.close()
+  print '%d expired persons scrubbed, %d notes removed' % (
+      scrubber.persons_scrubbed, scrubber.notes_removed)
+
+if __name__ == '__main__':
+  main()
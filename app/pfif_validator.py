@@ -19,8 +19,117 @@ import re
 import utils
 from urlparse import urlparse
 import datetime
-import inspect
-import sys
+import optparse
+import os
+import time
+import profiling
+import pfif_cache
+import pfif_parallel
+import pfif_corpus
+import pfif_feed_stats
+
+class RuleStats:
+  """How long one validation method took, how many records it visited, and
+  how many messages it produced."""
+
+  def __init__(self, name, seconds=0.0, records_visited=0, messages=0):
+    self.name = name
+    self.seconds = seconds
+    self.records_visited = records_visited
+    self.messages = messages
+
+class ValidationStats:
+  """Statistics about parsing a file and running each validation on it."""
+
+  # The prefix of every metric in the Prometheus text format
+  METRIC_PREFIX = 'pfif_validator_'
+
+  def __init__(self, parse_seconds=0.0, bytes_read=0):
+    self.parse_seconds = parse_seconds
+    self.bytes_read = bytes_read
+    # One RuleStats per validation method, in the order they were run
+    self.rules = []
+
+  def get_rule_seconds(self):
+    """Returns the total time spent running validations."""
+    return sum([rule.seconds for rule in self.rules])
+
+  def get_total_seconds(self):
+    """Returns the total time spent parsing and running validations."""
+    return self.parse_seconds + self.get_rule_seconds()
+
+  def to_str(self, is_html=False):
+    """Returns a table of the statistics, with the slowest rule first."""
+    output = utils.MessagesOutput(is_html, html_class='stats')
+    output.start_table(['Phase', 'Seconds', 'Records Visited', 'Messages'])
+    output.make_table_row(['parse (' + str(self.bytes_read) + ' bytes)',
+                           '%.4f' % self.parse_seconds, '', ''])
+    for rule in sorted(self.rules, key=lambda rule: -rule.seconds):
+      output.make_table_row([rule.name, '%.4f' % rule.seconds,
+                             str(rule.records_visited), str(rule.messages)])
+    output.make_table_row(['total', '%.4f' % self.get_total_seconds(), '',
+                           str(sum([rule.messages for rule in self.rules]))])
+    output.end_table()
+    return output.get_output()
+
+  def to_prometheus(self):
+    """Returns the statistics in the Prometheus text exposition format."""
+    lines = []
+    def add_metric(name, help_text, samples):
+      """Adds a gauge with the given (labels, value) samples."""
+      name = ValidationStats.METRIC_PREFIX + name
+      lines.append('# HELP ' + name + ' ' + help_text)
+      lines.append('# TYPE ' + name + ' gauge')
+      for labels, value in samples:
+        lines.append(name + labels + ' ' + repr(value))
+    add_metric('parse_seconds', 'Time spent parsing the PFIF XML.',
+               [('', self.parse_seconds)])
+    add_metric('bytes_read', 'Bytes of PFIF XML read.',
+               [('', self.bytes_read)])
+    for field, help_text in [('seconds', 'Time spent running each rule.'),
+                             ('records_visited',
+                              'Records visited by each rule.'),
+                             ('messages', 'Messages produced by each rule.')]:
+      add_metric('rule_' + field, help_text,
+                 [('{rule="' + rule.name + '"}', getattr(rule, field))
+                  for rule in self.rules])
+    return '\n'.join(lines) + '\n'
+
+  def write_prometheus(self, path):
+    """Writes the statistics in the Prometheus text format to path.  The file
+    is replaced all at once so that a collector never reads half of it."""
+    temp_path = path + '.tmp'
+    output = open(temp_path, 'w')
+    try:
+      output.write(self.to_prometheus())
+    finally:
+      output.close()
+    os.rename(temp_path, path)
+
+class Rule:
+  """A validation that can be selected by its rule_id.  Its method is
+  'validate_' + rule_id.  scope is RECORD if the rule checks each record on its
+  own or GLOBAL if it checks records against each other or the root, cost is
+  one of COSTS, and the rule only applies from min_version to max_version."""
+
+  RECORD = 'record'
+  GLOBAL = 'global'
+
+  # From least to most expensive
+  COSTS = ['cheap', 'moderate', 'expensive']
+
+  def __init__(self, rule_id, scope, cost, min_version=1.1, max_version=1.3):
+    assert cost in Rule.COSTS, 'Unknown cost: ' + cost
+    self.rule_id = rule_id
+    self.method_name = 'validate_' + rule_id
+    self.scope = scope
+    self.cost = cost
+    self.min_version = min_version
+    self.max_version = max_version
+
+  def applies_to(self, version):
+    """Returns True if the rule should be run on PFIF XML of version."""
+    return self.min_version <= version <= self.max_version
 
 class PfifValidator:
   """A validator that can run tests on a PFIF XML file."""
@@ -352,9 +461,26 @@ class PfifValidator:
   PLACEHOLDER_FIELDS = ['person_record_id', 'expiry_date', 'source_date',
                         'entry_date']
 
-  def __init__(self, xml_file):
-    self.tree = utils.PfifXmlTree(xml_file)
+  def __init__(self, xml_file, rules=None, parser=None):
+    """xml_file is a file of PFIF XML, a pfif_cache.ParsedFeed, or a
+    utils.PfifXmlTree that was already parsed.  rules is a list of the Rules to
+    run, as from select_rules.  It defaults to every rule.  parser is one of
+    utils.PARSERS."""
+    if isinstance(xml_file, pfif_cache.ParsedFeed):
+      self.tree = xml_file.get_tree()
+    elif isinstance(xml_file, utils.PfifXmlTree):
+      self.tree = xml_file
+    else:
+      self.tree = utils.PfifXmlTree(xml_file, parser=parser)
     self.version = self.tree.version
+    if rules is None:
+      rules = RULES
+    self.rules = rules
+    self.plan = get_validation_plan(self.version, self.tree.namespace)
+    # record : [(child, slot)], shared by every rule that checks children
+    self.child_slots = {}
+    self.stats = ValidationStats(parse_seconds=self.tree.parse_seconds,
+                                 bytes_read=self.tree.bytes_read)
 
   # helpers
 
@@ -362,19 +488,10 @@ class PfifValidator:
   def pfif_date_to_py_date(date_str):
     """Converts a date string in the format yyyy-mm-ddThh:mm:ssZ (where there
     can optionally be a fractional amount of seconds between ss and Z) to a
-    Python datetime object"""
-    # Fractional seconds are optionally allowed in the time, which means
-    # that it would be difficult to use datetime.datetime.strptime.
-    # Instead, we manually extract the fields using a regular expression.
-    match = re.match(
-        r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?Z$',
-        date_str)
-    time_parts = []
-    for i in range(1, 7):
-      time_parts.append(int(match.group(i)))
-    date = datetime.datetime(time_parts[0], time_parts[1], time_parts[2],
-                             time_parts[3], time_parts[4], time_parts[5])
-    return date
+    Python datetime object.  Returns None if date_str isn't a valid date."""
+    if not date_str:
+      return None
+    return utils.PFIF_DATES.parse(date_str)
 
   def get_expiry_datetime(self, person):
     """Returns the expiry date associated with a given person, adjusted by one
@@ -383,13 +500,20 @@ class PfifValidator:
     expiry_date_elem = person.find(
         self.tree.add_namespace_to_tag('expiry_date'))
     if expiry_date_elem != None:
-      expiry_date_str = expiry_date_elem.text
-      if expiry_date_str:
-        expiry_date = PfifValidator.pfif_date_to_py_date(expiry_date_str)
-        # Advances the expiry_date one day because the protocol doesn't
-        # require removing data until a day after expiration
-        expiry_date += datetime.timedelta(days=1)
-        return expiry_date
+      return PfifValidator.expiry_date_to_datetime(expiry_date_elem.text)
+    return None
+
+  @staticmethod
+  def expiry_date_to_datetime(expiry_date_str):
+    """Returns the date that data must be removed by for a person with the
+    expiry_date expiry_date_str, or None if it isn't a date."""
+    expiry_date = PfifValidator.pfif_date_to_py_date(expiry_date_str)
+    # A malformed expiry_date is reported by the format check.
+    if expiry_date:
+      # Advances the expiry_date one day because the protocol doesn't
+      # require removing data until a day after expiration
+      expiry_date += datetime.timedelta(days=1)
+      return expiry_date
     return None
 
   def add_linked_record_mapping(self, person_record_id, note, linked_records):
@@ -432,24 +556,51 @@ class PfifValidator:
         notes_set.add(note)
     return associated_notes
 
+  def get_child_slots(self, record):
+    """Returns the (child, slot) list of record from the plan, only scanning
+    the children of each record once per validator.  Only the selected
+    children of the root are returned, so the root isn't cached."""
+    if record is self.tree.getroot():
+      return self.plan.get_child_slots(self.tree.get_root_children())
+    child_slots = self.child_slots.get(record)
+    if child_slots is None:
+      child_slots = self.child_slots[record] = self.plan.get_child_slots(
+          record.getchildren())
+    return child_slots
+
+  def get_child_local_slots(self, record):
+    """Returns the (child, slot) list of record like get_child_slots, except
+    that a child in another namespace gets the slot of its tag without the
+    namespace, as utils.extract_tag gives it.  The extraneous field and field
+    order checks have always looked at tags that way."""
+    local_slots = self.plan.local_slots
+    return [(child, slot) if slot is not None else
+            (child, local_slots.get(utils.get_field_name(child.tag)))
+            for child, slot in self.get_child_slots(record)]
+
   def make_message(self, category, record, element=None,
                    xml_tag=None, is_error=True):
     """Wrapper for initializing a Message that extracts the person_record_id and
     note_record_id, if present, from a record and the text and line number from
-    an element"""
-    person_record_id = self.tree.get_field_text(record, 'person_record_id')
-    note_record_id = self.tree.get_field_text(record, 'note_record_id')
-    tag = xml_tag
-    text = None
-    line = None
-    if element != None:
-      tag = utils.extract_tag(element.tag)
-      text = element.text
-      line = self.tree.line_numbers[element]
-    return utils.Message(category, is_error=is_error, xml_line_number=line,
-                         xml_tag=tag, xml_text=text,
-                         person_record_id=person_record_id,
-                         note_record_id=note_record_id)
+    an element.  Those are only extracted when the message is read, so making
+    a message that is only counted is cheap."""
+    return utils.LazyMessage(category, self.tree, record, element=element,
+                             xml_tag=xml_tag, is_error=is_error)
+
+  def make_duplicate_id_message(self, record):
+    """Returns the message for a record whose id was already used."""
+    return self.make_message('You had a duplicate id.', record=record,
+                             element=record)
+
+  def make_asymmetric_link_message(self, note):
+    """Returns the message for a note that links to a person that doesn't link
+    back."""
+    link_field = note.find(
+        self.tree.add_namespace_to_tag('linked_person_record_id'))
+    return self.make_message(
+        'There is an asymmetric linked record.  That is, a note has a'
+        'linked_person_record_id to another person, but that person '
+        'does not link back.', record=note, element=link_field, is_error=False)
 
   def validator_messages_to_str(self, messages, **optional_args):
     """Wrapper for MessagesOutput.messages_to_str that adds in xml_lines if it's
@@ -457,13 +608,20 @@ class PfifValidator:
     optional_args.setdefault('xml_lines', self.tree.lines)
     return utils.MessagesOutput.messages_to_str(messages, **optional_args)
 
+  def validator_messages_to_chunks(self, messages, **optional_args):
+    """Wrapper for MessagesOutput.messages_to_chunks that adds in xml_lines if
+    it's not specified."""
+    optional_args.setdefault('xml_lines', self.tree.lines)
+    return utils.MessagesOutput.messages_to_chunks(messages, **optional_args)
+
   # validation
   # Each validate method can only be run on an initialized validator (the
   # validator will be initialized unless the constructor is called with
   # initialize=False).  Each validate method will return an array of messages,
   # where an empty array means that all validation tests passed.  Only methods
   # that take no arguments (other than self) should be called externally; all
-  # other methods should be considered private.
+  # other methods should be considered private.  Every method that takes no
+  # arguments must have a Rule in RULES.
 
   def validate_root_has_child(self):
     """If there is at least one child, returns an empty list.  Else, returns a
@@ -488,15 +646,22 @@ class PfifValidator:
     return [utils.Message('Having a person tag (or a note tag in PFIF 1.2+) as '
                           'one of the children of the root node is mandatory.')]
 
-  def validate_has_mandatory_children(self, parents, mandatory_children):
-    """Validates that every parent node has all mandatory children .  Returns a
-    list with the names of all mandatory children missing from any parent
-    found."""
+  def validate_has_mandatory_children(self, parents, record_type):
+    """Validates that every parent node has all mandatory children of
+    record_type in the plan.  Returns a list with the names of all mandatory
+    children missing from any parent found."""
     messages = []
+    record_plan = self.plan.get_record_plan(record_type)
+    mandatory_mask = record_plan.mandatory_mask
     for parent in parents:
-      for child_tag in mandatory_children:
-        child = parent.find(self.tree.add_namespace_to_tag(child_tag))
-        if child is None:
+      present = 0
+      for _, slot in self.get_child_slots(parent):
+        if slot is not None:
+          present |= 1 << slot
+      if present & mandatory_mask == mandatory_mask:
+        continue
+      for child_tag, bit in record_plan.mandatory:
+        if not present & bit:
           messages.append(self.make_message(
               'You do not have all mandatory children.  You were missing a tag',
               xml_tag=child_tag, record=parent))
@@ -505,60 +670,46 @@ class PfifValidator:
   def validate_person_has_mandatory_children(self):
     """Wrapper for validate_has_mandatory_children.  Validates that persons have
     all mandatory children."""
-    mandatory_children = (
-        PfifValidator.MANDATORY_CHILDREN[self.version]['person'])
     persons = self.tree.get_all_persons()
-    return self.validate_has_mandatory_children(persons, mandatory_children)
+    return self.validate_has_mandatory_children(persons, 'person')
 
   def validate_note_has_mandatory_children(self):
     """Wrapper for validate_has_mandatory_children.  Validates that notes have
     all mandatory children."""
     messages = []
     top_level_notes = self.tree.get_top_level_notes()
-    top_note_children = (
-        PfifValidator.MANDATORY_CHILDREN[self.version]['top_note'])
     messages.extend(self.validate_has_mandatory_children(top_level_notes,
-                                                         top_note_children))
+                                                         'top_note'))
 
     child_notes = self.tree.get_child_notes()
-    child_note_children = (
-        PfifValidator.MANDATORY_CHILDREN[self.version]['note'])
-    messages.extend(self.validate_has_mandatory_children(child_notes,
-                                                         child_note_children))
+    messages.extend(self.validate_has_mandatory_children(child_notes, 'note'))
     return messages
 
-  def validate_children_have_correct_format(self, parents, formats):
+  def validate_children_have_correct_format(self, parents, record_type):
     """validates that every element in parents has valid text, as per the
-    specification in formats"""
+    format checkers of record_type in the plan"""
     messages = []
+    checkers = self.plan.get_record_plan(record_type).checkers
     for parent in parents:
-      for field, field_format in formats.items():
-        elements = parent.findall(self.tree.add_namespace_to_tag(field))
-        for element in elements:
-          if element.text:
-            # note: the text is not stripped.  Some parsers may choke on extra
-            # whitespace, so extra whitespace around text will cause it to fail
-            # to match the field
-            text = element.text
-            if field_format == 'URL':
-              url = urlparse(text)
-              # The URL should be HTTP or HTTPS.  If the netloc is blank, the
-              # URL is probably blank or malformed.
-              # pylint: disable=E1101
-              failed = url.scheme not in ['http', 'https'] or url.netloc == ''
-              # pylint: enable=E1101
-            else:
-              match = re.match(field_format, text)
-              failed = (match is None)
-            if failed:
-              messages.append(self.make_message(
-                  'The text in one of your fields does not match the '
-                  'requirement in the specification.',
-                  record=parent, element=element))
-          else:
-            messages.append(self.make_message('You had an empty field.',
-                                              is_error=False, record=parent,
-                                              element=element))
+      for element, slot in self.get_child_slots(parent):
+        if slot is None:
+          continue
+        checker = checkers[slot]
+        if checker is None:
+          continue
+        # note: the text is not stripped.  Some parsers may choke on extra
+        # whitespace, so extra whitespace around text will cause it to fail to
+        # match the field
+        text = element.text
+        if not text:
+          messages.append(self.make_message('You had an empty field.',
+                                            is_error=False, record=parent,
+                                            element=element))
+        elif not checker(text):
+          messages.append(self.make_message(
+              'The text in one of your fields does not match the '
+              'requirement in the specification.',
+              record=parent, element=element))
     return messages
 
   def validate_fields_have_correct_format(self):
@@ -567,10 +718,9 @@ class PfifValidator:
     the fields that have improperly formatted data.  Wrapper for
     validate_children_have_correct_format"""
     messages = self.validate_children_have_correct_format(
-        self.tree.get_all_persons(),
-        PfifValidator.FORMATS[self.version]['person'])
+        self.tree.get_all_persons(), 'person')
     messages.extend(self.validate_children_have_correct_format(
-        self.tree.get_all_notes(), PfifValidator.FORMATS[self.version]['note']))
+        self.tree.get_all_notes(), 'note'))
     return messages
 
   def validate_ids_are_unique(self, records, field):
@@ -587,8 +737,7 @@ class PfifValidator:
       if id_field is not None:
         curr_id = id_field.text
         if curr_id in ids:
-          messages.append(self.make_message('You had a duplicate id.',
-                                            record=record, element=record))
+          messages.append(self.make_duplicate_id_message(record))
         elif curr_id not in ids:
           ids.append(curr_id)
     return messages
@@ -648,17 +797,17 @@ class PfifValidator:
     must appear last in a person, and note_record_id and person_record_id must
     appear first in notes"""
     messages = []
+    record_plan = self.plan.get_record_plan(field_type)
     # 1.3 and above don't have order
-    if self.version < 1.3:
-      field_order = PfifValidator.FIELD_ORDER[self.version][field_type]
+    if record_plan.is_ordered:
+      ranks = record_plan.ranks
       for record in records:
         # foreach field, if this field is lower than the current max field, it
         # represents an invalid order
         curr_max = 0
-        for field in record.getchildren():
-          tag = utils.extract_tag(field.tag)
-          if tag in field_order:
-            field_order_num = field_order[tag]
+        for field, slot in self.get_child_local_slots(record):
+          field_order_num = None if slot is None else ranks[slot]
+          if field_order_num is not None:
             if field_order_num >= curr_max:
               curr_max = field_order_num
             else:
@@ -692,7 +841,8 @@ class PfifValidator:
     # If source_date > expiry_date, the placeholder was made more than a day
     # after expiry; even though the current PFIF XML is not exposing data, it
     # was exposing data between expiry_date and search_date
-    if PfifValidator.pfif_date_to_py_date(source_date) > expiry_date:
+    placeholder_date = PfifValidator.pfif_date_to_py_date(source_date)
+    if placeholder_date and placeholder_date > expiry_date:
       source_element = person.find(
           self.tree.add_namespace_to_tag('source_date'))
       messages.append(self.make_message(
@@ -731,9 +881,9 @@ class PfifValidator:
     if self.version >= 1.3:
       persons = self.tree.get_all_persons()
       top_level_notes_by_person = self.get_top_level_notes_by_person()
+      curr_date = utils.get_utcnow()
       for person in persons:
         expiry_date = self.get_expiry_datetime(person)
-        curr_date = utils.get_utcnow()
         # if the record is expired
         if expiry_date != None and expiry_date < curr_date:
           # the person itself can't have data
@@ -758,32 +908,29 @@ class PfifValidator:
         # if B doesn't exist or B doesn't point to A, then A points to nowhere
         if (linked_id not in linked_records or
             person_record_id not in linked_records[linked_id]):
-          link_field = linking_note.find(
-              self.tree.add_namespace_to_tag('linked_person_record_id'))
-          messages.append(self.make_message(
-              'There is an asymmetric linked record.  That is, a note has a'
-              'linked_person_record_id to another person, but that person '
-              'does not link back.',
-              record=linking_note, element=link_field, is_error=False))
+          messages.append(self.make_asymmetric_link_message(linking_note))
     return messages
 
-  def validate_extraneous_children(self, parents, approved_tags):
-    """For each parent in parents, ensures that every child's tag is in
-    approved_tags and is not a duplicate (except for notes and persons).
-    Returns a list of all extraneous tags."""
+  def validate_extraneous_children(self, parents, record_type):
+    """For each parent in parents, ensures that every child's tag is allowed in
+    record_type by the plan and is not a duplicate (except for notes and
+    persons).  Returns a list of all extraneous tags."""
     messages = []
+    record_plan = self.plan.get_record_plan(record_type)
+    allowed_mask = record_plan.allowed_mask
+    repeatable_mask = record_plan.repeatable_mask
     for parent in parents:
-      used_tags = []
-      for child in parent.getchildren():
-        tag = utils.extract_tag(child.tag)
-        if tag in used_tags and tag != 'note' and tag != 'person':
+      used = 0
+      for child, slot in self.get_child_local_slots(parent):
+        bit = 0 if slot is None else 1 << slot
+        if used & bit and not repeatable_mask & bit:
           messages.append(self.make_message('Duplicate Tag.', record=parent,
                                             element=child))
-        elif tag not in approved_tags:
+        elif not allowed_mask & bit:
           messages.append(self.make_message('Extraneous Tag.', record=parent,
                                             element=child))
         else:
-          used_tags.append(tag)
+          used |= bit
     return messages
 
   def validate_extraneous_fields(self):
@@ -791,42 +938,311 @@ class PfifValidator:
     list with every extraneous or duplicate field.  This includes fields added
     in a more recent version of the specification."""
     messages = []
-
-    pfif_fields = PfifValidator.ALLOWED_CHILDREN[self.version]['pfif']
     messages.extend(self.validate_extraneous_children(
-        [self.tree.getroot()], pfif_fields))
-
-    person_fields = PfifValidator.ALLOWED_CHILDREN[self.version]['person']
+        [self.tree.getroot()], 'pfif'))
     messages.extend(self.validate_extraneous_children(
-        self.tree.get_all_persons(), person_fields))
-
-    note_fields = PfifValidator.FORMATS[self.version]['note'].keys()
+        self.tree.get_all_persons(), 'person'))
     messages.extend(self.validate_extraneous_children(
-        self.tree.get_all_notes(), note_fields))
+        self.tree.get_all_notes(), 'note'))
 
     return messages
 
+  def get_validation_methods(self):
+    """Returns a list of (rule_id, method) tuples for every selected rule that
+    applies to this version, in the order of RULES."""
+    return [(rule.rule_id, getattr(self, rule.method_name))
+            for rule in self.rules if rule.applies_to(self.version)]
+
+  def iter_validations(self):
+    """Runs all validations on the file specified by file_path, yielding the
+    messages from each validation as soon as it finishes.  file_path can be
+    anything that lxml will accept, including file objects and file-like
+    objects.  The time, records visited, and messages of each validation are
+    recorded in self.stats."""
+    self.stats.rules = []
+    for name, method in self.get_validation_methods():
+      records_visited = self.tree.records_visited
+      start_time = time.time()
+      messages = method()
+      self.stats.rules.append(RuleStats(
+          name, seconds=time.time() - start_time,
+          records_visited=self.tree.records_visited - records_visited,
+          messages=len(messages)))
+      for message in messages:
+        yield message
+
   def run_validations(self):
     """Runs all validations on the file specified by file_path.  Returns a list
     of all errors generated.  file_path can be anything that lxml will accept,
     including file objects and file-like objects."""
-    methods = inspect.getmembers(self, inspect.ismethod)
-    messages = []
-    for name, method in methods:
-      # run all validation methods except for any validation method that takes
-      # more than one argument (self), because that will have a wrapper method.
-      if (name.find('validate_') != -1 and
-          len(inspect.getargspec(method)[0]) == 1):
-        messages.extend(method())
-    return messages
+    return list(self.iter_validations())
+
+class RecordPlan:
+  """The compiled schema of one type of record (person, note, top_note, or
+  pfif) in one version.  Bits and slots come from the ValidationPlan that owns
+  this.  ranks and checkers are indexed by slot: ranks holds the FIELD_ORDER
+  rank of each field (or None if the field has no order), and checkers holds a
+  function that returns true if its text has the correct format (or None if
+  the field has no format)."""
+
+  def __init__(self, slots, allowed, mandatory, field_order, formats):
+    self.allowed_mask = RecordPlan.to_mask(slots, allowed)
+    self.repeatable_mask = RecordPlan.to_mask(slots, ['person', 'note'])
+    self.mandatory = tuple((tag, 1 << slots[tag]) for tag in mandatory)
+    self.mandatory_mask = RecordPlan.to_mask(slots, mandatory)
+    self.is_ordered = bool(field_order)
+    ranks = [None] * len(slots)
+    for tag, rank in field_order.items():
+      ranks[slots[tag]] = rank
+    self.ranks = tuple(ranks)
+    checkers = [None] * len(slots)
+    for tag, field_format in formats.items():
+      checkers[slots[tag]] = RecordPlan.make_checker(field_format)
+    self.checkers = tuple(checkers)
+    self.is_frozen = True
+
+  def __setattr__(self, name, value):
+    assert not self.__dict__.get('is_frozen'), (
+        'Plans are shared between validators and must not be modified')
+    self.__dict__[name] = value
+
+  @staticmethod
+  def to_mask(slots, tags):
+    """Returns a bitmask with the bit of every tag in tags set."""
+    mask = 0
+    for tag in tags:
+      mask |= 1 << slots[tag]
+    return mask
+
+  @staticmethod
+  def is_valid_url(text):
+    """Returns true if text is an HTTP or HTTPS URL."""
+    url = urlparse(text)
+    # The URL should be HTTP or HTTPS.  If the netloc is blank, the URL is
+    # probably blank or malformed.
+    # pylint: disable=E1101
+    is_valid = url.scheme in ['http', 'https'] and url.netloc != ''
+    # pylint: enable=E1101
+    return is_valid
+
+  @staticmethod
+  def make_checker(field_format):
+    """Returns a function that returns true if text matches field_format, which
+    is either a regular expression or PfifValidator.URL."""
+    if field_format == PfifValidator.URL:
+      return RecordPlan.is_valid_url
+    if field_format == PfifValidator.DATE:
+      return utils.PFIF_DATES.has_date_format
+    return re.compile(field_format).match
+
+class ValidationPlan:
+  """PfifValidator's schema tables for one version and namespace, compiled so
+  that the children of a record can be checked in one pass.  Every tag gets a
+  slot; its bit is 1 << slot.  Plans are cached by get_validation_plan and
+  shared, so they can't be modified."""
+
+  RECORD_TYPES = ['person', 'note', 'top_note', 'pfif']
+
+  def __init__(self, version, namespace):
+    self.version = version
+    self.namespace = namespace
+    formats = PfifValidator.FORMATS[version]
+    mandatory = PfifValidator.MANDATORY_CHILDREN[version]
+    allowed = PfifValidator.ALLOWED_CHILDREN[version]
+    field_order = PfifValidator.FIELD_ORDER.get(version, {})
+    tags = set(['person', 'note'])
+    for table in [formats, mandatory, allowed, field_order]:
+      for fields in table.values():
+        tags.update(fields)
+    self.tags = tuple(sorted(tags))
+    slots = dict((tag, slot) for slot, tag in enumerate(self.tags))
+    # Children are looked up by their fully qualified tag, so that the tag
+    # doesn't need to be extracted from each one.  local_slots looks up tags
+    # without their namespace.
+    self.slots = dict(('{' + namespace + '}' + tag, slot)
+                      for tag, slot in slots.items())
+    self.local_slots = slots
+    self.person = RecordPlan(slots, allowed['person'], mandatory['person'],
+                             field_order.get('person', {}), formats['person'])
+    # Notes are checked for extraneous fields against their formats.
+    self.note = RecordPlan(slots, formats['note'].keys(), mandatory['note'],
+                           field_order.get('note', {}), formats['note'])
+    self.top_note = RecordPlan(slots, formats['note'].keys(),
+                               mandatory['top_note'],
+                               field_order.get('note', {}), formats['note'])
+    self.pfif = RecordPlan(slots, allowed['pfif'], [], {}, {})
+    self.is_frozen = True
+
+  def __setattr__(self, name, value):
+    assert not self.__dict__.get('is_frozen'), (
+        'Plans are shared between validators and must not be modified')
+    self.__dict__[name] = value
+
+  def get_record_plan(self, record_type):
+    """Returns the RecordPlan for record_type, one of RECORD_TYPES."""
+    assert record_type in ValidationPlan.RECORD_TYPES, (
+        'Unknown record type: ' + record_type)
+    return getattr(self, record_type)
+
+  def get_child_slots(self, children):
+    """Returns a list of (child, slot) for every child in children, where slot
+    is None if the child's tag isn't in any table."""
+    slots = self.slots
+    return [(child, slots.get(child.tag)) for child in children]
+
+# (version, namespace) : ValidationPlan.  Plans are only compiled once per
+# process, so long-running servers share them between requests.
+VALIDATION_PLANS = {}
+
+def get_validation_plan(version, namespace):
+  """Returns the ValidationPlan for version and namespace, compiling it the
+  first time that it is needed."""
+  key = (version, namespace)
+  plan = VALIDATION_PLANS.get(key)
+  if plan is None:
+    plan = VALIDATION_PLANS[key] = ValidationPlan(version, namespace)
+  return plan
+
+# Every rule that PfifValidator can run, in the order that they are run.  Each
+# of these has a validate_ method on PfifValidator that takes no arguments.
+RULES = [Rule('expired_records_removed', Rule.GLOBAL, 'expensive',
+              min_version=1.3),
+         Rule('extraneous_fields', Rule.RECORD, 'cheap'),
+         Rule('fields_have_correct_format', Rule.RECORD, 'moderate'),
+         Rule('linked_records_matched', Rule.GLOBAL, 'expensive'),
+         Rule('note_field_order', Rule.RECORD, 'cheap', max_version=1.2),
+         Rule('note_has_mandatory_children', Rule.RECORD, 'cheap'),
+         Rule('note_ids_are_unique', Rule.GLOBAL, 'moderate'),
+         Rule('notes_belong_to_persons', Rule.RECORD, 'cheap'),
+         Rule('person_field_order', Rule.RECORD, 'cheap', max_version=1.2),
+         Rule('person_has_mandatory_children', Rule.RECORD, 'cheap'),
+         Rule('person_ids_are_unique', Rule.GLOBAL, 'moderate'),
+         Rule('root_has_child', Rule.GLOBAL, 'cheap'),
+         Rule('root_has_mandatory_children', Rule.GLOBAL, 'cheap')]
+
+RULES_BY_ID = dict((rule.rule_id, rule) for rule in RULES)
+
+def select_rules(rule_ids=None, exclude=None, max_cost=None, scopes=None):
+  """Returns a list of the Rules in RULES that are in rule_ids (if specified),
+  are not in exclude, cost at most max_cost (if specified), and have one of
+  scopes (if specified).  Raises a ValueError for an unknown rule or cost."""
+  for rule_id in (rule_ids or []) + (exclude or []):
+    if rule_id not in RULES_BY_ID:
+      raise ValueError('Unknown rule: ' + rule_id)
+  if max_cost is not None and max_cost not in Rule.COSTS:
+    raise ValueError('Unknown cost: ' + max_cost)
+  rules = []
+  for rule in RULES:
+    if ((rule_ids is None or rule.rule_id in rule_ids) and
+        (exclude is None or rule.rule_id not in exclude) and
+        (max_cost is None or
+         Rule.COSTS.index(rule.cost) <= Rule.COSTS.index(max_cost)) and
+        (scopes is None or rule.scope in scopes)):
+      rules.append(rule)
+  return rules
+
+def rules_to_str(rules):
+  """Returns a table describing rules."""
+  output = utils.MessagesOutput(is_html=False)
+  output.start_table(['Rule', 'Scope', 'Cost', 'Versions'])
+  for rule in rules:
+    output.make_table_row([rule.rule_id, rule.scope, rule.cost,
+                           '%s-%s' % (rule.min_version, rule.max_version)])
+  output.end_table()
+  return output.get_output()
+
+def split_rule_ids(rule_ids):
+  """Turns a comma-separated string of rule ids into a list, or None if
+  rule_ids is None."""
+  if rule_ids is None:
+    return None
+  return [rule_id.strip() for rule_id in rule_ids.split(',') if rule_id.strip()]
 
 def main():
   """Runs all validations on the provided PFIF XML file"""
-  assert len(sys.argv) == 2, 'Usage: python pfif_validator.py my-pyif-xml-file'
-  validator = PfifValidator(utils.open_file(sys.argv[1], 'r'))
-  messages = validator.run_validations()
-  print utils.MessagesOutput.generate_message_summary(messages, is_html=False)
-  print validator.validator_messages_to_str(messages)
+  parser = optparse.OptionParser(usage='usage: %prog [options] pfif-xml-file')
+  parser.add_option('--rules',
+                    help='A comma-separated list of the only rules to run.')
+  parser.add_option('--skip-rules',
+                    help='A comma-separated list of rules not to run.')
+  parser.add_option('--max-cost', choices=Rule.COSTS,
+                    help='Only runs rules that cost at most this much: ' +
+                    ', '.join(Rule.COSTS) + '.')
+  parser.add_option('--list-rules', action='store_true', default=False,
+                    help='Prints every rule that would be run and exits.')
+  parser.add_option('--stats', action='store_true', default=False,
+                    help='Prints how long parsing and each validation took, '
+                    'how many records each validation visited, and how many '
+                    'messages each validation produced.')
+  parser.add_option('--feed-stats', action='store_true', default=False,
+                    help='Also prints the fill rate, lengths, and distinct '
+                    'values of each field, the date ranges, and the most '
+                    'common values of the feed (see pfif_feed_stats.py), '
+                    'from the same parse.')
+  parser.add_option('--prometheus-output',
+                    help='Writes the same statistics as --stats to this file '
+                    'in the Prometheus text format.')
+  parser.add_option('--corpus-index',
+                    help='Also checks for ids and links shared with the feeds '
+                    'in this corpus index (see pfif_corpus.py).')
+  parser.add_option('--parser', choices=utils.PARSERS,
+                    help='The XML parser to use: ' + ', '.join(utils.PARSERS) +
+                    '.  Defaults to the fastest one installed.')
+  parser.add_option('--parse-cache',
+                    help='Loads the file from this directory of parsed feeds '
+                    '(see pfif_cache.py), parsing and saving it there first '
+                    'if it has not been parsed before.')
+  parser.add_option('--parallel', type='int', metavar='PROCESSES',
+                    help='Parses the file in chunks in this many processes '
+                    '(see pfif_parallel.py).')
+  profiling.add_profile_options(parser)
+  (options, args) = parser.parse_args()
+  if options.parse_cache and options.parallel:
+    parser.error('--parse-cache and --parallel cannot be used together.')
+
+  try:
+    rules = select_rules(rule_ids=split_rule_ids(options.rules),
+                         exclude=split_rule_ids(options.skip_rules),
+                         max_cost=options.max_cost)
+  except ValueError, error:
+    parser.error(str(error))
+  if options.list_rules:
+    print rules_to_str(rules)
+    return
+  assert len(args) == 1, 'Must provide one PFIF XML file to validate.'
+  profiler = profiling.make_profiler(options)
+  def parse():
+    """Returns a validator of the file, loading it from the parse cache if
+    there is one."""
+    if options.parse_cache:
+      xml_file = pfif_cache.ParsedFeedCache(options.parse_cache).load(
+          args[0], parser=options.parser)
+    elif options.parallel:
+      xml_file = pfif_parallel.ParallelPfifXmlTree(
+          args[0], parser=options.parser, processes=options.parallel)
+    else:
+      xml_file = utils.open_file(args[0], 'r')
+    return PfifValidator(xml_file, rules=rules, parser=options.parser)
+  validator = profiler.run('parse', parse)
+  messages = profiler.run('rules', validator.run_validations)
+  if options.corpus_index:
+    messages.extend(pfif_corpus.CorpusIndex(options.corpus_index).check_feed(
+        args[0], validator.tree))
+  def render():
+    """Returns the summary and the messages as a string."""
+    return (utils.MessagesOutput.generate_message_summary(messages,
+                                                          is_html=False) +
+            '\n' + validator.validator_messages_to_str(messages))
+  print profiler.run('render', render)
+  if options.stats:
+    print validator.stats.to_str()
+  if options.feed_stats:
+    feed_profile = pfif_feed_stats.FeedProfile()
+    feed_profile.add_tree(validator.tree)
+    print feed_profile.to_str()
+  if options.prometheus_output:
+    validator.stats.write_prometheus(options.prometheus_output)
+  profiling.report(profiler, options)
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Profiles the phases of a command line tool (ie, parse, rules, and render).
+
+Each phase is run under its own cProfile.Profile, so the time spent in each
+phase can be examined separately, and the profiles are written as standard
+pstats files.  Peak memory is measured with tracemalloc when it is available,
+along with the lines that allocated the most memory; otherwise, the peak
+resident set size of the process is used."""
+
+import cProfile
+import optparse
+import pstats
+import resource
+import sys
+import time
+from StringIO import StringIO
+
+try:
+  import tracemalloc # pylint: disable=F0401
+except ImportError:
+  tracemalloc = None # pylint: disable=C0103
+
+# The number of functions and allocation sites listed in the report
+TOP_ENTRIES = 10
+
+class Phase:
+  """The profile, time, and peak memory of one phase."""
+
+  def __init__(self, name, profile, seconds, peak_memory_kb):
+    self.name = name
+    self.profile = profile
+    self.seconds = seconds
+    self.peak_memory_kb = peak_memory_kb
+
+class PhaseProfiler:
+  """Runs functions as named phases, profiling them if enabled is True.  When
+  it isn't, run simply calls the function, so callers don't need to check."""
+
+  def __init__(self, enabled=True):
+    self.enabled = enabled
+    self.phases = []
+    self.snapshot = None
+    if enabled and tracemalloc is not None and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+  @staticmethod
+  def get_peak_memory_kb():
+    """Returns the peak memory in kilobytes since the last call if tracemalloc
+    is available, or the peak memory of the process otherwise."""
+    if tracemalloc is not None and tracemalloc.is_tracing():
+      peak = tracemalloc.get_traced_memory()[1] / 1024
+      if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+      return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on Mac OS.
+    if sys.platform == 'darwin':
+      peak /= 1024
+    return peak
+
+  def run(self, name, function, *args, **kwargs):
+    """Calls function with args and kwargs as the phase called name.  Returns
+    what function returns."""
+    if not self.enabled:
+      return function(*args, **kwargs)
+    profile = cProfile.Profile()
+    start_time = time.time()
+    result = profile.runcall(function, *args, **kwargs)
+    seconds = time.time() - start_time
+    self.phases.append(Phase(name, profile, seconds,
+                             PhaseProfiler.get_peak_memory_kb()))
+    return result
+
+  def finish(self):
+    """Records the top allocation sites.  Call after the last phase."""
+    if self.enabled and tracemalloc is not None and tracemalloc.is_tracing():
+      self.snapshot = tracemalloc.take_snapshot()
+      tracemalloc.stop()
+
+  def get_stats(self, phase=None):
+    """Returns a pstats.Stats for the named phase, or for every phase together
+    if phase is None."""
+    profiles = [each.profile for each in self.phases
+                if phase is None or each.name == phase]
+    stats = pstats.Stats(profiles[0], stream=StringIO())
+    for profile in profiles[1:]:
+      stats.add(profile)
+    return stats
+
+  def write_stats(self, output_prefix):
+    """Writes one pstats file per phase, named output_prefix.PHASE.pstats, and
+    one for every phase together, named output_prefix.pstats.  Returns a list
+    of the paths written."""
+    paths = []
+    for phase in self.phases:
+      path = output_prefix + '.' + phase.name + '.pstats'
+      phase.profile.dump_stats(path)
+      paths.append(path)
+    if self.phases:
+      path = output_prefix + '.pstats'
+      self.get_stats().dump_stats(path)
+      paths.append(path)
+    return paths
+
+  def to_str(self):
+    """Returns a report with the time and peak memory of each phase, the
+    functions that took the most time in each phase, and the top allocation
+    sites if they are known."""
+    output = StringIO()
+    output.write('Phase\tSeconds\tPeak Memory (KB)\n')
+    for phase in self.phases:
+      output.write('%s\t%.4f\t%d\n' % (phase.name, phase.seconds,
+                                       phase.peak_memory_kb))
+    for phase in self.phases:
+      output.write('\n--- ' + phase.name + '\n')
+      stats = self.get_stats(phase.name)
+      stats.stream = output
+      stats.sort_stats('cumulative').print_stats(TOP_ENTRIES)
+    if self.snapshot is not None:
+      output.write('\n--- Top allocation sites\n')
+      for statistic in self.snapshot.statistics('lineno')[:TOP_ENTRIES]:
+        output.write(str(statistic) + '\n')
+    return output.getvalue()
+
+def add_profile_options(parser):
+  """Adds --profile and --profile-output to an optparse.OptionParser."""
+  group = optparse.OptionGroup(parser, 'Profiling')
+  group.add_option('--profile', action='store_true', default=False,
+                   help='Prints the time, peak memory, and slowest functions '
+                   'of each phase to stderr.')
+  group.add_option('--profile-output', metavar='PREFIX',
+                   help='Writes a pstats file for each phase to '
+                   'PREFIX.PHASE.pstats and one for every phase to '
+                   'PREFIX.pstats.  Implies --profile.')
+  parser.add_option_group(group)
+
+def make_profiler(options):
+  """Returns a PhaseProfiler that is enabled if the options ask for it."""
+  return PhaseProfiler(enabled=bool(options.profile or options.profile_output))
+
+def report(profiler, options):
+  """Prints the report to stderr and writes the pstats files if the options
+  ask for them.  Call after the last phase."""
+  if not profiler.enabled:
+    return
+  profiler.finish()
+  sys.stderr.write(profiler.to_str())
+  if options.profile_output:
+    for path in profiler.write_stats(options.profile_output):
+      sys.stderr.write('Wrote ' + path + '\n')
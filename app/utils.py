@@ -15,11 +15,24 @@
 
 """Utilities for the PFIF Validator"""
 
+import bz2
 import re
+import time
+import zlib
 from datetime import datetime
 import xml.etree.ElementTree as ET
 import urllib
 import cgi
+from StringIO import StringIO
+from xml.sax.saxutils import escape
+
+try:
+  import lzma # pylint: disable=F0401
+except ImportError:
+  try:
+    from backports import lzma # pylint: disable=F0401
+  except ImportError:
+    lzma = None # pylint: disable=C0103
 
 # XML Parsing Utilities
 
@@ -46,67 +59,582 @@ def set_file_for_test(file_for_test):
   global _file_for_test # pylint: disable=w0603
   _file_for_test = file_for_test
 
+def get_file_for_test():
+  """Returns a new copy of the debug file so that every caller can read it
+  from the start as if it had opened it fresh, or None if it is not set."""
+  if _file_for_test is None:
+    return None
+  _file_for_test.seek(0)
+  return StringIO(_file_for_test.read())
+
 def open_file(filename, mode='r'):
-  """Opens the file or returns a debug value if set."""
-  return _file_for_test or open(filename, mode)
+  """Opens the file or returns a debug value if set.  Compressed files are
+  decompressed as they are read."""
+  return open_compressed(get_file_for_test() or open(filename, mode))
 
-# TODO(samking): do incremental URL reading to support massive files
 def open_url(url):
-  """Opens the url or returns a debug value if set."""
-  return _file_for_test or urllib.urlopen(url)
+  """Opens the url or returns a debug value if set.  The response is read
+  incrementally by PfifXmlTree, so it is not buffered here.  Compressed
+  responses are decompressed as they are read."""
+  response = get_file_for_test() or urllib.urlopen(url)
+  content_encoding = None
+  if hasattr(response, 'info'):
+    content_encoding = response.info().getheader('Content-Encoding')
+  return open_compressed(response, content_encoding=content_encoding)
+
+# Compressed input
+
+# compression : the bytes that every file compressed that way starts with
+COMPRESSION_MAGIC = {'gzip' : '\x1f\x8b', 'bz2' : 'BZh',
+                     'xz' : '\xfd7zXZ\x00'}
+
+# Content-Encoding header : compression
+CONTENT_ENCODINGS = {'gzip' : 'gzip', 'x-gzip' : 'gzip', 'bzip2' : 'bz2',
+                     'x-bzip2' : 'bz2', 'xz' : 'xz', 'x-xz' : 'xz'}
+
+def make_decompressor(compression):
+  """Returns a new decompressor object for compression."""
+  if compression == 'gzip':
+    # 16 tells zlib to expect a gzip header and trailer.
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+  if compression == 'bz2':
+    return bz2.BZ2Decompressor()
+  assert lzma is not None, ('Reading xz files needs the lzma module (or '
+                            'backports.lzma).')
+  return lzma.LZMADecompressor()
+
+class PrefixedFile:
+  """A file that returns prefix before the rest of source, so that the start of
+  a file that can't seek can be read to detect its compression and then put
+  back."""
+
+  def __init__(self, prefix, source):
+    self.prefix = prefix
+    self.source = source
+
+  def readline(self):
+    """Returns the next line."""
+    if not self.prefix:
+      return self.source.readline()
+    newline = self.prefix.find('\n')
+    if newline >= 0:
+      line = self.prefix[:newline + 1]
+      self.prefix = self.prefix[newline + 1:]
+      return line
+    line = self.prefix + self.source.readline()
+    self.prefix = ''
+    return line
+
+  def read(self, num_bytes=-1):
+    """Returns up to num_bytes bytes, or the rest of the file if num_bytes is
+    negative."""
+    if num_bytes < 0 or num_bytes > len(self.prefix):
+      data = self.prefix + self.source.read(
+          num_bytes - len(self.prefix) if num_bytes >= 0 else -1)
+      self.prefix = ''
+      return data
+    data = self.prefix[:num_bytes]
+    self.prefix = self.prefix[num_bytes:]
+    return data
+
+class DecompressingFile:
+  """A file that decompresses source a chunk at a time as lines are read from
+  it, so a compressed feed never has to be decompressed to disk or held in
+  memory all at once.  Concatenated gzip and bz2 streams are read one after
+  another, like gunzip and bunzip2 do."""
+
+  # The number of compressed bytes read from source at a time
+  CHUNK_SIZE = 64 * 1024
+
+  def __init__(self, source, compression):
+    self.source = source
+    self.compression = compression
+    self.decompressor = make_decompressor(compression)
+    self.buffer = ''
+    self.position = 0
+    self.is_done = False
+
+  def decompress_chunk(self):
+    """Adds the next chunk of decompressed data to the buffer.  Sets is_done at
+    the end of source."""
+    data = self.source.read(DecompressingFile.CHUNK_SIZE)
+    if not data:
+      self.is_done = True
+      if hasattr(self.decompressor, 'flush'):
+        self.add_to_buffer(self.decompressor.flush())
+      return
+    while data:
+      self.add_to_buffer(self.decompressor.decompress(data))
+      # Anything after the end of a stream is the start of the next one.
+      data = getattr(self.decompressor, 'unused_data', '')
+      if data:
+        self.decompressor = make_decompressor(self.compression)
+
+  def add_to_buffer(self, data):
+    """Appends data to the unread part of the buffer."""
+    if data:
+      self.buffer = self.buffer[self.position:] + data
+      self.position = 0
+
+  def readline(self):
+    """Returns the next decompressed line."""
+    newline = self.buffer.find('\n', self.position)
+    while newline < 0 and not self.is_done:
+      searched = len(self.buffer) - self.position
+      self.decompress_chunk()
+      newline = self.buffer.find('\n', self.position + searched)
+    if newline < 0:
+      end = len(self.buffer)
+    else:
+      end = newline + 1
+    line = self.buffer[self.position:end]
+    self.position = end
+    return line
+
+  def read(self, num_bytes=-1):
+    """Returns up to num_bytes decompressed bytes, or the rest of the file if
+    num_bytes is negative."""
+    while not self.is_done and (
+        num_bytes < 0 or len(self.buffer) - self.position < num_bytes):
+      self.decompress_chunk()
+    if num_bytes < 0:
+      end = len(self.buffer)
+    else:
+      end = min(len(self.buffer), self.position + num_bytes)
+    data = self.buffer[self.position:end]
+    self.position = end
+    return data
+
+def detect_compression(start):
+  """Returns the compression whose magic bytes start start, or None.  Text
+  that was already decoded to unicode can't be compressed."""
+  if isinstance(start, unicode):
+    return None
+  for compression, magic in COMPRESSION_MAGIC.items():
+    if start.startswith(magic):
+      return compression
+  return None
+
+def open_compressed(source, content_encoding=None):
+  """Returns a file that reads source decompressed if it is compressed with
+  gzip, bz2, or xz, or source itself (or an equivalent file) otherwise.  The
+  compression is taken from content_encoding (a Content-Encoding header) if it
+  names one, and otherwise from the first bytes of source, which are put back
+  by seeking if source can seek.  Pipes (and stdin) have a seek method that
+  fails, so those are treated like sources that can't seek."""
+  compression = CONTENT_ENCODINGS.get((content_encoding or '').lower())
+  if compression is None:
+    magic_length = max(len(magic) for magic in COMPRESSION_MAGIC.values())
+    start = source.read(magic_length)
+    try:
+      source.seek(0)
+    except (AttributeError, IOError, OSError):
+      source = PrefixedFile(start, source)
+    compression = detect_compression(start)
+  if compression is None:
+    return source
+  return DecompressingFile(source, compression)
 
 def get_utcnow():
   """Return current time in utc, or debug value if set."""
   return _utcnow_for_test or datetime.utcnow()
 
+class PfifDateCache:
+  """Parses dates in the format yyyy-mm-ddThh:mm:ssZ (where there can
+  optionally be a fractional amount of seconds between ss and Z), remembering
+  up to max_size of them.  Feeds often stamp thousands of records with the same
+  date, so most dates are only parsed once.  The cache is emptied when it is
+  full, which keeps it bounded without tracking how recently each date was
+  used."""
+
+  # Fractional seconds are optionally allowed in the time, which means that it
+  # would be difficult to use datetime.strptime.  Instead, we manually extract
+  # the fields using a regular expression.
+  DATE = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?Z$')
+
+  # Cached for text that has the format of a date but isn't a real date (ie,
+  # the 30th of February)
+  NOT_REAL = False
+
+  def __init__(self, max_size=10000):
+    self.max_size = max_size
+    # text : datetime, NOT_REAL, or None if it doesn't have the format of a date
+    self.dates = {}
+
+  def lookup(self, text):
+    """Returns what is cached for text, parsing it if it isn't cached yet."""
+    try:
+      return self.dates[text]
+    except KeyError:
+      pass
+    match = PfifDateCache.DATE.match(text)
+    date = None
+    if match:
+      try:
+        date = datetime(*[int(part) for part in match.groups()[:6]])
+      except ValueError:
+        date = PfifDateCache.NOT_REAL
+    if len(self.dates) >= self.max_size:
+      self.dates.clear()
+    self.dates[text] = date
+    return date
+
+  def has_date_format(self, text):
+    """Returns True if text has the format of a PFIF date."""
+    return self.lookup(text) is not None
+
+  def parse(self, text):
+    """Returns text as a datetime, or None if it isn't a PFIF date."""
+    return self.lookup(text) or None
+
+# Shared by every validator in the process
+PFIF_DATES = PfifDateCache()
+
+# XML parser backends
+
+# Every parser that PfifXmlTree can use, from fastest to slowest.  They all
+# produce the same tags, text, and line numbers, and fail on the same input.
+# lxml reports the line of each element itself; the others rely on
+# FileWithLines feeding them one line at a time.
+PARSERS = ['lxml', 'cElementTree', 'ElementTree']
+
+# The last line that lxml's sourceline is right for.
+LXML_MAX_SOURCELINE = 65535
+
+def import_parser(parser):
+  """Returns the ElementTree-compatible module for parser, or None if it isn't
+  installed."""
+  assert parser in PARSERS, 'Unknown parser: ' + parser
+  try:
+    if parser == 'lxml':
+      from lxml import etree # pylint: disable=F0401
+      return etree
+    if parser == 'cElementTree':
+      import xml.etree.cElementTree as cElementTree
+      return cElementTree
+  except ImportError:
+    return None
+  return ET
+
+def get_available_parsers():
+  """Returns a list of the parsers in PARSERS that are installed."""
+  return [parser for parser in PARSERS if import_parser(parser) is not None]
+
+def get_default_parser():
+  """Returns the fastest parser that is installed."""
+  return get_available_parsers()[0]
+
 class FileWithLines:
   """A file that keeps track of its line number.  From
   http://bytes.com/topic/python/answers/535191-elementtree-line-numbers-iterparse
-  """
+  Every line read is also kept in lines so that the source never has to be
+  read (or copied) a second time, unless keep_lines is False.  If
+  encode_unicode is True, unicode lines are passed to the parser as UTF-8 (but
+  kept in lines as they were read), for parsers that only accept bytes."""
 
-  def __init__(self, source):
+  def __init__(self, source, encode_unicode=False, keep_lines=True):
     self.source = source
+    self.encode_unicode = encode_unicode
+    self.keep_lines = keep_lines
     self.line_number = 0
+    self.bytes_read = 0
+    self.lines = []
 
   def read(self, num_bytes): # pylint: disable=W0613
     """Wrapper around file.readLine that keeps track of line number"""
-    self.line_number += 1
-    return self.source.readline()
+    line = self.source.readline()
+    if line:
+      self.line_number += 1
+      self.bytes_read += len(line)
+      if self.keep_lines:
+        self.lines.append(line)
+    if self.encode_unicode and isinstance(line, unicode):
+      return line.encode('utf-8')
+    return line
+
+def make_external_entity_refuser(etree):
+  """Returns a resolver for lxml (whose module is etree) that refuses to load
+  any external entity or DTD, which ElementTree treats as undefined."""
+  class ExternalEntityRefuser(etree.Resolver):
+    """Raises on every external entity."""
+    def resolve(self, url, pubid, context): # pylint: disable=W0613
+      raise SyntaxError('undefined entity: ' + url)
+  return ExternalEntityRefuser()
+
+def make_iterparse(parser, file_with_lines, events, tag=None):
+  """Returns an iterparse of file_with_lines, a FileWithLines, with parser.
+  With lxml, only the elements matching tag (any tag by default) are reported,
+  which lxml filters without calling back into Python, and, like ElementTree,
+  comments and processing instructions are dropped, entities defined in the
+  document are expanded, external entities are refused, and unicode lines are
+  encoded, since lxml only reads bytes.  The other parsers report every
+  element."""
+  etree = import_parser(parser)
+  assert etree is not None, 'The parser is not installed: ' + parser
+  if parser != 'lxml':
+    return etree.iterparse(file_with_lines, events=events)
+  file_with_lines.encode_unicode = True
+  tree_parser = etree.iterparse(file_with_lines, events=events, tag=tag,
+                                remove_comments=True, remove_pis=True,
+                                huge_tree=True)
+  tree_parser.resolvers.add(make_external_entity_refuser(etree))
+  return tree_parser
+
+# The children of the root that iter_records yields.
+RECORD_TAGS = ['person', 'note']
+
+# Person Finder serves PFIF records in Atom feeds, with each record (and no
+# other PFIF) in an entry that is a child of the feed.
+ATOM_NAMESPACE = 'http://www.w3.org/2005/Atom'
+ATOM_FEED_TAG = '{' + ATOM_NAMESPACE + '}feed'
+ATOM_ENTRY_TAG = '{' + ATOM_NAMESPACE + '}entry'
+
+# Matches a PFIF namespace of any version
+PFIF_NAMESPACE_RE = re.compile(r'http://zesty\.ca/pfif/')
+
+# Matches the declaration of a PFIF namespace, which is the group
+PFIF_NAMESPACE_DECLARATION_RE = re.compile(
+    r'xmlns(?::[^\s=]+)?\s*=\s*["\'](http://zesty\.ca/pfif/[^"\']*)["\']')
+
+def get_pfif_namespace(etree_tag):
+  """Returns the namespace of etree_tag if it is a PFIF namespace, or None."""
+  match = re.match(r'\{(.+)\}', etree_tag)
+  if match and PFIF_NAMESPACE_RE.match(match.group(1)):
+    return match.group(1)
+  return None
+
+def get_pfif_version(etree_tag):
+  """Returns the PFIF version of etree_tag's namespace as a float, or None if
+  it isn't a PFIF namespace with a version."""
+  match = re.match(r'\{http://zesty\.ca/pfif/(\d\.\d)\}', etree_tag)
+  if match:
+    return float(match.group(1))
+  return None
+
+def iter_records(xml_file, parser=None):
+  """Parses xml_file one record at a time, so that files of any size can be
+  read in bounded memory.  The first element yielded is the root, as soon as
+  its start tag has been parsed, and then each person and top level note is
+  yielded once it has been parsed completely, with its nested notes.  Each
+  record is emptied when the next one is requested and then removed from the
+  root, so only one record is kept at a time, and anything needed from a
+  record must be copied out of it.  Line numbers are not recorded; use
+  PfifXmlTree for those.
+
+  The records of an Atom feed are pulled out of its entries as they are
+  parsed.  The root yielded for an Atom feed is a new, empty pfif element in
+  the first PFIF namespace that is declared or used, as soon as there is one
+  (or the feed itself at the end, if there is none), and each entry is
+  emptied once it has been parsed, like a record."""
+  parser = parser or get_default_parser()
+  etree = import_parser(parser)
+  file_with_lines = FileWithLines(xml_file, keep_lines=False)
+  tree_parser = make_iterparse(
+      parser, file_with_lines, ('start-ns', 'start', 'end'),
+      tag=['{*}pfif', ATOM_FEED_TAG, ATOM_ENTRY_TAG] +
+      ['{*}' + tag for tag in RECORD_TAGS])
+  root = None
+  is_atom = False
+  namespace = None
+  yielded_root = False
+  # The elements that have started but not ended.  lxml doesn't report the
+  # elements that don't match the tags, so with lxml, parents are found with
+  # getparent instead.
+  open_elements = []
+  for event, elem in tree_parser:
+    if event == 'start-ns':
+      if namespace is None and PFIF_NAMESPACE_RE.match(elem[1]):
+        namespace = elem[1]
+      continue
+    if event == 'start':
+      open_elements.append(elem)
+      if root is None:
+        root = elem
+        is_atom = root.tag == ATOM_FEED_TAG
+        if not is_atom:
+          yielded_root = True
+          yield root
+      if not yielded_root:
+        namespace = get_pfif_namespace(elem.tag) or namespace
+        if namespace is not None:
+          yielded_root = True
+          yield etree.Element('{' + namespace + '}pfif')
+      continue
+    open_elements.pop()
+    if parser == 'lxml':
+      parent = elem.getparent()
+      grandparent = parent is not None and parent.getparent()
+    else:
+      parent = open_elements and open_elements[-1]
+      grandparent = len(open_elements) > 1 and open_elements[-2]
+    if parent is root:
+      if not is_atom and extract_tag(elem.tag) in RECORD_TAGS:
+        yield elem
+      # libxml2 may still add text to elem, so elem is only emptied, and it
+      # is removed along with the next record (or entry).
+      elem.clear()
+      while root[0] is not elem:
+        del root[0]
+    elif (is_atom and grandparent is root and parent.tag == ATOM_ENTRY_TAG and
+          get_pfif_namespace(elem.tag) and
+          extract_tag(elem.tag) in RECORD_TAGS):
+      yield elem
+  if root is not None:
+    if not yielded_root:
+      yield root
+    del root[:]
+
+# etree tag : field name, for get_field_name
+_field_names = {} # pylint: disable=c0103
+
+# get_field_name forgets the tags it has parsed once there are this many, so
+# that feeds with many different tags can't fill memory.
+FIELD_NAME_CACHE_SIZE = 1000
+
+def get_field_name(etree_tag):
+  """Returns extract_tag(etree_tag), only parsing each tag once."""
+  field = _field_names.get(etree_tag)
+  if field is None:
+    if len(_field_names) >= FIELD_NAME_CACHE_SIZE:
+      _field_names.clear()
+    field = _field_names[etree_tag] = extract_tag(etree_tag)
+  return field
+
+def get_fields(record):
+  """Returns a list of the (field, text) pairs of record, an element from
+  iter_records, in order, without its notes.  Fields without text have the
+  empty string, so they are still written by PfifXmlWriter."""
+  fields = []
+  for child in record:
+    field = get_field_name(child.tag)
+    if field != 'note':
+      fields.append((field, child.text or ''))
+  return fields
+
+def get_notes(person):
+  """Returns the fields of each note in person, as get_fields does."""
+  return [get_fields(note) for note in person
+          if get_field_name(note.tag) == 'note']
+
+def get_field(fields, field):
+  """Returns the text of the first field in fields, a list of (field, text)
+  pairs, or None."""
+  for name, text in fields:
+    if name == field:
+      return text
+  return None
+
+def read_version(records):
+  """Returns the PFIF version of the root, the first element from records, a
+  generator from iter_records."""
+  for root in records:
+    version = get_pfif_version(root.tag)
+    assert version and 1.1 <= version <= 1.3, (
+        'The XML namespace specified is not correct.  It should be in the '
+        'following format: http://zesty.ca/pfif/VERSION, where VERSION is '
+        '1.1, 1.2, or 1.3')
+    return version
+  raise SyntaxError('The file has no root element.')
 
 # Doesn't inherit from ET.ElementTree to avoid messing with the
 # ET.ElementTree.parse factory method
 class PfifXmlTree():
-  """An XML tree with PFIF-XML-specific helper functions."""
+  """An XML tree with PFIF-XML-specific helper functions.  It also keeps count
+  of how long parsing took, how many bytes were read, and how many records
+  have been returned by the get_*_persons and get_*_notes methods.  Those
+  methods can be restricted to some of the children of the root with
+  select_records."""
 
-  def __init__(self, xml_file):
+  def __init__(self, xml_file, parser=None):
+    """parser is one of PARSERS, defaulting to the fastest one installed."""
     self.namespace = None
     self.version = None
     self.tree = None
+    self.parser = parser or get_default_parser()
     self.line_numbers = {}
-    self.lines = xml_file.readlines()
-    xml_file.seek(0)
+    self.lines = []
+    self.parse_seconds = 0.0
+    self.bytes_read = 0
+    self.records_visited = 0
+    self.selected_records = None
     self.initialize_tree(xml_file)
+    self.unwrap_atom_feed()
     self.initialize_pfif_version()
 
-
   def initialize_tree(self, xml_file):
     """Reads in the XML tree from the XML file.  If the XML file is invalid,
-    the XML library will raise an exception."""
+    the XML library will raise an exception.  The file is only read once, so it
+    does not need to support seek."""
+    start_time = time.time()
+    etree = import_parser(self.parser)
+    assert etree is not None, 'The parser is not installed: ' + self.parser
     file_with_lines = FileWithLines(xml_file)
-    tree_parser = iter(ET.iterparse(file_with_lines, events=['start']))
-    event, root = tree_parser.next() # pylint: disable=W0612
-    self.line_numbers[root] = file_with_lines.line_number
-
-    for event, elem in tree_parser:
-      self.line_numbers[elem] = file_with_lines.line_number
-    self.tree = ET.ElementTree(root)
-
-  def initialize_pfif_version(self):
-    """Initializes the namespace and version.  Raises an exception of the XML
-    root does not specify a namespace or tag, if the tag isn't pfif, or if the
-    version isn't supported."""
-    root = self.tree.getroot()
-    tag = root.tag
+    self.lines = file_with_lines.lines
+    tree_parser = make_iterparse(self.parser, file_with_lines, ('start',))
+    if self.parser == 'lxml':
+      # libxml2 can't store lines past LXML_MAX_SOURCELINE, so after that the
+      # line is counted like it is for the other parsers, which is why every
+      # element needs an event rather than only some tags.
+      for _, elem in tree_parser:
+        if file_with_lines.line_number < LXML_MAX_SOURCELINE:
+          self.line_numbers[elem] = elem.sourceline
+        else:
+          self.line_numbers[elem] = file_with_lines.line_number
+      root = tree_parser.root
+      self.tree = etree.ElementTree(root)
+    else:
+      tree_parser = iter(tree_parser)
+      event, root = tree_parser.next() # pylint: disable=W0612
+      self.line_numbers[root] = file_with_lines.line_number
+
+      for event, elem in tree_parser:
+        self.line_numbers[elem] = file_with_lines.line_number
+      self.tree = etree.ElementTree(root)
+    self.bytes_read = file_with_lines.bytes_read
+    self.parse_seconds = time.time() - start_time
+
+  def unwrap_atom_feed(self):
+    """If the root is an Atom feed, replaces it with a pfif root holding the
+    PFIF children of its entries, in order, so that the feed is read like any
+    other PFIF XML file.  The elements keep their line numbers, and the pfif
+    root has the line number of the feed.  The root is in the namespace of the
+    first record, or of the first PFIF namespace declared if there are no
+    records.  The rest of the feed is dropped."""
+    feed = self.tree.getroot()
+    if feed.tag != ATOM_FEED_TAG:
+      return
+    records = []
+    for entry in feed.findall(ATOM_ENTRY_TAG):
+      for child in entry.getchildren():
+        if get_pfif_namespace(child.tag):
+          # ElementTree doesn't take an element out of its old parent.
+          entry.remove(child)
+          records.append(child)
+    if records:
+      namespace = get_pfif_namespace(records[0].tag)
+    else:
+      match = PFIF_NAMESPACE_DECLARATION_RE.search(''.join(self.lines))
+      if match is None:
+        # initialize_pfif_version reports the feed as the wrong kind of root.
+        return
+      namespace = match.group(1)
+    etree = import_parser(self.parser)
+    root = etree.Element('{' + namespace + '}pfif')
+    root.text = feed.text
+    for record in records:
+      root.append(record)
+    self.line_numbers[root] = self.line_numbers.pop(feed)
+    for child in feed:
+      for elem in child.getiterator():
+        self.line_numbers.pop(elem, None)
+    self.tree = etree.ElementTree(root)
+
+  def initialize_pfif_version(self, tag=None):
+    """Initializes the namespace and version from tag, the tag of the root.
+    Raises an exception of the XML root does not specify a namespace or tag, if
+    the tag isn't pfif, or if the version isn't supported."""
+    if tag is None:
+      tag = self.tree.getroot().tag
     # xml.etree.Element.tag is formatted like: {namespace}tag
     match = re.match(r'\{(.+)\}(.+)', tag)
     assert match, 'This XML root node does not specify a namespace and tag'
@@ -131,20 +659,44 @@ class PfifXmlTree():
     """turns a local tag into a fully qualified tag by adding a namespace """
     return '{' + self.namespace + '}' + tag
 
+  def select_records(self, records):
+    """Restricts the get_*_persons and get_*_notes methods and
+    get_root_children to records, a list of children of the root, or removes
+    the restriction if records is None."""
+    self.selected_records = records
+
+  def get_root_children(self):
+    """returns a list of the selected children of the root node"""
+    if self.selected_records is None:
+      return self.tree.getroot().getchildren()
+    return self.selected_records
+
+  def find_root_children(self, tag):
+    """returns a list of the selected children of the root node with tag"""
+    if self.selected_records is None:
+      return self.tree.findall(self.add_namespace_to_tag(tag))
+    tag = self.add_namespace_to_tag(tag)
+    return [record for record in self.selected_records if record.tag == tag]
+
   def get_all_persons(self):
     """returns a list of all persons in the tree"""
-    return self.tree.findall(self.add_namespace_to_tag('person'))
+    persons = self.find_root_children('person')
+    self.records_visited += len(persons)
+    return persons
 
   def get_child_notes(self):
     """returns a list of all notes that are subnodes of persons"""
     notes = []
-    for person in self.get_all_persons():
+    for person in self.find_root_children('person'):
       notes.extend(person.findall(self.add_namespace_to_tag('note')))
+    self.records_visited += len(notes)
     return notes
 
   def get_top_level_notes(self):
     """returns a list of all notes that are subnodes of the root node"""
-    return self.tree.findall(self.add_namespace_to_tag('note'))
+    notes = self.find_root_children('note')
+    self.records_visited += len(notes)
+    return notes
 
   def get_all_notes(self):
     """returns a list of all notes in the tree"""
@@ -160,9 +712,49 @@ class PfifXmlTree():
       return child.text
     return None
 
+class PfifXmlWriter:
+  """Writes PFIF XML one record at a time, so that a feed never has to be held
+  in memory.  A record is a list of (field, text) pairs in the order they
+  should be written; fields whose text is None are left out."""
+
+  def __init__(self, output, version):
+    self.output = output
+    self.output.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<pfif:pfif xmlns:pfif="http://zesty.ca/pfif/' +
+                      str(version) + '">\n')
+
+  @staticmethod
+  def record_to_lines(record_type, fields, notes, indent, lines):
+    """Appends the lines of a record, including its nested notes, to lines."""
+    lines.append(indent + '<pfif:' + record_type + '>\n')
+    for field, text in fields:
+      if text is not None:
+        if isinstance(text, unicode):
+          text = text.encode('utf-8')
+        lines.append(indent + '  <pfif:' + field + '>' + escape(text) +
+                     '</pfif:' + field + '>\n')
+    for note in notes:
+      PfifXmlWriter.record_to_lines('note', note, [], indent + '  ', lines)
+    lines.append(indent + '</pfif:' + record_type + '>\n')
+
+  def write_record(self, record_type, fields, notes=()):
+    """Writes a person or note as a child of the root.  notes is a list of
+    records to nest inside of it."""
+    lines = []
+    PfifXmlWriter.record_to_lines(record_type, fields, notes, '  ', lines)
+    self.output.write(''.join(lines))
+
+  def close(self):
+    """Closes the root.  The output itself is left open."""
+    self.output.write('</pfif:pfif>\n')
+
 class Message: # pylint: disable=R0902
   """A container for information about an error or warning message"""
 
+  # Every field of a message, which is what messages are compared by
+  FIELDS = ['category', 'extra_data', 'is_error', 'xml_line_number',
+            'xml_text', 'xml_tag', 'person_record_id', 'note_record_id']
+
   def __init__(self, category, extra_data=None, is_error=True,
                xml_line_number=None, xml_tag=None, xml_text=None,
                person_record_id=None, note_record_id=None):
@@ -175,8 +767,62 @@ class Message: # pylint: disable=R0902
     self.person_record_id = person_record_id
     self.note_record_id  = note_record_id
 
+  def get_fields(self):
+    """Returns a dict from each of FIELDS to its value."""
+    return dict((field, getattr(self, field)) for field in Message.FIELDS)
+
   def __eq__(self, other):
-    return self.__dict__ == other.__dict__
+    return self.get_fields() == other.get_fields()
+
+  def __ne__(self, other):
+    return not self == other
+
+class LazyMessage(Message):
+  """A Message about an element of a record in a PfifXmlTree that only looks
+  up the record ids, tag, text, and line number of the element when they are
+  first read, so that messages which are only counted or truncated cost almost
+  nothing to make.  Copies and pickles have every field looked up, so they
+  don't hold on to the tree."""
+
+  # The fields that are looked up from the tree
+  LAZY_FIELDS = ['xml_line_number', 'xml_text', 'xml_tag', 'person_record_id',
+                 'note_record_id']
+
+  # pylint: disable=W0231
+  def __init__(self, category, tree, record, element=None, xml_tag=None,
+               is_error=True, extra_data=None):
+    # The lazy fields are not set here, so reading them calls __getattr__.
+    self.category = category
+    self.extra_data = extra_data
+    self.is_error = is_error
+    self.lazy_source = (tree, record, element, xml_tag)
+  # pylint: enable=W0231
+
+  def __getattr__(self, name):
+    if (name not in LazyMessage.LAZY_FIELDS or
+        'lazy_source' not in self.__dict__):
+      raise AttributeError(name)
+    self.resolve()
+    return self.__dict__[name]
+
+  def resolve(self):
+    """Looks up every lazy field from the tree and lets go of the tree."""
+    tree, record, element, xml_tag = self.__dict__.pop('lazy_source')
+    self.person_record_id = tree.get_field_text(record, 'person_record_id')
+    self.note_record_id = tree.get_field_text(record, 'note_record_id')
+    self.xml_tag = xml_tag
+    self.xml_text = None
+    self.xml_line_number = None
+    if element is not None:
+      self.xml_tag = extract_tag(element.tag)
+      self.xml_text = element.text
+      self.xml_line_number = tree.line_numbers[element]
+
+  def __getstate__(self):
+    return self.get_fields()
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
 
 class Categories: # pylint: disable=W0232
   """Constants representing message categories."""
@@ -199,6 +845,10 @@ class MessagesOutput:
   # less in need of truncation.
   GROUPED_TRUNCATE_THRESHOLD = 400
 
+  # When streaming output (messages_to_chunks), this many messages are
+  # formatted at a time.
+  STREAM_CHUNK_SIZE = 50
+
   def __init__(self, is_html, html_class='all_messages'):
     self.is_html = is_html
     self.output = []
@@ -302,6 +952,33 @@ class MessagesOutput:
             'following category: ' + category + '.'))
     return truncated_messages
 
+  @staticmethod
+  def truncate_stream(messages, truncation_threshold):
+    """Like truncate, but yields messages as they come from the messages
+    iterable rather than grouping them by category.  The messages saying that
+    truncation happened are yielded at the end."""
+    category_counts = {}
+    for message in messages:
+      count = category_counts.get(message.category, 0) + 1
+      category_counts[message.category] = count
+      if count <= truncation_threshold:
+        yield message
+    for category, count in category_counts.items():
+      if count > truncation_threshold:
+        yield Message(
+            'You had too many messages, so some were truncated.',
+            extra_data='You had ' + str(count) + ' messages in the '
+            'following category: ' + category + '.')
+
+  @staticmethod
+  def count_messages_by_category(messages, category_counts):
+    """Yields each message from the messages iterable while adding one to its
+    category in the category_counts dict."""
+    for message in messages:
+      category_counts[message.category] = (
+          category_counts.get(message.category, 0) + 1)
+      yield message
+
   @staticmethod
   def group_messages_by_record(messages):
     """Returns a dict from record_id to a list of messages with that id.
@@ -338,11 +1015,21 @@ class MessagesOutput:
   @staticmethod
   def generate_message_summary(messages, is_html):
     """Returns a string with a summary of the categories of each message."""
-    output = MessagesOutput(is_html, html_class="summary")
     messages_by_category = MessagesOutput.group_messages_by_category(messages)
-    output.start_table(['Category', 'Number of Messages'])
+    category_counts = {}
     for category, messages_list in messages_by_category.items():
-      output.make_table_row([category, str(len(messages_list))])
+      category_counts[category] = len(messages_list)
+    return MessagesOutput.generate_category_count_summary(category_counts,
+                                                          is_html)
+
+  @staticmethod
+  def generate_category_count_summary(category_counts, is_html):
+    """Returns a string with a summary of a dict from category to the number of
+    messages in that category."""
+    output = MessagesOutput(is_html, html_class="summary")
+    output.start_table(['Category', 'Number of Messages'])
+    for category, count in category_counts.items():
+      output.make_table_row([category, str(count)])
     output.end_table()
     return output.get_output()
 
@@ -402,18 +1089,43 @@ class MessagesOutput:
     return output.get_output()
 
   @staticmethod
-  # pylint: disable=R0912
-  def messages_to_str(messages, show_error_type=True, show_errors=True,
-                      show_warnings=True, show_line_numbers=True,
-                      show_full_line=True, show_record_ids=True,
-                      show_xml_tag=True, show_xml_text=True, is_html=False,
-                      xml_lines=None, truncate=True):
-    # pylint: enable=R0912
-    """Returns a string containing all messages formatted per the options."""
+  def messages_to_str(messages, truncate=True, **optional_args):
+    """Returns a string containing all messages formatted per the options.  See
+    messages_to_chunks for the options."""
     if truncate:
       messages = MessagesOutput.truncate(
           messages, MessagesOutput.TRUNCATE_THRESHOLD)
+    return ''.join(MessagesOutput.messages_to_chunks(messages, **optional_args))
+
+  @staticmethod
+  def read_message_lines(xml_file, messages):
+    """Returns a dict from the index of each line of xml_file that one of
+    messages is about to the line, which can be used as xml_lines without
+    reading the whole file into memory."""
+    indices = set(message.xml_line_number - 1 for message in messages
+                  if message.xml_line_number is not None)
+    lines = {}
+    for index, line in enumerate(xml_file):
+      if index in indices:
+        lines[index] = line
+    return lines
+
+  @staticmethod
+  # pylint: disable=R0912
+  def messages_to_chunks(messages, show_error_type=True, show_errors=True,
+                         show_warnings=True, show_line_numbers=True,
+                         show_full_line=True, show_record_ids=True,
+                         show_xml_tag=True, show_xml_text=True, is_html=False,
+                         xml_lines=None, chunk_size=None):
+    # pylint: enable=R0912
+    """Formats every message from the messages iterable per the options,
+    yielding the output in strings of chunk_size messages (defaulting to
+    STREAM_CHUNK_SIZE) so that it can be sent before all messages exist.
+    Messages are not truncated."""
+    if chunk_size is None:
+      chunk_size = MessagesOutput.STREAM_CHUNK_SIZE
     output = MessagesOutput(is_html)
+    messages_in_chunk = 0
     for message in messages:
       if (message.is_error and show_errors) or (
           not message.is_error and show_warnings):
@@ -452,4 +1164,9 @@ class MessagesOutput:
           output.make_message_part_division(
               xml_lines[message.xml_line_number - 1], 'message_xml_full_line')
         output.end_new_message()
-    return output.get_output()
+        messages_in_chunk += 1
+        if messages_in_chunk == chunk_size:
+          yield ''.join(output.output)
+          output.output = []
+          messages_in_chunk = 0
+    yield output.get_output()
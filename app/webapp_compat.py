@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The parts of google.appengine.ext.webapp that the controllers use,
+implemented with only the standard library.
+
+This lets the controllers run outside of App Engine, for instance behind
+wsgi_server.py.  Only what pfif_tools needs is implemented: handlers are
+classes with get and post methods, requests support get, get_all, and POST,
+and responses are written to response.out.  Responses can also be streamed to
+the client with response.flush."""
+
+import cgi
+import re
+import sys
+import traceback
+from StringIO import StringIO
+from wsgiref.handlers import CGIHandler
+
+class MultiDict:
+  """A dict that can hold several values for each key, like webob's
+  MultiDict.  Lookups return the last value added for a key."""
+
+  def __init__(self):
+    self.items = []
+
+  def add(self, key, value):
+    """Adds a value for key without replacing any existing values."""
+    self.items.append((key, value))
+
+  def getall(self, key):
+    """Returns a list of every value for key."""
+    return [value for item_key, value in self.items if item_key == key]
+
+  def get(self, key, default=None):
+    """Returns the last value for key, or default if there is none."""
+    values = self.getall(key)
+    if values:
+      return values[-1]
+    return default
+
+  def __getitem__(self, key):
+    values = self.getall(key)
+    if not values:
+      raise KeyError(key)
+    return values[-1]
+
+  def __contains__(self, key):
+    return bool(self.getall(key))
+
+class Request:
+  """A request with the query string and form data parsed.  Uploaded files are
+  kept as cgi.FieldStorage objects, which spool large uploads to disk."""
+
+  def __init__(self, environ):
+    self.environ = environ
+    self.method = environ.get('REQUEST_METHOD', 'GET')
+    self.path = environ.get('PATH_INFO', '/')
+    self.GET = MultiDict() # pylint: disable=C0103
+    self.POST = MultiDict() # pylint: disable=C0103
+    for key, value in cgi.parse_qsl(environ.get('QUERY_STRING', ''),
+                                    keep_blank_values=True):
+      self.GET.add(key, value)
+    if self.method == 'POST':
+      # FieldStorage would read the query string again if it were present.
+      post_environ = dict(environ)
+      post_environ['QUERY_STRING'] = ''
+      form = cgi.FieldStorage(fp=environ['wsgi.input'], environ=post_environ,
+                              keep_blank_values=True)
+      for key in form.keys():
+        fields = form[key]
+        if not isinstance(fields, list):
+          fields = [fields]
+        for field in fields:
+          if field.filename is None:
+            self.POST.add(key, field.value)
+          else:
+            self.POST.add(key, field)
+
+  @staticmethod
+  def field_value(value):
+    """Returns the string value of a form field.  For uploads, that is the
+    contents of the file."""
+    if isinstance(value, cgi.FieldStorage):
+      return value.value
+    return value
+
+  def get_all(self, name):
+    """Returns a list of every value for name in the query string and form."""
+    return [Request.field_value(value) for value in
+            self.GET.getall(name) + self.POST.getall(name)]
+
+  def get(self, name, default_value=''):
+    """Returns the first value for name, or default_value if there is none."""
+    values = self.GET.getall(name) + self.POST.getall(name)
+    if not values:
+      return default_value
+    return Request.field_value(values[0])
+
+# Reason phrases for the status codes that WSGIApplication can produce.
+STATUS_MESSAGES = {200 : 'OK', 302 : 'Found', 400 : 'Bad Request',
+                   404 : 'Not Found', 405 : 'Method Not Allowed',
+                   413 : 'Request Entity Too Large',
+                   500 : 'Internal Server Error'}
+
+class Response:
+  """A response whose body is written to out.  Unlike webapp's responses, it
+  can be streamed: flush sends what has been written so far."""
+
+  def __init__(self, start_response=None):
+    self.out = StringIO()
+    self.status = 200
+    self.headers = [('Content-Type', 'text/html; charset=utf-8')]
+    self.start_response = start_response
+    # The WSGI write callable, once the response has started streaming.
+    self.write = None
+
+  def set_status(self, status):
+    """Sets the HTTP status code."""
+    self.status = status
+
+  def get_status_line(self):
+    """Returns the status code and reason phrase."""
+    return '%d %s' % (self.status, STATUS_MESSAGES.get(self.status, ''))
+
+  def get_body(self):
+    """Returns everything written since the last flush, encoded as UTF-8."""
+    body = self.out.getvalue()
+    if isinstance(body, unicode):
+      body = body.encode('utf-8')
+    return body
+
+  def flush(self):
+    """Sends everything written so far to the client.  The first flush sends
+    the status and headers, so they can't be changed afterwards.  Does nothing
+    if the response can't be streamed."""
+    if self.start_response is None:
+      return
+    if self.write is None:
+      self.write = self.start_response(self.get_status_line(),
+                                       list(self.headers))
+    self.write(self.get_body())
+    self.out = StringIO()
+
+class RequestHandler(object):
+  """Handles a request.  Subclasses define get and post methods."""
+
+  def __init__(self):
+    self.request = None
+    self.response = None
+
+  def initialize(self, request, response):
+    """Sets the request and response before get or post is called."""
+    self.request = request
+    self.response = response
+
+  def error(self, status):
+    """Clears the response and sets an error status."""
+    self.response.out = StringIO()
+    self.response.set_status(status)
+
+class WSGIApplication:
+  """A WSGI application that dispatches each request to the handler class
+  whose regular expression matches the whole path."""
+
+  def __init__(self, url_mapping, debug=False):
+    self.debug = debug
+    self.url_mapping = [(re.compile('^' + pattern + '$'), handler_class)
+                        for pattern, handler_class in url_mapping]
+
+  def get_handler_class(self, path):
+    """Returns the handler class for path, or None if there isn't one."""
+    for regex, handler_class in self.url_mapping:
+      if regex.match(path):
+        return handler_class
+    return None
+
+  def __call__(self, environ, start_response):
+    request = Request(environ)
+    response = Response(start_response)
+    handler_class = self.get_handler_class(request.path)
+    if handler_class is None:
+      response.set_status(404)
+    else:
+      handler = handler_class()
+      handler.initialize(request, response)
+      method = getattr(handler, request.method.lower(), None)
+      if method is None:
+        handler.error(405)
+      else:
+        try:
+          method()
+        except Exception: # pylint: disable=W0703
+          handler.error(500)
+          error_text = traceback.format_exc()
+          environ.get('wsgi.errors', sys.stderr).write(error_text)
+          if self.debug:
+            response.out.write('<pre>' + cgi.escape(error_text) + '</pre>')
+    body = response.get_body()
+    if response.write is None:
+      headers = list(response.headers)
+      headers.append(('Content-Length', str(len(body))))
+      start_response(response.get_status_line(), headers)
+    return [body]
+
+def run_wsgi_app(application):
+  """Runs application as a CGI script, like webapp.util.run_wsgi_app."""
+  CGIHandler().run(application)
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Serves pfif_tools over HTTP without App Engine.
+
+The same routes as app.yaml are served: the static pages and every route in
+controller.ROUTES.  Requests are handled by a fixed pool of threads in each of
+one or more processes that share the listening socket, so the server can be
+benchmarked locally or run behind a load balancer.  Processes only share
+background jobs through a sqlite file, so serving from more than one process
+needs a job database.  Connections are kept alive
+between requests (HTTP/1.1) unless keep-alive is turned off, and requests with
+bodies larger than a configurable limit are rejected without being read."""
+
+import mimetypes
+import optparse
+import os
+import Queue
+import signal
+import socket
+import sys
+import threading
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler
+import controller
+import webapp_compat
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# A map from path to the static file served for it, as in app.yaml.
+STATIC_FILES = {'/' : 'static/index.html',
+                '/validate' : 'static/validator.html',
+                '/diff' : 'static/diff.html'}
+STATIC_DIR_URL = '/static/'
+STATIC_DIR = 'static'
+
+class StaticFileApplication:
+  """A WSGI application that serves the static files in app.yaml and passes
+  every other request on to application."""
+
+  def __init__(self, application):
+    self.application = application
+
+  @staticmethod
+  def get_static_path(path):
+    """Returns the path of the static file for the URL path, or None if the URL
+    path is not a static file."""
+    if path in STATIC_FILES:
+      return os.path.join(APP_DIR, STATIC_FILES[path])
+    if path.startswith(STATIC_DIR_URL):
+      static_dir = os.path.join(APP_DIR, STATIC_DIR)
+      file_path = os.path.normpath(
+          os.path.join(static_dir, path[len(STATIC_DIR_URL):]))
+      # Don't serve anything outside of the static directory.
+      if file_path.startswith(static_dir + os.sep) and os.path.isfile(
+          file_path):
+        return file_path
+    return None
+
+  def __call__(self, environ, start_response):
+    static_path = StaticFileApplication.get_static_path(
+        environ.get('PATH_INFO', '/'))
+    if static_path is None:
+      return self.application(environ, start_response)
+    static_file = open(static_path, 'rb')
+    try:
+      body = static_file.read()
+    finally:
+      static_file.close()
+    content_type = mimetypes.guess_type(static_path)[0] or 'text/plain'
+    start_response('200 OK', [('Content-Type', content_type),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+def make_application():
+  """Returns the WSGI application for every pfif_tools route."""
+  return StaticFileApplication(
+      webapp_compat.WSGIApplication(controller.ROUTES, debug=False))
+
+class RequestBody:
+  """The body of a request.  Reads stop at the end of the body so that the
+  next request on a kept-alive connection is never read by mistake."""
+
+  def __init__(self, source, length):
+    self.source = source
+    self.remaining = length
+
+  def read(self, size=-1):
+    """Reads up to size bytes, or the rest of the body if size is negative."""
+    if size < 0 or size > self.remaining:
+      size = self.remaining
+    data = self.source.read(size)
+    self.remaining -= len(data)
+    return data
+
+  def readline(self, size=-1):
+    """Reads one line of at most size bytes."""
+    if size < 0 or size > self.remaining:
+      size = self.remaining
+    data = self.source.readline(size)
+    self.remaining -= len(data)
+    return data
+
+  def __iter__(self):
+    line = self.readline()
+    while line:
+      yield line
+      line = self.readline()
+
+  def discard_unread(self):
+    """Reads the rest of the body so that the connection can be reused."""
+    while self.remaining > 0 and self.read(64 * 1024):
+      pass
+
+class KeepAliveServerHandler(ServerHandler):
+  """A ServerHandler that speaks HTTP/1.1.  Streamed responses, which have no
+  Content-Length, are sent with chunked encoding to HTTP/1.1 clients so that
+  the connection can still be kept alive."""
+
+  http_version = '1.1'
+  chunked = False
+  # Whether the client can tell where the response ended.
+  is_delimited = False
+
+  def cleanup_headers(self):
+    ServerHandler.cleanup_headers(self)
+    if 'Content-Length' in self.headers:
+      self.is_delimited = True
+    elif self.environ.get('SERVER_PROTOCOL') == 'HTTP/1.1':
+      self.headers['Transfer-Encoding'] = 'chunked'
+      self.chunked = True
+      self.is_delimited = True
+
+  def write(self, data):
+    if not self.headers_sent:
+      self.bytes_sent = len(data)
+      self.send_headers()
+    else:
+      self.bytes_sent += len(data)
+    if not self.chunked:
+      self._write(data)
+    elif data:
+      self._write('%x\r\n%s\r\n' % (len(data), data))
+    self._flush()
+
+  def finish_content(self):
+    ServerHandler.finish_content(self)
+    if self.chunked:
+      self._write('0\r\n\r\n')
+      self._flush()
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+  """Handles every request on a connection until the client closes it, a
+  response can't be delimited, or the connection is idle for longer than the
+  server's keep_alive_timeout."""
+
+  protocol_version = 'HTTP/1.1'
+
+  def setup(self):
+    # StreamRequestHandler applies self.timeout to the connection.
+    self.timeout = self.server.keep_alive_timeout or None
+    WSGIRequestHandler.setup(self)
+
+  def handle(self):
+    self.close_connection = 1
+    try:
+      self.handle_one_request()
+      while not self.close_connection:
+        self.handle_one_request()
+    except socket.error:
+      # The connection timed out or the client went away.
+      self.close_connection = 1
+
+  def handle_one_request(self):
+    """Handles a single request on the connection."""
+    self.raw_requestline = self.rfile.readline(65537)
+    if not self.raw_requestline or len(self.raw_requestline) > 65536:
+      self.close_connection = 1
+      return
+    if not self.parse_request():
+      return
+    if not self.server.keep_alive_timeout:
+      self.close_connection = 1
+    if self.headers.getheader('Transfer-Encoding') is not None:
+      # Bodies are only framed by Content-Length.  A chunked body would
+      # otherwise be read as the next request on the connection, and with a
+      # Content-Length as well, a proxy in front would frame the body by the
+      # Transfer-Encoding instead (RFC 7230 3.3.3), so the two would disagree
+      # about where the next request starts.
+      self.send_error(411, 'Request bodies must have a Content-Length and no '
+                      'Transfer-Encoding.')
+      self.close_connection = 1
+      return
+    try:
+      content_length = int(self.headers.getheader('Content-Length') or 0)
+    except ValueError:
+      self.send_error(400, 'Bad Content-Length')
+      self.close_connection = 1
+      return
+    if (self.server.max_body_bytes is not None and
+        content_length > self.server.max_body_bytes):
+      self.send_error(413, 'The request body is larger than the limit of ' +
+                      str(self.server.max_body_bytes) + ' bytes.')
+      self.close_connection = 1
+      return
+    body = RequestBody(self.rfile, content_length)
+    environ = self.get_environ()
+    handler = KeepAliveServerHandler(body, self.wfile, self.get_stderr(),
+                                     environ)
+    handler.request_handler = self
+    handler.run(self.server.get_app())
+    body.discard_unread()
+    if not handler.is_delimited:
+      self.close_connection = 1
+
+  def log_message(self, log_format, *args):
+    if self.server.log_requests:
+      WSGIRequestHandler.log_message(self, log_format, *args)
+
+class PooledWSGIServer(WSGIServer):
+  """A WSGIServer that handles connections on a fixed pool of threads rather
+  than one at a time.  Connections wait in a queue for a free thread."""
+
+  # Allow a long queue of connections so that bursts are not refused.
+  request_queue_size = 128
+
+  def __init__(self, server_address, num_threads=8, max_body_bytes=None,
+               keep_alive_timeout=15, log_requests=False):
+    WSGIServer.__init__(self, server_address, KeepAliveRequestHandler)
+    self.max_body_bytes = max_body_bytes
+    self.keep_alive_timeout = keep_alive_timeout
+    self.log_requests = log_requests
+    self.num_threads = num_threads
+    self.connections = None
+
+  def serve_forever(self, poll_interval=0.5):
+    # Threads don't survive a fork, so each process starts its own workers.
+    self.connections = Queue.Queue()
+    for _ in range(self.num_threads):
+      worker = threading.Thread(target=self.work, args=(self.connections,))
+      worker.setDaemon(True)
+      worker.start()
+    WSGIServer.serve_forever(self, poll_interval)
+
+  def process_request(self, request, client_address):
+    self.connections.put((request, client_address))
+
+  def work(self, connections):
+    """Handles connections from the queue forever."""
+    while True:
+      request, client_address = connections.get()
+      try:
+        self.finish_request(request, client_address)
+      except Exception: # pylint: disable=W0703
+        self.handle_error(request, client_address)
+      self.shutdown_request(request)
+
+def make_server(host='', port=8080, num_threads=8,
+                max_body_bytes=64 * 1024 * 1024, keep_alive_timeout=15,
+                log_requests=False, job_db_path=None):
+  """Returns a PooledWSGIServer serving every pfif_tools route.  A
+  keep_alive_timeout of 0 turns off keep-alive.  Background jobs are stored in
+  the sqlite database at job_db_path, or in memory if it is None."""
+  if job_db_path is not None:
+    controller.set_job_db_path(job_db_path)
+  server = PooledWSGIServer((host, port), num_threads=num_threads,
+                            max_body_bytes=max_body_bytes,
+                            keep_alive_timeout=keep_alive_timeout,
+                            log_requests=log_requests)
+  server.set_app(make_application())
+  return server
+
+def serve(server, num_processes=1):
+  """Serves forever from num_processes processes that share the server's
+  listening socket.  More than one process needs a job database file."""
+  assert (num_processes == 1 or
+          controller.get_job_db_path() != controller.IN_MEMORY_JOB_DB), (
+              'Serving from more than one process needs a job database, or a '
+              'job could be polled on a process that does not know it.')
+  children = []
+  # Exit normally on SIGTERM so that the children are stopped too.
+  signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+  for _ in range(num_processes - 1):
+    pid = os.fork()
+    if pid == 0:
+      signal.signal(signal.SIGTERM, signal.SIG_DFL)
+      server.serve_forever()
+      os._exit(0) # pylint: disable=W0212
+    children.append(pid)
+  try:
+    server.serve_forever()
+  finally:
+    for pid in children:
+      os.kill(pid, signal.SIGTERM)
+
+def main():
+  """Starts the server."""
+  parser = optparse.OptionParser(usage='usage: %prog [options]')
+  parser.add_option('--host', default='',
+                    help='The address to listen on.  Defaults to all.')
+  parser.add_option('--port', type='int', default=8080)
+  parser.add_option('--processes', type='int', default=1,
+                    help='The number of processes to serve from.')
+  parser.add_option('--threads', type='int', default=8,
+                    help='The number of requests that each process handles at '
+                    'once.')
+  parser.add_option('--max-body-bytes', type='int', default=64 * 1024 * 1024,
+                    help='Requests with larger bodies are rejected.')
+  parser.add_option('--keep-alive-timeout', type='float', default=15,
+                    help='Seconds that an idle connection is kept open.  Use '
+                    '0 to close every connection after one request.')
+  parser.add_option('--log-requests', action='store_true', default=False)
+  parser.add_option('--job-db', metavar='PATH',
+                    help='The sqlite file that background jobs are stored '
+                    'in.  Required with more than one process.  Defaults to '
+                    'memory.')
+  (options, _) = parser.parse_args()
+  if options.processes > 1 and not options.job_db:
+    parser.error('--processes above 1 needs --job-db, so that every process '
+                 'sees the same jobs.')
+
+  server = make_server(options.host, options.port, num_threads=options.threads,
+                       max_body_bytes=options.max_body_bytes,
+                       keep_alive_timeout=options.keep_alive_timeout,
+                       log_requests=options.log_requests,
+                       job_db_path=options.job_db)
+  print 'Serving pfif_tools on port %d' % server.server_port
+  serve(server, num_processes=options.processes)
+
+if __name__ == '__main__':
+  main()
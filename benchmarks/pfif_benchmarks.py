@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks parsing, validating, diffing, and rendering PFIF XML.
+
+Feeds of each size are generated by pfif_generator.py.  Each benchmark runs in
+its own process so that its peak memory can be measured, and is repeated to
+keep the fastest time.  Results are printed and can be written as JSON, and
+two JSON files can be compared to find regressions.
+
+Instead of running this script directly, use the 'benchmarks' shell script in
+tools/, which sets up the PYTHONPATH."""
+
+import json
+import multiprocessing
+import optparse
+import os
+import platform
+import Queue
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import pfif_cache
+import pfif_diff
+import pfif_generator
+import pfif_parallel
+import pfif_validator
+import utils
+
+DEFAULT_SIZES = [1000, 10000]
+DEFAULT_CHANGE_RATIOS = [0.0, 0.01, 0.1, 0.5]
+# How often run_in_process checks that the benchmark process is still alive.
+RESULTS_POLL_SECONDS = 1
+
+# The options used to generate every feed.  Errors are injected so that there
+# are messages to render.
+FEED_OPTIONS = {'notes_per_person' : 2.0, 'top_level_note_ratio' : 0.25,
+                'error_rate' : 0.02, 'link_rate' : 0.1, 'expired_rate' : 0.05}
+
+class Feed:
+  """A generated feed on disk."""
+
+  def __init__(self, path, num_persons, num_records):
+    self.path = path
+    self.num_persons = num_persons
+    self.num_records = num_records
+    self.num_bytes = os.path.getsize(path)
+
+def generate_feed(feed_dir, num_persons, seed=0):
+  """Writes a feed with num_persons persons to feed_dir.  Returns a Feed."""
+  path = os.path.join(feed_dir, 'feed-%d-%d.xml' % (num_persons, seed))
+  generator = pfif_generator.FeedGenerator(num_persons, seed=seed,
+                                           **FEED_OPTIONS)
+  output = open(path, 'w')
+  try:
+    generator.write_feed(output)
+  finally:
+    output.close()
+  return Feed(path, num_persons, generator.record_count)
+
+def change_feed(feed, change_ratio, path, seed=0):
+  """Writes a copy of feed to path in which change_ratio of the records have
+  a changed author_name.  Returns a Feed."""
+  rng = random.Random(seed)
+  source = open(feed.path)
+  output = open(path, 'w')
+  try:
+    is_changed = False
+    for line in source:
+      stripped = line.strip()
+      if stripped in ('<pfif:person>', '<pfif:note>'):
+        is_changed = rng.random() < change_ratio
+      elif is_changed and stripped.startswith('<pfif:author_name>'):
+        line = line.replace('</pfif:author_name>',
+                            ' (changed)</pfif:author_name>')
+      output.write(line)
+  finally:
+    source.close()
+    output.close()
+  return Feed(path, feed.num_persons, feed.num_records)
+
+def make_result(name, seconds, feed=None, **extra):
+  """Returns a dict with the time and throughput of one benchmark."""
+  result = {'name' : name, 'seconds' : seconds}
+  if feed is not None:
+    result['records'] = feed.num_records
+    result['bytes'] = feed.num_bytes
+    if seconds:
+      result['records_per_second'] = feed.num_records / seconds
+      result['mb_per_second'] = feed.num_bytes / seconds / 1e6
+  result.update(extra)
+  return result
+
+def time_function(function, repeat, setup=None):
+  """Calls function repeat times.  If setup is given, it is called (untimed)
+  before each call, and function is called with what it returns, so that no
+  call is sped up by what an earlier one cached.  Returns a tuple (fastest time
+  in seconds, return value of the last call)."""
+  best = None
+  value = None
+  for _ in range(repeat):
+    args = ()
+    if setup:
+      args = (setup(),)
+    start = time.time()
+    value = function(*args)
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return (best, value)
+
+def benchmark_parse(feed, repeat):
+  """Times building a PfifXmlTree with the default parser and with each parser
+  that is installed, building one in parallel (on every CPU) with
+  pfif_parallel, reading the records with iter_records with each parser, and
+  loading the feed from a pfif_cache.ParsedFeedCache (which includes
+  hashing the file), with and without building its tree.  Returns a list of
+  results."""
+  results = []
+  for parser in [None] + utils.get_available_parsers():
+    def parse(parser=parser):
+      """Parses the feed."""
+      xml_file = open(feed.path)
+      try:
+        return utils.PfifXmlTree(xml_file, parser=parser)
+      finally:
+        xml_file.close()
+    seconds, _ = time_function(parse, repeat)
+    name = 'parse/%d' % feed.num_persons
+    if parser:
+      name += '/' + parser
+    results.append(make_result(name, seconds, feed))
+  seconds, _ = time_function(
+      lambda: pfif_parallel.ParallelPfifXmlTree(feed.path), repeat)
+  results.append(make_result('parse-parallel/%d' % feed.num_persons, seconds,
+                             feed))
+  for parser in utils.get_available_parsers():
+    def stream(parser=parser):
+      """Reads every record of the feed with iter_records."""
+      xml_file = open(feed.path)
+      try:
+        for _ in utils.iter_records(xml_file, parser=parser):
+          pass
+      finally:
+        xml_file.close()
+    seconds, _ = time_function(stream, repeat)
+    results.append(make_result('stream/%d/%s' % (feed.num_persons, parser),
+                               seconds, feed))
+  cache = pfif_cache.ParsedFeedCache(feed.path + '.cache')
+  cache.load(feed.path).close()
+  def load_cached(build_tree):
+    """Loads the parsed feed, and builds its tree if build_tree."""
+    parsed_feed = cache.load(feed.path)
+    if build_tree:
+      parsed_feed.get_tree().getroot()
+    parsed_feed.close()
+  for name, build_tree in [('load-parsed', False), ('load-parsed-tree', True)]:
+    seconds, _ = time_function(lambda build_tree=build_tree: load_cached(
+        build_tree), repeat)
+    results.append(make_result('%s/%d' % (name, feed.num_persons), seconds,
+                               feed))
+  shutil.rmtree(cache.cache_dir)
+  return results
+
+def benchmark_validate(feed, repeat):
+  """Times run_validations and each validation method.  Returns a list of
+  results, the first of which is for every validation together.  Each run
+  uses a new validator, so that none of them reuses the caches of another."""
+  def make_validator():
+    """Parses the feed."""
+    return pfif_validator.PfifValidator(open(feed.path))
+  seconds, messages = time_function(
+      lambda validator: validator.run_validations(), repeat,
+      setup=make_validator)
+  results = [make_result('validate/%d' % feed.num_persons, seconds, feed,
+                         messages=len(messages))]
+  for name, _ in make_validator().get_validation_methods():
+    def validate(validator, name=name):
+      """Runs one validation."""
+      return dict(validator.get_validation_methods())[name]()
+    seconds, messages = time_function(validate, repeat, setup=make_validator)
+    results.append(make_result('validate/%d/%s' % (feed.num_persons, name),
+                               seconds, feed, messages=len(messages)))
+  return results
+
+def benchmark_diff(feed, repeat, change_ratios):
+  """Times pfif_file_diff against copies of feed with change_ratio of the
+  records changed.  Returns a list of results."""
+  results = []
+  for change_ratio in change_ratios:
+    changed_feed = change_feed(feed, change_ratio,
+                               feed.path + '.changed-%s' % change_ratio)
+    def diff():
+      """Diffs the feed against the changed copy."""
+      return pfif_diff.pfif_file_diff(open(feed.path),
+                                      open(changed_feed.path))
+    seconds, messages = time_function(diff, repeat)
+    os.remove(changed_feed.path)
+    # Both feeds are read, so the throughput counts both.
+    changed_feed.num_records += feed.num_records
+    changed_feed.num_bytes += feed.num_bytes
+    results.append(make_result(
+        'diff/%d/%s' % (feed.num_persons, change_ratio), seconds,
+        changed_feed, messages=len(messages)))
+  return results
+
+def benchmark_render(feed, repeat):
+  """Times rendering the validation messages for feed as text and HTML, with
+  and without truncation.  Returns a list of results.  The messages are made
+  again before each run, since their fields are only looked up the first time
+  that they are rendered."""
+  validator = pfif_validator.PfifValidator(open(feed.path))
+  messages = validator.run_validations()
+  results = []
+  for is_html in [False, True]:
+    for truncate in [True, False]:
+      def render(fresh_messages, is_html=is_html, truncate=truncate):
+        """Renders every message."""
+        return validator.validator_messages_to_str(
+            fresh_messages, is_html=is_html, truncate=truncate)
+      seconds, output = time_function(render, repeat,
+                                      setup=validator.run_validations)
+      name = 'render/%d/%s%s' % (feed.num_persons, is_html and 'html' or 'text',
+                                 truncate and '-truncated' or '')
+      result = make_result(name, seconds, messages=len(messages),
+                           output_bytes=len(output))
+      if seconds:
+        result['messages_per_second'] = len(messages) / seconds
+      results.append(result)
+  return results
+
+def run_in_process(function, *args):
+  """Runs function in a new process and returns its list of results, with the
+  peak memory of the process added to each result.  Raises a RuntimeError if
+  function raises or if the process exits without any results."""
+  results_queue = multiprocessing.Queue()
+  def run():
+    """Runs the benchmark and reports the results and peak memory, or the
+    traceback if it failed."""
+    try:
+      results = function(*args)
+      # ru_maxrss is in kilobytes on Linux and bytes on Mac OS.
+      peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+      if sys.platform == 'darwin':
+        peak_memory /= 1024
+      for result in results:
+        result['peak_memory_kb'] = peak_memory
+      results_queue.put((None, results))
+    except Exception: # pylint: disable=W0703
+      results_queue.put((traceback.format_exc(), None))
+  process = multiprocessing.Process(target=run)
+  process.start()
+  while True:
+    try:
+      error, results = results_queue.get(timeout=RESULTS_POLL_SECONDS)
+      break
+    except Queue.Empty:
+      if not process.is_alive():
+        # The results may have been sent just before the process exited.
+        try:
+          error, results = results_queue.get(timeout=RESULTS_POLL_SECONDS)
+          break
+        except Queue.Empty:
+          raise RuntimeError('The benchmark process exited with code %s '
+                             'without any results.' % process.exitcode)
+  process.join()
+  if error:
+    raise RuntimeError('The benchmark process failed:\n' + error)
+  return results
+
+def run_benchmarks(sizes, change_ratios, repeat, benchmarks=None):
+  """Runs every benchmark in benchmarks (defaulting to all of them) on feeds of
+  each size, which is a number of persons.  Returns a dict with information
+  about the run and a list of results."""
+  benchmarks = benchmarks or ['parse', 'validate', 'diff', 'render']
+  feed_dir = tempfile.mkdtemp()
+  results = []
+  try:
+    for size in sizes:
+      feed = generate_feed(feed_dir, size)
+      if 'parse' in benchmarks:
+        results.extend(run_in_process(benchmark_parse, feed, repeat))
+      if 'validate' in benchmarks:
+        results.extend(run_in_process(benchmark_validate, feed, repeat))
+      if 'diff' in benchmarks:
+        results.extend(run_in_process(benchmark_diff, feed, repeat,
+                                      change_ratios))
+      if 'render' in benchmarks:
+        results.extend(run_in_process(benchmark_render, feed, repeat))
+  finally:
+    shutil.rmtree(feed_dir)
+  return {'time' : time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+          'python' : platform.python_version(),
+          'platform' : platform.platform(),
+          'repeat' : repeat,
+          'results' : results}
+
+def results_to_str(run):
+  """Returns a table of the results of a run."""
+  output = utils.MessagesOutput(is_html=False)
+  output.start_table(['Benchmark', 'Seconds', 'Records/s', 'MB/s',
+                      'Peak Memory (KB)'])
+  for result in run['results']:
+    row = [result['name'], '%.4f' % result['seconds']]
+    for field, field_format in [('records_per_second', '%.0f'),
+                                ('mb_per_second', '%.2f'),
+                                ('peak_memory_kb', '%d')]:
+      if field in result:
+        row.append(field_format % result[field])
+      else:
+        row.append('')
+    output.make_table_row(row)
+  output.end_table()
+  return output.get_output()
+
+def compare_runs(old_run, new_run, threshold=0.1):
+  """Compares the times of the benchmarks in both runs.  Returns a list of
+  (name, old seconds, new seconds, is_regression) tuples, where a regression
+  is a benchmark that got more than threshold (a fraction) slower."""
+  old_seconds = dict((result['name'], result['seconds'])
+                     for result in old_run['results'])
+  comparisons = []
+  for result in new_run['results']:
+    name = result['name']
+    if name in old_seconds:
+      old = old_seconds[name]
+      new = result['seconds']
+      comparisons.append((name, old, new, new > old * (1 + threshold)))
+  return comparisons
+
+def comparisons_to_str(comparisons):
+  """Returns a table of comparisons from compare_runs."""
+  output = utils.MessagesOutput(is_html=False)
+  output.start_table(['Benchmark', 'Old Seconds', 'New Seconds', 'Change', ''])
+  for name, old, new, is_regression in comparisons:
+    if old:
+      change = '%+.1f%%' % ((new - old) / old * 100)
+    else:
+      change = ''
+    output.make_table_row([name, '%.4f' % old, '%.4f' % new, change,
+                           is_regression and 'REGRESSION' or ''])
+  output.end_table()
+  return output.get_output()
+
+def main():
+  """Runs the benchmarks or compares two runs."""
+  parser = optparse.OptionParser(
+      usage='usage: %prog [options]\n       %prog --compare old.json new.json')
+  parser.add_option('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                    help='Comma-separated numbers of persons in each feed.')
+  parser.add_option('--change-ratios',
+                    default=','.join(map(str, DEFAULT_CHANGE_RATIOS)),
+                    help='Comma-separated fractions of records to change for '
+                    'the diff benchmarks.')
+  parser.add_option('--benchmark', action='append', dest='benchmarks',
+                    choices=['parse', 'validate', 'diff', 'render'],
+                    help='Only run this benchmark.  Use this flag multiple '
+                    'times to run several.')
+  parser.add_option('--repeat', type='int', default=3,
+                    help='Each benchmark is run this many times, and the '
+                    'fastest time is kept.')
+  parser.add_option('--output', help='Writes the results to this JSON file.')
+  parser.add_option('--compare', action='store_true', default=False,
+                    help='Compares two JSON files of results instead of '
+                    'running the benchmarks.')
+  parser.add_option('--threshold', type='float', default=0.1,
+                    help='When comparing, benchmarks that are this fraction '
+                    'slower are regressions.')
+  (options, args) = parser.parse_args()
+
+  if options.compare:
+    assert len(args) == 2, 'Must provide two JSON files to compare.'
+    old_run = json.load(open(args[0]))
+    new_run = json.load(open(args[1]))
+    comparisons = compare_runs(old_run, new_run, options.threshold)
+    print comparisons_to_str(comparisons)
+    regressions = [comparison for comparison in comparisons if comparison[3]]
+    if regressions:
+      print '%d regressions.' % len(regressions)
+      sys.exit(1)
+    return
+
+  sizes = [int(size) for size in options.sizes.split(',')]
+  change_ratios = [float(ratio) for ratio in options.change_ratios.split(',')]
+  run = run_benchmarks(sizes, change_ratios, options.repeat,
+                       benchmarks=options.benchmarks)
+  print results_to_str(run)
+  if options.output:
+    output = open(options.output, 'w')
+    try:
+      json.dump(run, output, indent=2, sort_keys=True)
+    finally:
+      output.close()
+
+if __name__ == '__main__':
+  main()
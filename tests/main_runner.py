@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs the main of a tool that reads feeds and writes one, for use with
+tests."""
+
+import os
+import shutil
+import sys
+import tempfile
+from StringIO import StringIO
+
+def run_main(main, argv, input_xmls):
+  """Writes each of input_xmls to a file in a temporary directory and runs
+  main with sys.argv set to argv, followed by the paths of the files and of
+  an output file.  Returns a tuple of what main printed and what it wrote to
+  the output file."""
+  temp_dir = tempfile.mkdtemp()
+  old_argv = sys.argv
+  old_stdout = sys.stdout
+  try:
+    input_paths = []
+    for number, xml in enumerate(input_xmls):
+      input_paths.append(os.path.join(temp_dir, 'feed%d.xml' % number))
+      input_file = open(input_paths[-1], 'w')
+      input_file.write(xml)
+      input_file.close()
+    output_path = os.path.join(temp_dir, 'output.xml')
+    sys.argv = argv + input_paths + [output_path]
+    sys.stdout = StringIO('')
+    main()
+    output = sys.stdout.getvalue()
+    output_file = open(output_path)
+    output_xml = output_file.read()
+    output_file.close()
+  finally:
+    sys.stdout = old_stdout
+    sys.argv = old_argv
+    shutil.rmtree(temp_dir)
+  return output, output_xml
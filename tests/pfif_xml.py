@@ -945,3 +945,66 @@ XML_ADDED_DELETED_CHANGED_2 = """<?xml version="1.0" encoding="UTF-8"?>
     <pfif:note_record_id>example.org/person2</pfif:note_record_id>
   </pfif:note>
 </pfif:pfif>"""
+
+XML_ATOM_12 = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:pfif="http://zesty.ca/pfif/1.2">
+  <id>http://example.org/feeds/person</id>
+  <title>Person Feed</title>
+  <updated>2011-01-01T00:00:00Z</updated>
+  <entry>
+    <pfif:person>
+      <pfif:person_record_id>example.org/person</pfif:person_record_id>
+      <pfif:first_name>Jane</pfif:first_name>
+      <pfif:note>
+        <pfif:note_record_id>example.org/note1</pfif:note_record_id>
+        <pfif:text>Found</pfif:text>
+      </pfif:note>
+    </pfif:person>
+    <id>pfif:example.org/person</id>
+    <title>Jane</title>
+  </entry>
+  <entry>
+    <pfif:note>
+      <pfif:note_record_id>example.org/note2</pfif:note_record_id>
+      <pfif:person_record_id>example.org/person</pfif:person_record_id>
+    </pfif:note>
+    <id>pfif:example.org/note2</id>
+  </entry>
+</feed>"""
+
+XML_ATOM_12_UNWRAPPED = """<?xml version="1.0" encoding="UTF-8"?>
+<pfif:pfif xmlns:pfif="http://zesty.ca/pfif/1.2">
+  <pfif:person>
+    <pfif:person_record_id>example.org/person</pfif:person_record_id>
+    <pfif:first_name>Jane</pfif:first_name>
+    <pfif:note>
+      <pfif:note_record_id>example.org/note1</pfif:note_record_id>
+      <pfif:text>Found</pfif:text>
+    </pfif:note>
+  </pfif:person>
+  <pfif:note>
+    <pfif:note_record_id>example.org/note2</pfif:note_record_id>
+    <pfif:person_record_id>example.org/person</pfif:person_record_id>
+  </pfif:note>
+</pfif:pfif>"""
+
+XML_ATOM_DEFAULT_NAMESPACE_13 = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <entry>
+    <person xmlns="http://zesty.ca/pfif/1.3">
+      <person_record_id>example.org/person</person_record_id>
+    </person>
+  </entry>
+</feed>"""
+
+XML_ATOM_NO_ENTRIES_13 = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"
+      xmlns:pfif="http://zesty.ca/pfif/1.3">
+  <title>Empty Feed</title>
+</feed>"""
+
+XML_ATOM_NO_PFIF = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <entry><title>Not PFIF</title></entry>
+</feed>"""
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for pfif_batch_validator.py"""
+
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+from StringIO import StringIO
+import tests.pfif_xml as PfifXml
+import pfif_batch_validator
+
+class BatchValidatorTests(unittest.TestCase):
+  """Defines tests for pfif_batch_validator.py"""
+
+  FEEDS = {'duplicate.xml' : PfifXml.XML_TWO_DUPLICATE_NO_CHILD,
+           'full.xml' : PfifXml.XML_11_FULL,
+           'invalid.xml' : PfifXml.XML_INVALID}
+
+  def setUp(self): # pylint: disable=C0103
+    """Writes each of the feeds in FEEDS to a temporary directory."""
+    self.feed_dir = tempfile.mkdtemp()
+    for filename, xml in BatchValidatorTests.FEEDS.items():
+      feed_file = open(os.path.join(self.feed_dir, filename), 'w')
+      feed_file.write(xml)
+      feed_file.close()
+
+  def tearDown(self): # pylint: disable=C0103
+    """Removes the temporary directory."""
+    shutil.rmtree(self.feed_dir)
+
+  def feed_path(self, filename):
+    """Returns the path to one of the feeds in FEEDS."""
+    return os.path.join(self.feed_dir, filename)
+
+  def test_find_feeds(self):
+    """find_feeds should expand directories and globs and read manifests."""
+    all_feeds = sorted([self.feed_path(filename) for filename in
+                        BatchValidatorTests.FEEDS])
+    self.assertEqual(pfif_batch_validator.find_feeds([self.feed_dir]),
+                     all_feeds)
+    self.assertEqual(pfif_batch_validator.find_feeds(
+        [self.feed_path('d*.xml')]), [self.feed_path('duplicate.xml')])
+
+    manifest = self.feed_path('manifest.txt')
+    manifest_file = open(manifest, 'w')
+    manifest_file.write('# a comment\n' + self.feed_path('full.xml') +
+                        '\n\nhttp://example.org/feed.xml\n')
+    manifest_file.close()
+    self.assertEqual(pfif_batch_validator.find_feeds([], manifest=manifest),
+                     [self.feed_path('full.xml'),
+                      'http://example.org/feed.xml'])
+
+  def test_validate_feeds(self):
+    """validate_feeds should return one result per feed in order, with the same
+    results from processes and threads, and should record invalid feeds as
+    failures."""
+    feeds = pfif_batch_validator.find_feeds([self.feed_dir])
+    for use_processes in [True, False]:
+      results = pfif_batch_validator.validate_feeds(
+          feeds, num_workers=2, use_processes=use_processes)
+      self.assertEqual([result.source for result in results], feeds)
+      results = dict([(os.path.basename(result.source), result)
+                      for result in results])
+      self.assertEqual(results['duplicate.xml'].error_count, 3)
+      self.assertEqual(results['duplicate.xml'].failure, None)
+      self.assertEqual(results['full.xml'].failure, None)
+      self.assertTrue(results['invalid.xml'].failure)
+    self.assertEqual(pfif_batch_validator.validate_feeds([]), [])
+
+  def test_feed_results_to_str(self):
+    """feed_results_to_str should have a row per feed and a row of totals."""
+    results = pfif_batch_validator.validate_feeds(
+        pfif_batch_validator.find_feeds([self.feed_dir]), use_processes=False)
+    output = pfif_batch_validator.feed_results_to_str(results, is_html=True,
+                                                      show_categories=True)
+    self.assertEqual(output.count('<table>'), 2)
+    self.assertTrue('3 feeds' in output)
+    self.assertTrue('1 failed' in output)
+    self.assertTrue('Extraneous Tag.' in output)
+
+  def test_main(self):
+    """main should print a summary of every feed."""
+    old_argv = sys.argv
+    old_stdout = sys.stdout
+    sys.argv = ['pfif_batch_validator.py', '--workers', '2', self.feed_dir]
+    sys.stdout = StringIO()
+    pfif_batch_validator.main()
+    output = sys.stdout.getvalue()
+    sys.stdout = old_stdout
+    sys.argv = old_argv
+    for filename in BatchValidatorTests.FEEDS:
+      self.assertTrue(filename in output)
+
+if __name__ == '__main__':
+  unittest.main()
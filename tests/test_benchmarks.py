@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for benchmarks/pfif_benchmarks.py"""
+
+import unittest
+import shutil
+import tempfile
+import benchmarks.pfif_benchmarks as pfif_benchmarks
+import pfif_diff
+
+def fail_benchmark():
+  """A benchmark that raises."""
+  raise ValueError('benchmark failed')
+
+class BenchmarkTests(unittest.TestCase):
+  """Defines tests for pfif_benchmarks.py"""
+
+  def test_change_feed(self):
+    """change_feed should change about change_ratio of the records."""
+    feed_dir = tempfile.mkdtemp()
+    try:
+      feed = pfif_benchmarks.generate_feed(feed_dir, 100)
+      for change_ratio in [0.0, 0.5]:
+        changed_feed = pfif_benchmarks.change_feed(
+            feed, change_ratio, feed.path + '.changed')
+        messages = pfif_diff.pfif_file_diff(open(feed.path),
+                                            open(changed_feed.path))
+        self.assertTrue(
+            abs(len(messages) - change_ratio * feed.num_records) <=
+            0.1 * feed.num_records)
+        for message in messages:
+          self.assertEqual(message.xml_tag, 'author_name')
+    finally:
+      shutil.rmtree(feed_dir)
+
+  def test_run_benchmarks(self):
+    """Every benchmark should report its time, throughput, and memory."""
+    run = pfif_benchmarks.run_benchmarks([20], [0.1], 1)
+    names = [result['name'] for result in run['results']]
+    self.assertTrue('parse/20' in names)
+    self.assertTrue('validate/20' in names)
+    self.assertTrue('validate/20/fields_have_correct_format' in names)
+    self.assertTrue('diff/20/0.1' in names)
+    self.assertTrue('render/20/html' in names)
+    for result in run['results']:
+      self.assertTrue(result['seconds'] >= 0)
+      self.assertTrue(result['peak_memory_kb'] > 0)
+    parse_result = run['results'][names.index('parse/20')]
+    self.assertTrue(parse_result['records'] > 20)
+    self.assertTrue(parse_result['bytes'] > 0)
+    self.assertTrue('parse/20' in pfif_benchmarks.results_to_str(run))
+
+  def test_run_in_process_failure(self):
+    """A benchmark that raises in its process should raise instead of hanging,
+    with the original error in the message."""
+    try:
+      pfif_benchmarks.run_in_process(fail_benchmark)
+      self.fail('run_in_process should have raised')
+    except RuntimeError, error:
+      self.assertTrue('benchmark failed' in str(error))
+
+  def test_compare_runs(self):
+    """Benchmarks that got slower by more than the threshold should be flagged
+    as regressions."""
+    old_run = {'results' : [{'name' : 'parse/10', 'seconds' : 1.0},
+                            {'name' : 'diff/10/0.1', 'seconds' : 1.0},
+                            {'name' : 'removed', 'seconds' : 1.0}]}
+    new_run = {'results' : [{'name' : 'parse/10', 'seconds' : 1.05},
+                            {'name' : 'diff/10/0.1', 'seconds' : 1.5},
+                            {'name' : 'added', 'seconds' : 1.0}]}
+    comparisons = pfif_benchmarks.compare_runs(old_run, new_run, threshold=0.1)
+    self.assertEqual(comparisons, [('parse/10', 1.0, 1.05, False),
+                                   ('diff/10/0.1', 1.0, 1.5, True)])
+    output = pfif_benchmarks.comparisons_to_str(comparisons)
+    self.assertTrue('+50.0%' in output)
+    self.assertEqual(output.count('REGRESSION'), 1)
+
+if __name__ == '__main__':
+  unittest.main()
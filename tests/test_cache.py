@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for pfif_cache.py"""
+
+import unittest
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+import pfif_cache
+import pfif_diff
+import pfif_generator
+import pfif_validator
+import utils
+import tests.pfif_xml as PfifXml
+
+class CacheTests(unittest.TestCase):
+  """Defines tests for pfif_cache.py"""
+
+  def setUp(self): # pylint: disable=C0103
+    """Makes a directory for the cache and the feeds."""
+    self.temp_dir = tempfile.mkdtemp()
+    self.cache = pfif_cache.ParsedFeedCache(os.path.join(self.temp_dir,
+                                                         'cache'))
+
+  def tearDown(self): # pylint: disable=C0103
+    """Removes the directory."""
+    shutil.rmtree(self.temp_dir)
+
+  def write_feed(self, xml, name='feed.xml'):
+    """Writes xml to a file and returns its path."""
+    path = os.path.join(self.temp_dir, name)
+    feed_file = open(path, 'w')
+    try:
+      feed_file.write(xml)
+    finally:
+      feed_file.close()
+    return path
+
+  @staticmethod
+  def generate():
+    """Returns a feed with errors, links, and top level notes."""
+    generator = pfif_generator.FeedGenerator(
+        30, seed=5, error_rate=0.1, link_rate=0.3, top_level_note_ratio=0.5)
+    output = StringIO()
+    generator.write_feed(output)
+    return output.getvalue()
+
+  def test_same_as_parsing(self):
+    """A reloaded parsed feed should give the same lines, line numbers,
+    messages, and objects as parsing the XML."""
+    for xml in [CacheTests.generate(), PfifXml.XML_UNICODE_12,
+                PfifXml.XML_TOP_LEVEL_NOTE_PERSON_11,
+                PfifXml.XML_ROOT_HAS_BAD_CHILD]:
+      path = self.write_feed(xml)
+      self.cache.load(path).close()
+      parsed_feed = self.cache.load(path)
+      self.assertEqual(parsed_feed.parsed_tree, None)
+      tree = parsed_feed.get_tree()
+      expected_tree = utils.PfifXmlTree(StringIO(xml))
+      self.assertEqual(tree.version, expected_tree.version)
+      self.assertEqual(list(tree.lines), expected_tree.lines)
+      self.assertEqual(
+          [tree.line_numbers[elem] for elem in tree.getroot().getiterator()],
+          [expected_tree.line_numbers[elem]
+           for elem in expected_tree.getroot().getiterator()])
+      messages = pfif_validator.PfifValidator(parsed_feed).run_validations()
+      expected_messages = pfif_validator.PfifValidator(
+          StringIO(xml)).run_validations()
+      self.assertEqual(messages, expected_messages)
+      self.assertEqual(pfif_diff.objectify_pfif_xml(parsed_feed),
+                       pfif_diff.objectify_pfif_xml(StringIO(xml)))
+      parsed_feed.close()
+
+  def test_unicode_lines(self):
+    """Lines that were read as unicode should be unicode again."""
+    xml = PfifXml.XML_UNICODE_12.decode('utf-8')
+    tree = utils.PfifXmlTree(StringIO(xml))
+    path = os.path.join(self.temp_dir, 'parsed')
+    pfif_cache.ParsedFeed.write(tree, path, 'hash')
+    parsed_feed = pfif_cache.ParsedFeed(path)
+    self.assertEqual(list(parsed_feed.lines), tree.lines)
+    self.assertTrue(isinstance(parsed_feed.lines[3], unicode))
+    self.assertEqual(parsed_feed.lines[-1], tree.lines[-1])
+    self.assertRaises(IndexError, parsed_feed.lines.__getitem__,
+                      len(tree.lines))
+    parsed_feed.close()
+
+  def test_keyed_by_content(self):
+    """A file should only be parsed again when its contents change, and a
+    parsed feed in another format should be replaced."""
+    path = self.write_feed(PfifXml.XML_11_FULL)
+    first = self.cache.load(path)
+    self.assertNotEqual(first.parsed_tree, None)
+    self.assertEqual(first.content_hash,
+                     pfif_cache.ParsedFeedCache.hash_file(path))
+    self.assertEqual(self.cache.load(path).path, first.path)
+    self.write_feed(PfifXml.XML_11_SMALL)
+    changed = self.cache.load(path)
+    self.assertNotEqual(changed.path, first.path)
+    self.assertEqual(len(os.listdir(self.cache.cache_dir)), 2)
+
+    corrupt_file = open(changed.path, 'wb')
+    corrupt_file.write('not a parsed feed' * 10)
+    corrupt_file.close()
+    self.assertRaises(ValueError, pfif_cache.ParsedFeed, changed.path)
+    self.assertNotEqual(self.cache.load(path).parsed_tree, None)
+    self.assertEqual(self.cache.load(path).parsed_tree, None)
+
+  def test_get_record(self):
+    """get_record should build one record with its line numbers."""
+    xml = PfifXml.XML_TOP_LEVEL_NOTE_PERSON_11
+    path = self.write_feed(xml)
+    self.cache.load(path)
+    parsed_feed = self.cache.load(path)
+    self.assertEqual(parsed_feed.get_record_count(), 3)
+    person, line_numbers = parsed_feed.get_record(1)
+    self.assertEqual(utils.extract_tag(person.tag), 'person')
+    self.assertEqual([line_numbers[elem] for elem in person.getiterator()],
+                     [4, 5, 6, 7])
+    self.assertEqual(person[1][0].tail, '\n    ')
+    note, line_numbers = parsed_feed.get_record(2)
+    self.assertEqual(line_numbers[note], 10)
+    parsed_feed.close()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for pfif_columns.py"""
+
+import sys
+import unittest
+from StringIO import StringIO
+import pfif_columns
+import pfif_diff
+import pfif_generator
+import pfif_validator
+import utils
+import tests.pfif_xml as PfifXml
+
+class ColumnsTests(unittest.TestCase):
+  """Defines tests for pfif_columns.py"""
+
+  @staticmethod
+  def make_records(xml, **optional_args):
+    """Returns ColumnarRecords of xml."""
+    return pfif_columns.ColumnarRecords(utils.PfifXmlTree(StringIO(xml)),
+                                        **optional_args)
+
+  @staticmethod
+  def to_objects(records):
+    """Returns the map that pfif_diff.objectify_pfif_tree makes of the same
+    records."""
+    objects = {}
+    for table in records.get_tables():
+      for row in xrange(len(table)):
+        objects[pfif_diff.record_id_to_key(
+            table.get_record_id(row), table.record_type == 'person')] = (
+                table.get_record(row))
+    return objects
+
+  @staticmethod
+  def generate():
+    """Returns a feed with errors, links, and top level notes."""
+    generator = pfif_generator.FeedGenerator(
+        40, seed=3, error_rate=0.2, link_rate=0.3, top_level_note_ratio=0.5)
+    output = StringIO()
+    generator.write_feed(output)
+    return output.getvalue()
+
+  def test_string_pool(self):
+    """Each string should have one code, and codes of strings that are the
+    same in lower case should map to the same code."""
+    pool = pfif_columns.StringPool()
+    self.assertEqual(pool.encode('Jane'), 0)
+    self.assertEqual(pool.encode('JANE'), 1)
+    self.assertEqual(pool.encode('Jane'), 0)
+    self.assertEqual(pool.encode(None), pfif_columns.NONE)
+    self.assertEqual(pool.decode(1), 'JANE')
+    self.assertEqual(pool.decode(pfif_columns.NONE), None)
+    lower_codes = pool.get_lower_codes()
+    self.assertEqual(lower_codes[0], lower_codes[1])
+    self.assertEqual(pool.decode(lower_codes[0]), 'jane')
+    self.assertEqual(lower_codes[lower_codes[0]], lower_codes[0])
+    self.assertEqual(lower_codes[pfif_columns.NONE], pfif_columns.NONE)
+
+  def test_set_fields(self):
+    """set_fields should store the same codes as set_field."""
+    pool = pfif_columns.StringPool()
+    table = pfif_columns.RecordTable('person', pool)
+    table.set_field(table.get_row('a'), 'full_name', 'Jane')
+    table.set_fields(table.get_row('b'), [('full_name', 'Jane'),
+                                          ('sex', 'female')])
+    self.assertEqual(list(table.columns['full_name']), [1, 1])
+    self.assertEqual(list(table.columns['sex']), [pfif_columns.NONE, 3])
+    self.assertEqual(table.get_record(1), {'full_name' : 'Jane',
+                                           'sex' : 'female'})
+    self.assertEqual(len(pool), 4)
+
+  def test_same_as_objectify(self):
+    """The records should be the same as objectify_pfif_tree's."""
+    for xml in [ColumnsTests.generate(), PfifXml.XML_11_FULL,
+                PfifXml.XML_FULL_12, PfifXml.XML_MANDATORY_13,
+                PfifXml.XML_TOP_LEVEL_NOTE_PERSON_11,
+                PfifXml.XML_DUPLICATE_FIELDS, PfifXml.XML_BLANK_FIELDS,
+                PfifXml.XML_UNICODE_12]:
+      for optional_args in [{}, {'ignore_fields' : ['person_record_id',
+                                                    'source_date']},
+                            {'omit_blank_fields' : True}]:
+        records = ColumnsTests.make_records(xml, **optional_args)
+        self.assertEqual(
+            ColumnsTests.to_objects(records),
+            pfif_diff.objectify_pfif_xml(StringIO(xml), **optional_args))
+
+  def test_shared_pool(self):
+    """Feeds that share a pool should share their codes."""
+    pool = pfif_columns.StringPool()
+    records_a = ColumnsTests.make_records(PfifXml.XML_11_FULL, pool=pool)
+    records_b = ColumnsTests.make_records(PfifXml.XML_11_FULL, pool=pool)
+    self.assertEqual(records_a.persons.columns, records_b.persons.columns)
+    self.assertEqual(records_a.notes.ids, records_b.notes.ids)
+    self.assertNotEqual(ColumnsTests.make_records(PfifXml.XML_11_FULL).pool,
+                        pool)
+
+  def test_check_formats(self):
+    """check_formats should find the same fields as the validator, checking
+    each distinct value once."""
+    bad_xml = PfifXml.XML_11_FULL.replace('>true<', '>maybe<').replace(
+        '>12345<', '>abcde<').replace('>author name<', '><')
+    for xml in [ColumnsTests.generate(), bad_xml]:
+      def message_key(message):
+        """Returns the fields of message that check_formats sets, except for
+        the person_record_id of notes in persons, which the validator leaves
+        out."""
+        return (message.category, message.is_error, message.xml_tag,
+                message.xml_text,
+                message.note_record_id or message.person_record_id)
+      messages = ColumnsTests.make_records(xml).check_formats()
+      expected_messages = pfif_validator.PfifValidator(
+          StringIO(xml)).validate_fields_have_correct_format()
+      self.assertTrue(len(expected_messages) > 3)
+      self.assertEqual(sorted(message_key(message) for message in messages),
+                       sorted(message_key(message)
+                              for message in expected_messages))
+
+    checked = []
+    def checker(text):
+      """Records each text that is checked."""
+      checked.append(text)
+      return text != 'bad'
+    table = pfif_columns.RecordTable('person', pfif_columns.StringPool())
+    for record_id, value in [('a', 'bad'), ('b', 'good'), ('c', 'bad'),
+                             ('d', ''), ('e', None)]:
+      row = table.get_row(record_id)
+      if value is not None:
+        table.set_field(row, 'field', value)
+    self.assertEqual(table.check_format('field', checker), ([3], [0, 2]))
+    self.assertEqual(sorted(checked), ['bad', 'good'])
+
+  def test_stats(self):
+    """Counts should be taken from the columns."""
+    records = ColumnsTests.make_records(PfifXml.XML_TOP_LEVEL_NOTE_PERSON_11)
+    # The notes don't have ids, so they are skipped.
+    self.assertEqual(records.get_field_stats(),
+                     [('person', 'person_record_id', 1, 1)])
+    records = ColumnsTests.make_records(PfifXml.XML_11_FULL)
+    self.assertEqual(records.notes.count_values('note_record_id'),
+                     {'www.example.org/local-id.4' : 1,
+                      'www.example.org/local-id.5' : 1})
+    self.assertEqual(records.persons.count_filled('home_zip'), 1)
+    self.assertEqual(records.persons.count_filled('not_a_field'), 0)
+
+  def test_main(self):
+    """main should count the format problems of each record type, including
+    notes that have a person_record_id."""
+    output = StringIO()
+    writer = utils.PfifXmlWriter(output, 1.3)
+    writer.write_record(
+        'person', [('person_record_id', 'example.org/person'),
+                   ('source_date', '2010-01-01T00:00:00Z'),
+                   ('full_name', 'Ana')],
+        [[('note_record_id', 'example.org/note'),
+          ('person_record_id', 'example.org/person'),
+          ('author_name', 'Ana'), ('source_date', 'bad date'),
+          ('text', 'text')]])
+    writer.close()
+    old_argv = sys.argv
+    old_stdout = sys.stdout
+    try:
+      sys.argv = ['pfif_columns.py', 'mocked_file']
+      sys.stdout = StringIO('')
+      utils.set_file_for_test(StringIO(output.getvalue()))
+      pfif_columns.main()
+      lines = sys.stdout.getvalue().splitlines()
+    finally:
+      sys.stdout = old_stdout
+      sys.argv = old_argv
+      utils.set_file_for_test(None)
+    self.assertTrue('person\tsource_date\t1\t1\t0\t0' in lines)
+    self.assertTrue('note\tsource_date\t1\t1\t0\t1' in lines)
+
+if __name__ == '__main__':
+  unittest.main()
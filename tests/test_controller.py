@@ -17,6 +17,11 @@
 """Tests for validator_controller.py"""
 
 import unittest
+import os
+import re
+import gzip
+import shutil
+import tempfile
 import controller
 from StringIO import StringIO
 from google.appengine.ext import webapp
@@ -30,6 +35,7 @@ class FakeFieldStorage(object):
   def __init__(self, filename, value):
     self.filename = filename
     self.value = value
+    self.file = StringIO(value)
 
   def __repr__(self):
     return self.value
@@ -86,6 +92,33 @@ class ControllerTests(unittest.TestCase):
                                          fake_file})
     self.assertTrue("3 Messages" in response.out.getvalue())
 
+  def test_file_upload_is_not_copied(self):
+    """An uploaded file should be read directly from the FieldStorage's file
+    rather than from a copy of its value."""
+    fake_file = FakeFieldStorage('two_duplicate_no_child.xml',
+                                 PfifXml.XML_TWO_DUPLICATE_NO_CHILD)
+    fake_file.value = None
+    response = self.make_webapp_request({'pfif_xml_file_1' : fake_file})
+    self.assertTrue("3 Messages" in response.out.getvalue())
+
+  def test_compressed_file_upload(self):
+    """A gzipped upload should be decompressed as it is validated."""
+    compressed = StringIO()
+    gzip_file = gzip.GzipFile(fileobj=compressed, mode='wb')
+    gzip_file.write(PfifXml.XML_TWO_DUPLICATE_NO_CHILD)
+    gzip_file.close()
+    fake_file = FakeFieldStorage('two_duplicate_no_child.xml.gz',
+                                 compressed.getvalue())
+    response = self.make_webapp_request({'pfif_xml_file_1' : fake_file})
+    self.assertTrue("3 Messages" in response.out.getvalue())
+
+  def test_empty_file_upload_is_ignored(self):
+    """A file input that was left blank (and so has an empty filename) should
+    not count as an uploaded file."""
+    fake_file = FakeFieldStorage('', '')
+    response = self.make_webapp_request({'pfif_xml_file_1' : fake_file})
+    self.assertTrue("Missing Input File" in response.out.getvalue())
+
   def test_url_upload(self):
     """The page should have the correct number of errors in the header when
     using the pfif_xml_url_1 POST variable to send PFIF XML."""
@@ -95,6 +128,25 @@ class ControllerTests(unittest.TestCase):
 
   # validator
 
+  def test_validator_rules(self):
+    """Only the rules selected in the form should be run."""
+    request = MultiDict({'pfif_xml_1' : PfifXml.XML_TWO_DUPLICATE_NO_CHILD,
+                         'skip_rules' : 'extraneous_fields'})
+    response = self.make_webapp_request(request)
+    self.assertTrue('1 Messages' in response.out.getvalue())
+
+    request = MultiDict({'pfif_xml_1' : PfifXml.XML_TWO_DUPLICATE_NO_CHILD,
+                         'max_cost' : 'cheap'})
+    response = self.make_webapp_request(request)
+    self.assertTrue('3 Messages' in response.out.getvalue())
+
+    for handler_method in [controller.ValidatorController,
+                           controller.ValidatorJobController]:
+      request = MultiDict({'pfif_xml_1' : PfifXml.XML_TWO_DUPLICATE_NO_CHILD,
+                           'skip_rules' : 'no_such_rule'})
+      response = self.make_webapp_request(request, handler_method)
+      self.assertTrue('Invalid Rules' in response.out.getvalue())
+
   def test_validator_options(self):
     """The validator results page should have a span or div for each print
     option."""
@@ -137,6 +189,28 @@ class ControllerTests(unittest.TestCase):
     response = self.make_webapp_request(request)
     self.assertTrue('message_xml_text' in response.out.getvalue())
 
+  def test_malformed_xml(self):
+    """XML that can't be parsed should be reported on the page that has
+    already started, which should still be finished."""
+    for handler_method, request in [
+        (controller.ValidatorController, {'pfif_xml_1' : PfifXml.XML_INVALID}),
+        (controller.ValidatorController,
+         {'pfif_xml_1' : PfifXml.XML_BAD_PFIF_VERSION}),
+        (controller.DiffController,
+         {'pfif_xml_1' : PfifXml.XML_ADDED_DELETED_CHANGED_1,
+          'pfif_xml_2' : PfifXml.XML_INVALID}),
+        (controller.DiffController,
+         {'pfif_xml_1' : PfifXml.XML_INVALID,
+          'pfif_xml_2' : PfifXml.XML_ADDED_DELETED_CHANGED_2,
+          'options' : 'group_messages_by_record'})]:
+      response = self.make_webapp_request(
+          request, handler_init_method=handler_method)
+      response_str = response.out.getvalue()
+      self.assertTrue('<h1>Invalid PFIF XML</h1>' in response_str)
+      self.assertTrue('class="parse_error"' in response_str)
+      self.assertFalse('Messages</h1>' in response_str)
+      self.assertTrue(response_str.endswith('</body></html>'))
+
   # diff
 
   def test_diff(self):
@@ -194,6 +268,103 @@ class ControllerTests(unittest.TestCase):
     response_str = response.out.getvalue()
     self.assertTrue('pasted in' in response_str)
 
+  # batch validation
+
+  def test_batch_validation(self):
+    """The batch results page should have one row per URL."""
+    utils.set_file_for_test(StringIO(PfifXml.XML_TWO_DUPLICATE_NO_CHILD))
+    response = self.make_webapp_request(
+        {'pfif_xml_urls' : 'http://example.org/a.xml\nhttp://example.org/b.xml',
+         'print_options' : 'show_categories'},
+        handler_init_method=controller.BatchValidatorController)
+    response_str = response.out.getvalue()
+    self.assertTrue('2 Feeds' in response_str)
+    self.assertTrue('http://example.org/a.xml' in response_str)
+    self.assertTrue('http://example.org/b.xml' in response_str)
+    self.assertTrue('0 failed' in response_str)
+
+  def test_batch_validation_without_urls(self):
+    """The batch results page should fail gracefully when there are no URLs."""
+    response = self.make_webapp_request(
+        {'pfif_xml_urls' : ''},
+        handler_init_method=controller.BatchValidatorController)
+    self.assertTrue('Missing Input File' in response.out.getvalue())
+
+  # jobs
+
+  @staticmethod
+  def get_job_status(job_id, page=0):
+    """Requests the status page for job_id.  Returns the response as a
+    string."""
+    request = webapp.Request({'wsgi.input' : StringIO(),
+                              'REQUEST_METHOD' : 'GET',
+                              'PATH_INFO' : '/jobs/status',
+                              'QUERY_STRING' : 'job_id=' + job_id + '&page=' +
+                                               str(page)})
+    response = webapp.Response()
+    handler = controller.JobStatusController()
+    handler.initialize(request, response)
+    handler.get()
+    return response.out.getvalue()
+
+  def queue_job(self, content, handler_init_method):
+    """Queues a job, waits for it to finish, and returns its job_id."""
+    response_str = self.make_webapp_request(
+        content, handler_init_method=handler_init_method).out.getvalue()
+    self.assertTrue('Job Queued' in response_str)
+    controller.get_job_queue().wait_for_jobs()
+    return re.search(r'class="job_id">(\w+)<', response_str).group(1)
+
+  def test_validator_job(self):
+    """A validation job should show the same number of messages as the results
+    page once it is done."""
+    job_id = self.queue_job({'pfif_xml_1' :
+                             PfifXml.XML_TWO_DUPLICATE_NO_CHILD},
+                            controller.ValidatorJobController)
+    status_str = self.get_job_status(job_id)
+    self.assertTrue('done' in status_str)
+    self.assertTrue('3 Messages' in status_str)
+    self.assertTrue('message_xml_full_line' in status_str)
+
+  def test_diff_job_pages(self):
+    """The results of a diff job should be split into pages."""
+    old_page_size = controller.JOB_RESULTS_PAGE_SIZE
+    controller.JOB_RESULTS_PAGE_SIZE = 2
+    try:
+      job_id = self.queue_job(
+          {'pfif_xml_1' : PfifXml.XML_ADDED_DELETED_CHANGED_1,
+           'pfif_xml_2' : PfifXml.XML_ADDED_DELETED_CHANGED_2},
+          controller.DiffJobController)
+      first_page = self.get_job_status(job_id, page=0)
+      second_page = self.get_job_status(job_id, page=1)
+    finally:
+      controller.JOB_RESULTS_PAGE_SIZE = old_page_size
+    self.assertEqual(first_page.count('"message"'), 2)
+    self.assertTrue('next_page' in first_page)
+    self.assertFalse('previous_page' in first_page)
+    self.assertTrue('previous_page' in second_page)
+
+  def test_shared_job_db(self):
+    """A job stored in a job database file should be found by another process
+    using the same file, which has its own queue and connection."""
+    temp_dir = tempfile.mkdtemp()
+    try:
+      controller.set_job_db_path(os.path.join(temp_dir, 'jobs.sqlite'))
+      job_id = self.queue_job({'pfif_xml_1' :
+                               PfifXml.XML_TWO_DUPLICATE_NO_CHILD},
+                              controller.ValidatorJobController)
+      controller.set_job_db_path(os.path.join(temp_dir, 'jobs.sqlite'))
+      status_str = self.get_job_status(job_id)
+    finally:
+      controller.set_job_db_path(controller.IN_MEMORY_JOB_DB)
+      shutil.rmtree(temp_dir)
+    self.assertTrue('done' in status_str)
+    self.assertTrue('3 Messages' in status_str)
+
+  def test_missing_job(self):
+    """The status page should fail gracefully for an unknown job."""
+    self.assertTrue('No Such Job' in self.get_job_status('no_such_job'))
+
   @staticmethod
   def test_main():
     """main should not crash."""
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for pfif_converter.py"""
+
+import unittest
+import os
+from StringIO import StringIO
+import pfif_converter
+import pfif_diff
+import utils
+from pfif_validator import PfifValidator
+import tests.pfif_xml as PfifXml
+from tests import main_runner
+
+class ConverterTests(unittest.TestCase):
+  """Defines tests for pfif_converter.py"""
+
+  def setUp(self): # pylint: disable=C0103
+    """Clears the debug file left by other tests."""
+    utils.set_file_for_test(None)
+
+  @staticmethod
+  def make_feed():
+    """Returns a PFIF 1.3 feed with a person whose top level notes come before
+    and after it, a person with a nested note and a postal code, and a note
+    about a person that isn't in the feed."""
+    output = StringIO()
+    writer = utils.PfifXmlWriter(output, 1.3)
+    writer.write_record('note', [('note_record_id', 'example.org/note1'),
+                                 ('person_record_id', 'example.org/person1'),
+                                 ('author_name', 'Ana'),
+                                 ('source_date', '2010-01-01T00:00:00Z'),
+                                 ('text', 'before the person')])
+    writer.write_record(
+        'person', [('person_record_id', 'example.org/person1'),
+                   ('source_date', '2010-01-01T00:00:00Z'),
+                   ('full_name', 'Ana Maria Silva'),
+                   ('sex', 'female')])
+    writer.write_record(
+        'person', [('person_record_id', 'example.org/person2'),
+                   ('source_date', '2010-01-01T00:00:00Z'),
+                   ('full_name', ''),
+                   ('home_postal_code', '12345'),
+                   ('entry_date', '2010-01-02T00:00:00Z')],
+        [[('note_record_id', 'example.org/note2'), ('author_name', 'Ana'),
+          ('source_date', '2010-01-01T00:00:00Z'), ('text', 'nested')]])
+    writer.write_record('note', [('note_record_id', 'example.org/note3'),
+                                 ('person_record_id', 'example.org/person1'),
+                                 ('status', 'is_note_author'),
+                                 ('author_name', 'Ana'),
+                                 ('source_date', '2010-01-01T00:00:00Z'),
+                                 ('text', 'after the person')])
+    writer.write_record('note', [('note_record_id', 'example.org/note4'),
+                                 ('person_record_id', 'example.org/missing'),
+                                 ('author_name', 'Ana'),
+                                 ('source_date', '2010-01-01T00:00:00Z'),
+                                 ('text', 'orphan')])
+    writer.close()
+    return output.getvalue()
+
+  @staticmethod
+  def convert(xml, target_version, notes=pfif_converter.KEEP_NOTES,
+              parser=None, batch_records=pfif_converter.BATCH_RECORDS):
+    """Returns the converter and the converted xml."""
+    converter = pfif_converter.VersionConverter(
+        target_version, notes=notes, parser=parser,
+        batch_records=batch_records)
+    converter.store_top_level_notes(StringIO(xml))
+    output = StringIO()
+    converter.convert(StringIO(xml), output)
+    return converter, output.getvalue()
+
+  def test_note_store(self):
+    """Notes should come out of the store in order, once, and the temporary
+    database should be removed when it is closed."""
+    store = pfif_converter.NoteStore()
+    path = store.temp_path
+    store.add_note('a', [('text', 'first')])
+    store.add_note('b', [('text', u'\xe9')])
+    store.add_note('a', [('text', 'second')])
+    self.assertEqual(store.pop_notes('a'),
+                     [[('text', 'first')], [('text', 'second')]])
+    self.assertEqual(store.pop_notes('a'), [])
+    self.assertEqual(list(store.iter_notes()), [[('text', u'\xe9')]])
+    self.assertTrue(os.path.exists(path))
+    store.close()
+    self.assertFalse(os.path.exists(path))
+
+  def test_convert_fields(self):
+    """Fields should be renamed, names filled in and put in capitals for
+    1.1, fields that the version doesn't have dropped, and the rest put in
+    order."""
+    converter = pfif_converter.VersionConverter(1.1)
+    self.assertEqual(
+        converter.convert_fields(
+            'person', [('person_record_id', 'example.org/id'),
+                       ('home_postal_code', '12345'),
+                       ('full_name', 'Ana Maria Silva'),
+                       ('sex', 'female'),
+                       ('entry_date', '2010-01-01T00:00:00Z')]),
+        [('person_record_id', 'example.org/id'),
+         ('entry_date', '2010-01-01T00:00:00Z'),
+         ('first_name', 'ANA MARIA'), ('last_name', 'SILVA'),
+         ('home_zip', '12345')])
+    self.assertEqual(converter.dropped_fields, {'full_name' : 1, 'sex' : 1})
+    self.assertEqual(
+        converter.convert_note([('note_record_id', 'example.org/note'),
+                                ('text', 'text')], 'example.org/id'),
+        [('note_record_id', 'example.org/note'), ('text', 'text')])
+    self.assertEqual(converter.dropped_fields['person_record_id'], 1)
+
+    converter = pfif_converter.VersionConverter(1.3)
+    self.assertEqual(
+        converter.convert_fields(
+            'person', [('person_record_id', 'example.org/id'),
+                       ('first_name', 'Ana'), ('last_name', 'Silva'),
+                       ('home_zip', '12345')]),
+        [('person_record_id', 'example.org/id'),
+         ('first_name', 'Ana'), ('last_name', 'Silva'),
+         ('home_postal_code', '12345'), ('full_name', 'Ana Silva')])
+    self.assertEqual(
+        converter.convert_note([('note_record_id', 'example.org/note'),
+                                ('text', 'text')], 'example.org/id'),
+        [('note_record_id', 'example.org/note'),
+         ('person_record_id', 'example.org/id'), ('text', 'text')])
+    self.assertEqual(converter.dropped_fields, {})
+
+  def test_nest_notes(self):
+    """Top level notes should be nested in their persons, in order, and notes
+    without a person should be dropped in 1.1 and kept at the top level
+    otherwise."""
+    xml = ConverterTests.make_feed()
+    for parser in utils.get_available_parsers():
+      converter, converted_xml = ConverterTests.convert(xml, 1.1,
+                                                        parser=parser)
+      self.assertEqual(converter.notes, pfif_converter.NEST_NOTES)
+      self.assertEqual(converter.records_written, 2)
+      self.assertEqual(converter.notes_nested, 2)
+      self.assertEqual(converter.orphaned_notes, 1)
+      # Only the blank names of person2 are warned about.
+      self.assertEqual(len(converter.messages), 2)
+      self.assertFalse([message for message in converter.messages
+                        if message.is_error])
+      tree = utils.PfifXmlTree(StringIO(converted_xml))
+      self.assertEqual(tree.version, 1.1)
+      self.assertEqual(tree.get_top_level_notes(), [])
+      persons = tree.get_all_persons()
+      self.assertEqual(
+          [tree.get_field_text(note, 'text')
+           for note in persons[0].findall(tree.add_namespace_to_tag('note'))],
+          ['before the person', 'after the person'])
+      validator = PfifValidator(StringIO(converted_xml))
+      self.assertEqual(validator.validate_person_field_order(), [])
+      self.assertEqual(validator.validate_note_field_order(), [])
+
+    converter, converted_xml = ConverterTests.convert(
+        xml, 1.2, notes=pfif_converter.NEST_NOTES)
+    self.assertEqual(converter.orphaned_notes, 0)
+    notes = utils.PfifXmlTree(StringIO(converted_xml)).get_top_level_notes()
+    self.assertEqual(len(notes), 1)
+
+  def test_hoist_notes(self):
+    """Nested notes should be moved after their persons, with the
+    person_record_id of the person."""
+    xml = ConverterTests.make_feed()
+    converter, converted_xml = ConverterTests.convert(
+        xml, 1.3, notes=pfif_converter.HOIST_NOTES)
+    self.assertEqual(converter.notes_hoisted, 1)
+    self.assertEqual(converter.records_written, 6)
+    records = pfif_diff.objectify_pfif_xml(StringIO(converted_xml))
+    self.assertEqual(
+        records[pfif_diff.record_id_to_key('example.org/note2', False)],
+        {'note_record_id' : 'example.org/note2',
+         'person_record_id' : 'example.org/person2', 'author_name' : 'Ana',
+         'source_date' : '2010-01-01T00:00:00Z', 'text' : 'nested'})
+    tree = utils.PfifXmlTree(StringIO(converted_xml))
+    self.assertEqual(len(tree.get_top_level_notes()), 4)
+    for person in tree.get_all_persons():
+      self.assertEqual(person.findall(tree.add_namespace_to_tag('note')), [])
+
+  def test_round_trip(self):
+    """Converting a feed to the same version and keeping its notes in place
+    should keep its records."""
+    for xml in [PfifXml.XML_11_FULL, PfifXml.XML_FULL_12,
+                ConverterTests.make_feed()]:
+      version = utils.PfifXmlTree(StringIO(xml)).version
+      _, converted_xml = ConverterTests.convert(xml, version)
+      self.assertEqual(pfif_diff.objectify_pfif_xml(StringIO(converted_xml)),
+                       pfif_diff.objectify_pfif_xml(StringIO(xml)))
+
+  def test_batch_validation(self):
+    """Validating the output in batches should give the same messages, at the
+    same lines, as validating the whole output with the record rules."""
+    output = StringIO()
+    writer = utils.PfifXmlWriter(output, 1.2)
+    for number in xrange(7):
+      writer.write_record(
+          'person', [('person_record_id', 'example.org/%d' % number),
+                     ('first_name', 'Ana'),
+                     ('last_name', number % 2 and 'Silva' or ''),
+                     ('sex', number % 3 and 'female' or 'unknown')],
+          [[('note_record_id', 'example.org/note%d' % number),
+            ('found', number % 2 and 'true' or 'maybe'), ('text', 'text')]])
+    writer.close()
+    converter, converted_xml = ConverterTests.convert(
+        output.getvalue(), 1.3, notes=pfif_converter.HOIST_NOTES,
+        batch_records=3)
+    self.assertTrue(converter.messages)
+    expected_messages = PfifValidator(
+        StringIO(converted_xml), rules=converter.rules).run_validations()
+    xml_lines = converted_xml.splitlines(True)
+    # Batches are validated rule by rule, so only the order can differ.
+    self.assertEqual(
+        sorted(utils.MessagesOutput.messages_to_str([message],
+                                                    xml_lines=xml_lines)
+               for message in converter.messages),
+        sorted(utils.MessagesOutput.messages_to_str([message],
+                                                    xml_lines=xml_lines)
+               for message in expected_messages))
+
+  def test_main(self):
+    """main should write the converted feed and print what it did."""
+    output, converted_xml = main_runner.run_main(
+        pfif_converter.main, ['pfif_converter.py', '--to-version', '1.1'],
+        [ConverterTests.make_feed()])
+    self.assertTrue(output.startswith('2 records written in PFIF 1.1\n'))
+    self.assertTrue('2 notes nested\n' in output)
+    self.assertTrue('1 notes dropped without a person\n' in output)
+    self.assertEqual(converted_xml,
+                     ConverterTests.convert(ConverterTests.make_feed(),
+                                            1.1)[1])
+
+if __name__ == '__main__':
+  unittest.main()
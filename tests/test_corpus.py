@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for pfif_corpus.py"""
+
+import unittest
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+import pfif_corpus
+import utils
+
+FEED_A = """<?xml version="1.0" encoding="UTF-8"?>
+<pfif:pfif xmlns:pfif="http://zesty.ca/pfif/1.3">
+  <pfif:person>
+    <pfif:person_record_id>example.org/a</pfif:person_record_id>
+    <pfif:note>
+      <pfif:note_record_id>example.org/note-a</pfif:note_record_id>
+      <pfif:linked_person_record_id>example.org/b</pfif:linked_person_record_id>
+    </pfif:note>
+  </pfif:person>
+  <pfif:person>
+    <pfif:person_record_id>example.org/shared</pfif:person_record_id>
+  </pfif:person>
+</pfif:pfif>"""
+
+FEED_B = """<?xml version="1.0" encoding="UTF-8"?>
+<pfif:pfif xmlns:pfif="http://zesty.ca/pfif/1.3">
+  <pfif:person>
+    <pfif:person_record_id>example.org/b</pfif:person_record_id>
+  </pfif:person>
+  <pfif:person>
+    <pfif:person_record_id>example.org/shared</pfif:person_record_id>
+  </pfif:person>
+  <pfif:note>
+    <pfif:note_record_id>example.org/note-b</pfif:note_record_id>
+    <pfif:person_record_id>example.org/c</pfif:person_record_id>
+    <pfif:linked_person_record_id>example.org/x</pfif:linked_person_record_id>
+  </pfif:note>
+</pfif:pfif>"""
+
+FEED_B_LINKED = FEED_B.replace(
+    '<pfif:person_record_id>example.org/b</pfif:person_record_id>',
+    '<pfif:person_record_id>example.org/b</pfif:person_record_id>\n'
+    '    <pfif:note>\n'
+    '      <pfif:note_record_id>example.org/note-c</pfif:note_record_id>\n'
+    '      <pfif:linked_person_record_id>example.org/a'
+    '</pfif:linked_person_record_id>\n'
+    '    </pfif:note>')
+
+def make_tree(xml):
+  """Returns a PfifXmlTree for xml."""
+  return utils.PfifXmlTree(StringIO(xml))
+
+class CorpusTests(unittest.TestCase):
+  """Defines tests for pfif_corpus.py"""
+
+  def test_add_and_remove_feed(self):
+    """Adding a feed should index its ids and links, adding it again should
+    replace them, and removing it should remove them."""
+    index = pfif_corpus.CorpusIndex()
+    index.add_feed('a', make_tree(FEED_A))
+    index.add_feed('a', make_tree(FEED_A))
+    self.assertEqual(index.get_feeds(), [('a', 3, 1)])
+    self.assertEqual(index.get_other_feeds('person', 'example.org/a', 'b'),
+                     ['a'])
+    self.assertEqual(index.get_other_feeds('note', 'example.org/a', 'b'), [])
+    self.assertTrue(index.has_link('example.org/a', 'example.org/b', 'b'))
+    self.assertFalse(index.has_link('example.org/a', 'example.org/b', 'a'))
+    index.remove_feed('a')
+    self.assertEqual(index.get_feeds(), [])
+    self.assertEqual(index.get_other_feeds('person', 'example.org/a', 'b'),
+                     [])
+
+  def test_check_feed(self):
+    """Checking a feed should find ids used by other feeds, links to persons
+    in no feed, and links that other feeds don't return."""
+    index = pfif_corpus.CorpusIndex()
+    messages = index.check_feed('a', make_tree(FEED_A))
+    self.assertEqual([message.xml_text for message in messages],
+                     ['example.org/b'])
+    index.add_feed('a', make_tree(FEED_A))
+    # A feed is never checked against itself.
+    self.assertEqual(len(index.check_feed('a', make_tree(FEED_A))), 1)
+    messages = index.check_feed('b', make_tree(FEED_B))
+    self.assertEqual(len(messages), 2)
+    duplicate, dangling = messages
+    self.assertTrue(duplicate.is_error)
+    self.assertEqual(duplicate.person_record_id, 'example.org/shared')
+    self.assertEqual(duplicate.xml_line_number, 7)
+    self.assertEqual(duplicate.extra_data, 'Also in: a')
+    self.assertFalse(dangling.is_error)
+    self.assertEqual(dangling.xml_text, 'example.org/x')
+    self.assertEqual(dangling.note_record_id, 'example.org/note-b')
+
+    index.add_feed('b', make_tree(FEED_B))
+    messages = index.check_feed('a', make_tree(FEED_A))
+    self.assertEqual([message.xml_tag for message in messages],
+                     ['person_record_id', 'linked_person_record_id'])
+    self.assertEqual(messages[1].category,
+                     'A note links to a person in another feed, but that '
+                     'person does not link back.')
+    index.add_feed('b', make_tree(FEED_B_LINKED))
+    messages = index.check_feed('a', make_tree(FEED_A))
+    self.assertEqual([message.xml_tag for message in messages],
+                     ['person_record_id'])
+
+  def test_persistent_index(self):
+    """An index on disk should still have its feeds when it is opened
+    again."""
+    index_dir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(index_dir, 'corpus.db')
+      pfif_corpus.CorpusIndex(path).add_feed('a', make_tree(FEED_A))
+      index = pfif_corpus.CorpusIndex(path)
+      self.assertEqual(index.get_feeds(), [('a', 3, 1)])
+      self.assertEqual(len(index.check_feed('b', make_tree(FEED_B))), 2)
+    finally:
+      shutil.rmtree(index_dir)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -18,6 +18,7 @@
 import unittest
 from StringIO import StringIO
 import tests.pfif_xml as PfifXml
+import pfif_columns
 import pfif_diff
 import sys
 import utils
@@ -109,6 +110,15 @@ class DiffTests(unittest.TestCase):
     messages = self.run_diff(PfifXml.XML_11_FULL, PfifXml.XML_11_FULL)
     self.assertEqual(len(messages), 0)
 
+  def test_diff_atom_feed(self):
+    """The records of an Atom feed should be the same as the same records in a
+    pfif root."""
+    messages = self.run_diff(PfifXml.XML_ATOM_12,
+                             PfifXml.XML_ATOM_12_UNWRAPPED)
+    self.assertEqual(len(messages), 0)
+    messages = self.run_diff(PfifXml.XML_ATOM_12, PfifXml.XML_11_FULL)
+    self.assertTrue(len(messages) > 0)
+
   def test_diff_no_content_changes(self):
     """Whether a note is a subnote or a top level note and whether or not a
     subnote contains a person_record_id should not cause differences."""
@@ -168,6 +178,37 @@ class DiffTests(unittest.TestCase):
                              text_is_case_sensitive=False)
     self.assertEqual(len(messages), 4)
 
+  def test_columnar_diff(self):
+    """iter_columnar_diff should find the same differences as
+    iter_pfif_obj_diff."""
+    for xml_a, xml_b in [
+        (PfifXml.XML_ADDED_DELETED_CHANGED_1,
+         PfifXml.XML_ADDED_DELETED_CHANGED_2),
+        (PfifXml.XML_ONE_PERSON_TWO_FIELDS,
+         PfifXml.XML_ONE_PERSON_TWO_FIELDS_NEW_VALUE),
+        (PfifXml.XML_TWO_PERSONS_ONE_FIELD, PfifXml.XML_ONE_PERSON_ONE_FIELD),
+        (PfifXml.XML_MANDATORY_13_SUBNOTE, PfifXml.XML_MANDATORY_13_NONSUB),
+        (PfifXml.XML_11_FULL, PfifXml.XML_FULL_12)]:
+      for text_is_case_sensitive in [True, False]:
+        pool = pfif_columns.StringPool()
+        messages = pfif_diff.iter_columnar_diff(
+            pfif_columns.ColumnarRecords(utils.PfifXmlTree(StringIO(xml_a)),
+                                         pool=pool),
+            pfif_columns.ColumnarRecords(utils.PfifXmlTree(StringIO(xml_b)),
+                                         pool=pool),
+            text_is_case_sensitive)
+        expected_messages = pfif_diff.iter_pfif_obj_diff(
+            pfif_diff.objectify_pfif_xml(StringIO(xml_a)),
+            pfif_diff.objectify_pfif_xml(StringIO(xml_b)),
+            text_is_case_sensitive)
+        def message_key(message):
+          """Returns the fields of message that are set by a diff."""
+          return (message.category, message.extra_data, message.xml_tag,
+                  message.person_record_id, message.note_record_id)
+        self.assertEqual(sorted(message_key(message) for message in messages),
+                         sorted(message_key(message)
+                                for message in expected_messages))
+
   # main
 
   def run_main(self, argv):
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for pfif_feed_stats.py"""
+
+import unittest
+import sys
+from datetime import datetime
+from StringIO import StringIO
+import pfif_feed_stats
+import pfif_generator
+import utils
+import tests.pfif_xml as PfifXml
+
+class FeedStatsTests(unittest.TestCase):
+  """Defines tests for pfif_feed_stats.py"""
+
+  def setUp(self): # pylint: disable=C0103
+    """Clears the debug file left by other tests."""
+    utils.set_file_for_test(None)
+
+  def test_distinct_counter(self):
+    """Small counts should be exact, and large ones should be close."""
+    counter = pfif_feed_stats.DistinctCounter(exact_limit=100)
+    for value in ['a', 'b', 'a', u'\xe9']:
+      counter.add(value)
+    self.assertTrue(counter.is_exact())
+    self.assertEqual(counter.count(), 3)
+    for number in xrange(20000):
+      counter.add(str(number % 10000))
+    self.assertFalse(counter.is_exact())
+    self.assertTrue(abs(counter.count() - 10003) < 10003 * 0.05)
+
+  def test_quantile_sketch(self):
+    """Quantiles should be within the accuracy of the sketch."""
+    sketch = pfif_feed_stats.QuantileSketch(accuracy=0.01)
+    self.assertEqual(sketch.get_quantile(0.5), None)
+    self.assertEqual(sketch.get_mean(), None)
+    for value in xrange(1001):
+      sketch.add(value)
+    self.assertEqual(sketch.get_quantile(0), 0)
+    self.assertEqual(sketch.get_quantile(1), 1000)
+    self.assertEqual(sketch.get_mean(), 500)
+    for quantile in [0.1, 0.5, 0.9, 0.99]:
+      self.assertTrue(abs(sketch.get_quantile(quantile) - quantile * 1000) <=
+                      quantile * 1000 * 0.01 + 1)
+    self.assertTrue(len(sketch.buckets) < 400)
+
+  def test_top_values(self):
+    """Counts should be exact until a value is evicted, only the reported
+    number of values should be reported, and values whose count may be all
+    error shouldn't be reported."""
+    top_values = pfif_feed_stats.TopValues(capacity=3, reported=2)
+    for value in ['a', 'b', 'a', 'c', 'a', 'b']:
+      top_values.add(value)
+    self.assertTrue(top_values.is_exact())
+    self.assertEqual(top_values.get_top(), [('a', 3), ('b', 2)])
+    for value in ['d', 'a', 'd']:
+      top_values.add(value)
+    self.assertFalse(top_values.is_exact())
+    # d took over the count of c, so it may have been seen once.
+    self.assertEqual(top_values.get_error('d'), 1)
+    self.assertEqual(top_values.get_cutoff(), 2)
+    self.assertEqual(top_values.get_top(), [('a', 4)])
+
+    top_values = pfif_feed_stats.TopValues()
+    common_values = ['common%d' % number for number in xrange(4)]
+    for number in xrange(50000):
+      top_values.add(common_values[number % 4])
+      top_values.add('rare%d' % number)
+    top = top_values.get_top()
+    self.assertEqual(sorted(value for value, _ in top), common_values)
+    for value, count in top:
+      self.assertTrue(count - top_values.get_error(value) <= 12500 <= count)
+
+  def test_profile(self):
+    """Records, nested notes, fields, and dates should be counted."""
+    profile = pfif_feed_stats.profile_file(StringIO(PfifXml.XML_11_FULL))
+    self.assertEqual(profile.version, 1.1)
+    self.assertEqual(profile.persons.count, 1)
+    self.assertEqual(profile.notes.count, 2)
+    self.assertEqual(profile.nested_notes, 2)
+    self.assertEqual(profile.top_level_notes, 0)
+    self.assertEqual(profile.notes_per_person.get_quantile(0.5), 2)
+    self.assertEqual(profile.notes.fields['entry_date'].filled, 1)
+    self.assertEqual(profile.notes.get_fill_rate('entry_date'), 0.5)
+    self.assertEqual(profile.notes.fields['text'].distinct.count(), 1)
+    self.assertEqual(profile.notes.fields['text'].length_histogram, {5 : 2})
+    # 1234-56-78 isn't a real date.
+    self.assertEqual(profile.notes.fields['source_date'].not_dates, 2)
+    self.assertEqual(profile.persons.top_values['source_name'].get_top(),
+                     [('source name', 1)])
+    self.assertFalse('note' in profile.persons.fields)
+
+    profile = pfif_feed_stats.profile_file(
+        StringIO(PfifXml.XML_TOP_LEVEL_NOTE_PERSON_11))
+    self.assertEqual(profile.top_level_notes, 2)
+    # Neither top level note has a person_record_id.
+    self.assertEqual(profile.noted_persons.count(), 0)
+    self.assertEqual(profile.notes.fields['note_record_id'].blank, 2)
+
+  def test_same_as_tree(self):
+    """Profiling a file one record at a time should give the same statistics
+    as profiling its parsed tree, and an Atom feed should give the same
+    statistics as its records."""
+    generator = pfif_generator.FeedGenerator(
+        50, seed=5, error_rate=0.1, link_rate=0.3, top_level_note_ratio=0.5)
+    output = StringIO()
+    generator.write_feed(output)
+    for xml in [output.getvalue(), PfifXml.XML_UNICODE_12]:
+      for parser in utils.get_available_parsers():
+        profile = pfif_feed_stats.profile_file(StringIO(xml), parser=parser)
+        expected_profile = pfif_feed_stats.FeedProfile()
+        expected_profile.add_tree(utils.PfifXmlTree(StringIO(xml)))
+        self.assertEqual(profile.to_str(), expected_profile.to_str())
+        self.assertEqual(profile.to_str(is_html=True),
+                         expected_profile.to_str(is_html=True))
+    profile = pfif_feed_stats.profile_file(StringIO(output.getvalue()))
+    self.assertEqual(profile.persons.count, 50)
+    self.assertTrue(0 < profile.noted_persons.count() <=
+                    profile.top_level_notes)
+    date_profile = profile.persons.fields['entry_date']
+    self.assertTrue(datetime(2000, 1, 1) < date_profile.earliest <=
+                    date_profile.latest)
+    self.assertEqual(
+        pfif_feed_stats.profile_file(StringIO(PfifXml.XML_ATOM_12)).to_str(),
+        pfif_feed_stats.profile_file(
+            StringIO(PfifXml.XML_ATOM_12_UNWRAPPED)).to_str())
+
+  def test_main(self):
+    """main should print the statistics of a file."""
+    old_argv = sys.argv
+    old_stdout = sys.stdout
+    sys.argv = ['pfif_feed_stats.py', 'mocked_file']
+    sys.stdout = StringIO('')
+    utils.set_file_for_test(StringIO(PfifXml.XML_11_FULL))
+    try:
+      pfif_feed_stats.main()
+      output = sys.stdout.getvalue()
+    finally:
+      sys.stdout = old_stdout
+      sys.argv = old_argv
+    self.assertTrue('person\tsource_name\tsource name\t1\t' in output)
+    self.assertTrue('note\tentry_date\t1\t50.0%\t' in output)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for pfif_generator.py"""
+
+import unittest
+from StringIO import StringIO
+import pfif_generator
+import pfif_validator
+import utils
+
+class GeneratorTests(unittest.TestCase):
+  """Defines tests for pfif_generator.py"""
+
+  @staticmethod
+  def generate(num_persons=50, **options):
+    """Returns a tuple (feed, generator) for a generated feed."""
+    generator = pfif_generator.FeedGenerator(num_persons, **options)
+    output = StringIO()
+    generator.write_feed(output)
+    return (output.getvalue(), generator)
+
+  @staticmethod
+  def validate(feed):
+    """Returns the messages from validating feed."""
+    return pfif_validator.PfifValidator(StringIO(feed)).run_validations()
+
+  def test_deterministic(self):
+    """The same seed should always generate the same feed."""
+    options = {'seed' : 7, 'notes_per_person' : 1.5, 'error_rate' : 0.1,
+               'top_level_note_ratio' : 0.5, 'link_rate' : 0.2}
+    feed = GeneratorTests.generate(**options)[0]
+    self.assertEqual(feed, GeneratorTests.generate(**options)[0])
+    options['seed'] = 8
+    self.assertNotEqual(feed, GeneratorTests.generate(**options)[0])
+
+  def test_valid_feeds(self):
+    """Without injected errors, every version should be valid."""
+    for version, options in [(1.1, {}),
+                             (1.2, {'top_level_note_ratio' : 0.5,
+                                    'link_rate' : 0.3}),
+                             (1.3, {'top_level_note_ratio' : 0.5,
+                                    'link_rate' : 0.3})]:
+      feed, _ = GeneratorTests.generate(version=version, notes_per_person=2,
+                                        **options)
+      self.assertEqual(GeneratorTests.validate(feed), [])
+      self.assertTrue(('pfif/' + str(version)) in feed)
+
+  def test_expired_records(self):
+    """Expired persons should be valid placeholders whose only messages are
+    warnings about the empty full_name."""
+    feed, _ = GeneratorTests.generate(expired_rate=0.5, link_rate=0.3)
+    messages = GeneratorTests.validate(feed)
+    self.assertTrue(messages)
+    for message in messages:
+      self.assertFalse(message.is_error)
+      self.assertEqual(message.xml_tag, 'full_name')
+
+  def test_injected_errors(self):
+    """Each injected error should cause one error message."""
+    for version in [1.1, 1.2, 1.3]:
+      feed, generator = GeneratorTests.generate(
+          num_persons=200, version=version, error_rate=0.2, notes_per_person=1)
+      errors = [message for message in GeneratorTests.validate(feed)
+                if message.is_error]
+      self.assertTrue(errors)
+      self.assertEqual(len(errors), sum(generator.injected_errors.values()))
+
+  def test_record_counts(self):
+    """Notes should be split between persons and the root per the options, and
+    linked persons should link to each other."""
+    feed, generator = GeneratorTests.generate(
+        num_persons=200, notes_per_person=2.5, top_level_note_ratio=0.5,
+        link_rate=0.5)
+    tree = utils.PfifXmlTree(StringIO(feed))
+    self.assertEqual(len(tree.get_all_persons()), 200)
+    notes = tree.get_all_notes()
+    self.assertEqual(generator.record_count, 200 + len(notes))
+    self.assertTrue(450 <= len(notes) <= 550)
+    self.assertTrue(tree.get_top_level_notes())
+    self.assertTrue(tree.get_child_notes())
+    validator = pfif_validator.PfifValidator(StringIO(feed))
+    self.assertTrue(validator.get_linked_records())
+    self.assertEqual(validator.validate_linked_records_matched(), [])
+
+  def test_version_restrictions(self):
+    """Options that a version doesn't support should be rejected."""
+    self.assertRaises(AssertionError, pfif_generator.FeedGenerator, 10,
+                      version=1.1, top_level_note_ratio=0.5)
+    self.assertRaises(AssertionError, pfif_generator.FeedGenerator, 10,
+                      version=1.2, expired_rate=0.5)
+
+class PfifXmlWriterTests(unittest.TestCase):
+  """Defines tests for utils.PfifXmlWriter"""
+
+  def test_write_record(self):
+    """Text should be escaped, None fields left out, and notes nested."""
+    output = StringIO()
+    writer = utils.PfifXmlWriter(output, 1.2)
+    writer.write_record('person', [('person_record_id', 'example.org/1'),
+                                   ('first_name', u'J\xe9r\xf4me & <Co>'),
+                                   ('last_name', None)],
+                        notes=[[('note_record_id', 'example.org/2')]])
+    writer.close()
+    tree = utils.PfifXmlTree(StringIO(output.getvalue()))
+    person = tree.get_all_persons()[0]
+    self.assertEqual(tree.version, 1.2)
+    self.assertEqual(tree.get_field_text(person, 'first_name'),
+                     u'J\xe9r\xf4me & <Co>')
+    self.assertEqual(tree.get_field_text(person, 'last_name'), None)
+    self.assertEqual(len(tree.get_child_notes()), 1)
+    self.assertEqual(tree.line_numbers[tree.get_child_notes()[0]], 6)
+
+if __name__ == '__main__':
+  unittest.main()
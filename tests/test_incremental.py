@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for pfif_incremental.py"""
+
+import unittest
+import os
+import re
+import shutil
+import tempfile
+from StringIO import StringIO
+import pfif_generator
+import pfif_incremental
+import pfif_validator
+import tests.pfif_xml as PfifXml
+
+PERSON_START = '  <pfif:person>'
+
+class IncrementalTests(unittest.TestCase):
+  """Defines tests for pfif_incremental.py"""
+
+  @staticmethod
+  def generate():
+    """Returns a feed with errors, links, and top level notes."""
+    generator = pfif_generator.FeedGenerator(
+        30, seed=3, error_rate=0.1, link_rate=0.3, top_level_note_ratio=0.5)
+    output = StringIO()
+    generator.write_feed(output)
+    return output.getvalue()
+
+  @staticmethod
+  def sort_messages(messages):
+    """Returns messages in a form that can be compared regardless of order."""
+    return sorted([sorted(message.get_fields().items())
+                   for message in messages])
+
+  def assert_same_as_full(self, xml, snapshot=None):
+    """Asserts that incrementally validating xml gives the same messages as
+    fully validating it, and returns the IncrementalValidator."""
+    validator = pfif_incremental.IncrementalValidator(StringIO(xml),
+                                                      snapshot=snapshot)
+    messages = validator.run_validations()
+    full_messages = pfif_validator.PfifValidator(
+        StringIO(xml)).run_validations()
+    self.assertEqual(IncrementalTests.sort_messages(messages),
+                     IncrementalTests.sort_messages(full_messages))
+    return validator
+
+  def test_same_as_full(self):
+    """Without a snapshot, every distinct record should be checked once, and
+    the messages should match a full validation."""
+    for xml in [IncrementalTests.generate(), PfifXml.XML_DUPLICATE_NOTE_IDS,
+                PfifXml.XML_ASYMMETRICALLY_LINKED_RECORDS,
+                PfifXml.XML_NOTES_WITHOUT_PEOPLE,
+                PfifXml.XML_INCORRECT_FIELD_ORDER_11,
+                PfifXml.XML_ROOT_HAS_BAD_CHILD]:
+      validator = self.assert_same_as_full(xml)
+      records = validator.tree.getroot().getchildren()
+      self.assertEqual(validator.records_checked,
+                       len(set([pfif_incremental.fingerprint_record(record)
+                                for record in records])))
+      self.assertEqual(validator.records_checked + validator.records_reused,
+                       len(records))
+
+  def test_only_changed_records_checked(self):
+    """Only changed records should be checked, even if every record moved and
+    the change makes an id duplicate."""
+    xml = IncrementalTests.generate()
+    validator = self.assert_same_as_full(xml)
+    records = xml.split(PERSON_START)
+    # Copies the third person to the front, which moves every line and
+    # duplicates its ids, and empties an author_name in the fifth.
+    records[5] = re.sub(r'<pfif:author_name>[^<]+<', '<pfif:author_name><',
+                        records[5], count=1)
+    changed_xml = PERSON_START.join(records[:1] + records[3:4] + records[1:])
+    self.assertNotEqual(changed_xml, xml)
+    changed_validator = self.assert_same_as_full(changed_xml,
+                                                 validator.snapshot)
+    self.assertEqual(changed_validator.records_checked, 1)
+    self.assertEqual(changed_validator.records_reused,
+                     validator.records_checked + 1)
+
+  def test_incompatible_snapshot(self):
+    """A snapshot of different rules should not be reused."""
+    xml = IncrementalTests.generate()
+    validator = self.assert_same_as_full(xml)
+    rules = pfif_validator.select_rules(exclude=['extraneous_fields'])
+    other_validator = pfif_incremental.IncrementalValidator(
+        StringIO(xml), snapshot=validator.snapshot, rules=rules)
+    other_validator.run_validations()
+    self.assertEqual(other_validator.records_reused, 0)
+
+  def test_save_and_load(self):
+    """A saved snapshot should load with the same results."""
+    snapshot_dir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(snapshot_dir, 'snapshot')
+      self.assertEqual(pfif_incremental.Snapshot.load(path), None)
+      xml = IncrementalTests.generate()
+      validator = self.assert_same_as_full(xml)
+      validator.snapshot.save(path)
+      snapshot = pfif_incremental.Snapshot.load(path)
+      self.assertEqual(snapshot.results, validator.snapshot.results)
+      self.assertEqual(
+          self.assert_same_as_full(xml, snapshot).records_checked, 0)
+    finally:
+      shutil.rmtree(snapshot_dir)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for jobs.py"""
+
+import unittest
+from StringIO import StringIO
+import tests.pfif_xml as PfifXml
+import jobs
+import utils
+
+class JobTests(unittest.TestCase):
+  """Defines tests for jobs.py"""
+
+  @staticmethod
+  def run_jobs(*job_args):
+    """Runs one job for each tuple of (kind, function, args...) in job_args.
+    Returns the queue and a list of the job_ids."""
+    queue = jobs.JobQueue(jobs.JobStore(), num_workers=2)
+    job_ids = [queue.enqueue(*job) for job in job_args]
+    queue.wait_for_jobs()
+    return queue, job_ids
+
+  def test_validation_job(self):
+    """A validation job should store the same messages as running the validator
+    directly, along with the full line of each message."""
+    queue, job_ids = self.run_jobs(
+        ('validate', jobs.run_validation,
+         StringIO(PfifXml.XML_TWO_DUPLICATE_NO_CHILD)))
+    job = queue.store.get_job(job_ids[0])
+    self.assertEqual(job['status'], jobs.JobStatus.DONE)
+    self.assertEqual(job['message_count'], 3)
+
+    expected_messages, lines = jobs.run_validation(
+        StringIO(PfifXml.XML_TWO_DUPLICATE_NO_CHILD))
+    messages, xml_lines = queue.store.get_messages(job_ids[0])
+    self.assertEqual(messages, expected_messages)
+    for message in messages:
+      if message.xml_line_number is not None:
+        self.assertEqual(xml_lines[message.xml_line_number - 1],
+                         lines[message.xml_line_number - 1])
+
+  def test_diff_job(self):
+    """A diff job should pass its options on to the diff."""
+    queue = jobs.JobQueue(jobs.JobStore())
+    job_ids = [
+        queue.enqueue('diff', jobs.run_diff,
+                      StringIO(PfifXml.XML_ADDED_DELETED_CHANGED_1),
+                      StringIO(PfifXml.XML_ADDED_DELETED_CHANGED_2)),
+        queue.enqueue('diff', jobs.run_diff,
+                      StringIO(PfifXml.XML_ADDED_DELETED_CHANGED_1),
+                      StringIO(PfifXml.XML_ADDED_DELETED_CHANGED_2),
+                      ignore_fields=['foo', 'bar', 'source_date'])]
+    queue.wait_for_jobs()
+    all_fields_count = queue.store.get_job(job_ids[0])['message_count']
+    ignored_fields_count = queue.store.get_job(job_ids[1])['message_count']
+    self.assertTrue(all_fields_count > ignored_fields_count)
+
+  def test_failed_job(self):
+    """A job that raises an exception should be marked as failed."""
+    queue, job_ids = self.run_jobs(
+        ('validate', jobs.run_validation, StringIO(PfifXml.XML_INVALID)))
+    job = queue.store.get_job(job_ids[0])
+    self.assertEqual(job['status'], jobs.JobStatus.FAILED)
+    self.assertTrue(job['error'])
+
+  def test_pagination(self):
+    """get_messages should return messages in order, one page at a time, and
+    get_category_counts should count every message."""
+    store = jobs.JobStore()
+    job_id = store.create_job('validate')
+    messages = [utils.Message('Category ' + str(i % 2), extra_data=str(i))
+                for i in range(5)]
+    store.add_messages(job_id, messages)
+    self.assertEqual(store.get_messages(job_id, offset=0, limit=2)[0],
+                     messages[0:2])
+    self.assertEqual(store.get_messages(job_id, offset=4, limit=2)[0],
+                     messages[4:])
+    self.assertEqual(store.get_category_counts(job_id),
+                     {'Category 0' : 3, 'Category 1' : 2})
+
+  def test_delete_old_jobs(self):
+    """Finished jobs should be deleted with their messages once they are too
+    old or there are too many of them, but unfinished jobs should be kept."""
+    store = jobs.JobStore(max_age_seconds=100, max_finished_jobs=2)
+    job_ids = [store.create_job('validate') for _ in range(4)]
+    for finished_time, job_id in enumerate(job_ids[:3]):
+      store.add_messages(job_id, [utils.Message('Category')])
+      store.set_status(job_id, jobs.JobStatus.DONE)
+      store.execute('UPDATE jobs SET finished_time = ? WHERE job_id = ?',
+                    (1000 + finished_time, job_id))
+    self.assertEqual(store.delete_old_jobs(now=1050), 1)
+    self.assertEqual(store.get_job(job_ids[0]), None)
+    self.assertEqual(store.get_messages(job_ids[0])[0], [])
+    self.assertEqual(store.get_job(job_ids[1])['message_count'], 1)
+    self.assertEqual(store.delete_old_jobs(now=1101.5), 1)
+    self.assertEqual(store.get_job(job_ids[1]), None)
+    self.assertEqual(store.get_job(job_ids[2])['status'], jobs.JobStatus.DONE)
+    self.assertEqual(store.delete_old_jobs(now=10 ** 6), 1)
+    self.assertEqual(store.get_job(job_ids[3])['status'],
+                     jobs.JobStatus.QUEUED)
+
+  def test_missing_job(self):
+    """get_job should return None for an unknown job_id."""
+    self.assertEqual(jobs.JobStore().get_job('no_such_job'), None)
+
+if __name__ == '__main__':
+  unittest.main()
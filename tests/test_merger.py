@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for pfif_merger.py"""
+
+import unittest
+import os
+from StringIO import StringIO
+import pfif_diff
+import pfif_merger
+import utils
+from pfif_validator import PfifValidator
+from tests import main_runner
+
+class MergerTests(unittest.TestCase):
+  """Defines tests for pfif_merger.py"""
+
+  def setUp(self): # pylint: disable=C0103
+    """Clears the debug file left by other tests."""
+    utils.set_file_for_test(None)
+
+  @staticmethod
+  def make_person(record_id, name, entry_date=None, source_date=None):
+    """Returns the fields of a PFIF 1.3 person."""
+    fields = [('person_record_id', 'example.org/' + record_id)]
+    if entry_date:
+      fields.append(('entry_date', entry_date))
+    if source_date:
+      fields.append(('source_date', source_date))
+    fields.append(('full_name', name))
+    return fields
+
+  @staticmethod
+  def make_note(record_id, text, person_id=None, entry_date=None):
+    """Returns the fields of a PFIF 1.3 note with its mandatory fields."""
+    fields = [('note_record_id', 'example.org/' + record_id)]
+    if person_id:
+      fields.append(('person_record_id', 'example.org/' + person_id))
+    if entry_date:
+      fields.append(('entry_date', entry_date))
+    fields.extend([('author_name', 'Ana'),
+                   ('source_date', '2010-01-01T00:00:00Z'), ('text', text)])
+    return fields
+
+  @staticmethod
+  def make_feeds():
+    """Returns two PFIF 1.3 feeds that share persons and notes, where the
+    copies to keep are decided by each kind of precedence."""
+    make_person = MergerTests.make_person
+    make_note = MergerTests.make_note
+    first_feed = StringIO()
+    writer = utils.PfifXmlWriter(first_feed, 1.3)
+    writer.write_record('note', make_note('note1', 'old', 'newer_entry',
+                                          '2010-01-01T00:00:00Z'))
+    writer.write_record(
+        'person', make_person('newer_entry', 'old', '2010-01-01T00:00:00Z',
+                              '2010-01-05T00:00:00Z'),
+        [make_note('note2', 'nested', entry_date='2010-01-01T00:00:00Z')])
+    writer.write_record(
+        'person', make_person('newer_source', 'new', '2010-01-02T00:00:00Z',
+                              '2010-01-02T00:00:00Z'))
+    writer.write_record(
+        'person', make_person('same_dates', 'old', '2010-01-01T00:00:00Z',
+                              '2010-01-01T00:00:00Z'))
+    writer.write_record(
+        'person', make_person('only_first', 'first', '2010-01-01T00:00:00Z',
+                              '2010-01-01T00:00:00Z'))
+    writer.write_record('note', make_note('note3', 'orphan', 'missing'))
+    writer.close()
+
+    second_feed = StringIO()
+    writer = utils.PfifXmlWriter(second_feed, 1.3)
+    writer.write_record(
+        'person', make_person('same_dates', 'new', '2010-01-01T00:00:00Z',
+                              '2010-01-01T00:00:00Z'))
+    writer.write_record(
+        'person', make_person('newer_source', 'old', '2010-01-02T00:00:00Z',
+                              '2010-01-01T00:00:00Z'),
+        [make_note('note4', 'about newer_source')])
+    writer.write_record(
+        'person', make_person('newer_entry', 'new', '2010-01-02T00:00:00Z',
+                              '2010-01-01T00:00:00Z'))
+    writer.write_record('note', make_note('note1', 'new', 'newer_entry',
+                                          '2010-01-02T00:00:00Z'))
+    writer.write_record('note', make_note('note2', 'stale', 'newer_entry'))
+    writer.close()
+    return [first_feed.getvalue(), second_feed.getvalue()]
+
+  @staticmethod
+  def merge(feeds, target_version=None, parser=None):
+    """Returns the merger and the merged xml."""
+    merger = pfif_merger.FeedMerger(target_version=target_version,
+                                    parser=parser)
+    for xml in feeds:
+      merger.index_feed(StringIO(xml))
+    output = StringIO()
+    merger.merge([StringIO(xml) for xml in feeds], output)
+    return merger, output.getvalue()
+
+  def test_record_index(self):
+    """The latest copy of each record should be chosen, and records without
+    an id should all be kept."""
+    index = pfif_merger.RecordIndex()
+    path = index.temp_path
+    for sequence, fields in enumerate([
+        [('person_record_id', 'a'), ('entry_date', '2010-01-02T00:00:00Z')],
+        [('person_record_id', 'a'), ('entry_date', '2010-01-01T00:00:00Z')],
+        [('full_name', 'no id')], [('full_name', 'no id')]]):
+      index.add_record('person', sequence, fields)
+    index.add_record('note', 0, [('note_record_id', 'a'), ('text', 'old')],
+                     'a')
+    index.add_record('note', 1, [('note_record_id', 'a'), ('text', 'new')],
+                     'b')
+    self.assertEqual(index.choose_records(), {'person' : 1, 'note' : 1})
+    self.assertEqual(list(index.iter_chosen_persons()), [0, 2, 3])
+    self.assertEqual(list(index.iter_chosen_notes()),
+                     [('b', [('note_record_id', 'a'), ('text', 'new')])])
+    index.close()
+    self.assertFalse(os.path.exists(path))
+
+  def test_merge(self):
+    """Duplicates should be dropped by entry_date, then source_date, then
+    the feed read last, and every note should be nested in its person."""
+    for parser in utils.get_available_parsers():
+      merger, merged_xml = MergerTests.merge(MergerTests.make_feeds(),
+                                             parser=parser)
+      self.assertEqual(merger.person_count, 7)
+      self.assertEqual(merger.note_count, 6)
+      self.assertEqual(merger.duplicates, {'person' : 3, 'note' : 2})
+      self.assertEqual(merger.converter.records_written, 5)
+      self.assertEqual(merger.converter.notes_nested, 3)
+      self.assertFalse([message for message in merger.converter.messages
+                        if message.is_error])
+
+      tree = utils.PfifXmlTree(StringIO(merged_xml))
+      self.assertEqual(tree.version, 1.3)
+      self.assertEqual(
+          [tree.get_field_text(person, 'full_name')
+           for person in tree.get_all_persons()],
+          ['new', 'first', 'new', 'new'])
+      notes = tree.get_top_level_notes()
+      self.assertEqual([tree.get_field_text(note, 'text') for note in notes],
+                       ['orphan'])
+      records = pfif_diff.objectify_pfif_xml(StringIO(merged_xml))
+      newer_entry_key = pfif_diff.record_id_to_key('example.org/newer_entry',
+                                                   True)
+      self.assertEqual(records[newer_entry_key]['full_name'], 'new')
+      for record_id, text in [('note1', 'new'), ('note2', 'nested'),
+                              ('note4', 'about newer_source')]:
+        self.assertEqual(records[pfif_diff.record_id_to_key(
+            'example.org/' + record_id, False)]['text'], text)
+      validator = PfifValidator(StringIO(merged_xml))
+      self.assertEqual(validator.validate_person_ids_are_unique(), [])
+      self.assertEqual(validator.validate_note_ids_are_unique(), [])
+      self.assertEqual(validator.validate_notes_belong_to_persons(), [])
+
+  def test_versions(self):
+    """Feeds of different versions should be merged into the newest one,
+    unless another is asked for, and notes without a person can't be kept in
+    1.1."""
+    feeds = MergerTests.make_feeds()[:1]
+    output = StringIO()
+    writer = utils.PfifXmlWriter(output, 1.1)
+    writer.write_record('person', [('person_record_id', 'example.org/old'),
+                                   ('first_name', 'OLD'),
+                                   ('last_name', 'FEED')])
+    writer.close()
+    feeds.append(output.getvalue())
+    merger, merged_xml = MergerTests.merge(feeds)
+    self.assertEqual(utils.PfifXmlTree(StringIO(merged_xml)).version, 1.3)
+    records = pfif_diff.objectify_pfif_xml(StringIO(merged_xml))
+    self.assertEqual(
+        records[pfif_diff.record_id_to_key('example.org/old', True)][
+            'full_name'], 'OLD FEED')
+
+    merger, merged_xml = MergerTests.merge(feeds, target_version=1.1)
+    tree = utils.PfifXmlTree(StringIO(merged_xml))
+    self.assertEqual(tree.version, 1.1)
+    self.assertEqual(tree.get_top_level_notes(), [])
+    self.assertEqual(merger.converter.orphaned_notes, 1)
+
+  def test_main(self):
+    """main should write the merged feed and print what it did."""
+    output, merged_xml = main_runner.run_main(
+        pfif_merger.main, ['pfif_merger.py'], MergerTests.make_feeds())
+    self.assertTrue(output.startswith(
+        '2 feeds merged with 7 persons and 6 notes\n'
+        '3 duplicate persons dropped\n2 duplicate notes dropped\n'
+        '5 records written in PFIF 1.3\n'))
+    self.assertEqual(merged_xml,
+                     MergerTests.merge(MergerTests.make_feeds())[1])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for pfif_parallel.py"""
+
+import unittest
+import gzip
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+import pfif_diff
+import pfif_generator
+import pfif_parallel
+import pfif_validator
+import utils
+import tests.pfif_xml as PfifXml
+
+class ParallelTests(unittest.TestCase):
+  """Defines tests for pfif_parallel.py"""
+
+  def setUp(self): # pylint: disable=C0103
+    """Makes a directory for the feeds and clears the debug file left by other
+    tests, which would be read instead of the feeds."""
+    self.temp_dir = tempfile.mkdtemp()
+    utils.set_file_for_test(None)
+
+  def tearDown(self): # pylint: disable=C0103
+    """Removes the directory."""
+    shutil.rmtree(self.temp_dir)
+
+  def write_feed(self, xml, name='feed.xml'):
+    """Writes xml to a file and returns its path."""
+    path = os.path.join(self.temp_dir, name)
+    feed_file = open(path, 'wb')
+    try:
+      feed_file.write(xml)
+    finally:
+      feed_file.close()
+    return path
+
+  @staticmethod
+  def parse(path):
+    """Parses the file at path in as many chunks as it has records."""
+    return pfif_parallel.ParallelPfifXmlTree(path, processes=2, chunk_bytes=1)
+
+  def test_find_chunks(self):
+    """Chunks should start at top level records, but not at nested notes or
+    anything in a comment or CDATA section."""
+    xml = PfifXml.XML_TOP_LEVEL_NOTE_PERSON_11
+    chunks = pfif_parallel.find_chunks(xml, 1)
+    self.assertEqual([line for _, line in chunks.starts], [1, 3, 4, 10])
+    self.assertEqual([xml[start:start + 12] for start, _ in chunks.starts[1:]],
+                     ['<pfif:note /', '<pfif:person', '<pfif:note>\n'])
+    self.assertEqual(xml[:chunks.header_end].splitlines()[-1],
+                     '<pfif:pfif xmlns:pfif="http://zesty.ca/pfif/1.1">')
+    self.assertEqual(chunks.header_line, 2)
+    self.assertEqual(chunks.close_tag, '</pfif:pfif>')
+
+    self.assertEqual(len(pfif_parallel.find_chunks(xml, 1000).starts), 1)
+
+    xml = ('<!-- <pfif:pfif> -->\n<pfif xmlns="http://zesty.ca/pfif/1.3">\n'
+           '<!-- <person> --><note>\n<![CDATA[<person>]]></note>\n'
+           '<person/><note/></pfif>')
+    chunks = pfif_parallel.find_chunks(xml, 1)
+    self.assertEqual(chunks.starts[1:], [(xml.index('<note>'), 3),
+                                         (xml.index('<person/>'), 5),
+                                         (xml.index('<note/>'), 5)])
+    self.assertEqual(chunks.close_tag, '</pfif>')
+
+    for xml in ['', 'not xml', '<pfif:pfif/>', '\x1f\x8b<pfif>']:
+      self.assertEqual(pfif_parallel.find_chunks(xml, 1), None)
+
+  def test_same_as_parsing(self):
+    """A file parsed in chunks should have the same elements, lines, line
+    numbers, messages, and objects as one parsed in one piece."""
+    generator = pfif_generator.FeedGenerator(
+        30, seed=7, error_rate=0.1, link_rate=0.3, top_level_note_ratio=0.5)
+    output = StringIO()
+    generator.write_feed(output)
+    bad_child_xml = PfifXml.XML_TOP_LEVEL_NOTE_PERSON_11.replace(
+        '  <pfif:person>', '  <pfif:foo />\n  <pfif:person>')
+    for xml in [output.getvalue(), PfifXml.XML_UNICODE_12,
+                PfifXml.XML_TOP_LEVEL_NOTE_PERSON_11, bad_child_xml]:
+      path = self.write_feed(xml)
+      for parser in utils.get_available_parsers():
+        tree = pfif_parallel.ParallelPfifXmlTree(path, parser=parser,
+                                                 processes=2, chunk_bytes=1)
+        self.assertTrue(tree.chunk_count > 1)
+        expected_tree = utils.PfifXmlTree(StringIO(xml), parser=parser)
+        self.assertEqual(tree.version, expected_tree.version)
+        self.assertEqual(tree.lines, expected_tree.lines)
+        self.assertEqual(tree.bytes_read, expected_tree.bytes_read)
+        elements = list(tree.getroot().getiterator())
+        expected_elements = list(expected_tree.getroot().getiterator())
+        self.assertEqual(
+            [(elem.tag, elem.text, elem.tail, tree.line_numbers[elem])
+             for elem in elements],
+            [(elem.tag, elem.text, elem.tail,
+              expected_tree.line_numbers[elem])
+             for elem in expected_elements])
+      self.assertEqual(
+          pfif_validator.PfifValidator(ParallelTests.parse(path))
+          .run_validations(),
+          pfif_validator.PfifValidator(StringIO(xml)).run_validations())
+      self.assertEqual(
+          pfif_diff.objectify_pfif_tree(ParallelTests.parse(path)),
+          pfif_diff.objectify_pfif_xml(StringIO(xml)))
+
+  def test_parsed_in_one_piece(self):
+    """Files that can't be split, or that fail to parse in chunks, should be
+    parsed in one piece, with the same results or errors."""
+    nested_xml = PfifXml.XML_TOP_LEVEL_NOTE_PERSON_11.replace(
+        '  <pfif:person>', '  <pfif:foo>\n  <pfif:person>').replace(
+            '  </pfif:person>', '  </pfif:person>\n  </pfif:foo>')
+    gzip_path = os.path.join(self.temp_dir, 'feed.xml.gz')
+    gzip_file = gzip.open(gzip_path, 'wb')
+    gzip_file.write(PfifXml.XML_11_FULL)
+    gzip_file.close()
+    for path, xml in [(self.write_feed(nested_xml), nested_xml),
+                      (gzip_path, PfifXml.XML_11_FULL)]:
+      tree = ParallelTests.parse(path)
+      self.assertEqual(tree.chunk_count, 0)
+      expected_tree = utils.PfifXmlTree(StringIO(xml))
+      self.assertEqual(tree.lines, expected_tree.lines)
+      self.assertEqual(
+          [elem.tag for elem in tree.getroot().getiterator()],
+          [elem.tag for elem in expected_tree.getroot().getiterator()])
+
+    tree = pfif_parallel.ParallelPfifXmlTree(
+        self.write_feed(PfifXml.XML_11_FULL), processes=1, chunk_bytes=1)
+    self.assertEqual(tree.chunk_count, 0)
+
+    path = self.write_feed(PfifXml.XML_TOP_LEVEL_NOTE_PERSON_11.replace(
+        '</pfif:note>\n</pfif:pfif>', '</pfif:person>\n</pfif:pfif>'))
+    self.assertRaises(SyntaxError, ParallelTests.parse, path)
+    path = self.write_feed(PfifXml.XML_NON_PFIF_ROOT)
+    self.assertRaises(AssertionError, ParallelTests.parse, path)
+
+if __name__ == '__main__':
+  unittest.main()
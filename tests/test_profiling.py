@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for profiling.py"""
+
+import unittest
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+from StringIO import StringIO
+import tests.pfif_xml as PfifXml
+import pfif_diff
+import pfif_validator
+import profiling
+import utils
+
+class ProfilingTests(unittest.TestCase):
+  """Defines tests for profiling.py"""
+
+  def setUp(self): # pylint: disable=C0103
+    """Makes a directory for pstats files."""
+    self.output_dir = tempfile.mkdtemp()
+
+  def tearDown(self): # pylint: disable=C0103
+    """Removes the directory for pstats files and the debug file."""
+    shutil.rmtree(self.output_dir)
+    utils.set_file_for_test(None)
+
+  def test_disabled(self):
+    """A disabled profiler should only call the function."""
+    profiler = profiling.PhaseProfiler(enabled=False)
+    self.assertEqual(profiler.run('add', lambda a, b: a + b, 1, b=2), 3)
+    self.assertEqual(profiler.phases, [])
+
+  def test_phases(self):
+    """Each phase should have its own profile, time, and peak memory, and the
+    profiles should be written as pstats files."""
+    profiler = profiling.PhaseProfiler()
+    tree = profiler.run('parse', utils.PfifXmlTree,
+                        StringIO(PfifXml.XML_FULL_12))
+    profiler.run('objectify', pfif_diff.objectify_pfif_tree, tree)
+    profiler.finish()
+    self.assertEqual([phase.name for phase in profiler.phases],
+                     ['parse', 'objectify'])
+    for phase in profiler.phases:
+      self.assertTrue(phase.seconds >= 0)
+      self.assertTrue(phase.peak_memory_kb > 0)
+    report = profiler.to_str()
+    self.assertTrue('--- parse' in report)
+    self.assertTrue('initialize_tree' in report)
+
+    prefix = os.path.join(self.output_dir, 'diff')
+    paths = profiler.write_stats(prefix)
+    self.assertEqual(paths, [prefix + '.parse.pstats',
+                             prefix + '.objectify.pstats', prefix + '.pstats'])
+    functions = [function[2] for function in
+                 pstats.Stats(prefix + '.pstats').stats.keys()]
+    self.assertTrue('initialize_tree' in functions)
+    self.assertTrue('objectify_parents' in functions)
+    functions = [function[2] for function in
+                 pstats.Stats(prefix + '.parse.pstats').stats.keys()]
+    self.assertFalse('objectify_parents' in functions)
+
+  def run_main(self, main, argv):
+    """Runs main with argv and returns what was written to stderr."""
+    old_argv = sys.argv
+    old_stdout = sys.stdout
+    old_stderr = sys.stderr
+    sys.argv = argv
+    sys.stdout = StringIO('')
+    sys.stderr = StringIO('')
+    utils.set_file_for_test(StringIO(PfifXml.XML_11_FULL))
+    try:
+      main()
+      return sys.stderr.getvalue()
+    finally:
+      sys.stdout = old_stdout
+      sys.stderr = old_stderr
+      sys.argv = old_argv
+
+  def test_main_options(self):
+    """--profile-output should write a pstats file for each phase of the
+    validator and diff tools."""
+    prefix = os.path.join(self.output_dir, 'validator')
+    report = self.run_main(pfif_validator.main,
+                           ['pfif_validator.py', 'mocked_file',
+                            '--profile-output', prefix])
+    for phase in ['parse', 'rules', 'render']:
+      self.assertTrue(os.path.exists(prefix + '.' + phase + '.pstats'))
+      self.assertTrue('--- ' + phase in report)
+
+    prefix = os.path.join(self.output_dir, 'diff')
+    report = self.run_main(pfif_diff.main,
+                           ['pfif_diff.py', 'mocked_file', 'mocked_file',
+                            '--profile-output', prefix])
+    for phase in ['parse', 'objectify', 'diff', 'render']:
+      self.assertTrue(os.path.exists(prefix + '.' + phase + '.pstats'))
+    self.assertTrue(os.path.exists(prefix + '.pstats'))
+
+    self.assertEqual(self.run_main(pfif_diff.main, ['pfif_diff.py', 'a', 'b']),
+                     '')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for pfif_scrubber.py"""
+
+import unittest
+from datetime import datetime
+from StringIO import StringIO
+import pfif_diff
+import pfif_generator
+import pfif_scrubber
+import pfif_validator
+import utils
+import tests.pfif_xml as PfifXml
+from tests import main_runner
+
+class ScrubberTests(unittest.TestCase):
+  """Defines tests for pfif_scrubber.py"""
+
+  # A time after everything in the test feeds with expiry dates in 1999
+  NOW = datetime(2000, 1, 1)
+
+  def setUp(self): # pylint: disable=C0103
+    """Clears the debug file and time left by other tests."""
+    utils.set_file_for_test(None)
+    utils.set_utcnow_for_test(ScrubberTests.NOW)
+
+  def tearDown(self): # pylint: disable=C0103
+    """Resets the time."""
+    utils.set_utcnow_for_test(None)
+
+  @staticmethod
+  def make_feed():
+    """Returns a feed with an expired person with data, notes, and dates that
+    don't match, whose top level notes come before and after it, an expired
+    placeholder whose dates are already right, and a person that hasn't
+    expired yet."""
+    output = StringIO()
+    writer = utils.PfifXmlWriter(output, 1.3)
+    writer.write_record('note', [('note_record_id', 'example.org/note1'),
+                                 ('person_record_id', 'example.org/expired'),
+                                 ('author_name', 'author'),
+                                 ('source_date', '1998-01-01T00:00:00Z'),
+                                 ('text', 'before the person')])
+    writer.write_record(
+        'person', [('person_record_id', 'example.org/expired'),
+                   ('entry_date', '1998-01-01T00:00:00Z'),
+                   ('expiry_date', '1999-02-03T04:05:06Z'),
+                   ('source_date', '1997-01-01T00:00:00Z'),
+                   ('full_name', 'Jane Doe'), ('other', '')],
+        [[('note_record_id', 'example.org/note2'), ('author_name', 'author'),
+          ('source_date', '1998-01-01T00:00:00Z'), ('text', 'nested')]])
+    writer.write_record(
+        'person', [('person_record_id', 'example.org/placeholder'),
+                   ('entry_date', '1999-02-03T16:00:00Z'),
+                   ('expiry_date', '1999-02-03T04:05:06Z'),
+                   ('source_date', '1999-02-03T16:00:00Z'),
+                   ('full_name', '')])
+    writer.write_record(
+        'person', [('person_record_id', 'example.org/current'),
+                   ('entry_date', '1998-01-01T00:00:00Z'),
+                   ('expiry_date', '2001-01-01T00:00:00Z'),
+                   ('source_date', '1998-01-01T00:00:00Z'),
+                   ('full_name', 'John Doe')],
+        [[('note_record_id', 'example.org/note3'), ('author_name', 'author'),
+          ('source_date', '1998-01-01T00:00:00Z'), ('text', 'kept')]])
+    writer.write_record('note', [('note_record_id', 'example.org/note4'),
+                                 ('person_record_id', 'example.org/expired'),
+                                 ('author_name', 'author'),
+                                 ('source_date', '1998-01-01T00:00:00Z'),
+                                 ('text', 'after the person')])
+    writer.write_record('note', [('note_record_id', 'example.org/note5'),
+                                 ('person_record_id', 'example.org/current'),
+                                 ('author_name', 'author'),
+                                 ('source_date', '1998-01-01T00:00:00Z'),
+                                 ('text', 'kept')])
+    writer.close()
+    return output.getvalue()
+
+  @staticmethod
+  def scrub(xml, parser=None, now=NOW):
+    """Returns the scrubber and the scrubbed xml."""
+    scrubber = pfif_scrubber.ExpiredRecordScrubber(now=now, parser=parser)
+    scrubber.find_expired_persons(StringIO(xml))
+    output = StringIO()
+    scrubber.scrub(StringIO(xml), output)
+    return scrubber, output.getvalue()
+
+  @staticmethod
+  def get_expiry_messages(xml):
+    """Returns the messages of the expiry rule for xml."""
+    return pfif_validator.PfifValidator(
+        StringIO(xml)).validate_expired_records_removed()
+
+  @staticmethod
+  def get_errors(xml):
+    """Returns the errors of every rule for xml."""
+    return [message for message in
+            pfif_validator.PfifValidator(StringIO(xml)).run_validations()
+            if message.is_error]
+
+  def assert_scrubbed_again_unchanged(self, scrubbed_xml, now=NOW):
+    """Scrubbing a feed that was already scrubbed shouldn't change it."""
+    scrubber, rescrubbed_xml = ScrubberTests.scrub(scrubbed_xml, now=now)
+    self.assertEqual(scrubber.persons_scrubbed, 0)
+    self.assertEqual(scrubber.notes_removed, 0)
+    self.assertEqual(rescrubbed_xml, scrubbed_xml)
+
+  def test_scrub(self):
+    """Expired persons should become placeholders with the right dates, their
+    notes should be removed, and everything else should be kept."""
+    xml = ScrubberTests.make_feed()
+    self.assertTrue(len(ScrubberTests.get_expiry_messages(xml)) > 3)
+    for parser in utils.get_available_parsers():
+      scrubber, scrubbed_xml = ScrubberTests.scrub(xml, parser=parser)
+      self.assertEqual(scrubber.expired_person_ids,
+                       set(['example.org/expired', 'example.org/placeholder']))
+      # The placeholder is already scrubbed, so it isn't counted.
+      self.assertEqual(scrubber.persons_scrubbed, 1)
+      self.assertEqual(scrubber.notes_removed, 3)
+      self.assertEqual(ScrubberTests.get_errors(scrubbed_xml), [])
+      self.assert_scrubbed_again_unchanged(scrubbed_xml)
+      records = pfif_diff.objectify_pfif_xml(StringIO(scrubbed_xml))
+      expected_records = pfif_diff.objectify_pfif_xml(StringIO(xml))
+      for record_id, is_person in [('example.org/current', True),
+                                   ('example.org/note3', False),
+                                   ('example.org/note5', False)]:
+        key = pfif_diff.record_id_to_key(record_id, is_person)
+        self.assertEqual(records.pop(key), expected_records[key])
+      self.assertEqual(
+          records, {pfif_diff.record_id_to_key('example.org/expired', True) :
+                    {'person_record_id' : 'example.org/expired',
+                     'expiry_date' : '1999-02-03T04:05:06Z',
+                     'source_date' : '1999-02-03T04:05:06Z',
+                     'entry_date' : '1999-02-03T04:05:06Z',
+                     'full_name' : ''},
+                    pfif_diff.record_id_to_key('example.org/placeholder',
+                                               True) :
+                    {'person_record_id' : 'example.org/placeholder',
+                     'expiry_date' : '1999-02-03T04:05:06Z',
+                     'source_date' : '1999-02-03T16:00:00Z',
+                     'entry_date' : '1999-02-03T16:00:00Z',
+                     'full_name' : ''}})
+
+  def test_validator_feeds(self):
+    """The feeds that fail the expiry rule should have no errors at all once
+    scrubbed, feeds without expiry dates should be unchanged, and feeds whose
+    expired persons are already placeholders should be unchanged."""
+    for xml in [PfifXml.XML_EXPIRE_99_HAS_DATA_NONSYNCED_DATES,
+                PfifXml.XML_EXPIRE_99_HAS_NOTE_DATA,
+                PfifXml.XML_EXPIRE_99_HAS_DATA_SYNCED_DATES,
+                PfifXml.XML_EXPIRE_99_NO_DATA_NONSYNCED_DATES]:
+      self.assertTrue(ScrubberTests.get_expiry_messages(xml))
+      _, scrubbed_xml = ScrubberTests.scrub(xml)
+      self.assertEqual(ScrubberTests.get_errors(scrubbed_xml), [])
+      self.assert_scrubbed_again_unchanged(scrubbed_xml)
+    for xml in [PfifXml.XML_EXPIRE_99_12, PfifXml.XML_NO_EXPIRY_DATE,
+                PfifXml.XML_FULL_12]:
+      scrubber, scrubbed_xml = ScrubberTests.scrub(xml)
+      self.assertEqual(scrubber.persons_scrubbed, 0)
+      self.assertEqual(pfif_diff.objectify_pfif_xml(StringIO(scrubbed_xml)),
+                       pfif_diff.objectify_pfif_xml(StringIO(xml)))
+
+    # The generator's expired persons are placeholders already.
+    output = StringIO()
+    pfif_generator.FeedGenerator(
+        50, seed=3, expired_rate=0.3, top_level_note_ratio=0.5).write_feed(
+            output)
+    later = datetime(2020, 1, 1)
+    utils.set_utcnow_for_test(later)
+    self.assertEqual(ScrubberTests.get_errors(output.getvalue()), [])
+    scrubber, scrubbed_xml = ScrubberTests.scrub(output.getvalue(), now=later)
+    self.assertTrue(scrubber.expired_person_ids)
+    self.assertEqual(scrubber.persons_scrubbed, 0)
+    self.assertEqual(ScrubberTests.get_errors(scrubbed_xml), [])
+    self.assert_scrubbed_again_unchanged(scrubbed_xml, now=later)
+
+  def test_main(self):
+    """main should write the scrubbed feed to the output file."""
+    output, scrubbed_xml = main_runner.run_main(
+        pfif_scrubber.main, ['pfif_scrubber.py'], [ScrubberTests.make_feed()])
+    self.assertEqual(output,
+                     '1 expired persons scrubbed, 3 notes removed\n')
+    self.assertEqual(scrubbed_xml,
+                     ScrubberTests.scrub(ScrubberTests.make_feed())[1])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -17,9 +17,16 @@
 
 import utils
 import unittest
+import bz2
+import copy
+import gzip
+import os
+import pickle
+from datetime import datetime
 from StringIO import StringIO
 import tests.pfif_xml as PfifXml
 import pfif_diff
+import pfif_validator
 
 class UtilTests(unittest.TestCase):
   """Defines tests for utils.py"""
@@ -40,6 +47,99 @@ class UtilTests(unittest.TestCase):
     namespace"""
     self.assertEqual(utils.extract_tag("{foo}bar"), "bar")
 
+  # PfifDateCache
+
+  def test_date_cache(self):
+    """PfifDateCache should parse dates with and without fractional seconds,
+    tell apart bad formats from dates that don't exist, and stay bounded."""
+    dates = utils.PfifDateCache(max_size=2)
+    self.assertEqual(dates.parse('2010-01-02T03:04:05Z'),
+                     datetime(2010, 1, 2, 3, 4, 5))
+    self.assertEqual(dates.parse('2010-01-02T03:04:05.25Z'),
+                     datetime(2010, 1, 2, 3, 4, 5))
+    self.assertTrue(dates.has_date_format('2010-02-30T00:00:00Z'))
+    self.assertEqual(dates.parse('2010-02-30T00:00:00Z'), None)
+    self.assertFalse(dates.has_date_format('2010-01-02'))
+    self.assertEqual(dates.parse('2010-01-02'), None)
+    self.assertTrue(len(dates.dates) <= 2)
+    self.assertEqual(dates.parse('2010-01-02T03:04:05Z'),
+                     datetime(2010, 1, 2, 3, 4, 5))
+
+  # Compressed input
+
+  @staticmethod
+  def compress(text, compression):
+    """Returns text compressed with compression, one of gzip or bz2."""
+    if compression == 'bz2':
+      return bz2.compress(text)
+    output = StringIO()
+    gzip_file = gzip.GzipFile(fileobj=output, mode='wb')
+    gzip_file.write(text)
+    gzip_file.close()
+    return output.getvalue()
+
+  @staticmethod
+  def make_pipe(text):
+    """Returns a pipe that will read text.  It has a seek method, but it
+    can't seek."""
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, text)
+    os.close(write_fd)
+    return os.fdopen(read_fd, 'r')
+
+  def test_open_compressed(self):
+    """open_compressed should detect gzip and bz2 by their magic bytes, even
+    in files and pipes that can't seek, and PfifXmlTree should have the same lines and
+    line numbers as for the uncompressed file."""
+    class UnseekableFile(object):
+      """A file that can only be read forwards."""
+      def __init__(self, text):
+        self.source = StringIO(text)
+      def read(self, num_bytes=-1):
+        """Reads up to num_bytes bytes."""
+        return self.source.read(num_bytes)
+      def readline(self):
+        """Reads one line."""
+        return self.source.readline()
+    expected_tree = utils.PfifXmlTree(StringIO(PfifXml.XML_11_FULL))
+    for compression in [None, 'gzip', 'bz2']:
+      text = PfifXml.XML_11_FULL
+      if compression:
+        text = UtilTests.compress(text, compression)
+      for source in [StringIO(text), UnseekableFile(text),
+                     UtilTests.make_pipe(text)]:
+        tree = utils.PfifXmlTree(utils.open_compressed(source))
+        self.assertEqual(tree.lines, expected_tree.lines)
+        self.assertEqual(sorted(tree.line_numbers.values()),
+                         sorted(expected_tree.line_numbers.values()))
+    # Text that was already decoded is never compressed.
+    text = unicode(PfifXml.XML_11_FULL)
+    self.assertEqual(utils.open_compressed(StringIO(text)).read(), text)
+
+  def test_decompressing_file(self):
+    """DecompressingFile should read lines across chunks and concatenated
+    streams, and should use the Content-Encoding if it is given."""
+    text = ''.join(['line %d\n' % number for number in range(5000)])
+    compressed = (UtilTests.compress(text[:100], 'gzip') +
+                  UtilTests.compress(text[100:], 'gzip'))
+    old_chunk_size = utils.DecompressingFile.CHUNK_SIZE
+    utils.DecompressingFile.CHUNK_SIZE = 7
+    try:
+      decompressed = utils.open_compressed(StringIO(compressed),
+                                           content_encoding='x-gzip')
+      lines = []
+      line = decompressed.readline()
+      while line:
+        lines.append(line)
+        line = decompressed.readline()
+    finally:
+      utils.DecompressingFile.CHUNK_SIZE = old_chunk_size
+    self.assertEqual(lines, text.splitlines(True))
+    decompressed = utils.open_compressed(
+        StringIO(UtilTests.compress(text, 'bz2')))
+    self.assertEqual(decompressed.read(5), 'line ')
+    self.assertEqual(decompressed.read(), text[5:])
+
   # PfifXmlTree initialization
 
   def test_valid_xml(self):
@@ -50,6 +150,121 @@ class UtilTests(unittest.TestCase):
     self.assertTrue(tree.lines)
     self.assertTrue(tree.line_numbers)
 
+  def test_xml_is_read_once(self):
+    """PfifXmlTree should not need to seek on its input, so it can parse
+    directly from a stream, and it should still record every line."""
+    class UnseekableFile(object):
+      """A file that can only be read forwards."""
+      def __init__(self, text):
+        self.source = StringIO(text)
+      def readline(self):
+        """Reads one line."""
+        return self.source.readline()
+    tree = utils.PfifXmlTree(UnseekableFile(PfifXml.XML_11_FULL))
+    self.assertEqual(''.join(tree.lines), PfifXml.XML_11_FULL)
+    self.assertEqual(len(tree.get_all_persons()), 1)
+
+  @staticmethod
+  def parse_with(xml, parser):
+    """Returns the lines, line numbers, and validation messages of xml parsed
+    with parser, or the kind of error if it can't be parsed."""
+    try:
+      validator = pfif_validator.PfifValidator(StringIO(xml), parser=parser)
+    except SyntaxError:
+      return 'syntax error'
+    except AssertionError, error:
+      return str(error)
+    tree = validator.tree
+    line_numbers = [tree.line_numbers[elem]
+                    for elem in tree.getroot().getiterator()]
+    messages = [message.get_fields()
+                for message in validator.run_validations()]
+    return (tree.lines, line_numbers, messages)
+
+  def test_parsers_match(self):
+    """Every installed parser should give the same lines, line numbers, and
+    validation messages, and should fail on the same input, including input
+    with entities and input with more lines than libxml2 can store."""
+    self.assertEqual(utils.get_available_parsers()[-1], 'ElementTree')
+    person = ('<pfif:pfif xmlns:pfif="http://zesty.ca/pfif/1.3">\n'
+              '<pfif:person><pfif:person_record_id>example.org/%s'
+              '</pfif:person_record_id></pfif:person>\n</pfif:pfif>')
+    extra_fixtures = [
+        person % '&undefined;',
+        '<!DOCTYPE pfif [<!ENTITY id "local">]>\n' + person % '&id;',
+        '<!DOCTYPE pfif [<!ENTITY id SYSTEM "file:///etc/hostname">]>\n' +
+        person % '&id;',
+        person % '&amp;&#65;',
+        person.replace('>\n<', '>' + '  \n' * 70000 + '<').replace(
+            '><', '>\n  <') % 'long']
+    fixtures = [value for name, value in sorted(vars(PfifXml).items())
+                if name.startswith('XML_') and isinstance(value, basestring)]
+    for xml in fixtures + extra_fixtures:
+      results = [UtilTests.parse_with(xml, parser)
+                 for parser in utils.get_available_parsers()]
+      for result in results[1:]:
+        self.assertEqual(result, results[0])
+    self.assertEqual(UtilTests.parse_with(extra_fixtures[0], None),
+                     'syntax error')
+    self.assertEqual(UtilTests.parse_with(extra_fixtures[2], None),
+                     'syntax error')
+    self.assertEqual(UtilTests.parse_with(extra_fixtures[1], None)[2][0][
+        'person_record_id'], 'example.org/local')
+
+  def test_iter_records(self):
+    """iter_records should yield the root and then each person and top level
+    note, the same way with every parser, keeping only one record at a time."""
+    xml = PfifXml.XML_TOP_LEVEL_NOTE_PERSON_11.replace(
+        '</pfif:pfif>', '<pfif:unknown/></pfif:pfif>')
+    results = []
+    # Records that end on the same line as the next one starts are parsed
+    # together.
+    for parser, xml in [(parser, xml) for parser in
+                        utils.get_available_parsers() for xml in
+                        [xml, xml.replace('\n', '')]]:
+      records = utils.iter_records(StringIO(xml), parser=parser)
+      root = records.next()
+      result = [utils.extract_tag(root.tag)]
+      previous = None
+      for record in records:
+        if previous is not None:
+          self.assertEqual(len(previous), 0)
+        previous = record
+        result.append((utils.extract_tag(record.tag),
+                       [utils.extract_tag(child.tag) for child in record]))
+      self.assertEqual(len(root), 0)
+      results.append(result)
+    self.assertEqual(results[0][0], 'pfif')
+    self.assertEqual([record[0] for record in results[0][1:]],
+                     ['note', 'person', 'note'])
+    for result in results[1:]:
+      self.assertEqual(result, results[0])
+
+  def test_record_fields(self):
+    """The fields and notes of a record from iter_records should be copied
+    out in order, and the version should be read from the root."""
+    records = utils.iter_records(StringIO(PfifXml.XML_11_FULL))
+    self.assertEqual(utils.read_version(records), 1.1)
+    person = records.next()
+    fields = utils.get_fields(person)
+    self.assertEqual(fields[:2],
+                     [('person_record_id', 'example.org/local-id.3'),
+                      ('entry_date', '1234-56-78T90:12:34Z')])
+    self.assertFalse('note' in [field for field, _ in fields])
+    self.assertEqual(utils.get_field(fields, 'home_zip'), '12345')
+    self.assertEqual(utils.get_field(fields, 'sex'), None)
+    notes = utils.get_notes(person)
+    self.assertEqual([utils.get_field(note, 'note_record_id')
+                      for note in notes],
+                     ['www.example.org/local-id.4',
+                      'www.example.org/local-id.5'])
+    self.assertEqual(utils.get_field_name('{http://zesty.ca/pfif/1.1}note'),
+                     'note')
+    self.assertRaises(SyntaxError, utils.read_version, iter([]))
+    self.assertRaises(AssertionError, utils.read_version,
+                      utils.iter_records(StringIO(
+                          PfifXml.XML_BAD_PFIF_VERSION)))
+
   def test_invalid_xml(self):
     """initialize_xml should raise an error on a string of invalid XML."""
     invalid_xml_file = StringIO(PfifXml.XML_INVALID)
@@ -87,6 +302,104 @@ class UtilTests(unittest.TestCase):
     pfif_bad_website_xml_file = StringIO(PfifXml.XML_BAD_PFIF_WEBSITE)
     self.assertRaises(Exception, utils.PfifXmlTree, pfif_bad_website_xml_file)
 
+  def test_get_pfif_version(self):
+    """get_pfif_version should read the version out of a PFIF tag."""
+    self.assertEqual(utils.get_pfif_version('{http://zesty.ca/pfif/1.3}pfif'),
+                     1.3)
+    self.assertEqual(utils.get_pfif_version('{http://zesty.ca/pfif/}pfif'),
+                     None)
+    self.assertEqual(utils.get_pfif_version('pfif'), None)
+
+  def test_read_message_lines(self):
+    """read_message_lines should only keep the lines that messages are on."""
+    messages = [utils.Message('category', xml_line_number=3),
+                utils.Message('category', xml_line_number=1),
+                utils.Message('category')]
+    xml_lines = utils.MessagesOutput.read_message_lines(
+        StringIO('a\nb\nc\nd\n'), messages)
+    self.assertEqual(xml_lines, {0 : 'a\n', 2 : 'c\n'})
+    self.assertEqual(
+        utils.MessagesOutput.messages_to_str(messages, xml_lines=xml_lines),
+        utils.MessagesOutput.messages_to_str(
+            messages, xml_lines=['a\n', 'b\n', 'c\n', 'd\n']))
+
+  # Atom feeds
+
+  def test_atom_feed(self):
+    """PfifXmlTree should unwrap the records of an Atom feed, keeping their
+    line numbers, with the version of their namespace."""
+    for parser in utils.get_available_parsers():
+      tree = utils.PfifXmlTree(StringIO(PfifXml.XML_ATOM_12), parser=parser)
+      self.assertEqual(tree.version, 1.2)
+      self.assertEqual(tree.getroot().tag, tree.add_namespace_to_tag('pfif'))
+      self.assertEqual(tree.lines,
+                       StringIO(PfifXml.XML_ATOM_12).readlines())
+      persons = tree.get_all_persons()
+      top_level_notes = tree.get_top_level_notes()
+      self.assertEqual([tree.line_numbers[record] for record in
+                        persons + tree.get_child_notes() + top_level_notes],
+                       [8, 11, 20])
+      self.assertEqual(tree.get_field_text(top_level_notes[0],
+                                           'note_record_id'),
+                       'example.org/note2')
+      # Only the elements that are left have line numbers.
+      self.assertEqual(len(tree.line_numbers),
+                       len(list(tree.getroot().getiterator())))
+
+      tree = utils.PfifXmlTree(StringIO(PfifXml.XML_ATOM_DEFAULT_NAMESPACE_13),
+                               parser=parser)
+      self.assertEqual(tree.version, 1.3)
+      self.assertEqual(len(tree.get_all_persons()), 1)
+      tree = utils.PfifXmlTree(StringIO(PfifXml.XML_ATOM_NO_ENTRIES_13),
+                               parser=parser)
+      self.assertEqual(tree.version, 1.3)
+      self.assertEqual(tree.get_root_children(), [])
+      self.assertRaises(AssertionError, utils.PfifXmlTree,
+                        StringIO(PfifXml.XML_ATOM_NO_PFIF), parser=parser)
+
+  def test_iter_records_atom_feed(self):
+    """iter_records should yield a pfif root and then the records of each
+    entry of an Atom feed, emptying each entry when it is done."""
+    for parser in utils.get_available_parsers():
+      for xml, expected_root, expected_records in [
+          (PfifXml.XML_ATOM_12, '{http://zesty.ca/pfif/1.2}pfif',
+           ['person', 'note']),
+          (PfifXml.XML_ATOM_DEFAULT_NAMESPACE_13,
+           '{http://zesty.ca/pfif/1.3}pfif', ['person']),
+          (PfifXml.XML_ATOM_NO_ENTRIES_13, '{http://zesty.ca/pfif/1.3}pfif',
+           []),
+          (PfifXml.XML_ATOM_NO_PFIF, utils.ATOM_FEED_TAG, [])]:
+        records = utils.iter_records(StringIO(xml), parser=parser)
+        self.assertEqual(records.next().tag, expected_root)
+        result = []
+        for record in records:
+          result.append(utils.extract_tag(record.tag))
+          self.assertTrue(len(record) > 0)
+        self.assertEqual(result, expected_records)
+
+  # LazyMessage
+
+  def test_lazy_message(self):
+    """A LazyMessage should look up its fields when they are read, equal the
+    Message with the same fields, and survive copying and pickling without its
+    tree."""
+    tree = utils.PfifXmlTree(StringIO(PfifXml.XML_11_FULL))
+    person = tree.get_all_persons()[0]
+    element = person.find(tree.add_namespace_to_tag('first_name'))
+    message = utils.LazyMessage('Category', tree, person, element=element)
+    self.assertTrue('xml_text' not in message.__dict__)
+    expected = utils.Message('Category', xml_line_number=12,
+                             xml_tag='first_name', xml_text='FIRST NAME',
+                             person_record_id='example.org/local-id.3')
+    for copied in [copy.copy(message),
+                   pickle.loads(pickle.dumps(message))]:
+      self.assertEqual(copied, expected)
+      self.assertFalse('lazy_source' in copied.__dict__)
+    self.assertEqual(message, expected)
+    self.assertEqual(expected, message)
+    self.assertFalse(message != expected)
+    self.assertRaises(AttributeError, getattr, message, 'no_such_field')
+
   # MessagesOutput
 
   def test_group_messages_by_record(self):
@@ -20,10 +20,14 @@ import unittest
 from StringIO import StringIO
 
 import os
+import re
+import shutil
 import sys
+import tempfile
 from pfif_validator import PfifValidator
 import pfif_validator # to test main
 import datetime
+import inspect
 import utils
 from utils import Message
 import tests.pfif_xml as PfifXml
@@ -495,6 +499,41 @@ class ValidatorTests(unittest.TestCase):
     validator = self.set_up_validator(PfifXml.XML_TOP_LEVEL_NOTE_PERSON_11)
     self.assertEqual(len(validator.validate_extraneous_fields()), 2)
 
+  def test_foreign_namespace_fields(self):
+    """Fields in another namespace should be checked for being extraneous,
+    duplicated, or out of order by their tag without the namespace, and not
+    be checked for their format or count as mandatory fields."""
+    xml = """<?xml version="1.0" encoding="UTF-8"?>
+<pfif:pfif xmlns:pfif="http://zesty.ca/pfif/1.1" xmlns:x="http://example.org/x">
+  <pfif:person>
+    <x:person_record_id>example.org/foreign</x:person_record_id>
+    <pfif:first_name>FIRST</pfif:first_name>
+    <pfif:last_name>LAST</pfif:last_name>
+  </pfif:person>
+  <pfif:person>
+    <pfif:person_record_id>example.org/id</pfif:person_record_id>
+    <x:last_name>last</x:last_name>
+    <pfif:first_name>FIRST</pfif:first_name>
+    <pfif:last_name>LAST</pfif:last_name>
+    <x:home_zip>not a zip</x:home_zip>
+    <x:gibberish>gibberish</x:gibberish>
+  </pfif:person>
+</pfif:pfif>"""
+    validator = self.set_up_validator(xml)
+    self.assertEqual(
+        [(message.category, message.xml_tag)
+         for message in validator.validate_extraneous_fields()],
+        [('Duplicate Tag.', 'last_name'), ('Extraneous Tag.', 'gibberish')])
+    self.assertEqual(
+        [message.xml_tag
+         for message in validator.validate_person_field_order()],
+        ['first_name'])
+    self.assertEqual(validator.validate_fields_have_correct_format(), [])
+    self.assertEqual(
+        [message.xml_tag
+         for message in validator.validate_person_has_mandatory_children()],
+        ['person_record_id'])
+
   # main application + run_validations
 
   def test_run_validations_without_errors(self):
@@ -530,6 +569,207 @@ class ValidatorTests(unittest.TestCase):
     sys.stdout = old_stdout
     sys.argv = old_argv
 
+  def test_main_stats(self):
+    """main should print statistics with --stats and write them in the
+    Prometheus text format with --prometheus-output."""
+    old_argv = sys.argv
+    old_stdout = sys.stdout
+    prometheus_dir = tempfile.mkdtemp()
+    prometheus_path = os.path.join(prometheus_dir, 'pfif.prom')
+    sys.argv = ['pfif_validator.py', 'mocked_file', '--stats',
+                '--prometheus-output', prometheus_path]
+    sys.stdout = StringIO('')
+
+    utils.set_file_for_test(StringIO(PfifXml.XML_11_FULL))
+    pfif_validator.main()
+    self.assertTrue('fields_have_correct_format' in sys.stdout.getvalue())
+    prometheus_text = open(prometheus_path).read()
+    self.assertTrue('pfif_validator_rule_seconds{rule="note_field_order"} ' in
+                    prometheus_text)
+    self.assertTrue('# TYPE pfif_validator_parse_seconds gauge' in
+                    prometheus_text)
+    shutil.rmtree(prometheus_dir)
+
+    sys.stdout = old_stdout
+    sys.argv = old_argv
+
+  def test_main_feed_stats(self):
+    """main should print the statistics of the feed with --feed-stats."""
+    old_argv = sys.argv
+    old_stdout = sys.stdout
+    sys.argv = ['pfif_validator.py', 'mocked_file', '--feed-stats']
+    sys.stdout = StringIO('')
+
+    utils.set_file_for_test(StringIO(PfifXml.XML_11_FULL))
+    pfif_validator.main()
+    self.assertTrue('person\tsource_name\tsource name\t1\t' in
+                    sys.stdout.getvalue())
+
+    sys.stdout = old_stdout
+    sys.argv = old_argv
+
+  def test_main_rules(self):
+    """main should only run the selected rules."""
+    old_argv = sys.argv
+    old_stdout = sys.stdout
+    utils.set_file_for_test(StringIO(PfifXml.XML_TWO_DUPLICATE_NO_CHILD))
+    for argv, expected_messages in [([], 3),
+                                    (['--skip-rules', 'extraneous_fields'], 1),
+                                    (['--rules', 'extraneous_fields,'
+                                      'root_has_child'], 2)]:
+      sys.argv = ['pfif_validator.py', 'mocked_file', '--stats'] + argv
+      sys.stdout = StringIO('')
+      pfif_validator.main()
+      output = sys.stdout.getvalue()
+      sys.stdout = old_stdout
+      total_messages = re.search(r'total\t[\d.]+\t\t(\d+)', output).group(1)
+      self.assertEqual(int(total_messages), expected_messages)
+
+    sys.argv = ['pfif_validator.py', '--list-rules', '--max-cost', 'cheap']
+    sys.stdout = StringIO('')
+    pfif_validator.main()
+    output = sys.stdout.getvalue()
+    sys.stdout = old_stdout
+    sys.argv = old_argv
+    self.assertTrue('root_has_child' in output)
+    self.assertFalse('linked_records_matched' in output)
+
+  # rules
+
+  def test_every_rule_is_registered(self):
+    """Every validation method that takes no arguments should have a rule, and
+    every rule should have a method."""
+    validator = self.set_up_validator(PfifXml.XML_11_SMALL)
+    method_names = [name for name, method in inspect.getmembers(
+        validator, inspect.ismethod) if name.startswith('validate_') and
+                    len(inspect.getargspec(method)[0]) == 1]
+    self.assertEqual(sorted(method_names),
+                     sorted([rule.method_name for rule in
+                             pfif_validator.RULES]))
+
+  def test_select_rules(self):
+    """select_rules should filter by id, cost, and scope."""
+    self.assertEqual(pfif_validator.select_rules(), pfif_validator.RULES)
+    rules = pfif_validator.select_rules(rule_ids=['root_has_child',
+                                                  'extraneous_fields'])
+    self.assertEqual([rule.rule_id for rule in rules],
+                     ['extraneous_fields', 'root_has_child'])
+    rules = pfif_validator.select_rules(exclude=['root_has_child'])
+    self.assertEqual(len(rules), len(pfif_validator.RULES) - 1)
+    for rule in pfif_validator.select_rules(max_cost='moderate'):
+      self.assertNotEqual(rule.cost, 'expensive')
+    record_scope = pfif_validator.Rule.RECORD
+    for rule in pfif_validator.select_rules(scopes=[record_scope]):
+      self.assertEqual(rule.scope, record_scope)
+    self.assertRaises(ValueError, pfif_validator.select_rules,
+                      rule_ids=['no_such_rule'])
+    self.assertRaises(ValueError, pfif_validator.select_rules,
+                      max_cost='free')
+
+  def test_rules_by_version(self):
+    """Only the selected rules that apply to the version should be run."""
+    validator = self.set_up_validator(PfifXml.XML_11_FULL)
+    rule_ids = [rule_id for rule_id, _ in validator.get_validation_methods()]
+    self.assertTrue('person_field_order' in rule_ids)
+    self.assertFalse('expired_records_removed' in rule_ids)
+    validator = self.set_up_validator(
+        PfifXml.XML_EXPIRE_99_HAS_DATA_SYNCED_DATES)
+    rule_ids = [rule_id for rule_id, _ in validator.get_validation_methods()]
+    self.assertFalse('person_field_order' in rule_ids)
+    self.assertTrue('expired_records_removed' in rule_ids)
+
+    validator = PfifValidator(StringIO(PfifXml.XML_TWO_DUPLICATE_NO_CHILD),
+                              rules=pfif_validator.select_rules(
+                                  rule_ids=['extraneous_fields']))
+    messages = validator.run_validations()
+    self.assertEqual([message.category for message in messages],
+                     ['Extraneous Tag.', 'Extraneous Tag.'])
+
+  # plans
+
+  def test_validation_plan(self):
+    """Validators of the same version should share one compiled plan, and the
+    plan should compile each table into bits, ranks, and checkers."""
+    validator = self.set_up_validator(PfifXml.XML_11_FULL)
+    other_validator = self.set_up_validator(PfifXml.XML_11_SMALL)
+    self.assertTrue(validator.plan is other_validator.plan)
+    self.assertFalse(validator.plan is
+                     self.set_up_validator(PfifXml.XML_FULL_12).plan)
+    plan = validator.plan
+    self.assertEqual(plan.version, 1.1)
+    person_plan = plan.get_record_plan('person')
+    slot = plan.tags.index('home_zip')
+    self.assertTrue(person_plan.allowed_mask & (1 << slot))
+    self.assertFalse(plan.get_record_plan('note').allowed_mask & (1 << slot))
+    self.assertEqual(person_plan.ranks[slot], 15)
+    self.assertTrue(person_plan.checkers[slot]('12345'))
+    self.assertFalse(person_plan.checkers[slot]('abc'))
+    url_slot = plan.tags.index('photo_url')
+    self.assertTrue(person_plan.checkers[url_slot]('http://example.org/a'))
+    self.assertFalse(person_plan.checkers[url_slot]('example.org/a'))
+    self.assertEqual([tag for tag, _ in person_plan.mandatory],
+                     ['person_record_id', 'first_name', 'last_name'])
+    self.assertFalse(self.set_up_validator(
+        PfifXml.XML_CORRECT_FORMAT_13).plan.person.is_ordered)
+    self.assertRaises(AssertionError, setattr, plan, 'version', 1.2)
+    self.assertRaises(AssertionError, setattr, person_plan, 'allowed_mask', 0)
+
+  # stats
+
+  def test_stats(self):
+    """run_validations should record the time, records visited, and messages
+    of every validation as well as the time and bytes of parsing."""
+    validator = self.set_up_validator(PfifXml.XML_DUPLICATE_PERSON_IDS)
+    messages = validator.run_validations()
+    stats = validator.stats
+    self.assertEqual(stats.bytes_read, len(PfifXml.XML_DUPLICATE_PERSON_IDS))
+    self.assertTrue(stats.parse_seconds > 0)
+    self.assertEqual([rule.name for rule in stats.rules],
+                     [name for name, _ in validator.get_validation_methods()])
+    self.assertEqual(sum([rule.messages for rule in stats.rules]),
+                     len(messages))
+    rules = dict((rule.name, rule) for rule in stats.rules)
+    self.assertEqual(rules['person_ids_are_unique'].messages, 2)
+    self.assertEqual(rules['person_ids_are_unique'].records_visited,
+                     4)
+    self.assertEqual(rules['root_has_child'].records_visited, 0)
+    self.assertTrue(stats.get_total_seconds() >= stats.get_rule_seconds())
+
+    # running the validations again replaces the statistics
+    validator.run_validations()
+    self.assertEqual(len(validator.stats.rules), len(rules))
+
+  def test_stats_output(self):
+    """The statistics should be printable as a table and in the Prometheus
+    text format."""
+    stats = pfif_validator.ValidationStats(parse_seconds=0.5, bytes_read=10)
+    stats.rules = [pfif_validator.RuleStats('validate_a', 0.25, 4, 1),
+                   pfif_validator.RuleStats('validate_b', 0.5, 2, 0)]
+    self.assertEqual(stats.get_total_seconds(), 1.25)
+    table = stats.to_str()
+    self.assertTrue(table.index('validate_b') < table.index('validate_a'))
+    self.assertTrue('total\t1.2500\t\t1' in table)
+    self.assertEqual(stats.to_prometheus(), """\
+# HELP pfif_validator_parse_seconds Time spent parsing the PFIF XML.
+# TYPE pfif_validator_parse_seconds gauge
+pfif_validator_parse_seconds 0.5
+# HELP pfif_validator_bytes_read Bytes of PFIF XML read.
+# TYPE pfif_validator_bytes_read gauge
+pfif_validator_bytes_read 10
+# HELP pfif_validator_rule_seconds Time spent running each rule.
+# TYPE pfif_validator_rule_seconds gauge
+pfif_validator_rule_seconds{rule="validate_a"} 0.25
+pfif_validator_rule_seconds{rule="validate_b"} 0.5
+# HELP pfif_validator_rule_records_visited Records visited by each rule.
+# TYPE pfif_validator_rule_records_visited gauge
+pfif_validator_rule_records_visited{rule="validate_a"} 4
+pfif_validator_rule_records_visited{rule="validate_b"} 2
+# HELP pfif_validator_rule_messages Messages produced by each rule.
+# TYPE pfif_validator_rule_messages gauge
+pfif_validator_rule_messages{rule="validate_a"} 1
+pfif_validator_rule_messages{rule="validate_b"} 0
+""")
+
   # line numbers
 
   def test_line_numbers(self):
@@ -543,6 +783,29 @@ class ValidatorTests(unittest.TestCase):
       for child in node.getchildren():
         self.assertTrue(child in validator.tree.line_numbers)
 
+  # Atom feeds
+
+  def test_atom_feed(self):
+    """The records of an Atom feed should give the same messages as the same
+    records in a pfif root, with the lines of the Atom feed."""
+    validator = self.set_up_validator(PfifXml.XML_ATOM_12)
+    messages = validator.run_validations()
+    unwrapped_validator = self.set_up_validator(
+        PfifXml.XML_ATOM_12_UNWRAPPED)
+    unwrapped_messages = unwrapped_validator.run_validations()
+    self.assertTrue(len(messages) > 0)
+    self.assertEqual(len(messages), len(unwrapped_messages))
+    for message, unwrapped_message in zip(messages, unwrapped_messages):
+      self.assertEqual(message.category, unwrapped_message.category)
+      self.assertEqual(message.xml_text, unwrapped_message.xml_text)
+      if unwrapped_message.xml_line_number is None:
+        self.assertEqual(message.xml_line_number, None)
+      else:
+        self.assertEqual(
+            validator.tree.lines[message.xml_line_number - 1].strip(),
+            unwrapped_validator.tree.lines[
+                unwrapped_message.xml_line_number - 1].strip())
+
   # unicode
 
   def test_unicode_works(self):
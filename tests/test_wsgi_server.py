@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for wsgi_server.py and webapp_compat.py"""
+
+import unittest
+import httplib
+import socket
+import threading
+import urllib
+from StringIO import StringIO
+import controller
+import tests.pfif_xml as PfifXml
+import utils
+import wsgi_server
+
+class WsgiServerTests(unittest.TestCase):
+  """Defines tests for wsgi_server.py, which serves the controllers with
+  webapp_compat.py"""
+
+  MAX_BODY_BYTES = 16 * 1024
+
+  def setUp(self): # pylint: disable=C0103
+    """Starts a server on a free port."""
+    self.server = wsgi_server.make_server(
+        'localhost', 0, num_threads=2,
+        max_body_bytes=WsgiServerTests.MAX_BODY_BYTES, keep_alive_timeout=5)
+    self.server_thread = threading.Thread(target=self.server.serve_forever)
+    self.server_thread.start()
+
+  def tearDown(self): # pylint: disable=C0103
+    """Stops the server."""
+    self.server.shutdown()
+    self.server_thread.join()
+    self.server.server_close()
+
+  def connect(self):
+    """Returns a new connection to the server."""
+    return httplib.HTTPConnection('localhost', self.server.server_port)
+
+  @staticmethod
+  def post(connection, path, fields):
+    """POSTs the url-encoded fields to path.  Returns the response."""
+    connection.request('POST', path, urllib.urlencode(fields),
+                       {'Content-Type' : 'application/x-www-form-urlencoded'})
+    return connection.getresponse()
+
+  def test_validate_and_diff(self):
+    """Both results pages should be served, on one kept-alive connection."""
+    connection = self.connect()
+    response = self.post(connection, '/validate/results',
+                         {'pfif_xml_1' : PfifXml.XML_TWO_DUPLICATE_NO_CHILD})
+    self.assertEqual(response.status, 200)
+    self.assertTrue('3 Messages' in response.read())
+    self.assertNotEqual(response.getheader('Connection'), 'close')
+
+    response = self.post(connection, '/diff/results',
+                         {'pfif_xml_1' : PfifXml.XML_ADDED_DELETED_CHANGED_1,
+                          'pfif_xml_2' : PfifXml.XML_ADDED_DELETED_CHANGED_2,
+                          'options' : 'group_messages_by_record'})
+    self.assertEqual(response.status, 200)
+    self.assertTrue('Diff' in response.read())
+    connection.close()
+
+  def test_streaming(self):
+    """Results pages should be sent in several chunks, with the summary at the
+    end, and the connection should still be kept alive."""
+    old_chunk_size = utils.MessagesOutput.STREAM_CHUNK_SIZE
+    utils.MessagesOutput.STREAM_CHUNK_SIZE = 1
+    environ = {'REQUEST_METHOD' : 'POST', 'PATH_INFO' : '/validate/results',
+               'CONTENT_TYPE' : 'application/x-www-form-urlencoded'}
+    body = urllib.urlencode(
+        {'pfif_xml_1' : PfifXml.XML_TWO_DUPLICATE_NO_CHILD,
+         'print_options' : 'show_errors'})
+    environ['CONTENT_LENGTH'] = str(len(body))
+    environ['wsgi.input'] = StringIO(body)
+    written = []
+    def start_response(status, headers): # pylint: disable=W0613
+      """Records the status and returns a write function."""
+      written.append(status)
+      return written.append
+    result = wsgi_server.make_application()(environ, start_response)
+    written.extend(result)
+
+    connection = self.connect()
+    response = self.post(connection, '/validate/results',
+                         {'pfif_xml_1' : PfifXml.XML_TWO_DUPLICATE_NO_CHILD})
+    chunked = response.getheader('Transfer-Encoding')
+    response_str = response.read()
+    connection.request('GET', '/')
+    second_status = connection.getresponse().status
+    connection.close()
+    utils.MessagesOutput.STREAM_CHUNK_SIZE = old_chunk_size
+
+    self.assertEqual(written[0], '200 OK')
+    # the header, one chunk per message, the end of the messages, and the
+    # summary
+    self.assertTrue(len(written) >= 6)
+    self.assertTrue('summary_placeholder' in written[1])
+    self.assertTrue('3 Messages' in written[-1])
+    self.assertEqual(chunked, 'chunked')
+    self.assertTrue('3 Messages' in response_str)
+    self.assertEqual(second_status, 200)
+
+  def test_file_upload(self):
+    """Uploaded files should be validated."""
+    boundary = 'pfif_tools_boundary'
+    body = ('--' + boundary + '\r\n'
+            'Content-Disposition: form-data; name="pfif_xml_file_1"; '
+            'filename="feed.xml"\r\n'
+            'Content-Type: text/xml\r\n\r\n' +
+            PfifXml.XML_TWO_DUPLICATE_NO_CHILD + '\r\n'
+            '--' + boundary + '--\r\n')
+    connection = self.connect()
+    connection.request('POST', '/validate/results', body,
+                       {'Content-Type' : 'multipart/form-data; boundary=' +
+                                         boundary})
+    response = connection.getresponse()
+    self.assertTrue('3 Messages' in response.read())
+    connection.close()
+
+  def test_static_files(self):
+    """The static pages from app.yaml should be served, but nothing outside of
+    the static directory."""
+    connection = self.connect()
+    for path in ['/', '/validate', '/diff', '/static/style.css']:
+      connection.request('GET', path)
+      response = connection.getresponse()
+      self.assertEqual(response.status, 200, path)
+      response.read()
+    connection.request('GET', '/static/../controller.py')
+    response = connection.getresponse()
+    self.assertEqual(response.status, 404)
+    response.read()
+    connection.close()
+
+  def test_body_limit(self):
+    """Requests with a body over the limit should be rejected."""
+    connection = self.connect()
+    response = self.post(connection, '/validate/results',
+                         {'pfif_xml_1' : 'x' * WsgiServerTests.MAX_BODY_BYTES})
+    self.assertEqual(response.status, 413)
+    connection.close()
+
+  def test_chunked_body(self):
+    """A request with a Transfer-Encoding but no Content-Length should be
+    refused and the connection closed, rather than its body being read as
+    the next request."""
+    connection = self.connect()
+    connection.putrequest('POST', '/validate/results')
+    connection.putheader('Transfer-Encoding', 'chunked')
+    connection.endheaders()
+    connection.send('4\r\nfoo=\r\n0\r\n\r\n')
+    response = connection.getresponse()
+    self.assertEqual(response.status, 411)
+    self.assertEqual(response.getheader('Connection'), 'close')
+    response.read()
+    connection.close()
+
+  def test_chunked_body_with_content_length(self):
+    """A request with both a Transfer-Encoding and a Content-Length should be
+    refused and the connection closed, so that what a proxy would read as the
+    rest of a chunked body is never handled as another request."""
+    connection = socket.create_connection(('localhost',
+                                           self.server.server_port))
+    connection.sendall('POST /validate/results HTTP/1.1\r\n'
+                       'Host: localhost\r\n'
+                       'Transfer-Encoding: chunked\r\n'
+                       'Content-Length: 4\r\n\r\n'
+                       '4\r\nfoo=\r\n0\r\n\r\n'
+                       'GET /no_such_page HTTP/1.1\r\n'
+                       'Host: localhost\r\n\r\n')
+    # The server closes the connection, so this reads every response.
+    responses = ''
+    data = connection.recv(4096)
+    while data:
+      responses += data
+      data = connection.recv(4096)
+    connection.close()
+    self.assertTrue(responses.startswith('HTTP/1.1 411 '))
+    self.assertTrue('\r\nConnection: close\r\n' in responses)
+    self.assertEqual(responses.count('HTTP/1.'), 1)
+
+  def test_processes_need_job_db(self):
+    """Serving from more than one process should be refused while jobs are
+    only kept in memory."""
+    self.assertEqual(controller.get_job_db_path(), controller.IN_MEMORY_JOB_DB)
+    self.assertRaises(AssertionError, wsgi_server.serve, self.server,
+                      num_processes=2)
+
+  def test_unknown_path(self):
+    """Unknown paths should be not found, and the connection should still be
+    usable afterwards even though the body was not read."""
+    connection = self.connect()
+    response = self.post(connection, '/no_such_page', {'foo' : 'bar'})
+    self.assertEqual(response.status, 404)
+    response.read()
+    connection.request('GET', '/')
+    self.assertEqual(connection.getresponse().status, 200)
+    connection.close()
+
+if __name__ == '__main__':
+  unittest.main()